@@ -1,14 +1,15 @@
 from django.contrib import admin
 from .models import (
     AIInsight, PatientTrend, RiskPrediction, 
-    ClinicalDecisionSupport, AIProcessingLog
+    ClinicalDecisionSupport, AIProcessingLog, AIUsageRollup, AIInsightCounter,
+    ClinicalEntityExtraction, ClinicalEntity
 )
 
 
 @admin.register(AIInsight)
 class AIInsightAdmin(admin.ModelAdmin):
     list_display = ['patient', 'title', 'insight_type', 'risk_level', 'priority_score', 'status', 'created_at']
-    list_filter = ['insight_type', 'risk_level', 'status', 'urgency_level', 'created_at']
+    list_filter = ['insight_type', 'risk_level', 'status', 'urgency_level', 'is_active', 'created_at']
     search_fields = ['patient__first_name', 'patient__last_name', 'title', 'description']
     readonly_fields = ['created_at', 'updated_at', 'is_critical', 'days_since_created']
     
@@ -29,7 +30,7 @@ class AIInsightAdmin(admin.ModelAdmin):
             'fields': ('status', 'reviewed_by', 'reviewed_at', 'review_notes')
         }),
         ('Timestamps', {
-            'fields': ('created_at', 'updated_at', 'expires_at', 'is_critical', 'days_since_created'),
+            'fields': ('created_at', 'updated_at', 'expires_at', 'is_active', 'archived_at', 'is_critical', 'days_since_created'),
             'classes': ('collapse',)
         })
     )
@@ -65,3 +66,31 @@ class AIProcessingLogAdmin(admin.ModelAdmin):
     list_filter = ['process_type', 'success', 'completed_at']
     search_fields = ['patient__first_name', 'patient__last_name', 'model_used']
     readonly_fields = ['started_at', 'completed_at']
+
+
+@admin.register(AIUsageRollup)
+class AIUsageRollupAdmin(admin.ModelAdmin):
+    list_display = ['period', 'bucket_start', 'model_used', 'process_type', 'request_count', 'error_count', 'p90_latency_seconds', 'total_cost']
+    list_filter = ['period', 'model_used', 'process_type']
+    readonly_fields = ['updated_at']
+
+
+@admin.register(AIInsightCounter)
+class AIInsightCounterAdmin(admin.ModelAdmin):
+    list_display = ['patient', 'metric', 'value', 'updated_at']
+    search_fields = ['metric', 'patient__first_name', 'patient__last_name']
+    readonly_fields = ['updated_at']
+
+
+@admin.register(ClinicalEntityExtraction)
+class ClinicalEntityExtractionAdmin(admin.ModelAdmin):
+    list_display = ['source_type', 'source_id', 'patient', 'entity_count', 'extractor', 'extracted_at']
+    list_filter = ['source_type', 'extractor']
+    readonly_fields = ['extracted_at']
+
+
+@admin.register(ClinicalEntity)
+class ClinicalEntityAdmin(admin.ModelAdmin):
+    list_display = ['label', 'text', 'normalized', 'value', 'unit', 'patient']
+    list_filter = ['label']
+    search_fields = ['text', 'normalized']
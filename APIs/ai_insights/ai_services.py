@@ -8,112 +8,134 @@ Provides core AI functionality including:
 - Clinical decision support
 """
 
-import openai
 import logging
+from dataclasses import replace
 from typing import Dict, List, Any, Optional, Tuple
 from datetime import datetime, timedelta
 from django.conf import settings
 from django.utils import timezone
 from .models import AIInsight, PatientTrend, RiskPrediction, ClinicalDecisionSupport, AIProcessingLog
+from .analytics import estimate_cost
+from .audit import audit_log_writer
+from .prompt_builder import PromptBuilder, BuiltPrompt, TokenCounter, downsample_to_fit, summarize_series
+from .providers import AIResponse, ai_router
+from .clinical_ner import extract_entities, medical_ner_enabled, to_clinical_data
+from .structured_output import OUTPUT_SCHEMAS, parse_output, reask_message
+from .risk_rules import (
+    RULES_MODEL_NAME, TriageDecision, fall_risk_medications, high_alert_medications, risk_category,
+    triage_fall_risk, triage_readmission_risk
+)
+from .trend_engine import (
+    RunningTrendStats, analyze_series_batch, cap_points, collect_vital_series, metric_category
+)
 import json
 import re
-from dataclasses import dataclass
 
 logger = logging.getLogger('ai_insights')
 
 
-@dataclass
-class AIResponse:
-    """Structured response from AI processing"""
-    success: bool
-    content: str
-    confidence: float
-    model_used: str
-    tokens_used: int = 0
-    processing_time: float = 0.0
-    error_message: str = ""
-
-
 class AIServiceManager:
     """Main AI service manager for healthcare insights"""
     
     def __init__(self):
-        self._openai_client = None
+        self.router = ai_router
         self.default_model = getattr(settings, 'AI_CONFIG', {}).get('DEFAULT_MODEL', 'gpt-4o-mini')
         self.max_tokens = getattr(settings, 'AI_CONFIG', {}).get('MAX_TOKENS', 4000)
         self.temperature = getattr(settings, 'AI_CONFIG', {}).get('TEMPERATURE', 0.3)
     
-    @property
-    def openai_client(self):
-        """Lazy initialization of OpenAI client"""
-        if self._openai_client is None:
-            api_key = getattr(settings, 'OPENAI_API_KEY', None)
-            if api_key and api_key != 'your-openai-api-key-here':
-                try:
-                    self._openai_client = openai.OpenAI(api_key=api_key)
-                except Exception as e:
-                    print(f"Warning: Failed to initialize OpenAI client: {e}")
-                    self._openai_client = None
-        return self._openai_client
-    
     def _log_processing(self, process_type: str, patient_id: int = None, 
-                       user_id: int = None, **kwargs) -> AIProcessingLog:
-        """Log AI processing for audit trail"""
-        return AIProcessingLog.objects.create(
+                       user_id: int = None, **kwargs) -> None:
+        """Queue an AIProcessingLog record for the audit trail (written in batches)"""
+        kwargs.setdefault('started_at', timezone.now())
+        audit_log_writer.submit(
             patient_id=patient_id,
             user_id=user_id,
             process_type=process_type,
-            started_at=timezone.now(),
             **kwargs
         )
     
-    def _call_openai(self, messages: List[Dict], model: str = None) -> AIResponse:
-        """Make a call to OpenAI API with error handling"""
-        start_time = timezone.now()
-        model = model or self.default_model
-        
-        if not self.openai_client:
-            return AIResponse(
-                success=False,
-                content="OpenAI client not available. Please configure OPENAI_API_KEY.",
-                error="OpenAI client not initialized",
-                processing_time_seconds=0,
-                model_used=model,
-                tokens_used=0
-            )
+    def _build_prompt(self, system_prompt: str, model: str = None, output: str = None) -> PromptBuilder:
+        """Start a token-budgeted prompt for the given (or default) model, optionally with an output schema"""
+        return PromptBuilder(
+            system_prompt, model or self.default_model, completion_tokens=self.max_tokens,
+            output_schema=OUTPUT_SCHEMAS[output] if output else None
+        )
+    
+    def _complete(self, prompt: BuiltPrompt, process_type: str, patient_id: int = None,
+                  user_id: int = None) -> AIResponse:
+        """Send an assembled prompt and record its token accounting"""
+        started_at = timezone.now()
+        response_schema = prompt.output_schema.provider_format() if prompt.output_schema else None
+        response = self._call_model(prompt.messages, model=prompt.model, response_schema=response_schema)
+        response.prompt_tokens = response.prompt_tokens or prompt.prompt_tokens
+        completion_tokens = max(response.tokens_used - response.prompt_tokens, 0)
+        cost = estimate_cost(response.model_used, response.prompt_tokens, completion_tokens) if response.success else None
         
         try:
-            response = self.openai_client.chat.completions.create(
-                model=model,
-                messages=messages,
-                max_tokens=self.max_tokens,
-                temperature=self.temperature,
-                top_p=getattr(settings, 'AI_CONFIG', {}).get('TOP_P', 0.9)
-            )
-            
-            processing_time = (timezone.now() - start_time).total_seconds()
-            
-            return AIResponse(
-                success=True,
-                content=response.choices[0].message.content,
-                confidence=1.0,  # OpenAI doesn't return confidence directly
-                model_used=model,
-                tokens_used=response.usage.total_tokens,
-                processing_time=processing_time
+            self._log_processing(
+                process_type,
+                patient_id=patient_id,
+                user_id=user_id,
+                started_at=started_at,
+                model_used=response.model_used,
+                input_data_size=prompt.input_data_size,
+                processing_time_seconds=response.processing_time,
+                success=response.success,
+                error_message=response.error_message,
+                output_summary=prompt.accounting(),
+                # Fall back to the local count when the provider reported no usage
+                tokens_used=response.tokens_used or prompt.prompt_tokens,
+                cost_estimate=cost,
             )
-            
         except Exception as e:
-            processing_time = (timezone.now() - start_time).total_seconds()
-            logger.error(f"OpenAI API call failed: {str(e)}")
+            logger.error(f"Failed to log AI processing: {str(e)}")
+        
+        return response
+    
+    def _complete_structured(self, prompt: BuiltPrompt, process_type: str, patient_id: int = None,
+                             user_id: int = None) -> AIResponse:
+        """
+        Complete a prompt built with an output schema. Replies are repaired and
+        validated locally; only a reply that still fails validation is re-asked
+        (with the errors). Valid data is returned on response.parsed.
+        """
+        output_schema = prompt.output_schema
+        reasks = getattr(settings, 'AI_CONFIG', {}).get('STRUCTURED_OUTPUT_REASKS', 1)
+        response = self._complete(prompt, process_type, patient_id=patient_id, user_id=user_id)
+        
+        for attempt in range(reasks + 1):
+            if not response.success:
+                return response
+            parsed = parse_output(response.content, output_schema)
+            if parsed.valid:
+                if parsed.repaired:
+                    logger.info(f"Repaired {output_schema.name} reply locally")
+                response.parsed = parsed.data
+                return response
             
-            return AIResponse(
-                success=False,
-                content="",
-                confidence=0.0,
-                model_used=model,
-                processing_time=processing_time,
-                error_message=str(e)
-            )
+            logger.warning(f"{output_schema.name} reply failed validation: {'; '.join(parsed.errors[:5])}")
+            if attempt == reasks:
+                break
+            messages = prompt.messages + [
+                {'role': 'assistant', 'content': response.content},
+                {'role': 'user', 'content': reask_message(parsed)},
+            ]
+            prompt = replace(prompt, messages=messages,
+                             prompt_tokens=TokenCounter(prompt.model).count_messages(messages))
+            response = self._complete(prompt, process_type, patient_id=patient_id, user_id=user_id)
+        
+        return response
+    
+    def _call_model(self, messages: List[Dict], model: str = None, response_schema: Dict = None) -> AIResponse:
+        """Make a chat completion call, failing over between configured providers"""
+        return self.router.complete(
+            messages,
+            model=model or self.default_model,
+            max_tokens=self.max_tokens,
+            temperature=self.temperature,
+            top_p=getattr(settings, 'AI_CONFIG', {}).get('TOP_P', 0.9),
+            response_schema=response_schema
+        )
 
 
 class ClinicalInsightGenerator(AIServiceManager):
@@ -131,26 +153,16 @@ class ClinicalInsightGenerator(AIServiceManager):
         4. Care gaps or documentation needs
         5. Recommendations for healthcare providers
         
-        Format your response as structured JSON with the following sections:
-        - summary: Brief overall summary
-        - key_findings: List of important findings
-        - risk_factors: Identified risk factors
-        - recommendations: Actionable recommendations
-        - urgency_level: immediate, within_24h, within_week, or routine
+        Besides the overall summary, list each distinct finding as a separate typed insight
+        with its own risk level, priority and recommended actions.
         """
         
-        user_prompt = f"""Analyze this patient data:
-        
-        Patient Information: {json.dumps(patient_data, indent=2)}
+        prompt = self._build_prompt(system_prompt, output='patient_summary')
+        prompt.set_intro("Analyze this patient data:")
+        prompt.add_section("Patient Information", patient_data, required=True)
+        prompt.set_outro("Provide insights focusing on clinical significance and actionable recommendations.")
         
-        Provide insights focusing on clinical significance and actionable recommendations."""
-        
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
-        
-        return self._call_openai(messages)
+        return self._complete_structured(prompt.build(), 'insight_generation', patient_id=patient_data.get('patient_id'))
     
     def analyze_visit_notes(self, visit_notes: str, patient_context: Dict) -> AIResponse:
         """Analyze visit notes and extract insights"""
@@ -166,18 +178,12 @@ class ClinicalInsightGenerator(AIServiceManager):
         
         Return structured analysis focusing on actionable insights."""
         
-        user_prompt = f"""Visit Notes: {visit_notes}
-        
-        Patient Context: {json.dumps(patient_context, indent=2)}
-        
-        Analyze these notes and provide clinical insights."""
-        
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
+        prompt = self._build_prompt(system_prompt)
+        prompt.add_section("Visit Notes", visit_notes, priority=10, required=True)
+        prompt.add_section("Patient Context", patient_context, priority=5)
+        prompt.set_outro("Analyze these notes and provide clinical insights.")
         
-        return self._call_openai(messages)
+        return self._complete(prompt.build(), 'document_analysis', patient_id=patient_context.get('patient_id'))
     
     def identify_care_gaps(self, patient_data: Dict, oasis_data: Dict = None) -> AIResponse:
         """Identify gaps in patient care based on conditions and history"""
@@ -193,26 +199,28 @@ class ClinicalInsightGenerator(AIServiceManager):
         
         Prioritize gaps by clinical significance and regulatory requirements."""
         
-        user_prompt = f"""Patient Data: {json.dumps(patient_data, indent=2)}
+        prompt = self._build_prompt(system_prompt)
+        prompt.add_section("Patient Data", patient_data, priority=10, required=True)
+        prompt.add_section("OASIS Data", oasis_data or {}, priority=5)
+        prompt.set_outro("Identify care gaps and provide recommendations.")
         
-        OASIS Data: {json.dumps(oasis_data or {}, indent=2)}
-        
-        Identify care gaps and provide recommendations."""
-        
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
-        
-        return self._call_openai(messages)
+        return self._complete(prompt.build(), 'insight_generation', patient_id=patient_data.get('patient_id'))
 
 
 class RiskAssessmentEngine(AIServiceManager):
     """AI-powered risk assessment for various clinical outcomes"""
     
+    PREDICTION_TTL_DAYS = 7
+    RISK_TYPES = ('fall_risk', 'readmission_risk')
+    
     def assess_fall_risk(self, patient_data: Dict) -> Tuple[float, Dict]:
         """Assess fall risk using AI analysis of patient factors"""
         
+        # Clear-cut patients are scored by the rules without an AI call
+        decision = triage_fall_risk(patient_data)
+        if decision.confident:
+            return self._triage_result(decision, patient_data)
+        
         # Extract relevant factors for fall risk
         factors = self._extract_fall_risk_factors(patient_data)
         
@@ -227,35 +235,22 @@ class RiskAssessmentEngine(AIServiceManager):
         - Environmental factors
         - Comorbidities
         
-        Return a JSON response with:
-        - risk_score: float between 0-1 (1 = highest risk)
-        - risk_category: low, moderate, high, or critical
-        - contributing_factors: list of factors increasing risk
-        - protective_factors: list of factors reducing risk
-        - recommendations: prevention strategies
+        risk_score is between 0 and 1 (1 = highest risk).
         """
         
-        user_prompt = f"Assess fall risk for patient with these factors: {json.dumps(factors, indent=2)}"
-        
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
-        
-        response = self._call_openai(messages)
+        prompt = self._build_prompt(system_prompt, output='fall_risk')
+        prompt.set_intro("Assess fall risk for patient with these factors:")
+        prompt.add_section("Factors", factors, required=True)
         
-        if response.success:
-            try:
-                risk_data = json.loads(response.content)
-                return risk_data.get('risk_score', 0.0), risk_data
-            except json.JSONDecodeError:
-                logger.error("Failed to parse fall risk assessment response")
-                return 0.0, {}
-        
-        return 0.0, {}
+        response = self._complete_structured(prompt.build(), 'risk_assessment', patient_id=patient_data.get('patient_id'))
+        return self._llm_risk_result(response, decision)
     
     def assess_readmission_risk(self, patient_data: Dict, recent_admissions: List) -> Tuple[float, Dict]:
-        """Assess 30-day readmission risk"""
+        """Assess 30-day readmission risk (recent_admissions newest first)"""
+        
+        decision = triage_readmission_risk(patient_data, recent_admissions)
+        if decision.confident:
+            return self._triage_result(decision, patient_data)
         
         system_prompt = """You are a readmission risk prediction AI. Analyze patient data to predict 
         30-day readmission risk based on clinical indicators, social determinants, and historical patterns.
@@ -268,30 +263,77 @@ class RiskAssessmentEngine(AIServiceManager):
         - Discharge planning adequacy
         - Follow-up care arrangements
         
-        Return structured risk assessment with score and recommendations."""
-        
-        context_data = {
-            'patient_data': patient_data,
-            'recent_admissions': recent_admissions
-        }
+        Return a risk score between 0 and 1 with contributing factors and recommendations."""
         
-        user_prompt = f"Assess readmission risk: {json.dumps(context_data, indent=2)}"
+        prompt = self._build_prompt(system_prompt, output='readmission_risk')
+        prompt.set_intro("Assess readmission risk:")
+        prompt.add_section("Patient Data", patient_data, priority=10, required=True)
+        # Over budget the list keeps its leading entries, so admissions are passed newest first
+        prompt.add_section("Recent Admissions", recent_admissions, priority=5)
         
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
-        
-        response = self._call_openai(messages)
-        
-        if response.success:
-            try:
-                risk_data = json.loads(response.content)
-                return risk_data.get('risk_score', 0.0), risk_data
-            except json.JSONDecodeError:
-                return 0.0, {}
-        
-        return 0.0, {}
+        response = self._complete_structured(prompt.build(), 'risk_assessment', patient_id=patient_data.get('patient_id'))
+        return self._llm_risk_result(response, decision)
+    
+    def _llm_risk_result(self, response: AIResponse, decision: TriageDecision) -> Tuple[float, Dict]:
+        if response.parsed is None:
+            if response.success:
+                logger.error(f"Failed to parse {decision.risk_type} assessment response")
+            return 0.0, {}
+        risk_data = dict(response.parsed, assessment_path='llm', rule_score=round(decision.risk_score, 4))
+        risk_data['model_used'] = response.model_used
+        return risk_data['risk_score'], risk_data
+    
+    def create_risk_predictions(self, patient_id: int, risk_types: List[str], patient_data: Dict,
+                                recent_admissions: List = None) -> List[RiskPrediction]:
+        """Assess several risk types and store the results with one bulk insert"""
+        expires_at = timezone.now() + timedelta(days=self.PREDICTION_TTL_DAYS)
+        predictions = []
+        for risk_type in risk_types:
+            if risk_type == 'fall_risk':
+                risk_score, risk_data = self.assess_fall_risk(patient_data)
+            elif risk_type == 'readmission_risk':
+                risk_score, risk_data = self.assess_readmission_risk(patient_data, recent_admissions or [])
+            else:
+                raise ValueError(f"Unsupported risk type: {risk_type}")
+            if not risk_data:
+                continue
+            
+            path = risk_data.get('assessment_path', 'llm')
+            predictions.append(RiskPrediction(
+                patient_id=patient_id,
+                risk_type=risk_type,
+                risk_score=risk_score,
+                risk_category=risk_data.get('risk_category') or risk_category(risk_score),
+                model_name=RULES_MODEL_NAME if path.startswith('rules') else risk_data.get('model_used', self.default_model),
+                feature_importance=risk_data.get('score_breakdown', {}),
+                risk_factors=risk_data.get('contributing_factors', []),
+                protective_factors=risk_data.get('protective_factors', []),
+                prevention_strategies=risk_data.get('recommendations', []),
+                expires_at=expires_at,
+            ))
+        return RiskPrediction.objects.bulk_create(predictions)
+    
+    def _triage_result(self, decision: TriageDecision, patient_data: Dict) -> Tuple[float, Dict]:
+        """Return a rules-only assessment and record that the AI call was skipped"""
+        risk_data = decision.to_dict()
+        try:
+            self._log_processing(
+                'risk_assessment',
+                patient_id=patient_data.get('patient_id'),
+                model_used=RULES_MODEL_NAME,
+                input_data_size=0,
+                processing_time_seconds=0.0,
+                success=True,
+                output_summary={
+                    'risk_type': decision.risk_type,
+                    'assessment_path': decision.path,
+                    'risk_score': risk_data['risk_score'],
+                },
+                tokens_used=0,
+            )
+        except Exception as e:
+            logger.error(f"Failed to log AI processing: {str(e)}")
+        return decision.risk_score, risk_data
     
     def _extract_fall_risk_factors(self, patient_data: Dict) -> Dict:
         """Extract relevant factors for fall risk assessment"""
@@ -303,13 +345,8 @@ class RiskAssessmentEngine(AIServiceManager):
         
         # Medications
         if 'medications' in patient_data:
-            fall_risk_meds = []
-            for med in patient_data['medications']:
-                # Check for fall-risk medications
-                med_name = med.get('name', '').lower()
-                if any(risky in med_name for risky in ['sedative', 'hypnotic', 'antipsychotic', 'benzodiazepine']):
-                    fall_risk_meds.append(med)
-            factors['fall_risk_medications'] = fall_risk_meds
+            factors['fall_risk_medications'] = fall_risk_medications(patient_data)
+            factors['high_alert_medications'] = high_alert_medications(patient_data)
         
         # Mobility and functional status
         if 'functional_status' in patient_data:
@@ -332,15 +369,46 @@ class TrendAnalyzer(AIServiceManager):
         if len(data_points) < 3:
             return {"error": "Insufficient data points for trend analysis"}
         
-        # Calculate basic trend statistics
-        values = [point['value'] for point in data_points]
-        timestamps = [point['timestamp'] for point in data_points]
-        
-        # Simple trend calculation (could be enhanced with more sophisticated methods)
-        trend_direction = self._calculate_trend_direction(values)
-        trend_strength = self._calculate_trend_strength(values)
-        
-        # Get AI interpretation
+        key = (patient_id, metric_name)
+        return self.analyze_trends({key: data_points}, days=days, persist=False)[key]
+    
+    def analyze_patient_trends(self, patient_ids: List[int], days: int = 30,
+                               metrics: List[str] = None) -> Dict[Tuple[int, str], Dict]:
+        """Analyze and store vital-sign trends for many patients in one batch"""
+        since = timezone.now() - timedelta(days=days)
+        series = collect_vital_series(patient_ids, since, metrics=metrics)
+        return self.analyze_trends(series, days=days)
+    
+    def analyze_trends(self, series: Dict[Tuple[int, str], List[Dict]], days: int = 30,
+                       persist: bool = True) -> Dict[Tuple[int, str], Dict]:
+        """
+        Run the vectorized statistics over every (patient_id, metric) series at
+        once; only statistically significant trends get an AI interpretation.
+        Results are upserted into PatientTrend in one bulk statement.
+        """
+        stats = analyze_series_batch({
+            key: ([point['timestamp'] for point in points], [point['value'] for point in points])
+            for key, points in series.items()
+        })
+        
+        results = {}
+        for key, trend in stats.items():
+            patient_id, metric_name = key
+            result = trend.to_dict()
+            result['analysis_period_days'] = days
+            if trend.is_significant:
+                response = self._interpret_trend(patient_id, metric_name, result, series[key], days)
+                if response.success:
+                    result['ai_interpretation'] = response.content
+                    result['clinical_significance'] = self._extract_clinical_significance(response.content)
+            results[key] = result
+        
+        if persist and results:
+            self._save_trends(series, results, days)
+        return results
+    
+    def _interpret_trend(self, patient_id: int, metric_name: str, trend_stats: Dict,
+                         data_points: List[Dict], days: int) -> AIResponse:
         system_prompt = f"""You are a clinical data analyst AI. Analyze the trend in {metric_name} 
         over the past {days} days and provide clinical interpretation.
         
@@ -354,69 +422,53 @@ class TrendAnalyzer(AIServiceManager):
         
         trend_data = {
             'metric': metric_name,
-            'data_points': data_points,
-            'trend_direction': trend_direction,
-            'trend_strength': trend_strength,
-            'analysis_period': f"{days} days"
+            'analysis_period': f"{days} days",
+            'statistics': summarize_series([point['value'] for point in data_points]),
+            **trend_stats
         }
         
-        user_prompt = f"Analyze this clinical trend: {json.dumps(trend_data, indent=2)}"
-        
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
+        prompt = self._build_prompt(system_prompt)
+        prompt.set_intro("Analyze this clinical trend:")
+        prompt.add_section("Trend", trend_data, priority=10, required=True)
+        # Long series are downsampled (bucket mean/min/max) rather than cut off
+        points = [{'timestamp': point['timestamp'], 'value': point['value']} for point in data_points]
+        prompt.add_section("Data Points", {'data_points': points}, priority=5,
+                           shrink=downsample_to_fit('data_points'))
         
-        response = self._call_openai(messages)
-        
-        result = {
-            'trend_direction': trend_direction,
-            'trend_strength': trend_strength,
-            'data_points_count': len(data_points),
-            'analysis_period_days': days
-        }
-        
-        if response.success:
-            result['ai_interpretation'] = response.content
-            result['clinical_significance'] = self._extract_clinical_significance(response.content)
-        
-        return result
-    
-    def _calculate_trend_direction(self, values: List[float]) -> str:
-        """Calculate basic trend direction"""
-        if len(values) < 2:
-            return 'stable'
-        
-        # Simple linear trend
-        first_half = sum(values[:len(values)//2]) / (len(values)//2)
-        second_half = sum(values[len(values)//2:]) / (len(values) - len(values)//2)
-        
-        diff_threshold = 0.1  # 10% change threshold
-        relative_change = abs(second_half - first_half) / first_half
-        
-        if relative_change < diff_threshold:
-            return 'stable'
-        elif second_half > first_half:
-            return 'improving'
-        else:
-            return 'declining'
+        return self._complete(prompt.build(), 'trend_analysis', patient_id=patient_id)
     
-    def _calculate_trend_strength(self, values: List[float]) -> float:
-        """Calculate trend strength (0-1 scale)"""
-        if len(values) < 3:
-            return 0.0
-        
-        # Calculate coefficient of variation as a measure of stability
-        import statistics
-        mean_val = statistics.mean(values)
-        if mean_val == 0:
-            return 0.0
-        
-        std_dev = statistics.stdev(values)
-        cv = std_dev / mean_val
-        
-        # Convert to trend strength (inverse of volatility)
-        return max(0.0, min(1.0, 1.0 - cv))
+    def _save_trends(self, series: Dict[Tuple[int, str], List[Dict]],
+                     results: Dict[Tuple[int, str], Dict], days: int) -> None:
+        trends = []
+        for (patient_id, metric_name), result in results.items():
+            points = series[(patient_id, metric_name)]
+            # Seed the running statistics so later observations update incrementally
+            data_points, archived_points = cap_points(list(points), [])
+            trends.append(PatientTrend(
+                patient_id=patient_id,
+                metric_name=metric_name,
+                metric_category=metric_category(metric_name),
+                trend_direction=result['trend_direction'],
+                trend_strength=result['trend_strength'],
+                statistical_significance=result['p_value'],
+                data_points=data_points,
+                archived_points=archived_points,
+                running_stats=RunningTrendStats.from_points(points).to_dict(),
+                analysis_period_days=days,
+                ai_interpretation=result.get('ai_interpretation', ''),
+                clinical_significance=result.get('clinical_significance', 'low'),
+            ))
+        PatientTrend.objects.bulk_create(
+            trends,
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=['patient', 'metric_name', 'metric_category'],
+            update_fields=[
+                'trend_direction', 'trend_strength', 'statistical_significance', 'data_points',
+                'archived_points', 'running_stats', 'analysis_period_days', 'ai_interpretation',
+                'clinical_significance', 'updated_at', 'last_analyzed',
+            ],
+        )
     
     def _extract_clinical_significance(self, ai_response: str) -> str:
         """Extract clinical significance from AI response"""
@@ -435,6 +487,17 @@ class DocumentAnalyzer(AIServiceManager):
     def extract_clinical_data(self, document_text: str, document_type: str) -> Dict:
         """Extract structured clinical data from documents"""
         
+        # Local NER first; the model is only asked when it finds nothing
+        if medical_ner_enabled():
+            try:
+                entities = extract_entities([document_text])[0]
+                local_data = to_clinical_data(document_text, entities)
+                if local_data['diagnoses'] or local_data['medications'] or local_data['vital_signs']:
+                    local_data['extraction_path'] = 'local_ner'
+                    return local_data
+            except ImportError as e:
+                logger.warning(f"Local NER unavailable, falling back to the model: {str(e)}")
+        
         system_prompt = f"""You are a clinical document analysis AI. Extract structured data from 
         {document_type} documents. Focus on:
         
@@ -444,25 +507,19 @@ class DocumentAnalyzer(AIServiceManager):
         4. Vital signs and measurements
         5. Procedures and treatments
         6. Assessment findings
-        7. Plan of care
-        
-        Return structured JSON data with extracted information clearly categorized."""
+        7. Plan of care"""
         
-        user_prompt = f"Extract clinical data from this {document_type}:\n\n{document_text}"
+        prompt = self._build_prompt(system_prompt, output='document_extraction')
+        prompt.set_intro(f"Extract clinical data from this {document_type}:")
+        prompt.add_section("Document", document_text, required=True)
         
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
-        
-        response = self._call_openai(messages)
+        response = self._complete_structured(prompt.build(), 'data_extraction')
         
+        if response.parsed is not None:
+            return response.parsed
         if response.success:
-            try:
-                return json.loads(response.content)
-            except json.JSONDecodeError:
-                # Return raw text if JSON parsing fails
-                return {'raw_analysis': response.content}
+            # Return raw text if the reply never matched the schema
+            return {'raw_analysis': response.content}
         
         return {'error': 'Failed to analyze document'}
     
@@ -488,17 +545,12 @@ class DocumentAnalyzer(AIServiceManager):
             'date_of_communication': datetime.now().isoformat()
         }
         
-        user_prompt = f"""Generate provider communication for:
-        {json.dumps(communication_data, indent=2)}
-        
-        Format as professional clinical communication."""
-        
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
+        prompt = self._build_prompt(system_prompt)
+        prompt.set_intro("Generate provider communication for:")
+        prompt.add_section("Communication", communication_data, required=True)
+        prompt.set_outro("Format as professional clinical communication.")
         
-        return self._call_openai(messages)
+        return self._complete(prompt.build(), 'decision_support', patient_id=patient_data.get('patient_id'))
 
 
 # Initialize AI services
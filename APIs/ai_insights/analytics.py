@@ -0,0 +1,295 @@
+"""
+AI usage analytics
+Latency / error / token / cost rollups over AIProcessingLog:
+- Per-model price table used to populate cost_estimate
+- Mergeable streaming quantile sketch (DDSketch) for p50/p90/p99
+- Hourly rollups streamed from raw logs, daily rollups merged from hourly
+"""
+
+import logging
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger('ai_insights')
+
+
+# USD per 1M tokens: (prompt, completion). Longest matching prefix wins.
+MODEL_PRICING = {
+    'gpt-4': (30.00, 60.00),
+    'gpt-4-32k': (60.00, 120.00),
+    'gpt-4-turbo': (10.00, 30.00),
+    'gpt-4o': (2.50, 10.00),
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-3.5-turbo': (0.50, 1.50),
+    'claude-3-opus': (15.00, 75.00),
+    'claude-3-sonnet': (3.00, 15.00),
+    'claude-3-5-sonnet': (3.00, 15.00),
+    'claude-3-haiku': (0.25, 1.25),
+}
+
+QUANTILES = (0.5, 0.9, 0.99)
+ROLLUP_BATCH_SIZE = 5000
+
+
+def model_pricing(model: str) -> Optional[Tuple[float, float]]:
+    """Look up (prompt, completion) USD per 1M tokens for a model"""
+    pricing = dict(MODEL_PRICING)
+    pricing.update(getattr(settings, 'AI_CONFIG', {}).get('MODEL_PRICING', {}))
+    if model in pricing:
+        return pricing[model]
+    for prefix in sorted(pricing, key=len, reverse=True):
+        if model.startswith(prefix):
+            return pricing[prefix]
+    return None
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> Optional[Decimal]:
+    """Estimated USD cost of one call, or None for unknown models"""
+    pricing = model_pricing(model)
+    if pricing is None:
+        return None
+    prompt_price, completion_price = pricing
+    cost = (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+    return Decimal(str(cost)).quantize(Decimal('0.0001'), rounding=ROUND_HALF_UP)
+
+
+class QuantileSketch:
+    """
+    DDSketch: quantiles with bounded relative error in O(log range) space.
+
+    Values land in logarithmic bins (gamma = (1 + alpha) / (1 - alpha)), so
+    any quantile is accurate to within `alpha` relative error. Sketches merge
+    by adding bin counts, which is what lets daily rollups be built from
+    hourly ones without re-reading raw logs.
+    """
+
+    def __init__(self, alpha: float = 0.01):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = defaultdict(int)
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value: float) -> None:
+        if value is None:
+            return
+        self.count += 1
+        if value <= 0:
+            self.zero_count += 1
+            return
+        self.bins[int(math.ceil(math.log(value) / self._log_gamma))] += 1
+
+    def merge(self, other: 'QuantileSketch') -> 'QuantileSketch':
+        if other.alpha != self.alpha:
+            raise ValueError("Cannot merge sketches with different accuracy")
+        for key, count in other.bins.items():
+            self.bins[key] += count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        return self
+
+    def quantile(self, q: float) -> Optional[float]:
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+
+    def to_dict(self) -> Dict:
+        return {
+            'alpha': self.alpha,
+            'zero': self.zero_count,
+            'bins': {str(key): count for key, count in self.bins.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'QuantileSketch':
+        sketch = cls(alpha=data.get('alpha', 0.01))
+        sketch.zero_count = data.get('zero', 0)
+        for key, count in data.get('bins', {}).items():
+            sketch.bins[int(key)] = count
+        sketch.count = sketch.zero_count + sum(sketch.bins.values())
+        return sketch
+
+
+class UsageAccumulator:
+    """Running totals and latency sketch for one rollup group"""
+
+    def __init__(self):
+        self.request_count = 0
+        self.error_count = 0
+        self.total_tokens = 0
+        self.total_cost = Decimal('0')
+        self.total_latency = 0.0
+        self.latency = QuantileSketch()
+
+    def add(self, success: bool, latency: float, tokens: Optional[int], cost: Optional[Decimal]) -> None:
+        self.request_count += 1
+        if not success:
+            self.error_count += 1
+        self.total_tokens += tokens or 0
+        self.total_cost += cost or 0
+        self.total_latency += latency or 0.0
+        self.latency.add(latency)
+
+    def merge_rollup(self, rollup) -> None:
+        self.request_count += rollup.request_count
+        self.error_count += rollup.error_count
+        self.total_tokens += rollup.total_tokens
+        self.total_cost += rollup.total_cost
+        self.total_latency += rollup.total_latency_seconds
+        self.latency.merge(QuantileSketch.from_dict(rollup.latency_sketch))
+
+    def summary(self) -> Dict:
+        p50, p90, p99 = (self.latency.quantile(q) for q in QUANTILES)
+        return {
+            'request_count': self.request_count,
+            'error_count': self.error_count,
+            'error_rate': round(self.error_count / self.request_count, 4) if self.request_count else 0.0,
+            'total_tokens': self.total_tokens,
+            'total_cost': self.total_cost,
+            'avg_latency_seconds': round(self.total_latency / self.request_count, 4) if self.request_count else None,
+            'p50_latency_seconds': p50,
+            'p90_latency_seconds': p90,
+            'p99_latency_seconds': p99,
+        }
+
+    def rollup_fields(self) -> Dict:
+        summary = self.summary()
+        return {
+            'request_count': self.request_count,
+            'error_count': self.error_count,
+            'total_tokens': self.total_tokens,
+            'total_cost': self.total_cost,
+            'total_latency_seconds': self.total_latency,
+            'p50_latency_seconds': summary['p50_latency_seconds'],
+            'p90_latency_seconds': summary['p90_latency_seconds'],
+            'p99_latency_seconds': summary['p99_latency_seconds'],
+            'latency_sketch': self.latency.to_dict(),
+        }
+
+
+def _truncate(moment: datetime, period: str) -> datetime:
+    moment = moment.replace(minute=0, second=0, microsecond=0)
+    if period == 'day':
+        moment = moment.replace(hour=0)
+    return moment
+
+
+def _save_rollups(period: str, groups: Dict[Tuple, UsageAccumulator]) -> int:
+    from .models import AIUsageRollup
+
+    rows = [
+        AIUsageRollup(
+            period=period,
+            bucket_start=bucket_start,
+            model_used=model_used,
+            process_type=process_type,
+            **accumulator.rollup_fields()
+        )
+        for (bucket_start, model_used, process_type), accumulator in groups.items()
+    ]
+    AIUsageRollup.objects.bulk_create(
+        rows,
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['period', 'bucket_start', 'model_used', 'process_type'],
+        update_fields=[
+            'request_count', 'error_count', 'total_tokens', 'total_cost',
+            'total_latency_seconds', 'p50_latency_seconds', 'p90_latency_seconds',
+            'p99_latency_seconds', 'latency_sketch', 'updated_at',
+        ],
+    )
+    return len(rows)
+
+
+def rollup_hourly(since: datetime, until: datetime = None) -> int:
+    """
+    Recompute hourly rollups for [since, until) in one streaming pass over
+    AIProcessingLog. Only the columns needed are fetched, in server-side
+    chunks, so memory stays proportional to the number of groups.
+    """
+    from .models import AIProcessingLog
+
+    since = _truncate(since, 'hour')
+    until = until or timezone.now()
+    groups: Dict[Tuple, UsageAccumulator] = defaultdict(UsageAccumulator)
+
+    rows = (
+        AIProcessingLog.objects
+        .filter(started_at__gte=since, started_at__lt=until)
+        .order_by()
+        .values_list('started_at', 'model_used', 'process_type', 'success',
+                     'processing_time_seconds', 'tokens_used', 'cost_estimate')
+        .iterator(chunk_size=ROLLUP_BATCH_SIZE)
+    )
+    for started_at, model_used, process_type, success, latency, tokens, cost in rows:
+        groups[(_truncate(started_at, 'hour'), model_used, process_type)].add(success, latency, tokens, cost)
+
+    return _save_rollups('hour', groups)
+
+
+def rollup_daily(since: datetime, until: datetime = None) -> int:
+    """Recompute daily rollups for [since, until) by merging hourly rollups"""
+    from .models import AIUsageRollup
+
+    since = _truncate(since, 'day')
+    until = until or timezone.now()
+    groups: Dict[Tuple, UsageAccumulator] = defaultdict(UsageAccumulator)
+
+    hourly = AIUsageRollup.objects.filter(period='hour', bucket_start__gte=since, bucket_start__lt=until)
+    for rollup in hourly.iterator(chunk_size=ROLLUP_BATCH_SIZE):
+        groups[(_truncate(rollup.bucket_start, 'day'), rollup.model_used, rollup.process_type)].merge_rollup(rollup)
+
+    return _save_rollups('day', groups)
+
+
+def run_rollups(lookback_hours: int = 2, since: datetime = None) -> Dict[str, int]:
+    """
+    Incremental rollup job. Recomputes from the latest hourly bucket minus a
+    lookback window (buffered/spilled audit records can arrive late).
+    """
+    from .models import AIUsageRollup
+
+    if since is None:
+        latest = AIUsageRollup.objects.filter(period='hour').order_by('-bucket_start').first()
+        if latest is None:
+            from .models import AIProcessingLog
+            first_log = AIProcessingLog.objects.order_by('started_at').first()
+            if first_log is None:
+                return {'hour': 0, 'day': 0}
+            since = first_log.started_at
+        else:
+            since = latest.bucket_start - timedelta(hours=lookback_hours)
+
+    hourly = rollup_hourly(since)
+    daily = rollup_daily(since)
+    logger.info(f"AI usage rollup since {since.isoformat()}: {hourly} hourly, {daily} daily rows")
+    return {'hour': hourly, 'day': daily}
+
+
+def summarize_rollups(rollups: Iterable, group_by: str = None) -> Dict:
+    """Merge rollup rows into one summary, or one per value of group_by"""
+    if group_by is None:
+        accumulator = UsageAccumulator()
+        for rollup in rollups:
+            accumulator.merge_rollup(rollup)
+        return accumulator.summary()
+
+    groups: Dict[str, UsageAccumulator] = defaultdict(UsageAccumulator)
+    for rollup in rollups:
+        groups[getattr(rollup, group_by)].merge_rollup(rollup)
+    return {key: accumulator.summary() for key, accumulator in groups.items()}
@@ -7,5 +7,4 @@ class AiInsightsConfig(AppConfig):
     verbose_name = 'AI Clinical Insights'
     
     def ready(self):
-        # Import signals or other startup code here if needed
-        pass
+        from . import signals  # noqa: F401
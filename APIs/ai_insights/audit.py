@@ -0,0 +1,266 @@
+"""
+Buffered audit writer for AIProcessingLog
+Keeps the audit INSERT off the AI request path:
+- Records are queued in memory and written with bulk_create
+- A background thread flushes on batch size or time interval
+- Pending records are flushed at interpreter shutdown
+- If the database is unavailable, records spill to a local JSONL file
+  and are replayed on the next successful flush; replay files left by a
+  crashed process are picked up again, and records the database rejects
+  (e.g. a deleted patient) are moved to a .rejected file so they do not
+  block the rest
+- completed_at is stamped when a record is submitted, so buffered and
+  replayed records keep the time the call finished
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from decimal import Decimal
+from pathlib import Path
+from typing import Dict, List
+
+from django.conf import settings
+from django.db import DatabaseError, InterfaceError, OperationalError, close_old_connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+logger = logging.getLogger('ai_insights')
+
+DATETIME_FIELDS = ('started_at', 'completed_at')
+# A replay file this old belongs to a process that died while replaying it
+ORPHANED_REPLAY_SECONDS = 300
+
+
+def _audit_config() -> Dict:
+    config = {
+        'ASYNC': True,
+        'BATCH_SIZE': 100,
+        'FLUSH_INTERVAL_SECONDS': 2.0,
+        'SPILL_PATH': Path(settings.BASE_DIR) / 'logs' / 'ai_audit_spill.jsonl',
+    }
+    config.update(getattr(settings, 'AI_AUDIT_CONFIG', {}))
+    return config
+
+
+def _encode(record: Dict) -> str:
+    def default(value):
+        if isinstance(value, datetime):
+            return value.isoformat()
+        if isinstance(value, Decimal):
+            return str(value)
+        return str(value)
+    return json.dumps(record, default=default, separators=(',', ':'))
+
+
+def _decode(line: str) -> Dict:
+    record = json.loads(line)
+    for name in DATETIME_FIELDS:
+        if isinstance(record.get(name), str):
+            record[name] = parse_datetime(record[name])
+    if record.get('cost_estimate') is not None:
+        record['cost_estimate'] = Decimal(record['cost_estimate'])
+    return record
+
+
+class AuditLogWriter:
+    """Queue AIProcessingLog records and write them in batches"""
+
+    def __init__(self, batch_size: int = None, flush_interval: float = None,
+                 spill_path: Path = None, asynchronous: bool = None):
+        config = _audit_config()
+        self.batch_size = batch_size or config['BATCH_SIZE']
+        self.flush_interval = flush_interval or config['FLUSH_INTERVAL_SECONDS']
+        self.spill_path = Path(spill_path or config['SPILL_PATH'])
+        self.asynchronous = config['ASYNC'] if asynchronous is None else asynchronous
+
+        self._buffer: List[Dict] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._pid = None
+        atexit.register(self.close)
+
+    def submit(self, **record) -> None:
+        """Queue one AIProcessingLog record (model field names as keys)"""
+        record.setdefault('completed_at', timezone.now())
+        with self._lock:
+            self._buffer.append(record)
+            pending = len(self._buffer)
+
+        if not self.asynchronous:
+            self.flush()
+            return
+
+        self._ensure_worker()
+        if pending >= self.batch_size:
+            self._wakeup.set()
+
+    def _ensure_worker(self) -> None:
+        # Worker threads do not survive fork (gunicorn preload), so start per process
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='ai-audit-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Audit writer flush failed: {str(e)}")
+            finally:
+                close_old_connections()
+
+    def flush(self) -> int:
+        """Write all queued (and previously spilled) records; returns rows written"""
+        with self._flush_lock:
+            with self._lock:
+                records, self._buffer = self._buffer, []
+
+            written = self._replay_spill()
+            if not records:
+                return written
+
+            try:
+                written += self._write(records)
+            except Exception as e:
+                logger.error(f"Audit log write failed, spilling {len(records)} records: {str(e)}")
+                self._spill(records)
+            return written
+
+    def _write(self, records: List[Dict]) -> int:
+        from .models import AIProcessingLog
+        # All-or-nothing, so a failed batch can be spilled without duplicates
+        with transaction.atomic():
+            AIProcessingLog.objects.bulk_create(
+                [AIProcessingLog(**record) for record in records],
+                batch_size=self.batch_size
+            )
+        return len(records)
+
+    def _spill(self, records: List[Dict]) -> None:
+        try:
+            self.spill_path.parent.mkdir(parents=True, exist_ok=True)
+            self._append(self.spill_path, records)
+        except OSError as e:
+            # Nowhere to put them: keep them queued for the next attempt
+            logger.error(f"Audit spill to {self.spill_path} failed: {str(e)}")
+            with self._lock:
+                self._buffer[:0] = records
+
+    def _replay_spill(self) -> int:
+        replay_path = self.spill_path.with_name(f"{self.spill_path.name}.{os.getpid()}.replay")
+        written = 0
+        # Leftovers of a process that crashed mid-replay first, then the current spill
+        for source in self._orphaned_replays() + [self.spill_path]:
+            # Claim the file first so concurrent writers append to a fresh one
+            try:
+                os.replace(source, replay_path)
+            except FileNotFoundError:
+                continue
+            # Marks the claim as live for other processes looking for orphans
+            os.utime(replay_path)
+            replayed = self._replay_file(replay_path)
+            if replayed is None:
+                break
+            written += replayed
+        if written:
+            logger.info(f"Replayed {written} spilled audit records")
+        return written
+
+    def _orphaned_replays(self) -> List[Path]:
+        own = f"{self.spill_path.name}.{os.getpid()}.replay"
+        orphans = []
+        for path in self.spill_path.parent.glob(f"{self.spill_path.name}.*.replay"):
+            try:
+                # Our own name can only be left over from a dead process with the same pid
+                if path.name == own or time.time() - path.stat().st_mtime > ORPHANED_REPLAY_SECONDS:
+                    orphans.append(path)
+            except FileNotFoundError:
+                continue
+        return orphans
+
+    def _replay_file(self, replay_path: Path):
+        """Write a claimed replay file; returns the rows written, or None if the database is unavailable"""
+        try:
+            with open(replay_path, encoding='utf-8') as replay_file:
+                records = [_decode(line) for line in replay_file if line.strip()]
+        except (OSError, ValueError) as e:
+            logger.error(f"Unreadable audit spill {replay_path} kept for inspection: {str(e)}")
+            os.replace(replay_path, replay_path.with_suffix('.unreadable'))
+            return 0
+        try:
+            written = self._write(records)
+        except (OperationalError, InterfaceError) as e:
+            logger.warning(f"Audit spill replay deferred: {str(e)}")
+            self._restore_spill(replay_path)
+            return None
+        except Exception:
+            # Some record is invalid: write row by row and set the rejected ones aside
+            written, rejected, pending = self._write_each(records)
+            if rejected:
+                logger.error(f"Rejected {len(rejected)} spilled audit records; kept in {self._rejected_path()}")
+                self._append(self._rejected_path(), rejected)
+            if pending:
+                self._append(self.spill_path, pending)
+                replay_path.unlink()
+                return None
+        replay_path.unlink()
+        return written
+
+    def _write_each(self, records: List[Dict]):
+        """(rows written, rejected records, records left for later when the database went away)"""
+        written, rejected = 0, []
+        for index, record in enumerate(records):
+            try:
+                written += self._write([record])
+            except (OperationalError, InterfaceError):
+                return written, rejected, records[index:]
+            except (DatabaseError, ValueError, TypeError) as e:
+                rejected.append(dict(record, rejected_error=str(e)))
+        return written, rejected, []
+
+    def _rejected_path(self) -> Path:
+        return self.spill_path.with_name(f"{self.spill_path.name}.rejected")
+
+    def _append(self, path: Path, records: List[Dict]) -> None:
+        with open(path, 'a', encoding='utf-8') as spill_file:
+            for record in records:
+                spill_file.write(_encode(record) + '\n')
+            spill_file.flush()
+            os.fsync(spill_file.fileno())
+
+    def _restore_spill(self, replay_path: Path) -> None:
+        with open(replay_path, encoding='utf-8') as replay_file:
+            pending = replay_file.read()
+        with open(self.spill_path, 'a', encoding='utf-8') as spill_file:
+            spill_file.write(pending)
+        replay_path.unlink()
+
+    def close(self) -> None:
+        """Stop the worker and flush everything still queued"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout=self.flush_interval + 5)
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Audit writer final flush failed: {str(e)}")
+
+
+audit_log_writer = AuditLogWriter()
@@ -0,0 +1,400 @@
+"""
+Local medical named-entity recognition
+Extracts problems, medications, doses and vital signs without an LLM call:
+- A spaCy pipeline (statistical NER if the configured model is installed,
+  plus an entity ruler built from the medication lexicon and a problem
+  list) is loaded once per worker process
+- Texts are processed with nlp.pipe in batches, fanned out over a process
+  pool when MEDICAL_NER['N_PROCESS'] > 1; a sync starts that pool once and
+  reuses it for every batch
+- Doses and vital signs are parsed from the text with compiled patterns and
+  normalized (generic drug, problem term, vital metric + value + unit)
+- Visit notes and OCR text are extracted incrementally into
+  ClinicalEntityExtraction / ClinicalEntity rows; unchanged documents are
+  skipped by content hash
+"""
+
+import hashlib
+import logging
+import re
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+
+from .medication_lexicon import get_lexicon
+
+logger = logging.getLogger('ai_insights')
+
+SOURCE_VISIT_NOTE = 'visit_note'
+SOURCE_OCR_TEXT = 'ocr_text'
+
+PROBLEM_TERMS = {
+    'heart failure': 'heart failure', 'chf': 'heart failure', 'congestive heart failure': 'heart failure',
+    'copd': 'copd', 'chronic obstructive pulmonary disease': 'copd',
+    'pneumonia': 'pneumonia', 'sepsis': 'sepsis', 'uti': 'urinary tract infection',
+    'urinary tract infection': 'urinary tract infection',
+    'diabetes': 'diabetes', 'diabetes mellitus': 'diabetes', 'dm2': 'diabetes', 't2dm': 'diabetes',
+    'hypertension': 'hypertension', 'htn': 'hypertension',
+    'atrial fibrillation': 'atrial fibrillation', 'afib': 'atrial fibrillation', 'a-fib': 'atrial fibrillation',
+    'coronary artery disease': 'coronary artery disease', 'cad': 'coronary artery disease',
+    'myocardial infarction': 'myocardial infarction', 'mi': 'myocardial infarction',
+    'stroke': 'stroke', 'cva': 'stroke', 'tia': 'transient ischemic attack',
+    'chronic kidney disease': 'chronic kidney disease', 'ckd': 'chronic kidney disease',
+    'renal failure': 'renal failure', 'aki': 'acute kidney injury', 'acute kidney injury': 'acute kidney injury',
+    'dementia': 'dementia', "alzheimer's disease": 'dementia', 'alzheimer disease': 'dementia',
+    'delirium': 'delirium', 'depression': 'depression', 'anxiety': 'anxiety',
+    "parkinson's disease": "parkinson's disease", 'parkinson disease': "parkinson's disease",
+    'osteoarthritis': 'osteoarthritis', 'osteoporosis': 'osteoporosis',
+    'hip fracture': 'hip fracture', 'fracture': 'fracture',
+    'pressure ulcer': 'pressure injury', 'pressure injury': 'pressure injury', 'wound': 'wound',
+    'cellulitis': 'cellulitis', 'dvt': 'deep vein thrombosis', 'deep vein thrombosis': 'deep vein thrombosis',
+    'pulmonary embolism': 'pulmonary embolism', 'anemia': 'anemia', 'edema': 'edema',
+    'hypoglycemia': 'hypoglycemia', 'hyperglycemia': 'hyperglycemia', 'dehydration': 'dehydration',
+    'malnutrition': 'malnutrition', 'obesity': 'obesity', 'asthma': 'asthma', 'cancer': 'cancer',
+}
+
+DOSE_UNITS = r'mg|mcg|µg|g|units?|iu|ml|meq|puffs?|tabs?|tablets?|caps?|capsules?|drops?'
+DOSE_RE = re.compile(rf'\b(\d+(?:\.\d+)?)\s*({DOSE_UNITS})\b', re.IGNORECASE)
+FREQUENCY_RE = re.compile(
+    r'\b(once daily|twice daily|three times daily|daily|nightly|qd|bid|tid|qid|qhs|qam|qpm|prn|'
+    r'q\s?\d{1,2}\s?h(?:rs?)?|every \d{1,2} hours|weekly)\b',
+    re.IGNORECASE
+)
+# (metric, pattern, unit); the first group is the value
+VITAL_PATTERNS = [
+    ('blood_pressure', re.compile(r'\b(?:bp|b/p|blood pressure)\s*(?:of|:|=|was|is)?\s*(\d{2,3}\s*/\s*\d{2,3})\b', re.IGNORECASE), 'mmHg'),
+    ('heart_rate', re.compile(r'\b(?:hr|heart rate|pulse)\s*(?:of|:|=|was|is)?\s*(\d{2,3})\b(?:\s*bpm)?', re.IGNORECASE), 'bpm'),
+    ('respiratory_rate', re.compile(r'\b(?:rr|resp(?:irations|iratory rate)?)\s*(?:of|:|=|was|is)?\s*(\d{1,2})\b', re.IGNORECASE), '/min'),
+    ('temperature', re.compile(r'\b(?:t|temp|temperature)\s*(?:of|:|=|was|is)?\s*(\d{2,3}(?:\.\d)?)\s*°?\s*[fc]?\b', re.IGNORECASE), 'F'),
+    ('oxygen_saturation', re.compile(r'\b(?:spo2|o2 sat|sao2|sats?|pulse ox)\s*(?:of|:|=|was|is)?\s*(\d{2,3})\s*%?', re.IGNORECASE), '%'),
+    ('weight', re.compile(r'\b(?:wt|weight)\s*(?:of|:|=|was|is)?\s*(\d{2,3}(?:\.\d)?)\s*(?:lbs?|kg)?\b', re.IGNORECASE), 'lb'),
+    ('blood_glucose', re.compile(r'\b(?:bg|fsbs|cbg|blood (?:sugar|glucose)|glucose)\s*(?:of|:|=|was|is)?\s*(\d{2,3})\b', re.IGNORECASE), 'mg/dL'),
+    ('pain', re.compile(r'\bpain\s*(?:score|level)?\s*(?:of|:|=|was|is)?\s*(\d{1,2})\s*/\s*10\b', re.IGNORECASE), '/10'),
+]
+VITAL_RANGES = {
+    'heart_rate': (20, 250), 'respiratory_rate': (4, 60), 'temperature': (90, 110),
+    'oxygen_saturation': (50, 100), 'weight': (50, 700), 'blood_glucose': (20, 900), 'pain': (0, 10),
+}
+
+
+def _ner_config() -> Dict:
+    healthcare_config = getattr(settings, 'HEALTHCARE_AI_CONFIG', {})
+    config = {
+        'ENABLED': healthcare_config.get('ENABLE_MEDICAL_NER', False),
+        'MODEL_NAME': 'en_core_sci_sm',
+        'BATCH_SIZE': 64,
+        'N_PROCESS': 1,
+        'SYNC_BATCH_SIZE': 500,
+        'MAX_CHARS': 100000,
+        # Labels of the statistical model kept as entities (others are ignored)
+        'LABEL_MAP': {'DISEASE': 'problem', 'CHEMICAL': 'medication'},
+    }
+    config.update(healthcare_config.get('MEDICAL_NER', {}))
+    return config
+
+
+def medical_ner_enabled() -> bool:
+    return bool(_ner_config()['ENABLED'])
+
+
+def _ruler_patterns() -> List[Dict]:
+    lexicon = get_lexicon()
+    patterns = []
+    for term, (drug, _) in lexicon.terms.items():
+        if drug in lexicon.drug_classes:
+            patterns.append({'label': 'MEDICATION', 'pattern': term, 'id': drug})
+    for term, normalized in PROBLEM_TERMS.items():
+        patterns.append({'label': 'PROBLEM', 'pattern': term, 'id': normalized})
+    return patterns
+
+
+def load_pipeline(model_name: str):
+    """spaCy pipeline with the statistical model (if installed) and the clinical entity ruler"""
+    import spacy
+
+    try:
+        nlp = spacy.load(model_name, exclude=['parser', 'lemmatizer', 'textcat'])
+    except OSError:
+        logger.warning(f"spaCy model {model_name} is not installed; using rule-based entities only")
+        nlp = spacy.blank('en')
+    ruler = nlp.add_pipe('entity_ruler', name='clinical_ruler', last=True,
+                         config={'overwrite_ents': True, 'phrase_matcher_attr': 'LOWER'})
+    ruler.add_patterns(_ruler_patterns())
+    return nlp
+
+
+@lru_cache(maxsize=1)
+def _local_pipeline(model_name: str):
+    return load_pipeline(model_name)
+
+
+# Set in each worker process by the pool initializer
+_worker_nlp = None
+
+
+def _init_worker(model_name: str) -> None:
+    global _worker_nlp
+    _worker_nlp = load_pipeline(model_name)
+
+
+def _entity(label: str, text: str, start: int, end: int, normalized: str = '',
+            value: Optional[float] = None, unit: str = '') -> Dict:
+    return {
+        'label': label, 'text': text[:255], 'normalized': normalized[:100],
+        'value': value, 'unit': unit, 'start_char': start, 'end_char': end,
+    }
+
+
+def measurement_entities(text: str) -> List[Dict]:
+    """Dose and vital-sign entities parsed from the text"""
+    entities = []
+    for match in DOSE_RE.finditer(text):
+        unit = match.group(2).lower()
+        entities.append(_entity('dose', match.group(0), match.start(), match.end(),
+                                normalized=f"{match.group(1)} {unit}", value=float(match.group(1)), unit=unit))
+
+    taken = []
+    for metric, pattern, default_unit in VITAL_PATTERNS:
+        for match in pattern.finditer(text):
+            unit = default_unit
+            if any(start < match.end() and match.start() < end for start, end in taken):
+                continue
+            raw = match.group(1).replace(' ', '')
+            if metric == 'blood_pressure':
+                value = float(raw.split('/')[0])
+                if not 60 <= value <= 260:
+                    continue
+            else:
+                value = float(raw)
+                low, high = VITAL_RANGES[metric]
+                if metric == 'temperature' and 30 <= value <= 45:
+                    unit = 'C'
+                elif not low <= value <= high:
+                    continue
+            taken.append((match.start(), match.end()))
+            entities.append(_entity('vital', match.group(0), match.start(), match.end(),
+                                    normalized=metric if metric != 'blood_pressure' else f"blood_pressure {raw}",
+                                    value=value, unit=unit))
+    return entities
+
+
+def entities_from_doc(doc, label_map: Dict[str, str]) -> List[Dict]:
+    """Plain-dict entities (picklable) for one processed spaCy Doc"""
+    entities = []
+    for ent in doc.ents:
+        if ent.label_ in ('MEDICATION', 'PROBLEM'):
+            label, normalized = ent.label_.lower(), ent.ent_id_ or ent.text.lower()
+        elif ent.label_ in label_map:
+            label, normalized = label_map[ent.label_], ent.text.lower()
+        else:
+            continue
+        entities.append(_entity(label, ent.text, ent.start_char, ent.end_char, normalized=normalized))
+    entities.extend(measurement_entities(doc.text))
+    entities.sort(key=lambda entity: entity['start_char'])
+    return entities
+
+
+def _extract_batch(texts: List[str], batch_size: int, label_map: Dict[str, str],
+                   nlp=None) -> List[List[Dict]]:
+    nlp = nlp or _worker_nlp
+    return [entities_from_doc(doc, label_map) for doc in nlp.pipe(texts, batch_size=batch_size)]
+
+
+@contextmanager
+def extraction_pool():
+    """Worker pool shared by every batch of a sync, or None when N_PROCESS <= 1"""
+    config = _ner_config()
+    if config['N_PROCESS'] <= 1:
+        yield None
+        return
+    with ProcessPoolExecutor(max_workers=config['N_PROCESS'], initializer=_init_worker,
+                             initargs=(config['MODEL_NAME'],)) as pool:
+        yield pool
+
+
+def extract_entities(texts: List[str], pool: Optional[ProcessPoolExecutor] = None) -> List[List[Dict]]:
+    """
+    Entities for each text, in order. Batches go through nlp.pipe; with
+    N_PROCESS > 1 they are spread over worker processes that each load the
+    pipeline once (pass the pool from extraction_pool() to reuse it across
+    calls).
+    """
+    config = _ner_config()
+    texts = [text[:config['MAX_CHARS']] for text in texts]
+    batch_size = config['BATCH_SIZE']
+    if config['N_PROCESS'] <= 1 or len(texts) <= batch_size:
+        return _extract_batch(texts, batch_size, config['LABEL_MAP'], nlp=_local_pipeline(config['MODEL_NAME']))
+    if pool is None:
+        with extraction_pool() as pool:
+            return extract_entities(texts, pool)
+
+    # Several nlp.pipe batches per task keep inter-process overhead low
+    task_size = batch_size * 4
+    tasks = [texts[start:start + task_size] for start in range(0, len(texts), task_size)]
+    results: List[List[Dict]] = []
+    for batch in pool.map(_extract_batch, tasks, [batch_size] * len(tasks), [config['LABEL_MAP']] * len(tasks)):
+        results.extend(batch)
+    return results
+
+
+def pipeline_name() -> str:
+    config = _ner_config()
+    return f"spacy:{config['MODEL_NAME']}+lexicon_v{get_lexicon().version}"
+
+
+def to_clinical_data(text: str, entities: List[Dict]) -> Dict:
+    """Shape entities like the document_extraction output (diagnoses, medications, vital_signs)"""
+    diagnoses, medications, vital_signs = [], [], {}
+    doses = [entity for entity in entities if entity['label'] == 'dose']
+    for entity in entities:
+        if entity['label'] == 'problem' and entity['normalized'] not in diagnoses:
+            diagnoses.append(entity['normalized'])
+        elif entity['label'] == 'medication':
+            if any(m['name'] == entity['normalized'] for m in medications):
+                continue
+            # Dose and frequency written on the same line after the drug name
+            line_end = text.find('\n', entity['end_char'])
+            window_end = min(line_end if line_end >= 0 else len(text), entity['end_char'] + 40)
+            medication = {'name': entity['normalized']}
+            dose = next((d for d in doses if entity['end_char'] <= d['start_char'] < window_end), None)
+            if dose:
+                medication['dose'] = dose['normalized']
+            frequency = FREQUENCY_RE.search(text, entity['end_char'], window_end)
+            if frequency:
+                medication['frequency'] = frequency.group(0).lower()
+            medications.append(medication)
+        elif entity['label'] == 'vital':
+            metric, _, reading = entity['normalized'].partition(' ')
+            vital_signs.setdefault(metric, reading or entity['value'])
+    return {'diagnoses': diagnoses, 'medications': medications, 'vital_signs': vital_signs}
+
+
+class ClinicalNERService:
+    """Incremental entity extraction over visit notes and OCR text"""
+
+    def _sources(self, full: bool) -> Iterator[Tuple[str, int, int, str, object]]:
+        """Yield (source_type, source_id, patient_id, text, updated_at) for changed documents"""
+        from django.apps import apps
+        from .models import ClinicalEntityExtraction
+        VisitNote = apps.get_model('visits', 'VisitNote')
+        UploadedFile = apps.get_model('file_management', 'UploadedFile')
+
+        batch = _ner_config()['SYNC_BATCH_SIZE']
+        querysets = [
+            (SOURCE_VISIT_NOTE, VisitNote.objects.values_list('id', 'visit__patient_id', 'content', 'updated_at')),
+            (SOURCE_OCR_TEXT, UploadedFile.objects.exclude(ocr_text='').values_list(
+                'id', 'patient_id', 'ocr_text', 'updated_at')),
+        ]
+        for source_type, queryset in querysets:
+            if not full:
+                # Watermark: newest source version already extracted for this source type
+                since = ClinicalEntityExtraction.objects.filter(source_type=source_type).aggregate(
+                    since=Max('source_updated_at'))['since']
+                if since is not None:
+                    queryset = queryset.filter(updated_at__gt=since)
+            for source_id, patient_id, text, updated_at in queryset.order_by('updated_at').iterator(chunk_size=batch):
+                yield source_type, source_id, patient_id, text, updated_at
+
+    def _content_hash(self, text: str) -> str:
+        return hashlib.sha1(f"{pipeline_name()}\n{text}".encode('utf-8')).hexdigest()
+
+    def sync(self, full: bool = False) -> Dict[str, int]:
+        """Extract entities from new or changed documents"""
+        stats = {'documents': 0, 'skipped': 0, 'entities': 0}
+        pending = []
+        with extraction_pool() as pool:
+            for document in self._sources(full):
+                stats['documents'] += 1
+                pending.append(document)
+                if len(pending) >= _ner_config()['SYNC_BATCH_SIZE']:
+                    self._extract_documents(pending, stats, pool)
+                    pending = []
+            if pending:
+                self._extract_documents(pending, stats, pool)
+        logger.info(f"Clinical NER sync: {stats}")
+        return stats
+
+    def _extract_documents(self, documents: List[Tuple], stats: Dict[str, int],
+                           pool: Optional[ProcessPoolExecutor] = None) -> None:
+        from .models import ClinicalEntity, ClinicalEntityExtraction
+
+        existing = {}
+        for source_type in {document[0] for document in documents}:
+            ids = [document[1] for document in documents if document[0] == source_type]
+            for row in ClinicalEntityExtraction.objects.filter(source_type=source_type, source_id__in=ids):
+                existing[(row.source_type, row.source_id)] = row
+
+        changed = []
+        for source_type, source_id, patient_id, text, updated_at in documents:
+            content_hash = self._content_hash(text)
+            current = existing.get((source_type, source_id))
+            if current is not None and current.content_hash == content_hash:
+                stats['skipped'] += 1
+                if current.source_updated_at != updated_at:
+                    # Keep the watermark moving for saves that did not change the text
+                    ClinicalEntityExtraction.objects.filter(pk=current.pk).update(source_updated_at=updated_at)
+                continue
+            changed.append((source_type, source_id, patient_id, text, updated_at, content_hash))
+        if not changed:
+            return
+
+        extracted = extract_entities([document[3] for document in changed], pool)
+        extractor = pipeline_name()
+        with transaction.atomic():
+            ClinicalEntityExtraction.objects.filter(
+                pk__in=[existing[(d[0], d[1])].pk for d in changed if (d[0], d[1]) in existing]
+            ).delete()
+            extractions = ClinicalEntityExtraction.objects.bulk_create([
+                ClinicalEntityExtraction(
+                    source_type=source_type, source_id=source_id, patient_id=patient_id,
+                    content_hash=content_hash, extractor=extractor, entity_count=len(entities),
+                    source_updated_at=updated_at,
+                )
+                for (source_type, source_id, patient_id, _, updated_at, content_hash), entities
+                in zip(changed, extracted)
+            ])
+            if any(extraction.pk is None for extraction in extractions):
+                # Backends without RETURNING: read the ids back
+                lookup = {
+                    (row.source_type, row.source_id): row.pk
+                    for row in ClinicalEntityExtraction.objects.filter(
+                        source_id__in=[extraction.source_id for extraction in extractions])
+                }
+                for extraction in extractions:
+                    extraction.pk = lookup[(extraction.source_type, extraction.source_id)]
+            rows = [
+                ClinicalEntity(extraction_id=extraction.pk, patient_id=extraction.patient_id, **entity)
+                for extraction, entities in zip(extractions, extracted)
+                for entity in entities
+            ]
+            ClinicalEntity.objects.bulk_create(rows, batch_size=1000)
+        stats['entities'] += len(rows)
+
+    def prune_orphans(self) -> int:
+        """Delete extractions whose source document no longer exists"""
+        from django.apps import apps
+        from .models import ClinicalEntityExtraction
+
+        source_models = {
+            SOURCE_VISIT_NOTE: apps.get_model('visits', 'VisitNote'),
+            SOURCE_OCR_TEXT: apps.get_model('file_management', 'UploadedFile'),
+        }
+        deleted = 0
+        for source_type, model in source_models.items():
+            extracted = set(ClinicalEntityExtraction.objects.filter(source_type=source_type)
+                            .values_list('source_id', flat=True))
+            live = set(model.objects.filter(id__in=extracted).values_list('id', flat=True)) if extracted else set()
+            orphans = list(extracted - live)
+            for start in range(0, len(orphans), 1000):
+                deleted += ClinicalEntityExtraction.objects.filter(
+                    source_type=source_type, source_id__in=orphans[start:start + 1000]
+                ).delete()[1].get('ai_insights.ClinicalEntityExtraction', 0)
+        return deleted
+
+
+clinical_ner_service = ClinicalNERService()
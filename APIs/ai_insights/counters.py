@@ -0,0 +1,184 @@
+"""
+AIInsight dashboard counters
+Per-patient and global counts of active insights, kept current on write:
+- Each insight contributes to total, critical, status:*, type:* and risk:* metrics
+- Saves and deletes apply the difference between the old and new contribution
+  with atomic F() increments (signals, see signals.py)
+- Bulk inserts and bulk deactivations (the lifecycle sweeper) are applied
+  in one pass per batch
+- One conditional-aggregation query rebuilds the counters from scratch
+"""
+
+import logging
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from .models import AIInsight, AIInsightCounter, AIInsightType, RiskLevel
+
+logger = logging.getLogger('ai_insights')
+
+STATUSES = [value for value, _ in AIInsight._meta.get_field('status').choices]
+CRITICAL_Q = Q(risk_level=RiskLevel.CRITICAL) | Q(urgency_level='immediate')
+TRACKED_FIELDS = ('patient_id', 'insight_type', 'risk_level', 'urgency_level', 'status', 'is_active')
+
+
+def insight_metrics(insight_type: str, risk_level: str, urgency_level: str, status: str,
+                    is_active: bool = True) -> List[str]:
+    """Metrics one insight counts towards (none once inactive)"""
+    if not is_active:
+        return []
+    metrics = ['total', f'status:{status}', f'type:{insight_type}', f'risk:{risk_level}']
+    if risk_level == RiskLevel.CRITICAL or urgency_level == 'immediate':
+        metrics.append('critical')
+    return metrics
+
+
+def snapshot(insight: AIInsight) -> Optional[tuple]:
+    """(patient_id, metrics) for an instance, or None if counted fields were deferred"""
+    if insight.pk is None or insight.get_deferred_fields() & set(TRACKED_FIELDS):
+        return None
+    return insight.patient_id, insight_metrics(
+        insight.insight_type, insight.risk_level, insight.urgency_level, insight.status, insight.is_active
+    )
+
+
+def apply_deltas(deltas: Dict[tuple, int]) -> None:
+    """Apply {(patient_id, metric): delta} to the patient and global counters"""
+    combined = Counter()
+    for (patient_id, metric), delta in deltas.items():
+        combined[(patient_id, metric)] += delta
+        combined[(None, metric)] += delta
+
+    now = timezone.now()
+    for (patient_id, metric), delta in combined.items():
+        if not delta:
+            continue
+        counters = AIInsightCounter.objects.filter(patient_id=patient_id, metric=metric)
+        if counters.update(value=F('value') + delta, updated_at=now):
+            continue
+        if delta < 0:
+            # Nothing to subtract from, e.g. the patient's counters were cascade-deleted with the patient
+            continue
+        try:
+            with transaction.atomic():
+                AIInsightCounter.objects.create(patient_id=patient_id, metric=metric, value=delta)
+        except IntegrityError:
+            # Another writer created the row first
+            counters.update(value=F('value') + delta, updated_at=now)
+
+
+def record_change(before: Optional[tuple], after: Optional[tuple]) -> None:
+    """Apply the difference between two snapshots of the same insight"""
+    deltas = Counter()
+    if before:
+        for metric in before[1]:
+            deltas[(before[0], metric)] -= 1
+    if after:
+        for metric in after[1]:
+            deltas[(after[0], metric)] += 1
+    apply_deltas({key: delta for key, delta in deltas.items() if delta})
+
+
+def record_bulk_created(insights) -> None:
+    """Add rows inserted with bulk_create (which skips signals)"""
+    deltas = Counter()
+    for insight in insights:
+        for metric in insight_metrics(insight.insight_type, insight.risk_level, insight.urgency_level,
+                                      insight.status, insight.is_active):
+            deltas[(insight.patient_id, metric)] += 1
+    apply_deltas(deltas)
+    for insight in insights:
+        insight._counter_snapshot = snapshot(insight)
+
+
+def record_bulk_removal(queryset) -> None:
+    """
+    Subtract the contribution of every active row in `queryset`. Call before a
+    queryset.update()/delete() that deactivates them, in the same transaction.
+    """
+    deltas = Counter()
+    rows = (
+        queryset.filter(is_active=True)
+        .order_by()
+        .values('patient_id', 'insight_type', 'risk_level', 'status')
+        .annotate(n=Count('id'), critical=Count('id', filter=CRITICAL_Q))
+    )
+    for row in rows:
+        patient_id, n = row['patient_id'], row['n']
+        deltas[(patient_id, 'total')] -= n
+        deltas[(patient_id, f"status:{row['status']}")] -= n
+        deltas[(patient_id, f"type:{row['insight_type']}")] -= n
+        deltas[(patient_id, f"risk:{row['risk_level']}")] -= n
+        deltas[(patient_id, 'critical')] -= row['critical']
+    apply_deltas(deltas)
+
+
+def _aggregations() -> Dict:
+    aggregations = {
+        'total': Count('id'),
+        'critical': Count('id', filter=CRITICAL_Q),
+    }
+    for status in STATUSES:
+        aggregations[f'status:{status}'] = Count('id', filter=Q(status=status))
+    for insight_type in AIInsightType.values:
+        aggregations[f'type:{insight_type}'] = Count('id', filter=Q(insight_type=insight_type))
+    for risk_level in RiskLevel.values:
+        aggregations[f'risk:{risk_level}'] = Count('id', filter=Q(risk_level=risk_level))
+    return aggregations
+
+
+def aggregate_metrics(queryset) -> Dict[str, int]:
+    """All dashboard metrics for a queryset in one conditional-aggregation query"""
+    return queryset.filter(is_active=True).aggregate(**_aggregations())
+
+
+def rebuild_counters() -> int:
+    """Recompute every counter from the insight table; returns rows written"""
+    rows = []
+    per_patient = (
+        AIInsight.objects.filter(is_active=True)
+        .order_by()
+        .values('patient_id')
+        .annotate(**_aggregations())
+    )
+    for values in per_patient.iterator():
+        patient_id = values.pop('patient_id')
+        rows.extend(AIInsightCounter(patient_id=patient_id, metric=m, value=v) for m, v in values.items() if v)
+    rows.extend(
+        AIInsightCounter(patient_id=None, metric=m, value=v)
+        for m, v in aggregate_metrics(AIInsight.objects.all()).items()
+    )
+
+    with transaction.atomic():
+        AIInsightCounter.objects.all().delete()
+        AIInsightCounter.objects.bulk_create(rows, batch_size=1000)
+    logger.info(f"Rebuilt {len(rows)} AI insight counters")
+    return len(rows)
+
+
+def read_counters(patient_id: int = None) -> Optional[Dict[str, int]]:
+    """Counter values for a patient (or global), or None if never counted"""
+    values = dict(
+        AIInsightCounter.objects.filter(patient_id=patient_id).values_list('metric', 'value')
+    )
+    return values or None
+
+
+def dashboard_summary(metrics: Dict[str, int]) -> Dict:
+    """Shape a metric map into the dashboard summary fields"""
+    by_prefix = defaultdict(dict)
+    for metric, value in metrics.items():
+        prefix, _, key = metric.partition(':')
+        if key and value:
+            by_prefix[prefix][key] = value
+    return {
+        'total_insights': metrics.get('total', 0),
+        'critical_insights': metrics.get('critical', 0),
+        'new_insights': metrics.get('status:new', 0),
+        'insights_by_type': by_prefix['type'],
+        'insights_by_risk_level': by_prefix['risk'],
+    }
@@ -0,0 +1,250 @@
+"""
+Drug-drug interaction screening
+Local, rule-based interaction checks (no LLM call):
+- The interaction table (data/drug_interactions.json) is expanded once into a
+  pair index keyed by normalized ingredient ids; entries may name a drug or a
+  whole class ("class:opioid") from the medication lexicon
+- A medication list is normalized to ingredient ids and every pair is one
+  dict lookup
+- Hits become ClinicalDecisionSupport rows; open rows for the same pair are
+  not duplicated
+- Batch mode screens every active patient in streamed chunks
+"""
+
+import json
+import logging
+from dataclasses import dataclass
+from functools import lru_cache
+from itertools import combinations
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+
+from .medication_lexicon import MedicationLexicon, get_lexicon
+from .models import ClinicalDecisionSupport
+
+logger = logging.getLogger('ai_insights')
+
+DEFAULT_INTERACTIONS_PATH = Path(__file__).resolve().parent / 'data' / 'drug_interactions.json'
+SUPPORT_TYPE = 'medication_adjustment'
+TITLE_PREFIX = 'Drug interaction: '
+OPEN_STATUSES = ('pending', 'approved', 'modified')
+SEVERITY_RANK = {'minor': 0, 'moderate': 1, 'major': 2, 'contraindicated': 3}
+SEVERITY_URGENCY = {
+    'contraindicated': 'immediate',
+    'major': 'within_24h',
+    'moderate': 'next_visit',
+    'minor': 'routine',
+}
+
+
+def _interaction_config() -> Dict:
+    healthcare_config = getattr(settings, 'HEALTHCARE_AI_CONFIG', {})
+    config = {
+        'ENABLED': healthcare_config.get('ENABLE_DRUG_INTERACTION_CHECK', False),
+        'MIN_SEVERITY': 'moderate',
+        'TABLE_PATH': None,
+    }
+    config.update(healthcare_config.get('DRUG_INTERACTIONS', {}))
+    return config
+
+
+def interaction_checks_enabled() -> bool:
+    return bool(_interaction_config()['ENABLED'])
+
+
+@dataclass(frozen=True)
+class Interaction:
+    """One row of the interaction table"""
+    severity: str
+    evidence: str
+    effect: str
+    management: str
+
+
+@dataclass(frozen=True)
+class InteractionHit:
+    """An interacting pair found in a medication list"""
+    drug_a: str
+    drug_b: str
+    interaction: Interaction
+
+    @property
+    def title(self) -> str:
+        return f"{TITLE_PREFIX}{self.drug_a} + {self.drug_b}"[:200]
+
+    def to_dict(self) -> Dict:
+        return {
+            'drugs': [self.drug_a, self.drug_b],
+            'severity': self.interaction.severity,
+            'effect': self.interaction.effect,
+            'management': self.interaction.management,
+        }
+
+
+class InteractionIndex:
+    """Interaction table expanded into {pair key: Interaction} over ingredient ids"""
+
+    def __init__(self, data: Dict, lexicon: MedicationLexicon):
+        self.version = data.get('version', 1)
+        self.lexicon = lexicon
+        # Ingredient ids are positions in the sorted generic-name list
+        self.ingredients = sorted(lexicon.drug_classes)
+        self.ingredient_ids = {name: index for index, name in enumerate(self.ingredients)}
+        self._width = len(self.ingredients)
+
+        members: Dict[str, List[int]] = {}
+        for name, classes in lexicon.drug_classes.items():
+            for class_name in classes:
+                members.setdefault(class_name, []).append(self.ingredient_ids[name])
+
+        self._pairs: Dict[int, Interaction] = {}
+        for entry in data['interactions']:
+            interaction = Interaction(
+                severity=entry['severity'],
+                evidence=entry.get('evidence', 'moderate'),
+                effect=entry['effect'],
+                management=entry['management'],
+            )
+            side_a, side_b = (self._expand(ref, members) for ref in entry['drugs'])
+            for a in side_a:
+                for b in side_b:
+                    if a == b:
+                        continue
+                    key = self._key(a, b)
+                    current = self._pairs.get(key)
+                    # Keep the most severe entry when class and drug rows overlap
+                    if current is None or SEVERITY_RANK[interaction.severity] > SEVERITY_RANK[current.severity]:
+                        self._pairs[key] = interaction
+
+    def _expand(self, reference: str, members: Dict[str, List[int]]) -> List[int]:
+        if reference.startswith('class:'):
+            class_name = reference[len('class:'):]
+            if class_name not in self.lexicon.classes:
+                raise ValueError(f"Interaction references unknown class: {class_name}")
+            return members.get(class_name, [])
+        if reference not in self.ingredient_ids:
+            raise ValueError(f"Interaction references unknown drug: {reference}")
+        return [self.ingredient_ids[reference]]
+
+    def _key(self, a: int, b: int) -> int:
+        return min(a, b) * self._width + max(a, b)
+
+    def __len__(self) -> int:
+        return len(self._pairs)
+
+    def normalize(self, medications) -> List[int]:
+        """Ingredient ids for a free-text or list medication field"""
+        if not medications:
+            return []
+        if not isinstance(medications, str):
+            medications = '\n'.join(
+                str(m.get('name', '')) if isinstance(m, dict) else str(m) for m in medications
+            )
+        return sorted({self.ingredient_ids[drug] for drug in self.lexicon.drugs(medications)})
+
+    def check_ids(self, ingredient_ids: List[int], min_severity: str = 'minor') -> List[InteractionHit]:
+        floor = SEVERITY_RANK[min_severity]
+        hits = []
+        for a, b in combinations(ingredient_ids, 2):
+            interaction = self._pairs.get(self._key(a, b))
+            if interaction is not None and SEVERITY_RANK[interaction.severity] >= floor:
+                hits.append(InteractionHit(self.ingredients[a], self.ingredients[b], interaction))
+        hits.sort(key=lambda hit: -SEVERITY_RANK[hit.interaction.severity])
+        return hits
+
+    def check(self, medications, min_severity: str = 'minor') -> List[InteractionHit]:
+        return self.check_ids(self.normalize(medications), min_severity)
+
+
+@lru_cache(maxsize=1)
+def get_interaction_index() -> InteractionIndex:
+    """The compiled pair index, built once per process"""
+    path = Path(_interaction_config()['TABLE_PATH'] or DEFAULT_INTERACTIONS_PATH)
+    with open(path, encoding='utf-8') as handle:
+        index = InteractionIndex(json.load(handle), get_lexicon())
+    logger.info(f"Compiled drug interaction index v{index.version} ({len(index)} pairs) from {path}")
+    return index
+
+
+def _support_row(patient_id: int, hit: InteractionHit, version: int) -> ClinicalDecisionSupport:
+    interaction = hit.interaction
+    return ClinicalDecisionSupport(
+        patient_id=patient_id,
+        support_type=SUPPORT_TYPE,
+        title=hit.title,
+        recommendation=interaction.management,
+        rationale=f"{interaction.severity.title()} interaction: {interaction.effect}",
+        evidence_level=interaction.evidence,
+        current_status=f"Active medication list includes {hit.drug_a} and {hit.drug_b}",
+        proposed_changes=[interaction.management],
+        potential_risks=[interaction.effect],
+        urgency=SEVERITY_URGENCY[interaction.severity],
+        requires_md_approval=SEVERITY_RANK[interaction.severity] >= SEVERITY_RANK['major'],
+        implementation_notes=f"Local interaction table v{version}",
+    )
+
+
+def _create_support_rows(hits_by_patient: Dict[int, List[InteractionHit]]) -> List[ClinicalDecisionSupport]:
+    """Insert rows for hits that have no open decision-support row yet"""
+    if not hits_by_patient:
+        return []
+    existing = set(
+        ClinicalDecisionSupport.objects.filter(
+            patient_id__in=list(hits_by_patient),
+            support_type=SUPPORT_TYPE,
+            title__startswith=TITLE_PREFIX,
+            status__in=OPEN_STATUSES,
+        ).values_list('patient_id', 'title')
+    )
+    version = get_interaction_index().version
+    rows = [
+        _support_row(patient_id, hit, version)
+        for patient_id, hits in hits_by_patient.items()
+        for hit in hits
+        if (patient_id, hit.title) not in existing
+    ]
+    with transaction.atomic():
+        ClinicalDecisionSupport.objects.bulk_create(rows, batch_size=500)
+    return rows
+
+
+def check_patient(patient_id: int, medications, create_support: bool = True) -> List[InteractionHit]:
+    """Interactions in one patient's medication list, optionally recorded as decision support"""
+    config = _interaction_config()
+    hits = get_interaction_index().check(medications, config['MIN_SEVERITY'])
+    if hits and create_support:
+        _create_support_rows({patient_id: hits})
+    return hits
+
+
+def screen_patients(patient_ids: Optional[Iterable[int]] = None, chunk_size: int = 2000) -> Dict[str, int]:
+    """
+    Screen every active (or the given) patient's medication list, streaming
+    patients in chunks and writing one bulk insert per chunk.
+    """
+    from patients.models import Patient
+
+    config = _interaction_config()
+    index = get_interaction_index()
+    queryset = Patient.objects.filter(is_active=True).exclude(medications='').order_by('id')
+    if patient_ids is not None:
+        queryset = queryset.filter(id__in=list(patient_ids))
+
+    stats = {'patients': 0, 'patients_with_interactions': 0, 'interactions': 0, 'created': 0}
+    pending: Dict[int, List[InteractionHit]] = {}
+    for patient_id, medications in queryset.values_list('id', 'medications').iterator(chunk_size=chunk_size):
+        stats['patients'] += 1
+        hits = index.check(medications, config['MIN_SEVERITY'])
+        if hits:
+            pending[patient_id] = hits
+            stats['patients_with_interactions'] += 1
+            stats['interactions'] += len(hits)
+        if len(pending) >= chunk_size:
+            stats['created'] += len(_create_support_rows(pending))
+            pending = {}
+    stats['created'] += len(_create_support_rows(pending))
+    logger.info(f"Drug interaction screen: {stats}")
+    return stats
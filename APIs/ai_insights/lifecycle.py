@@ -0,0 +1,240 @@
+"""
+AIInsight lifecycle
+Keeps the set of live insights small as history grows:
+- Dedupe on write: exact content fingerprint per patient, insight type,
+  risk level and urgency, plus a SimHash check that catches regenerated text
+  differing by a word or two; a duplicate takes the newer wording
+- Batched upsert for model replies that produce several insights at once
+- Default expiry for generated insights
+- Chunked sweeper that expires stale insights and archives closed ones
+"""
+
+import hashlib
+import logging
+import re
+from datetime import timedelta
+from typing import Dict, List, Tuple
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .counters import record_bulk_created, record_bulk_removal
+from .models import AIInsight, RiskLevel
+
+logger = logging.getLogger('ai_insights')
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+CLOSED_STATUSES = ('dismissed', 'resolved')
+# Written back when a duplicate refreshes an existing insight
+MERGED_FIELDS = ['title', 'description', 'risk_level', 'fingerprint', 'simhash', 'confidence_score',
+                 'priority_score', 'expires_at', 'updated_at']
+
+
+def _lifecycle_config() -> Dict:
+    config = {
+        'INSIGHT_TTL_DAYS': 30,
+        'ARCHIVE_CLOSED_AFTER_DAYS': 7,
+        # Kept tight: one changed word ('low'/'high', 'improving'/'worsening') is 5-6 bits
+        'NEAR_DUPLICATE_MAX_DISTANCE': 3,
+        'SWEEP_BATCH_SIZE': 1000,
+    }
+    config.update(getattr(settings, 'HEALTHCARE_AI_CONFIG', {}).get('INSIGHT_LIFECYCLE', {}))
+    return config
+
+
+def _tokens(text: str):
+    return TOKEN_RE.findall(text.lower())
+
+
+def content_fingerprint(patient_id: int, insight_type: str, title: str, description: str,
+                        risk_level: str = RiskLevel.LOW, urgency_level: str = 'routine') -> str:
+    """Exact fingerprint of the normalized (case/whitespace/punctuation-insensitive) content and its severity"""
+    normalized = ' '.join(_tokens(f"{title} {description}"))
+    key = f"{patient_id}|{insight_type}|{risk_level}|{urgency_level}|{normalized}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def _severity(fields: Dict) -> Dict[str, str]:
+    """Fields that must match for two insights to be duplicates (besides patient and type)"""
+    return {
+        'risk_level': fields.get('risk_level') or RiskLevel.LOW,
+        'urgency_level': fields.get('urgency_level') or 'routine',
+    }
+
+
+def _fingerprint(patient_id: int, fields: Dict) -> str:
+    return content_fingerprint(patient_id, fields['insight_type'], fields.get('title', ''),
+                               fields.get('description', ''), **_severity(fields))
+
+
+def simhash(text: str) -> int:
+    """64-bit SimHash over word features, as a signed value for BigIntegerField"""
+    weights = [0] * 64
+    for token in _tokens(text):
+        value = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'big')
+        for bit in range(64):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    result = sum(1 << bit for bit in range(64) if weights[bit] > 0)
+    return result - (1 << 64) if result >= 1 << 63 else result
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin((a ^ b) & ((1 << 64) - 1)).count('1')
+
+
+def upsert_insight(**fields) -> Tuple[AIInsight, bool]:
+    """
+    Create an insight unless an equivalent live one already exists for the
+    same patient, type, risk level and urgency. Duplicates refresh the
+    existing row (wording, confidence, priority, expiry) instead of adding a
+    new one. Returns (insight, created).
+    """
+    config = _lifecycle_config()
+    patient_id = fields.get('patient_id') or fields['patient'].pk
+    fingerprint = _fingerprint(patient_id, fields)
+    content_simhash = simhash(f"{fields.get('title', '')} {fields.get('description', '')}")
+    if not fields.get('expires_at'):
+        fields['expires_at'] = timezone.now() + timedelta(days=config['INSIGHT_TTL_DAYS'])
+
+    live = AIInsight.objects.filter(patient_id=patient_id, insight_type=fields['insight_type'], is_active=True,
+                                    **_severity(fields))
+    existing = live.filter(fingerprint=fingerprint).first()
+    if existing is None:
+        # Near-duplicate check only touches this patient's live insights of one type and severity
+        for candidate_id, candidate_simhash in live.exclude(simhash=None).values_list('id', 'simhash'):
+            if hamming_distance(candidate_simhash, content_simhash) <= config['NEAR_DUPLICATE_MAX_DISTANCE']:
+                existing = live.get(id=candidate_id)
+                break
+
+    if existing is not None:
+        return _refresh_duplicate(existing, fields, fingerprint, content_simhash), False
+
+    try:
+        with transaction.atomic():
+            insight = AIInsight.objects.create(fingerprint=fingerprint, simhash=content_simhash, **fields)
+        return insight, True
+    except IntegrityError:
+        # Lost a race with a concurrent writer of the same content
+        existing = live.get(fingerprint=fingerprint)
+        return _refresh_duplicate(existing, fields, fingerprint, content_simhash), False
+
+
+def bulk_upsert_insights(rows: List[Dict]) -> List[Tuple[AIInsight, bool]]:
+    """
+    upsert_insight for many insights at once: one query for the live
+    candidates, one bulk_create for the new rows and one bulk_update for
+    refreshed duplicates (including duplicates within the batch itself).
+    Returns (insight, created) in input order.
+    """
+    if not rows:
+        return []
+    config = _lifecycle_config()
+    default_expiry = timezone.now() + timedelta(days=config['INSIGHT_TTL_DAYS'])
+
+    prepared = []
+    for fields in rows:
+        fields = dict(fields)
+        patient_id = fields.get('patient_id') or fields['patient'].pk
+        fields.setdefault('expires_at', None)
+        fields['expires_at'] = fields['expires_at'] or default_expiry
+        text = f"{fields.get('title', '')} {fields.get('description', '')}"
+        prepared.append((patient_id, fields, _fingerprint(patient_id, fields), simhash(text)))
+
+    live = {}
+    for insight in AIInsight.objects.filter(
+        patient_id__in={item[0] for item in prepared},
+        insight_type__in={item[1]['insight_type'] for item in prepared},
+        is_active=True,
+    ):
+        live.setdefault((insight.patient_id, insight.insight_type), []).append(insight)
+
+    results, new, refreshed = [], [], {}
+    for patient_id, fields, fingerprint, content_simhash in prepared:
+        candidates = live.setdefault((patient_id, fields['insight_type']), [])
+        severity = _severity(fields)
+        existing = next((c for c in candidates if c.fingerprint == fingerprint), None) or next(
+            (c for c in candidates if c.simhash is not None
+             and (c.risk_level, c.urgency_level) == (severity['risk_level'], severity['urgency_level'])
+             and hamming_distance(c.simhash, content_simhash) <= config['NEAR_DUPLICATE_MAX_DISTANCE']),
+            None
+        )
+        if existing is not None:
+            _merge_duplicate(existing, fields, fingerprint, content_simhash)
+            if existing.pk is not None:
+                refreshed[existing.pk] = existing
+            results.append((existing, False))
+            continue
+        insight = AIInsight(fingerprint=fingerprint, simhash=content_simhash, **fields)
+        candidates.append(insight)
+        new.append(insight)
+        results.append((insight, True))
+
+    try:
+        with transaction.atomic():
+            AIInsight.objects.bulk_create(new)
+            if refreshed:
+                AIInsight.objects.bulk_update(list(refreshed.values()), MERGED_FIELDS)
+            record_bulk_created(new)
+    except IntegrityError:
+        # A concurrent writer inserted some of the same content: fall back to row-by-row
+        return [upsert_insight(**fields) for _, fields, _, _ in prepared]
+    return results
+
+
+def _merge_duplicate(insight: AIInsight, fields: Dict, fingerprint: str, content_simhash: int) -> None:
+    """Take the newer wording of a duplicate; keep the higher scores and the later expiry"""
+    insight.title = fields.get('title', insight.title)
+    insight.description = fields.get('description', insight.description)
+    insight.risk_level = fields.get('risk_level') or insight.risk_level
+    insight.fingerprint, insight.simhash = fingerprint, content_simhash
+    insight.confidence_score = max(insight.confidence_score, fields.get('confidence_score', 0.0))
+    insight.priority_score = max(insight.priority_score, fields.get('priority_score', 0.0))
+    if fields.get('expires_at') and (insight.expires_at is None or fields['expires_at'] > insight.expires_at):
+        insight.expires_at = fields['expires_at']
+    insight.updated_at = timezone.now()
+
+
+def _refresh_duplicate(insight: AIInsight, fields: Dict, fingerprint: str, content_simhash: int) -> AIInsight:
+    _merge_duplicate(insight, fields, fingerprint, content_simhash)
+    insight.save(update_fields=MERGED_FIELDS)
+    return insight
+
+
+def _deactivate_in_batches(queryset, batch_size: int, **updates) -> int:
+    """Update matching rows in id-ordered chunks to keep transactions short"""
+    total = 0
+    while True:
+        ids = list(queryset.order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return total
+        with transaction.atomic():
+            locked = AIInsight.objects.select_for_update().filter(id__in=ids, is_active=True)
+            batch = AIInsight.objects.filter(id__in=list(locked.values_list('id', flat=True)))
+            # Bulk updates skip signals, so take the rows out of the dashboard counters here
+            record_bulk_removal(batch)
+            total += batch.update(**updates)
+
+
+def sweep_insights(batch_size: int = None) -> Dict[str, int]:
+    """Expire insights past expires_at and archive long-closed ones"""
+    config = _lifecycle_config()
+    batch_size = batch_size or config['SWEEP_BATCH_SIZE']
+    now = timezone.now()
+
+    expired = _deactivate_in_batches(
+        AIInsight.objects.filter(is_active=True, expires_at__lt=now),
+        batch_size, is_active=False, archived_at=now, updated_at=now
+    )
+    archived = _deactivate_in_batches(
+        AIInsight.objects.filter(
+            Q(status__in=CLOSED_STATUSES),
+            is_active=True,
+            updated_at__lt=now - timedelta(days=config['ARCHIVE_CLOSED_AFTER_DAYS'])
+        ),
+        batch_size, is_active=False, archived_at=now, updated_at=now
+    )
+    if expired or archived:
+        logger.info(f"Insight sweep: {expired} expired, {archived} archived")
+    return {'expired': expired, 'archived': archived}
@@ -0,0 +1,31 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from ai_insights.ai_services import trend_analyzer
+
+
+class Command(BaseCommand):
+    help = "Recompute vital-sign trends for active patients and store them in PatientTrend"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help="Analysis window in days")
+        parser.add_argument('--patient', type=int, action='append', dest='patients',
+                            help="Limit to a patient id (repeatable)")
+        parser.add_argument('--batch-size', type=int, default=500, help="Patients per vectorized batch")
+
+    def handle(self, *args, **options):
+        Patient = apps.get_model('patients', 'Patient')
+        patient_ids = options['patients'] or list(
+            Patient.objects.filter(is_active=True).order_by('id').values_list('id', flat=True)
+        )
+
+        analyzed = significant = 0
+        for start in range(0, len(patient_ids), options['batch_size']):
+            batch = patient_ids[start:start + options['batch_size']]
+            results = trend_analyzer.analyze_patient_trends(batch, days=options['days'])
+            analyzed += len(results)
+            significant += sum(1 for result in results.values() if result['is_significant'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Analyzed {analyzed} trends for {len(patient_ids)} patients ({significant} significant)"
+        ))
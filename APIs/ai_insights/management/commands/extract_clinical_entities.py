@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from ai_insights.clinical_ner import clinical_ner_service, medical_ner_enabled
+
+
+class Command(BaseCommand):
+    help = "Extract problems, medications, doses and vital signs from new or changed visit notes and OCR text"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help="Re-check every document instead of only those changed since the last run")
+        parser.add_argument('--prune', action='store_true',
+                            help="Delete entities whose source document no longer exists")
+        parser.add_argument('--force', action='store_true',
+                            help="Run even if ENABLE_MEDICAL_NER is off")
+
+    def handle(self, *args, **options):
+        if not (options['force'] or medical_ner_enabled()):
+            self.stdout.write(self.style.WARNING("Medical NER is disabled; use --force to run anyway"))
+            return
+
+        stats = clinical_ner_service.sync(full=options['full'])
+        self.stdout.write(
+            f"Extracted {stats['entities']} entities from {stats['documents'] - stats['skipped']} documents "
+            f"({stats['skipped']} unchanged)"
+        )
+        if options['prune']:
+            deleted = clinical_ner_service.prune_orphans()
+            self.stdout.write(self.style.SUCCESS(f"Pruned {deleted} orphaned extractions"))
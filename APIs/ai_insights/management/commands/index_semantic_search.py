@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from ai_insights.semantic_search import semantic_search_service
+
+
+class Command(BaseCommand):
+    help = "Embed new or changed visit notes, OCR text and AI insights into the semantic index"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help="Re-check every document instead of only those changed since the last sync")
+        parser.add_argument('--rebuild', action='store_true',
+                            help="Retrain the IVF lists and fold the delta segment into the main index")
+
+    def handle(self, *args, **options):
+        stats = semantic_search_service.sync(full=options['full'])
+        self.stdout.write(
+            f"Indexed {stats['chunks']} chunks from {stats['documents']} documents "
+            f"({stats['skipped']} unchanged)"
+        )
+        if options['rebuild']:
+            count = semantic_search_service.rebuild()
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt index with {count} vectors"))
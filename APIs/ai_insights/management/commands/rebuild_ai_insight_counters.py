@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from ai_insights.counters import rebuild_counters
+
+
+class Command(BaseCommand):
+    help = "Recompute the per-patient and global AI insight dashboard counters"
+
+    def handle(self, *args, **options):
+        rows = rebuild_counters()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} insight counters"))
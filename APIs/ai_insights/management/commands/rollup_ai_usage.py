@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_datetime
+
+from ai_insights.analytics import run_rollups
+
+
+class Command(BaseCommand):
+    help = "Roll AIProcessingLog up into hourly and daily latency/cost rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help="ISO datetime to recompute from (default: incremental)")
+        parser.add_argument('--lookback-hours', type=int, default=2,
+                            help="Hours before the latest rollup to recompute for late records")
+
+    def handle(self, *args, **options):
+        since = parse_datetime(options['since']) if options['since'] else None
+        counts = run_rollups(lookback_hours=options['lookback_hours'], since=since)
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {counts['hour']} hourly and {counts['day']} daily rollup rows"
+        ))
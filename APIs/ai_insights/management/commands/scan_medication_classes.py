@@ -0,0 +1,31 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from ai_insights.medication_lexicon import get_lexicon, scan_patient_medications
+
+
+class Command(BaseCommand):
+    help = "Classify every patient's medication list by drug class and report fall-risk / high-alert counts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patient', type=int, action='append', dest='patients',
+                            help="Limit to a patient id (repeatable)")
+
+    def handle(self, *args, **options):
+        lexicon = get_lexicon()
+        results = scan_patient_medications(options['patients'])
+
+        by_class = Counter()
+        fall_risk = high_alert = 0
+        for classes in results.values():
+            by_class.update(classes.keys())
+            fall_risk += bool(lexicon.fall_risk_classes.intersection(classes))
+            high_alert += bool(lexicon.high_alert_classes.intersection(classes))
+
+        for class_name, count in by_class.most_common():
+            self.stdout.write(f"{class_name}: {count}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Classified medications for {len(results)} patients "
+            f"({fall_risk} on fall-risk drugs, {high_alert} on high-alert drugs)"
+        ))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from ai_insights.drug_interactions import interaction_checks_enabled, screen_patients
+
+
+class Command(BaseCommand):
+    help = "Screen active patients' medication lists for drug interactions (nightly batch)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patient', type=int, action='append', dest='patients',
+                            help="Limit to a patient id (repeatable)")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Patients per streamed chunk")
+        parser.add_argument('--force', action='store_true',
+                            help="Run even if ENABLE_DRUG_INTERACTION_CHECK is off")
+
+    def handle(self, *args, **options):
+        if not (options['force'] or interaction_checks_enabled()):
+            self.stdout.write(self.style.WARNING("Drug interaction checks are disabled; use --force to run anyway"))
+            return
+
+        stats = screen_patients(options['patients'], chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Screened {stats['patients']} patients: {stats['interactions']} interactions in "
+            f"{stats['patients_with_interactions']} patients, {stats['created']} new decision-support rows"
+        ))
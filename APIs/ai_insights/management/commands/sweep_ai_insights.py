@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from ai_insights.lifecycle import sweep_insights
+
+
+class Command(BaseCommand):
+    help = "Expire insights past expires_at and archive long-closed insights"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help="Rows updated per chunk")
+        parser.add_argument('--loop', action='store_true', help="Keep sweeping as a background worker")
+        parser.add_argument('--interval', type=int, default=300, help="Seconds between sweeps with --loop")
+
+    def handle(self, *args, **options):
+        while True:
+            counts = sweep_insights(batch_size=options['batch_size'])
+            self.stdout.write(f"Expired {counts['expired']}, archived {counts['archived']} insights")
+            if not options['loop']:
+                return
+            close_old_connections()
+            time.sleep(options['interval'])
@@ -0,0 +1,219 @@
+"""
+Medication class lexicon
+Classifies free-text medication lists, notes and OCR output by drug class:
+- Generic names, brand names and class words are shipped as data
+  (data/drug_classes.json) and compiled once into an Aho-Corasick automaton
+- One linear pass over the text finds every term; matches must sit on word
+  boundaries and overlapping hits resolve to the longest term
+- Classes carry fall-risk and high-alert flags used by risk triage
+- Batch helpers classify many texts or the whole patient cohort at once
+"""
+
+import json
+import logging
+from collections import deque
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger('ai_insights')
+
+DEFAULT_LEXICON_PATH = Path(__file__).resolve().parent / 'data' / 'drug_classes.json'
+
+
+@dataclass(frozen=True)
+class MedicationMatch:
+    """One lexicon term found in a text"""
+    term: str
+    drug: str
+    classes: Tuple[str, ...]
+    start: int
+    end: int
+
+    def to_dict(self) -> Dict:
+        return {
+            'term': self.term,
+            'drug': self.drug,
+            'classes': list(self.classes),
+            'start': self.start,
+            'end': self.end,
+        }
+
+
+class AhoCorasick:
+    """Multi-pattern matcher: all occurrences of every key in one pass over the text"""
+
+    def __init__(self, patterns: Dict[str, object]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[Tuple[int, object]]] = [[]]
+
+        for pattern, payload in patterns.items():
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = next_state
+            self._output[state].append((len(pattern), payload))
+
+        # Breadth-first failure links; each state inherits the outputs of its suffix state
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                # Depth-1 states would otherwise point at themselves
+                self._fail[next_state] = target if target != next_state else 0
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def iter(self, text: str) -> Iterator[Tuple[int, int, object]]:
+        """(start, end, payload) for every occurrence, in order of end position"""
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for length, payload in output[state]:
+                yield index + 1 - length, index + 1, payload
+
+
+def _is_boundary(text: str, index: int) -> bool:
+    return index < 0 or index >= len(text) or not text[index].isalnum()
+
+
+class MedicationLexicon:
+    """Drug-class lexicon compiled into an Aho-Corasick automaton"""
+
+    def __init__(self, data: Dict):
+        self.version = data.get('version', 1)
+        self.classes: Dict[str, Dict] = data['classes']
+        self.fall_risk_classes = frozenset(name for name, c in self.classes.items() if c.get('fall_risk'))
+        self.high_alert_classes = frozenset(name for name, c in self.classes.items() if c.get('high_alert'))
+        self.drug_classes: Dict[str, Tuple[str, ...]] = {}
+
+        terms: Dict[str, Tuple[str, Tuple[str, ...]]] = {}
+        for class_name, class_info in self.classes.items():
+            for term in class_info.get('terms', []):
+                terms[term.lower()] = (term.lower(), (class_name,))
+        for drug, drug_info in data['drugs'].items():
+            classes = tuple(drug_info['classes'])
+            self.drug_classes[drug.lower()] = classes
+            unknown = set(classes) - set(self.classes)
+            if unknown:
+                raise ValueError(f"Drug {drug} references unknown classes: {', '.join(sorted(unknown))}")
+            for term in [drug] + drug_info.get('brands', []):
+                terms[term.lower()] = (drug.lower(), classes)
+
+        self.terms = terms
+        self.term_count = len(terms)
+        self._automaton = AhoCorasick({term: (term, drug, classes) for term, (drug, classes) in terms.items()})
+
+    @classmethod
+    def from_file(cls, path) -> 'MedicationLexicon':
+        with open(path, encoding='utf-8') as handle:
+            return cls(json.load(handle))
+
+    def find(self, text: str) -> List[MedicationMatch]:
+        """Non-overlapping whole-word matches, preferring the longest term at each position"""
+        if not text:
+            return []
+        lowered = text.lower()
+        candidates = [
+            (start, end, payload) for start, end, payload in self._automaton.iter(lowered)
+            if _is_boundary(lowered, start - 1) and _is_boundary(lowered, end)
+        ]
+        candidates.sort(key=lambda candidate: (candidate[0], candidate[0] - candidate[1]))
+
+        matches, covered_to = [], 0
+        for start, end, (term, drug, classes) in candidates:
+            if start < covered_to:
+                continue
+            matches.append(MedicationMatch(term, drug, classes, start, end))
+            covered_to = end
+        return matches
+
+    def classify(self, text: str) -> Dict[str, List[str]]:
+        """{class: [drugs]} for every class mentioned in the text"""
+        by_class: Dict[str, List[str]] = {}
+        for match in self.find(text):
+            for class_name in match.classes:
+                drugs = by_class.setdefault(class_name, [])
+                if match.drug not in drugs:
+                    drugs.append(match.drug)
+        return by_class
+
+    def classify_batch(self, texts: Dict[object, str]) -> Dict[object, Dict[str, List[str]]]:
+        """classify() for many texts keyed by e.g. patient id; texts without matches are omitted"""
+        results = {}
+        for key, text in texts.items():
+            classified = self.classify(text)
+            if classified:
+                results[key] = classified
+        return results
+
+    def drugs(self, text: str) -> List[str]:
+        """Distinct generic drugs (not bare class words) mentioned in the text"""
+        drugs = []
+        for match in self.find(text):
+            if match.drug in self.drug_classes and match.drug not in drugs:
+                drugs.append(match.drug)
+        return drugs
+
+    def matches_in_classes(self, text: str, class_names: Iterable[str]) -> List[MedicationMatch]:
+        wanted = set(class_names)
+        return [match for match in self.find(text) if wanted.intersection(match.classes)]
+
+    def fall_risk_matches(self, text: str) -> List[MedicationMatch]:
+        return self.matches_in_classes(text, self.fall_risk_classes)
+
+    def high_alert_matches(self, text: str) -> List[MedicationMatch]:
+        return self.matches_in_classes(text, self.high_alert_classes)
+
+
+def _lexicon_path() -> Path:
+    healthcare_config = getattr(settings, 'HEALTHCARE_AI_CONFIG', {})
+    return Path(healthcare_config.get('MEDICATION_LEXICON_PATH') or DEFAULT_LEXICON_PATH)
+
+
+@lru_cache(maxsize=1)
+def get_lexicon() -> MedicationLexicon:
+    """The compiled lexicon, built once per process"""
+    path = _lexicon_path()
+    lexicon = MedicationLexicon.from_file(path)
+    logger.info(f"Compiled medication lexicon v{lexicon.version} ({lexicon.term_count} terms) from {path}")
+    return lexicon
+
+
+def scan_patient_medications(patient_ids: Optional[Iterable[int]] = None,
+                             chunk_size: int = 2000) -> Dict[int, Dict[str, List[str]]]:
+    """
+    Classify the medication list of every (or the given) patient. Rows are
+    streamed in chunks; returns {patient_id: {class: [drugs]}} for patients
+    with at least one classified medication.
+    """
+    from patients.models import Patient
+
+    queryset = Patient.objects.exclude(medications='')
+    if patient_ids is not None:
+        queryset = queryset.filter(id__in=list(patient_ids))
+
+    lexicon = get_lexicon()
+    results = {}
+    for patient_id, medications in queryset.values_list('id', 'medications').iterator(chunk_size=chunk_size):
+        classified = lexicon.classify(medications)
+        if classified:
+            results[patient_id] = classified
+    return results
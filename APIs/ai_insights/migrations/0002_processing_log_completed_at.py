@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-19 07:27
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_insights', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='aiprocessinglog',
+            name='completed_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_insights', '0002_processing_log_completed_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AIUsageRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hourly'), ('day', 'Daily')], max_length=10)),
+                ('bucket_start', models.DateTimeField()),
+                ('model_used', models.CharField(max_length=100)),
+                ('process_type', models.CharField(max_length=50)),
+                ('request_count', models.IntegerField(default=0)),
+                ('error_count', models.IntegerField(default=0)),
+                ('total_tokens', models.BigIntegerField(default=0)),
+                ('total_cost', models.DecimalField(decimal_places=4, default=0, max_digits=14)),
+                ('total_latency_seconds', models.FloatField(default=0.0)),
+                ('p50_latency_seconds', models.FloatField(blank=True, null=True)),
+                ('p90_latency_seconds', models.FloatField(blank=True, null=True)),
+                ('p99_latency_seconds', models.FloatField(blank=True, null=True)),
+                ('latency_sketch', models.JSONField(default=dict, help_text='Mergeable quantile sketch of latencies')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['-bucket_start'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='aiprocessinglog',
+            index=models.Index(fields=['started_at'], name='ai_insights_started_e4e116_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='aiusagerollup',
+            index=models.Index(fields=['period', 'bucket_start'], name='ai_insights_period_2e140c_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='aiusagerollup',
+            unique_together={('period', 'bucket_start', 'model_used', 'process_type')},
+        ),
+    ]
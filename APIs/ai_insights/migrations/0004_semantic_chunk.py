@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0001_initial'),
+        ('ai_insights', '0003_ai_usage_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SemanticChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_type', models.CharField(choices=[('visit_note', 'Visit Note'), ('ocr_text', 'OCR Text'), ('ai_insight', 'AI Insight')], max_length=20)),
+                ('source_id', models.BigIntegerField()),
+                ('chunk_index', models.IntegerField(default=0)),
+                ('text', models.TextField()),
+                ('content_hash', models.CharField(help_text='Hash of the source text and embedding model', max_length=40)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='semantic_chunks', to='patients.patient')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['patient', 'source_type'], name='ai_insights_patient_531ee1_idx')],
+                'unique_together': {('source_type', 'source_id', 'chunk_index')},
+            },
+        ),
+    ]
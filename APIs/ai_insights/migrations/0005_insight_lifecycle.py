@@ -0,0 +1,49 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_insights', '0004_semantic_chunk'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aiinsight',
+            name='archived_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='aiinsight',
+            name='fingerprint',
+            field=models.CharField(blank=True, help_text='Content fingerprint used to dedupe insights', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='aiinsight',
+            name='is_active',
+            field=models.BooleanField(default=True, help_text='False once expired or archived'),
+        ),
+        migrations.AddField(
+            model_name='aiinsight',
+            name='simhash',
+            field=models.BigIntegerField(blank=True, help_text='SimHash of the content for near-duplicate detection', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='aiinsight',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['patient', 'insight_type'], name='ai_insight_active_patient_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='aiinsight',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-priority_score', '-created_at'], name='ai_insight_active_priority_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='aiinsight',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['expires_at'], name='ai_insight_active_expiry_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='aiinsight',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_active', True), models.Q(('fingerprint', ''), _negated=True)), fields=('patient', 'insight_type', 'fingerprint'), name='ai_insight_unique_active_fingerprint'),
+        ),
+    ]
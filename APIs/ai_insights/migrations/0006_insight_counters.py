@@ -0,0 +1,62 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_counters(apps, schema_editor):
+    """Seed the counters from existing active insights"""
+    from collections import Counter
+
+    AIInsight = apps.get_model('ai_insights', 'AIInsight')
+    AIInsightCounter = apps.get_model('ai_insights', 'AIInsightCounter')
+
+    counts = Counter()
+    rows = (
+        AIInsight.objects.filter(is_active=True)
+        .values_list('patient_id', 'insight_type', 'risk_level', 'urgency_level', 'status')
+        .iterator()
+    )
+    for patient_id, insight_type, risk_level, urgency_level, status in rows:
+        metrics = ['total', f'status:{status}', f'type:{insight_type}', f'risk:{risk_level}']
+        if risk_level == 'critical' or urgency_level == 'immediate':
+            metrics.append('critical')
+        for metric in metrics:
+            counts[(patient_id, metric)] += 1
+            counts[(None, metric)] += 1
+
+    AIInsightCounter.objects.bulk_create(
+        [AIInsightCounter(patient_id=patient_id, metric=metric, value=value)
+         for (patient_id, metric), value in counts.items()],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0001_initial'),
+        ('ai_insights', '0005_insight_lifecycle'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AIInsightCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(help_text='e.g. total, critical, status:new, type:care_gap, risk:high', max_length=80)),
+                ('value', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('patient', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='ai_insight_counters', to='patients.patient')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='aiinsightcounter',
+            constraint=models.UniqueConstraint(condition=models.Q(('patient__isnull', False)), fields=('patient', 'metric'), name='ai_insight_counter_patient_metric'),
+        ),
+        migrations.AddConstraint(
+            model_name='aiinsightcounter',
+            constraint=models.UniqueConstraint(condition=models.Q(('patient__isnull', True)), fields=('metric',), name='ai_insight_counter_global_metric'),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
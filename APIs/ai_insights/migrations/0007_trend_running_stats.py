@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_insights', '0006_insight_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patienttrend',
+            name='archived_points',
+            field=models.JSONField(default=list, help_text='Older data points folded into mean/min/max buckets'),
+        ),
+        migrations.AddField(
+            model_name='patienttrend',
+            name='running_stats',
+            field=models.JSONField(default=dict, help_text='Running sufficient statistics for incremental updates'),
+        ),
+        migrations.AlterField(
+            model_name='patienttrend',
+            name='data_points',
+            field=models.JSONField(default=list, help_text='Most recent raw time series data points'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0001_initial'),
+        ('ai_insights', '0007_trend_running_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClinicalEntityExtraction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_type', models.CharField(choices=[('visit_note', 'Visit Note'), ('ocr_text', 'OCR Text')], max_length=20)),
+                ('source_id', models.BigIntegerField()),
+                ('content_hash', models.CharField(help_text='Hash of the source text and NER pipeline', max_length=40)),
+                ('extractor', models.CharField(help_text='spaCy pipeline that produced the entities', max_length=100)),
+                ('entity_count', models.IntegerField(default=0)),
+                ('source_updated_at', models.DateTimeField(help_text='updated_at of the source document when extracted')),
+                ('extracted_at', models.DateTimeField(auto_now=True)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entity_extractions', to='patients.patient')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ClinicalEntity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('label', models.CharField(choices=[('problem', 'Problem'), ('medication', 'Medication'), ('dose', 'Dose'), ('vital', 'Vital Sign')], max_length=20)),
+                ('text', models.CharField(max_length=255)),
+                ('normalized', models.CharField(blank=True, help_text='Generic drug, problem term or vital metric', max_length=100)),
+                ('value', models.FloatField(blank=True, null=True)),
+                ('unit', models.CharField(blank=True, max_length=20)),
+                ('start_char', models.IntegerField()),
+                ('end_char', models.IntegerField()),
+                ('extraction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entities', to='ai_insights.clinicalentityextraction')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='clinical_entities', to='patients.patient')),
+            ],
+            options={
+                'ordering': ['extraction', 'start_char'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='clinicalentityextraction',
+            index=models.Index(fields=['source_type', 'source_updated_at'], name='ai_insights_source__3bacbf_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='clinicalentityextraction',
+            unique_together={('source_type', 'source_id')},
+        ),
+        migrations.AddIndex(
+            model_name='clinicalentity',
+            index=models.Index(fields=['patient', 'label'], name='ai_insights_patient_d0ef83_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='clinicalentity',
+            index=models.Index(fields=['label', 'normalized'], name='ai_insights_label_71ce67_idx'),
+        ),
+    ]
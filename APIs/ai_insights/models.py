@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth import get_user_model
 from django.conf import settings
+from django.utils import timezone
 import json
 
 User = get_user_model()
@@ -72,6 +73,12 @@ class AIInsight(models.Model):
     reviewed_at = models.DateTimeField(null=True, blank=True)
     review_notes = models.TextField(blank=True)
     
+    # Lifecycle
+    is_active = models.BooleanField(default=True, help_text="False once expired or archived")
+    archived_at = models.DateTimeField(null=True, blank=True)
+    fingerprint = models.CharField(max_length=64, blank=True, help_text="Content fingerprint used to dedupe insights")
+    simhash = models.BigIntegerField(null=True, blank=True, help_text="SimHash of the content for near-duplicate detection")
+    
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -83,6 +90,20 @@ class AIInsight(models.Model):
             models.Index(fields=['patient', 'insight_type']),
             models.Index(fields=['risk_level', 'status']),
             models.Index(fields=['created_at', 'priority_score']),
+            # Partial indexes: active-insight queries and the sweeper only touch live rows
+            models.Index(fields=['patient', 'insight_type'], condition=models.Q(is_active=True),
+                         name='ai_insight_active_patient_idx'),
+            models.Index(fields=['-priority_score', '-created_at'], condition=models.Q(is_active=True),
+                         name='ai_insight_active_priority_idx'),
+            models.Index(fields=['expires_at'], condition=models.Q(is_active=True),
+                         name='ai_insight_active_expiry_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['patient', 'insight_type', 'fingerprint'],
+                condition=models.Q(is_active=True) & ~models.Q(fingerprint=''),
+                name='ai_insight_unique_active_fingerprint'
+            ),
         ]
     
     def __str__(self):
@@ -127,7 +148,9 @@ class PatientTrend(models.Model):
     statistical_significance = models.FloatField(null=True, blank=True, help_text="P-value if applicable")
     
     # Data Points
-    data_points = models.JSONField(default=list, help_text="Time series data points")
+    data_points = models.JSONField(default=list, help_text="Most recent raw time series data points")
+    archived_points = models.JSONField(default=list, help_text="Older data points folded into mean/min/max buckets")
+    running_stats = models.JSONField(default=dict, help_text="Running sufficient statistics for incremental updates")
     analysis_period_days = models.IntegerField(default=30)
     
     # AI Analysis
@@ -301,11 +324,164 @@ class AIProcessingLog(models.Model):
     
     # Timestamps
     started_at = models.DateTimeField()
-    completed_at = models.DateTimeField(auto_now_add=True)
+    # Set when the call finished, not when the buffered record was written
+    completed_at = models.DateTimeField(default=timezone.now)
     
     class Meta:
         ordering = ['-completed_at']
+        indexes = [
+            models.Index(fields=['started_at']),
+        ]
     
     def __str__(self):
         status = "Success" if self.success else "Failed"
         return f"{self.process_type} - {status} ({self.processing_time_seconds:.2f}s)"
+
+
+class AIUsageRollup(models.Model):
+    """Hourly/daily latency, error, token and cost rollup of AIProcessingLog"""
+    period = models.CharField(max_length=10, choices=[
+        ('hour', 'Hourly'),
+        ('day', 'Daily')
+    ])
+    bucket_start = models.DateTimeField()
+    model_used = models.CharField(max_length=100)
+    process_type = models.CharField(max_length=50)
+    
+    # Volume
+    request_count = models.IntegerField(default=0)
+    error_count = models.IntegerField(default=0)
+    total_tokens = models.BigIntegerField(default=0)
+    total_cost = models.DecimalField(max_digits=14, decimal_places=4, default=0)
+    
+    # Latency
+    total_latency_seconds = models.FloatField(default=0.0)
+    p50_latency_seconds = models.FloatField(null=True, blank=True)
+    p90_latency_seconds = models.FloatField(null=True, blank=True)
+    p99_latency_seconds = models.FloatField(null=True, blank=True)
+    latency_sketch = models.JSONField(default=dict, help_text="Mergeable quantile sketch of latencies")
+    
+    # Timestamps
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-bucket_start']
+        unique_together = ['period', 'bucket_start', 'model_used', 'process_type']
+        indexes = [
+            models.Index(fields=['period', 'bucket_start']),
+        ]
+    
+    def __str__(self):
+        return f"{self.period} {self.bucket_start:%Y-%m-%d %H:00} - {self.model_used}/{self.process_type}"
+    
+    @property
+    def error_rate(self):
+        return self.error_count / self.request_count if self.request_count else 0.0
+
+
+class SemanticChunk(models.Model):
+    """Chunk of clinical text indexed for semantic search (vectors live in the on-disk index)"""
+    SOURCE_TYPES = [
+        ('visit_note', 'Visit Note'),
+        ('ocr_text', 'OCR Text'),
+        ('ai_insight', 'AI Insight'),
+    ]
+    
+    patient = models.ForeignKey('patients.Patient', on_delete=models.CASCADE, related_name='semantic_chunks')
+    source_type = models.CharField(max_length=20, choices=SOURCE_TYPES)
+    source_id = models.BigIntegerField()
+    chunk_index = models.IntegerField(default=0)
+    text = models.TextField()
+    content_hash = models.CharField(max_length=40, help_text="Hash of the source text and embedding model")
+    
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        unique_together = ['source_type', 'source_id', 'chunk_index']
+        indexes = [
+            models.Index(fields=['patient', 'source_type']),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_source_type_display()} #{self.source_id} [{self.chunk_index}]"
+
+
+class AIInsightCounter(models.Model):
+    """Incrementally maintained count of active insights, per patient or global (patient is null)"""
+    patient = models.ForeignKey('patients.Patient', on_delete=models.CASCADE, null=True, blank=True, related_name='ai_insight_counters')
+    metric = models.CharField(max_length=80, help_text="e.g. total, critical, status:new, type:care_gap, risk:high")
+    value = models.IntegerField(default=0)
+    
+    # Timestamps
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['patient', 'metric'], condition=models.Q(patient__isnull=False),
+                                    name='ai_insight_counter_patient_metric'),
+            models.UniqueConstraint(fields=['metric'], condition=models.Q(patient__isnull=True),
+                                    name='ai_insight_counter_global_metric'),
+        ]
+    
+    def __str__(self):
+        scope = f"Patient #{self.patient_id}" if self.patient_id else "Global"
+        return f"{scope} {self.metric}={self.value}"
+
+
+class ClinicalEntityExtraction(models.Model):
+    """Local NER run over one clinical document (visit note or OCR text)"""
+    SOURCE_TYPES = [
+        ('visit_note', 'Visit Note'),
+        ('ocr_text', 'OCR Text'),
+    ]
+    
+    patient = models.ForeignKey('patients.Patient', on_delete=models.CASCADE, related_name='entity_extractions')
+    source_type = models.CharField(max_length=20, choices=SOURCE_TYPES)
+    source_id = models.BigIntegerField()
+    content_hash = models.CharField(max_length=40, help_text="Hash of the source text and NER pipeline")
+    extractor = models.CharField(max_length=100, help_text="spaCy pipeline that produced the entities")
+    entity_count = models.IntegerField(default=0)
+    source_updated_at = models.DateTimeField(help_text="updated_at of the source document when extracted")
+    
+    # Timestamps
+    extracted_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ['source_type', 'source_id']
+        indexes = [
+            models.Index(fields=['source_type', 'source_updated_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_source_type_display()} #{self.source_id} ({self.entity_count} entities)"
+
+
+class ClinicalEntity(models.Model):
+    """Structured entity (problem, medication, dose, vital sign) found by local NER"""
+    LABELS = [
+        ('problem', 'Problem'),
+        ('medication', 'Medication'),
+        ('dose', 'Dose'),
+        ('vital', 'Vital Sign'),
+    ]
+    
+    extraction = models.ForeignKey(ClinicalEntityExtraction, on_delete=models.CASCADE, related_name='entities')
+    patient = models.ForeignKey('patients.Patient', on_delete=models.CASCADE, related_name='clinical_entities')
+    label = models.CharField(max_length=20, choices=LABELS)
+    text = models.CharField(max_length=255)
+    normalized = models.CharField(max_length=100, blank=True, help_text="Generic drug, problem term or vital metric")
+    value = models.FloatField(null=True, blank=True)
+    unit = models.CharField(max_length=20, blank=True)
+    start_char = models.IntegerField()
+    end_char = models.IntegerField()
+    
+    class Meta:
+        ordering = ['extraction', 'start_char']
+        indexes = [
+            models.Index(fields=['patient', 'label']),
+            models.Index(fields=['label', 'normalized']),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_label_display()}: {self.text}"
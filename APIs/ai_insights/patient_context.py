@@ -0,0 +1,268 @@
+"""
+Patient context assembly for AI prompts
+Builds the compact patient snapshot that insight generation and risk
+assessment send to the model:
+- Demographics, diagnoses, allergies and medications from the patient row
+- Recent visits with their notes, vital-sign observations, the latest
+  OASIS assessment, current trends, open insights and recent files
+- A fixed number of queries regardless of history size (one stamp query,
+  then one query per source on a cache miss)
+- Snapshots carry a schema version and are cached under a key derived from
+  the max updated_at (and row count) of every input, so repeated AI calls
+  for an unchanged patient reuse the cached snapshot
+"""
+
+import hashlib
+import logging
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, IntegerField, Max, OuterRef, Prefetch, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+logger = logging.getLogger('ai_insights')
+
+# Bump when the snapshot layout changes so cached snapshots are not reused
+CONTEXT_VERSION = 1
+
+ADL_FIELDS = ['grooming', 'dressing_upper', 'dressing_lower', 'bathing', 'toileting',
+              'transferring', 'ambulation', 'feeding']
+
+
+def _context_config() -> Dict:
+    healthcare_config = getattr(settings, 'HEALTHCARE_AI_CONFIG', {})
+    config = {
+        'CACHE_TIMEOUT': 60 * 60,
+        'MAX_VISITS': 10,
+        'NOTES_PER_VISIT': 3,
+        'NOTE_CHARS': 1500,
+        'MAX_OPEN_INSIGHTS': 10,
+        'MAX_FILES': 10,
+    }
+    config.update(healthcare_config.get('PATIENT_CONTEXT', {}))
+    return config
+
+
+def _models():
+    return {
+        'Patient': apps.get_model('patients', 'Patient'),
+        'Visit': apps.get_model('visits', 'Visit'),
+        'VisitNote': apps.get_model('visits', 'VisitNote'),
+        'OasisAssessment': apps.get_model('oasis', 'OasisAssessment'),
+        'UploadedFile': apps.get_model('file_management', 'UploadedFile'),
+        'AIInsight': apps.get_model('ai_insights', 'AIInsight'),
+        'PatientTrend': apps.get_model('ai_insights', 'PatientTrend'),
+    }
+
+
+def _split_list(text: str) -> List[str]:
+    if not text:
+        return []
+    return [item.strip() for item in text.replace(';', '\n').replace(',', '\n').splitlines() if item.strip()]
+
+
+def _age(date_of_birth: Optional[date]) -> Optional[int]:
+    if not date_of_birth:
+        return None
+    today = date.today()
+    return today.year - date_of_birth.year - ((today.month, today.day) < (date_of_birth.month, date_of_birth.day))
+
+
+def _stamp_subqueries(models: Dict, since) -> Dict:
+    """Max updated_at and row count of every input, as correlated subqueries"""
+    def stamp(queryset, group='patient_id'):
+        grouped = queryset.order_by().values(group)
+        return (
+            Subquery(grouped.annotate(latest=Max('updated_at')).values('latest')[:1]),
+            Coalesce(Subquery(grouped.annotate(n=Count('pk')).values('n')[:1],
+                              output_field=IntegerField()), Value(0)),
+        )
+
+    patient = OuterRef('pk')
+    sources = {
+        'visits': (models['Visit'].objects.filter(patient_id=patient, scheduled_date__gte=since), 'patient_id'),
+        'notes': (models['VisitNote'].objects.filter(visit__patient_id=patient, visit__scheduled_date__gte=since),
+                  'visit__patient_id'),
+        'oasis': (models['OasisAssessment'].objects.filter(patient_id=patient), 'patient_id'),
+        'files': (models['UploadedFile'].objects.filter(patient_id=patient), 'patient_id'),
+        'insights': (models['AIInsight'].objects.filter(patient_id=patient, is_active=True), 'patient_id'),
+        'trends': (models['PatientTrend'].objects.filter(patient_id=patient), 'patient_id'),
+    }
+    annotations = {}
+    for name, (queryset, group) in sources.items():
+        annotations[f'{name}_latest'], annotations[f'{name}_count'] = stamp(queryset, group)
+    return annotations
+
+
+def _fetch_patient_with_stamp(patient_id: int, since) -> Optional[Dict]:
+    models = _models()
+    return (
+        models['Patient'].objects.filter(pk=patient_id)
+        .annotate(**_stamp_subqueries(models, since))
+        .values(
+            'id', 'date_of_birth', 'gender', 'primary_diagnosis', 'secondary_diagnoses',
+            'allergies', 'medications', 'updated_at',
+            *[f'{name}_{part}' for name in ('visits', 'notes', 'oasis', 'files', 'insights', 'trends')
+              for part in ('latest', 'count')]
+        )
+        .first()
+    )
+
+
+def _cache_key(patient_row: Dict, days: int, include_historical: bool) -> str:
+    stamp = '|'.join(
+        str(value.isoformat() if hasattr(value, 'isoformat') else value)
+        for key, value in sorted(patient_row.items())
+        if key == 'updated_at' or key.endswith('_latest') or key.endswith('_count')
+    )
+    digest = hashlib.sha1(stamp.encode('utf-8')).hexdigest()[:16]
+    return f"ai_patient_context:v{CONTEXT_VERSION}:{patient_row['id']}:{days}:{int(include_historical)}:{digest}"
+
+
+def _oasis_summary(assessment) -> Dict:
+    functional = {}
+    for field_name in ADL_FIELDS:
+        if getattr(assessment, field_name) is not None:
+            functional[field_name] = getattr(assessment, f'get_{field_name}_display')()
+    return {
+        'assessment_type': assessment.assessment_type,
+        'assessment_date': assessment.assessment_date.isoformat(),
+        'primary_diagnosis': assessment.primary_diagnosis,
+        'other_diagnoses': assessment.other_diagnoses,
+        'functional_status': functional,
+        'cognitive_functioning': assessment.get_cognitive_functioning_display()
+        if assessment.cognitive_functioning is not None else None,
+        'vision': assessment.get_vision_display() if assessment.vision is not None else None,
+        'hearing': assessment.get_hearing_display() if assessment.hearing is not None else None,
+        'risk_scores': assessment.risk_scores,
+    }
+
+
+def _build_context(patient_row: Dict, since, include_historical: bool, config: Dict) -> Dict:
+    models = _models()
+    patient_id = patient_row['id']
+    conditions = [patient_row['primary_diagnosis']] + _split_list(patient_row['secondary_diagnoses'])
+    context = {
+        'context_version': CONTEXT_VERSION,
+        'generated_at': timezone.now().isoformat(),
+        'patient_id': patient_id,
+        'age': _age(patient_row['date_of_birth']),
+        'demographics': {
+            'age': _age(patient_row['date_of_birth']),
+            'gender': patient_row['gender'],
+        },
+        'primary_diagnosis': patient_row['primary_diagnosis'],
+        'conditions': [condition for condition in conditions if condition],
+        'allergies': _split_list(patient_row['allergies']),
+        'medications': _split_list(patient_row['medications']),
+        'recent_visits': [],
+        'vital_signs': [],
+        'assessments': [],
+        'trends': [],
+        'open_insights': [],
+        'files': [],
+    }
+
+    # Latest OASIS assessment
+    oasis = models['OasisAssessment'].objects.filter(patient_id=patient_id).order_by(
+        '-assessment_date', '-created_at').first()
+    if oasis is not None:
+        summary = _oasis_summary(oasis)
+        context['assessments'].append(summary)
+        context['functional_status'] = summary['functional_status']
+        if summary['cognitive_functioning']:
+            context['cognitive_status'] = summary['cognitive_functioning']
+
+    # Open insights
+    context['open_insights'] = [
+        {
+            'type': insight['insight_type'],
+            'title': insight['title'],
+            'risk_level': insight['risk_level'],
+            'urgency_level': insight['urgency_level'],
+            'created_at': insight['created_at'].isoformat(),
+        }
+        for insight in models['AIInsight'].objects.filter(
+            patient_id=patient_id, is_active=True, status__in=['new', 'reviewed']
+        ).order_by('-priority_score', '-created_at').values(
+            'insight_type', 'title', 'risk_level', 'urgency_level', 'created_at'
+        )[:config['MAX_OPEN_INSIGHTS']]
+    ]
+
+    if not include_historical:
+        return context
+
+    # Recent visits with their latest notes (two queries)
+    notes = models['VisitNote'].objects.only('visit_id', 'note_type', 'title', 'content', 'created_at').order_by('-created_at')
+    visits = (
+        models['Visit'].objects.filter(patient_id=patient_id, scheduled_date__gte=since)
+        .order_by('-scheduled_date')
+        .only('id', 'scheduled_date', 'visit_type', 'status', 'chief_complaint', 'vital_signs', 'assessment', 'plan')
+        .prefetch_related(Prefetch('notes', queryset=notes))[:config['MAX_VISITS']]
+    )
+    for visit in visits:
+        context['recent_visits'].append({
+            'date': visit.scheduled_date.isoformat(),
+            'type': visit.visit_type,
+            'status': visit.status,
+            'chief_complaint': visit.chief_complaint,
+            'assessment': visit.assessment[:config['NOTE_CHARS']],
+            'plan': visit.plan[:config['NOTE_CHARS']],
+            'notes': [
+                {'type': note.note_type, 'title': note.title, 'content': note.content[:config['NOTE_CHARS']]}
+                for note in list(visit.notes.all())[:config['NOTES_PER_VISIT']]
+            ],
+        })
+        if visit.vital_signs:
+            context['vital_signs'].append({'date': visit.scheduled_date.isoformat(), 'values': visit.vital_signs})
+
+    # Stored trends: the observation summary the model can use without raw series
+    context['trends'] = [
+        {
+            'metric': trend['metric_name'],
+            'direction': trend['trend_direction'],
+            'strength': round(trend['trend_strength'], 3),
+            'p_value': trend['statistical_significance'],
+        }
+        for trend in models['PatientTrend'].objects.filter(patient_id=patient_id).order_by('metric_name').values(
+            'metric_name', 'trend_direction', 'trend_strength', 'statistical_significance'
+        )
+    ]
+
+    context['files'] = [
+        {
+            'filename': uploaded['original_filename'],
+            'category': uploaded['category'],
+            'uploaded_at': uploaded['created_at'].isoformat(),
+            'processed': uploaded['is_processed'],
+        }
+        for uploaded in models['UploadedFile'].objects.filter(patient_id=patient_id).order_by('-created_at').values(
+            'original_filename', 'category', 'created_at', 'is_processed'
+        )[:config['MAX_FILES']]
+    ]
+    return context
+
+
+def assemble_patient_context(patient_id: int, days: int = 30, include_historical: bool = True) -> Optional[Dict]:
+    """
+    Versioned context snapshot for a patient (None if the patient does not
+    exist). Served from the cache while none of its inputs have changed.
+    """
+    config = _context_config()
+    since = timezone.now() - timedelta(days=days)
+    patient_row = _fetch_patient_with_stamp(patient_id, since)
+    if patient_row is None:
+        return None
+
+    key = _cache_key(patient_row, days, include_historical)
+    context = cache.get(key)
+    if context is not None:
+        return context
+
+    context = _build_context(patient_row, since, include_historical, config)
+    cache.set(key, context, config['CACHE_TIMEOUT'])
+    return context
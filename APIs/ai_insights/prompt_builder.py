@@ -0,0 +1,388 @@
+"""
+Prompt assembly for AI services
+Builds chat prompts that fit the model context window:
+- Compact JSON serialization (no indentation, empty values dropped)
+- Local token counting per model
+- Prioritized truncation / summarization of prompt sections
+- Statistical downsampling of long time series
+- Optional output schema instruction for JSON replies
+"""
+
+import json
+import logging
+import math
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional
+
+from django.conf import settings
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken ships with langchain-openai but is optional here
+    tiktoken = None
+
+logger = logging.getLogger('ai_insights')
+
+
+# Context window sizes (prompt + completion) for the models we call
+MODEL_CONTEXT_WINDOWS = {
+    'gpt-4': 8192,
+    'gpt-4-32k': 32768,
+    'gpt-4-turbo': 128000,
+    'gpt-4o': 128000,
+    'gpt-4o-mini': 128000,
+    'gpt-3.5-turbo': 16385,
+    'claude-3': 200000,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# Approximate characters per token when no tokenizer is available
+CHARS_PER_TOKEN = 4.0
+CLAUDE_CHARS_PER_TOKEN = 3.5
+
+# Per-message overhead of the chat format (role markers, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_PRIMING_TOKENS = 2
+
+
+def compact_json(data: Any) -> str:
+    """Serialize data as compact JSON, dropping empty values"""
+    return json.dumps(_prune(data), separators=(',', ':'), ensure_ascii=False, default=str)
+
+
+def _prune(value: Any) -> Any:
+    """Recursively drop None, empty strings and empty containers"""
+    if isinstance(value, dict):
+        pruned = {}
+        for key, item in value.items():
+            item = _prune(item)
+            if item is None or item == '' or item == [] or item == {}:
+                continue
+            pruned[key] = item
+        return pruned
+    if isinstance(value, (list, tuple)):
+        return [_prune(item) for item in value]
+    if isinstance(value, float):
+        return round(value, 4)
+    return value
+
+
+def context_window_for(model: str) -> int:
+    """Look up the context window for a model name (prefix match)"""
+    if model in MODEL_CONTEXT_WINDOWS:
+        return MODEL_CONTEXT_WINDOWS[model]
+    for prefix, window in sorted(MODEL_CONTEXT_WINDOWS.items(), key=lambda item: -len(item[0])):
+        if model.startswith(prefix):
+            return window
+    return DEFAULT_CONTEXT_WINDOW
+
+
+@lru_cache(maxsize=16)
+def _encoding_for(model: str):
+    """Load (once) the tiktoken encoding for a model, or None"""
+    if tiktoken is None or model.startswith('claude'):
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        try:
+            return tiktoken.get_encoding('cl100k_base')
+        except Exception:
+            return None
+    except Exception as e:
+        logger.warning(f"Tokenizer unavailable for {model}, using estimate: {str(e)}")
+        return None
+
+
+class TokenCounter:
+    """Count tokens locally for a given model"""
+
+    def __init__(self, model: str):
+        self.model = model
+        self.encoding = _encoding_for(model)
+        self.chars_per_token = CLAUDE_CHARS_PER_TOKEN if model.startswith('claude') else CHARS_PER_TOKEN
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return int(math.ceil(len(text) / self.chars_per_token))
+
+    def count_messages(self, messages: List[Dict]) -> int:
+        total = REPLY_PRIMING_TOKENS
+        for message in messages:
+            total += MESSAGE_OVERHEAD_TOKENS + self.count(message.get('content', ''))
+        return total
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Cut text down to at most max_tokens"""
+        if max_tokens <= 0:
+            return ''
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            if len(tokens) <= max_tokens:
+                return text
+            return self.encoding.decode(tokens[:max_tokens])
+        max_chars = int(max_tokens * self.chars_per_token)
+        return text[:max_chars]
+
+
+def summarize_series(values: List[float]) -> Dict[str, float]:
+    """Summary statistics for a numeric series"""
+    if not values:
+        return {}
+    n = len(values)
+    mean = sum(values) / n
+    variance = sum((v - mean) ** 2 for v in values) / (n - 1) if n > 1 else 0.0
+    return {
+        'count': n,
+        'first': values[0],
+        'last': values[-1],
+        'min': min(values),
+        'max': max(values),
+        'mean': round(mean, 4),
+        'stdev': round(math.sqrt(variance), 4),
+    }
+
+
+def downsample_series(data_points: List[Dict], max_points: int,
+                      value_key: str = 'value', time_key: str = 'timestamp') -> List[Dict]:
+    """
+    Downsample a time series into at most max_points buckets.
+
+    Each bucket keeps its first timestamp, mean value, min/max and count, so
+    extremes survive. The first and last observations are kept verbatim.
+    """
+    if len(data_points) <= max_points:
+        return list(data_points)
+    if max_points < 3:
+        return [data_points[0], data_points[-1]][:max(max_points, 0)]
+
+    inner = data_points[1:-1]
+    buckets = max_points - 2
+    size = len(inner) / buckets
+    downsampled = [data_points[0]]
+    for i in range(buckets):
+        chunk = inner[int(i * size):int((i + 1) * size)]
+        if not chunk:
+            continue
+        values = [point[value_key] for point in chunk if isinstance(point.get(value_key), (int, float))]
+        if not values:
+            continue
+        downsampled.append({
+            time_key: chunk[0].get(time_key),
+            value_key: round(sum(values) / len(values), 4),
+            'min': min(values),
+            'max': max(values),
+            'n': len(values),
+        })
+    downsampled.append(data_points[-1])
+    return downsampled
+
+
+def downsample_to_fit(series_key: str = None, value_key: str = 'value',
+                      time_key: str = 'timestamp') -> Callable:
+    """
+    Build a section shrink callable that downsamples a time series until the
+    section fits. With series_key the series is read from that key of a dict
+    section, otherwise the section content itself is the series.
+    """
+    def shrink(content: Any, max_tokens: int, counter: TokenCounter) -> Any:
+        points = content[series_key] if series_key else content
+        max_points = len(points)
+        while max_points > 2:
+            max_points = max(2, max_points // 2)
+            reduced = downsample_series(points, max_points, value_key, time_key)
+            if series_key:
+                candidate = dict(content, **{series_key: reduced, 'downsampled_from': len(points)})
+            else:
+                candidate = reduced
+            if counter.count(compact_json(candidate)) <= max_tokens:
+                return candidate
+        return None
+    return shrink
+
+
+@dataclass
+class PromptSection:
+    """A labelled block of prompt content"""
+    label: str
+    content: Any
+    priority: int = 0
+    required: bool = False
+    shrink: Optional[Callable[[Any, int, 'TokenCounter'], Any]] = None
+
+
+@dataclass
+class BuiltPrompt:
+    """Assembled prompt with token accounting"""
+    messages: List[Dict]
+    model: str
+    prompt_tokens: int
+    budget_tokens: int
+    sections: Dict[str, Dict] = field(default_factory=dict)
+    output_schema: Optional[Any] = None
+
+    @property
+    def input_data_size(self) -> int:
+        return sum(len(message['content'].encode('utf-8')) for message in self.messages)
+
+    def accounting(self) -> Dict:
+        """Summary stored alongside the processing log"""
+        return {
+            'prompt_tokens': self.prompt_tokens,
+            'budget_tokens': self.budget_tokens,
+            'sections': self.sections,
+        }
+
+
+class PromptBuilder:
+    """
+    Assemble a system + user prompt within the model's token budget.
+
+    Sections are rendered in the order they were added, but budget is handed
+    out by priority (higher first, required sections always). A section that
+    does not fit is shrunk with its `shrink` callable (or the default list/text
+    truncation) and dropped only if nothing useful fits.
+    """
+
+    def __init__(self, system_prompt: str, model: str, completion_tokens: int = 0,
+                 budget_tokens: int = None, output_schema=None):
+        self.output_schema = output_schema
+        if output_schema is not None:
+            system_prompt = f"{system_prompt}\n\n{output_schema.instruction()}"
+        self.system_prompt = system_prompt
+        self.model = model
+        self.counter = TokenCounter(model)
+        self.completion_tokens = completion_tokens
+        self.budget_tokens = budget_tokens
+        self.intro = ''
+        self.outro = ''
+        self.sections: List[PromptSection] = []
+
+    def set_intro(self, text: str) -> 'PromptBuilder':
+        self.intro = text
+        return self
+
+    def set_outro(self, text: str) -> 'PromptBuilder':
+        self.outro = text
+        return self
+
+    def add_section(self, label: str, content: Any, priority: int = 0,
+                    required: bool = False, shrink: Callable = None) -> 'PromptBuilder':
+        self.sections.append(PromptSection(label, content, priority, required, shrink))
+        return self
+
+    def _budget(self) -> int:
+        ai_config = getattr(settings, 'AI_CONFIG', {})
+        budget = context_window_for(self.model) - self.completion_tokens
+        configured = self.budget_tokens or ai_config.get('PROMPT_TOKEN_BUDGET')
+        if configured:
+            budget = min(budget, configured)
+        return max(budget, 0)
+
+    def _render(self, section: PromptSection, content: Any) -> str:
+        body = content if isinstance(content, str) else compact_json(content)
+        return f"{section.label}: {body}"
+
+    @staticmethod
+    def _default_shrink(content: Any, max_tokens: int, counter: TokenCounter) -> Any:
+        """Keep as many leading list items / characters as fit"""
+        if isinstance(content, str):
+            return counter.truncate(content, max_tokens)
+        if isinstance(content, list):
+            low, high = 0, len(content)
+            while low < high:
+                mid = (low + high + 1) // 2
+                if counter.count(compact_json(content[:mid])) <= max_tokens:
+                    low = mid
+                else:
+                    high = mid - 1
+            return content[:low]
+        if isinstance(content, dict):
+            shrunk = dict(content)
+            # Repeatedly halve the largest list/text field until it fits
+            for _ in range(32):
+                if counter.count(compact_json(shrunk)) <= max_tokens:
+                    return shrunk
+                sizes = {
+                    key: len(compact_json(value)) for key, value in shrunk.items()
+                    if isinstance(value, (list, str)) and value
+                }
+                if not sizes:
+                    break
+                key = max(sizes, key=sizes.get)
+                shrunk[key] = shrunk[key][:len(shrunk[key]) // 2]
+            return shrunk if counter.count(compact_json(shrunk)) <= max_tokens else None
+        return None
+
+    def _fit(self, section: PromptSection, max_tokens: int):
+        """Return (rendered_text, tokens, state) for a section within max_tokens"""
+        text = self._render(section, section.content)
+        tokens = self.counter.count(text)
+        if tokens <= max_tokens:
+            return text, tokens, 'full'
+
+        label_tokens = self.counter.count(f"{section.label}: ")
+        content_budget = max_tokens - label_tokens
+        if content_budget > 0:
+            shrink = section.shrink or self._default_shrink
+            content = shrink(section.content, content_budget, self.counter)
+            if content:
+                text = self._render(section, content)
+                tokens = self.counter.count(text)
+                if tokens > max_tokens:
+                    text = self.counter.truncate(text, max_tokens)
+                    tokens = self.counter.count(text)
+                return text, tokens, 'truncated'
+
+        if section.required:
+            text = self.counter.truncate(self._render(section, section.content), max(max_tokens, 0))
+            return text, self.counter.count(text), 'truncated'
+        return '', 0, 'dropped'
+
+    def build(self) -> BuiltPrompt:
+        budget = self._budget()
+        fixed_messages = [
+            {'role': 'system', 'content': self.system_prompt},
+            {'role': 'user', 'content': '\n\n'.join(filter(None, [self.intro, self.outro]))},
+        ]
+        remaining = budget - self.counter.count_messages(fixed_messages)
+
+        # Hand out budget: required first, then by descending priority
+        order = sorted(
+            range(len(self.sections)),
+            key=lambda i: (not self.sections[i].required, -self.sections[i].priority, i)
+        )
+        rendered = {}
+        accounting = {}
+        for index in order:
+            section = self.sections[index]
+            # Two newlines join each section into the user message
+            text, tokens, state = self._fit(section, remaining - 1)
+            if text:
+                remaining -= tokens + 1
+                rendered[index] = text
+            accounting[section.label] = {'tokens': tokens, 'state': state}
+
+        parts = [self.intro] + [rendered[i] for i in sorted(rendered)] + [self.outro]
+        user_prompt = '\n\n'.join(part for part in parts if part)
+        messages = [
+            {'role': 'system', 'content': self.system_prompt},
+            {'role': 'user', 'content': user_prompt},
+        ]
+
+        dropped = [label for label, info in accounting.items() if info['state'] != 'full']
+        if dropped:
+            logger.info(f"Prompt for {self.model} shrunk to fit {budget} tokens: {', '.join(dropped)}")
+
+        return BuiltPrompt(
+            messages=messages,
+            model=self.model,
+            prompt_tokens=self.counter.count_messages(messages),
+            budget_tokens=budget,
+            sections=accounting,
+            output_schema=self.output_schema,
+        )
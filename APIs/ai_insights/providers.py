@@ -0,0 +1,364 @@
+"""
+LLM provider routing
+Sends chat completions to OpenAI with Anthropic as backup:
+- Automatic failover on errors or timeouts
+- Optional hedged request to the backup when the primary runs past its p95 latency
+- Health-scored circuit breaker per provider
+- Provider responses normalized into AIResponse
+- JSON / structured-output mode when the caller supplies an output schema
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout, as_completed
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import anthropic
+import openai
+from django.conf import settings
+
+logger = logging.getLogger('ai_insights')
+
+PLACEHOLDER_KEYS = ('', 'your-openai-api-key-here', 'your-anthropic-api-key-here')
+
+# OpenAI models accepting response_format json_schema, and those limited to json_object
+STRUCTURED_OUTPUT_MODELS = ('gpt-4o', 'gpt-4.1', 'o1', 'o3', 'o4')
+JSON_MODE_MODELS = ('gpt-4-turbo', 'gpt-4-1106', 'gpt-4-0125', 'gpt-3.5-turbo')
+
+
+@dataclass
+class AIResponse:
+    """Structured response from AI processing"""
+    success: bool
+    content: str
+    confidence: float
+    model_used: str
+    tokens_used: int = 0
+    processing_time: float = 0.0
+    error_message: str = ""
+    prompt_tokens: int = 0
+    parsed: Optional[Any] = None
+
+
+class CircuitBreaker:
+    """
+    Health-scored circuit breaker.
+
+    Health is an exponentially weighted success rate. The circuit opens after
+    `failure_threshold` consecutive failures or when health drops below
+    `min_health`, stays open for `cooldown_seconds`, then lets a single trial
+    request through (half-open): it closes on that request's success and
+    reopens on its failure, and other requests are rejected meanwhile.
+    """
+
+    def __init__(self, failure_threshold: int = 5, cooldown_seconds: float = 30.0,
+                 min_health: float = 0.3, health_decay: float = 0.2, latency_window: int = 200):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.min_health = min_health
+        self.health_decay = health_decay
+        self.health = 1.0
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probe_started_at: Optional[float] = None
+        self.latencies = deque(maxlen=latency_window)
+        self._lock = threading.Lock()
+
+    def _refresh(self, now: float) -> bool:
+        """Move to half-open after the cooldown; True if a request may go through now"""
+        if self.state == 'open' and now - self.opened_at >= self.cooldown_seconds:
+            self.state = 'half_open'
+            self.probe_started_at = None
+        if self.state == 'half_open':
+            # A trial that never reported back is given up after one cooldown
+            return self.probe_started_at is None or now - self.probe_started_at >= self.cooldown_seconds
+        return self.state == 'closed'
+
+    def available(self) -> bool:
+        """Whether allow_request() would let a request through (without taking the half-open trial)"""
+        with self._lock:
+            return self._refresh(time.monotonic())
+
+    def allow_request(self) -> bool:
+        """Call right before the request; in half-open state only the first caller gets through"""
+        with self._lock:
+            now = time.monotonic()
+            if not self._refresh(now):
+                return False
+            if self.state == 'half_open':
+                self.probe_started_at = now
+            return True
+
+    def record_success(self, latency: float) -> None:
+        with self._lock:
+            self.health += self.health_decay * (1.0 - self.health)
+            self.consecutive_failures = 0
+            self.latencies.append(latency)
+            self.state = 'closed'
+            self.probe_started_at = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.health -= self.health_decay * self.health
+            self.consecutive_failures += 1
+            if (self.state == 'half_open'
+                    or self.consecutive_failures >= self.failure_threshold
+                    or self.health < self.min_health):
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self.probe_started_at = None
+
+    def latency_percentile(self, q: float, min_samples: int = 20) -> Optional[float]:
+        with self._lock:
+            if len(self.latencies) < min_samples:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def status(self) -> Dict:
+        return {
+            'state': self.state,
+            'health': round(self.health, 3),
+            'consecutive_failures': self.consecutive_failures,
+            'p95_latency_seconds': self.latency_percentile(0.95),
+        }
+
+
+class LLMProvider:
+    """Base class for a chat completion backend"""
+    name = 'base'
+
+    def __init__(self, api_key: str, model: str, timeout: float):
+        self.api_key = api_key
+        self.model = model
+        self.timeout = timeout
+        self.breaker = CircuitBreaker()
+        self._client = None
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key) and self.api_key not in PLACEHOLDER_KEYS and bool(self.model)
+
+    @property
+    def client(self):
+        """Lazy initialization of the SDK client"""
+        if self._client is None and self.configured:
+            try:
+                self._client = self._create_client()
+            except Exception as e:
+                logger.warning(f"Failed to initialize {self.name} client: {str(e)}")
+        return self._client
+
+    def _create_client(self):
+        raise NotImplementedError
+
+    def complete(self, model: str, messages: List[Dict], max_tokens: int,
+                 temperature: float, top_p: float, response_schema: Dict = None) -> AIResponse:
+        """response_schema is {'name', 'schema'} when a JSON reply is required"""
+        raise NotImplementedError
+
+
+class OpenAIProvider(LLMProvider):
+    name = 'openai'
+
+    def _create_client(self):
+        return openai.OpenAI(api_key=self.api_key, max_retries=0)
+
+    @staticmethod
+    def _response_format(model: str, response_schema: Dict = None) -> Optional[Dict]:
+        if not response_schema:
+            return None
+        if model.startswith(STRUCTURED_OUTPUT_MODELS):
+            return {
+                'type': 'json_schema',
+                'json_schema': {'name': response_schema['name'], 'schema': response_schema['schema'], 'strict': False},
+            }
+        if model.startswith(JSON_MODE_MODELS):
+            return {'type': 'json_object'}
+        return None
+
+    def complete(self, model, messages, max_tokens, temperature, top_p, response_schema=None):
+        extra = {}
+        response_format = self._response_format(model, response_schema)
+        if response_format:
+            extra['response_format'] = response_format
+        response = self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            timeout=self.timeout,
+            **extra
+        )
+        return AIResponse(
+            success=True,
+            content=response.choices[0].message.content,
+            confidence=1.0,  # OpenAI doesn't return confidence directly
+            model_used=model,
+            tokens_used=response.usage.total_tokens,
+            prompt_tokens=response.usage.prompt_tokens
+        )
+
+
+class AnthropicProvider(LLMProvider):
+    name = 'anthropic'
+
+    def _create_client(self):
+        return anthropic.Anthropic(api_key=self.api_key, max_retries=0)
+
+    def complete(self, model, messages, max_tokens, temperature, top_p, response_schema=None):
+        # Anthropic takes the system prompt separately from the turns
+        system = '\n\n'.join(m['content'] for m in messages if m['role'] == 'system')
+        turns = [m for m in messages if m['role'] != 'system']
+        # No JSON mode: prefill the reply with the opening brace instead
+        prefill = '{' if response_schema else ''
+        if prefill:
+            turns.append({'role': 'assistant', 'content': prefill})
+        response = self.client.messages.create(
+            model=model,
+            system=system,
+            messages=turns,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            timeout=self.timeout
+        )
+        content = prefill + ''.join(block.text for block in response.content if getattr(block, 'type', '') == 'text')
+        return AIResponse(
+            success=True,
+            content=content,
+            confidence=1.0,
+            model_used=model,
+            tokens_used=response.usage.input_tokens + response.usage.output_tokens,
+            prompt_tokens=response.usage.input_tokens
+        )
+
+
+class ProviderRouter:
+    """Route completions across providers with failover and optional hedging"""
+
+    def __init__(self, providers: List[LLMProvider], hedging: bool = False,
+                 hedge_percentile: float = 0.95, hedge_min_delay: float = 1.0):
+        self.providers = providers
+        self.hedging = hedging
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='ai-provider')
+
+    @classmethod
+    def from_settings(cls) -> 'ProviderRouter':
+        ai_config = getattr(settings, 'AI_CONFIG', {})
+        timeout = ai_config.get('REQUEST_TIMEOUT_SECONDS', 60)
+        providers = [
+            OpenAIProvider(getattr(settings, 'OPENAI_API_KEY', ''), ai_config.get('DEFAULT_MODEL', 'gpt-4o-mini'), timeout),
+            AnthropicProvider(getattr(settings, 'ANTHROPIC_API_KEY', ''), ai_config.get('BACKUP_MODEL', ''), timeout),
+        ]
+        return cls(
+            providers,
+            hedging=ai_config.get('ENABLE_HEDGING', False),
+            hedge_min_delay=ai_config.get('HEDGE_MIN_DELAY_SECONDS', 1.0)
+        )
+
+    def status(self) -> Dict:
+        return {provider.name: provider.breaker.status() for provider in self.providers}
+
+    def _attempt(self, provider: LLMProvider, model: Optional[str], messages: List[Dict],
+                 max_tokens: int, temperature: float, top_p: float,
+                 response_schema: Dict = None) -> AIResponse:
+        start = time.monotonic()
+        # Only the primary honours a caller-chosen model; backups use their own
+        model_used = model if model and provider is self.providers[0] else provider.model
+        if not provider.breaker.allow_request():
+            # Half-open and another request is the trial call
+            return AIResponse(success=False, content="", confidence=0.0, model_used=model_used,
+                              error_message=f"{provider.name}: circuit open")
+        try:
+            if provider.client is None:
+                raise RuntimeError(f"{provider.name} client not initialized")
+            response = provider.complete(model_used, messages, max_tokens, temperature, top_p, response_schema)
+            response.processing_time = time.monotonic() - start
+            provider.breaker.record_success(response.processing_time)
+            logger.info(
+                f"{provider.name} call succeeded ({model_used}): {response.tokens_used} tokens "
+                f"in {response.processing_time:.2f}s"
+            )
+            return response
+        except Exception as e:
+            elapsed = time.monotonic() - start
+            provider.breaker.record_failure()
+            logger.error(f"{provider.name} call failed ({model_used}) after {elapsed:.2f}s: {str(e)}")
+            return AIResponse(
+                success=False,
+                content="",
+                confidence=0.0,
+                model_used=model_used,
+                processing_time=elapsed,
+                error_message=f"{provider.name}: {str(e)}"
+            )
+
+    def _hedged(self, primary: LLMProvider, backup: LLMProvider, *args) -> List[AIResponse]:
+        """
+        Start the primary; if it outlives its p95 latency, race the backup
+        against it. Returns the finished attempts, ending at the first success;
+        the backup appears only if it was actually called.
+        """
+        primary_future = self._executor.submit(self._attempt, primary, *args)
+        p95 = primary.breaker.latency_percentile(self.hedge_percentile)
+        if p95 is None:
+            return [primary_future.result()]
+
+        try:
+            return [primary_future.result(timeout=max(p95, self.hedge_min_delay))]
+        except FuturesTimeout:
+            logger.info(f"Hedging {primary.name} request to {backup.name} after {p95:.2f}s")
+
+        backup_future = self._executor.submit(self._attempt, backup, *args)
+        attempts = []
+        for future in as_completed([primary_future, backup_future]):
+            attempts.append(future.result())
+            if attempts[-1].success:
+                break
+        return attempts
+
+    def complete(self, messages: List[Dict], model: str = None, max_tokens: int = 4000,
+                 temperature: float = 0.3, top_p: float = 0.9, response_schema: Dict = None) -> AIResponse:
+        candidates = [p for p in self.providers if p.configured and p.breaker.available()]
+        if not candidates:
+            logger.warning("AI call skipped: no provider configured or available")
+            return AIResponse(
+                success=False,
+                content="AI provider not available. Please configure OPENAI_API_KEY or ANTHROPIC_API_KEY.",
+                confidence=0.0,
+                model_used=model or '',
+                error_message="No AI provider available"
+            )
+
+        start = time.monotonic()
+        args = (model, messages, max_tokens, temperature, top_p, response_schema)
+        errors = []
+        remaining = list(candidates)
+        if self.hedging and len(remaining) > 1:
+            attempts = self._hedged(remaining[0], remaining[1], *args)
+            for response in attempts:
+                if response.success:
+                    return response
+                errors.append(response.error_message)
+            # A backup that was never raced is still tried as a normal failover
+            remaining = remaining[len(attempts):]
+
+        for provider in remaining:
+            response = self._attempt(provider, *args)
+            if response.success:
+                return response
+            errors.append(response.error_message)
+
+        response.processing_time = time.monotonic() - start
+        response.error_message = '; '.join(errors)
+        return response
+
+
+ai_router = ProviderRouter.from_settings()
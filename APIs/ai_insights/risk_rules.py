@@ -0,0 +1,313 @@
+"""
+Rule-based risk triage
+Deterministic pre-screen that runs before any LLM risk assessment:
+- Additive point scores over age, functional status, fall-risk and
+  high-alert medications, fall history, cognition, diagnoses and prior
+  admissions
+- Confident low / high scores are answered by the rules alone
+- Free-text statuses and OASIS labels (Able/Supervision/Assistance/Unable,
+  Alert/oriented ... Unable to care) are both recognized; mobility is read
+  clause by clause so negated mentions ('no assistive device', 'not able')
+  count the right way round
+- Borderline or data-poor patients are escalated to the LLM; a status that
+  is present but unrecognized counts as missing
+- Every decision records which path it took
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from django.conf import settings
+
+from .medication_lexicon import get_lexicon
+
+RULES_MODEL_NAME = 'rule_triage_v1'
+
+# OASIS ADL labels: Able / Supervision / Assistance / Unable. Only words that
+# mean impairment on their own: 'gait', 'transfer' or 'limited' also appear in
+# descriptions of independent patients
+IMPAIRED_MOBILITY_TERMS = (
+    'walker', 'wheelchair', 'cane', 'assistive device', 'assistance', 'assisted', 'needs assist',
+    'requires assist', 'min assist', 'mod assist', 'max assist', 'unsteady', 'impaired', 'bedbound',
+    'bed bound', 'non-ambulatory', 'dependent', 'shuffling', 'supervision', 'unable',
+)
+INDEPENDENT_MOBILITY_TERMS = ('independent', 'steady', 'able')
+# OASIS cognitive functioning labels: Alert/oriented, Requires prompting ... Unable to care
+COGNITIVE_IMPAIRMENT_TERMS = (
+    'dementia', 'alzheimer', 'confus', 'delirium', 'cognitive impairment', 'disoriented',
+    'requires prompting', 'requires assistance', 'requires considerable assistance', 'unable to care',
+)
+COGNITIVE_INTACT_TERMS = ('alert', 'oriented', 'intact', 'no cognitive impairment')
+HIGH_READMISSION_DIAGNOSES = (
+    'heart failure', 'chf', 'copd', 'pneumonia', 'sepsis', 'renal failure',
+    'ckd', 'diabetes', 'myocardial infarction', 'stroke',
+)
+
+
+def _term_pattern(terms) -> re.Pattern:
+    # Word-start anchored so e.g. 'dependent' does not match 'independent'
+    return re.compile(r'\b(?:' + '|'.join(re.escape(term) for term in terms) + ')')
+
+
+IMPAIRED_MOBILITY_RE = _term_pattern(IMPAIRED_MOBILITY_TERMS)
+INDEPENDENT_MOBILITY_RE = _term_pattern(INDEPENDENT_MOBILITY_TERMS)
+COGNITIVE_IMPAIRMENT_RE = _term_pattern(COGNITIVE_IMPAIRMENT_TERMS)
+COGNITIVE_INTACT_RE = _term_pattern(COGNITIVE_INTACT_TERMS)
+HIGH_READMISSION_RE = _term_pattern(HIGH_READMISSION_DIAGNOSES)
+NEGATION_RE = re.compile(r'\b(?:no|not|cannot|without|denies|never)\b')
+CLAUSE_SPLIT_RE = re.compile(r'[,;.\n]|\bbut\b')
+
+
+def _triage_config() -> Dict:
+    healthcare_config = getattr(settings, 'HEALTHCARE_AI_CONFIG', {})
+    config = {
+        'HIGH_THRESHOLD': healthcare_config.get('RISK_THRESHOLD', 0.7),
+        'LOW_THRESHOLD': 0.2,
+        'POLYPHARMACY_COUNT': 10,
+    }
+    config.update(healthcare_config.get('RISK_TRIAGE', {}))
+    return config
+
+
+@dataclass
+class TriageDecision:
+    """Outcome of the rule pre-screen for one risk type"""
+    risk_type: str
+    risk_score: float
+    confident: bool
+    path: str
+    contributing_factors: List[str] = field(default_factory=list)
+    protective_factors: List[str] = field(default_factory=list)
+    points: Dict[str, float] = field(default_factory=dict)
+    missing_inputs: List[str] = field(default_factory=list)
+
+    @property
+    def risk_category(self) -> str:
+        return risk_category(self.risk_score)
+
+    def to_dict(self) -> Dict:
+        return {
+            'risk_score': round(self.risk_score, 4),
+            'risk_category': self.risk_category,
+            'contributing_factors': self.contributing_factors,
+            'protective_factors': self.protective_factors,
+            'recommendations': RECOMMENDATIONS[self.risk_type].get(self.risk_category, []),
+            'score_breakdown': self.points,
+            'assessment_path': self.path,
+        }
+
+
+RECOMMENDATIONS = {
+    'fall_risk': {
+        'low': ['Continue routine fall-prevention education'],
+        'moderate': ['Review home safety', 'Reassess gait and balance at next visit'],
+        'high': ['Initiate fall-prevention plan', 'PT referral for gait and balance training',
+                 'Medication review for fall-risk drugs'],
+        'critical': ['Initiate fall-prevention plan', 'PT referral for gait and balance training',
+                     'Medication review for fall-risk drugs', 'Notify physician'],
+    },
+    'readmission_risk': {
+        'low': ['Routine follow-up per plan of care'],
+        'moderate': ['Confirm follow-up appointment within 7 days', 'Medication reconciliation'],
+        'high': ['Front-load visits in the first week', 'Medication reconciliation',
+                 'Teach-back on red-flag symptoms'],
+        'critical': ['Front-load visits in the first week', 'Medication reconciliation',
+                     'Teach-back on red-flag symptoms', 'Notify physician'],
+    },
+}
+
+
+def risk_category(score: float) -> str:
+    if score >= 0.85:
+        return 'critical'
+    if score >= 0.6:
+        return 'high'
+    if score >= 0.3:
+        return 'moderate'
+    return 'low'
+
+
+def _text(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, dict):
+        return ' '.join(_text(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return ' '.join(_text(v) for v in value)
+    return str(value).lower()
+
+
+def _clauses(value) -> List[str]:
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        return [clause for item in value for clause in _clauses(item)]
+    return CLAUSE_SPLIT_RE.split(_text(value))
+
+
+def mobility_status(functional_status) -> Optional[str]:
+    """
+    'impaired', 'independent' or None when nothing is recognized. Each clause
+    (or OASIS item) is read on its own and a negation flips it: 'no walker' is
+    independent, 'not able to transfer' is impaired. Any impaired clause wins.
+    """
+    found = set()
+    for clause in _clauses(functional_status):
+        impaired = IMPAIRED_MOBILITY_RE.search(clause)
+        independent = INDEPENDENT_MOBILITY_RE.search(clause)
+        if NEGATION_RE.search(clause):
+            impaired, independent = bool(independent and not impaired), bool(impaired)
+        if impaired:
+            found.add('impaired')
+        elif independent:
+            found.add('independent')
+    if 'impaired' in found:
+        return 'impaired'
+    return 'independent' if found else None
+
+
+def _age(patient_data: Dict) -> Optional[float]:
+    age = patient_data.get('age')
+    if age is None:
+        age = (patient_data.get('demographics') or {}).get('age')
+    try:
+        return float(age) if age is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _medication_names(patient_data: Dict) -> List[str]:
+    medications = patient_data.get('medications') or []
+    if isinstance(medications, str):
+        medications = [m for m in re.split(r'[,;\n]', medications) if m.strip()]
+    names = []
+    for medication in medications:
+        name = medication.get('name', '') if isinstance(medication, dict) else medication
+        names.append(str(name).strip().lower())
+    return [name for name in names if name]
+
+
+def fall_risk_medications(patient_data: Dict) -> List[str]:
+    """Medications in a fall-risk drug class (see medication_lexicon)"""
+    lexicon = get_lexicon()
+    return [name for name in _medication_names(patient_data) if lexicon.fall_risk_matches(name)]
+
+
+def high_alert_medications(patient_data: Dict) -> List[str]:
+    """Medications in a high-alert drug class (anticoagulants, insulin, opioids ...)"""
+    lexicon = get_lexicon()
+    return [name for name in _medication_names(patient_data) if lexicon.high_alert_matches(name)]
+
+
+def _decide(risk_type: str, points: Dict[str, float], contributing: List[str], protective: List[str],
+            missing: List[str], config: Dict) -> TriageDecision:
+    score = max(0.0, min(1.0, sum(points.values())))
+    if score >= config['HIGH_THRESHOLD']:
+        confident, path = True, 'rules_high'
+    elif score <= config['LOW_THRESHOLD'] and not missing:
+        confident, path = True, 'rules_low'
+    else:
+        confident, path = False, 'llm'
+    return TriageDecision(
+        risk_type=risk_type, risk_score=score, confident=confident, path=path,
+        contributing_factors=contributing, protective_factors=protective,
+        points=points, missing_inputs=missing,
+    )
+
+
+def triage_fall_risk(patient_data: Dict) -> TriageDecision:
+    config = _triage_config()
+    points, contributing, protective, missing = {}, [], [], []
+
+    age = _age(patient_data)
+    if age is None:
+        missing.append('age')
+    elif age >= 85:
+        points['age'] = 0.25
+        contributing.append(f"Age {int(age)}")
+    elif age >= 75:
+        points['age'] = 0.15
+        contributing.append(f"Age {int(age)}")
+    elif age >= 65:
+        points['age'] = 0.05
+    else:
+        protective.append("Age under 65")
+
+    history = patient_data.get('history') or {}
+    falls = history.get('falls') if isinstance(history, dict) else None
+    if falls:
+        points['fall_history'] = 0.35 if len(falls) > 1 else 0.25
+        contributing.append(f"{len(falls)} prior fall(s)")
+
+    medications = fall_risk_medications(patient_data)
+    if medications:
+        points['medications'] = min(0.1 * len(medications), 0.3)
+        contributing.append(f"Fall-risk medications: {', '.join(medications)}")
+
+    mobility = mobility_status(patient_data.get('functional_status'))
+    if mobility == 'impaired':
+        points['mobility'] = 0.2
+        contributing.append("Impaired mobility")
+    elif mobility == 'independent':
+        protective.append("Independent mobility")
+    else:
+        missing.append('functional_status')
+
+    cognitive_status = _text(patient_data.get('cognitive_status'))
+    cognition = cognitive_status + ' ' + _text(patient_data.get('conditions'))
+    if COGNITIVE_IMPAIRMENT_RE.search(cognition):
+        points['cognition'] = 0.15
+        contributing.append("Cognitive impairment")
+    elif cognitive_status.strip() and not COGNITIVE_INTACT_RE.search(cognitive_status):
+        missing.append('cognitive_status')
+
+    return _decide('fall_risk', points, contributing, protective, missing, config)
+
+
+def triage_readmission_risk(patient_data: Dict, recent_admissions: List) -> TriageDecision:
+    config = _triage_config()
+    points, contributing, protective, missing = {}, [], [], []
+
+    admissions = len(recent_admissions or [])
+    if admissions >= 2:
+        points['prior_admissions'] = 0.45
+        contributing.append(f"{admissions} recent admissions")
+    elif admissions == 1:
+        points['prior_admissions'] = 0.25
+        contributing.append("1 recent admission")
+    else:
+        protective.append("No recent admissions")
+
+    age = _age(patient_data)
+    if age is None:
+        missing.append('age')
+    elif age >= 80:
+        points['age'] = 0.1
+        contributing.append(f"Age {int(age)}")
+
+    medication_count = len(_medication_names(patient_data))
+    if medication_count >= config['POLYPHARMACY_COUNT']:
+        points['polypharmacy'] = 0.15
+        contributing.append(f"Polypharmacy ({medication_count} medications)")
+    elif medication_count >= 5:
+        points['polypharmacy'] = 0.05
+
+    high_alert = high_alert_medications(patient_data)
+    if high_alert:
+        points['high_alert_medications'] = 0.1
+        contributing.append(f"High-alert medications: {', '.join(high_alert)}")
+
+    diagnoses = _text(patient_data.get('primary_diagnosis')) + ' ' + _text(patient_data.get('conditions'))
+    if not diagnoses.strip():
+        missing.append('diagnoses')
+    matched = sorted(set(HIGH_READMISSION_RE.findall(diagnoses)))
+    if matched:
+        points['diagnoses'] = 0.2
+        contributing.append(f"High-readmission diagnoses: {', '.join(matched)}")
+
+    if mobility_status(patient_data.get('functional_status')) == 'impaired':
+        points['functional_status'] = 0.1
+        contributing.append("Impaired functional status")
+
+    return _decide('readmission_risk', points, contributing, protective, missing, config)
@@ -0,0 +1,562 @@
+"""
+Semantic search over clinical text
+Embeds visit notes, OCR text and AI insights with a local
+sentence-transformers model and serves nearest-neighbour queries:
+- Documents are chunked, hashed and only re-embedded when they change
+- Encoding is batched
+- Vectors are stored as normalized float16 arrays on disk
+- Global queries use an IVF (inverted file) index: k-means lists stored
+  contiguously, only the closest lists are scanned
+- New vectors go to a flat delta segment until the next rebuild
+- Patient-scoped queries do an exact scan over that patient's vectors;
+  so do queries restricted to the patients a user may see
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger('ai_insights')
+
+SOURCE_VISIT_NOTE = 'visit_note'
+SOURCE_OCR_TEXT = 'ocr_text'
+SOURCE_AI_INSIGHT = 'ai_insight'
+
+
+def _search_config() -> Dict:
+    config = {
+        'MODEL_NAME': 'sentence-transformers/all-MiniLM-L6-v2',
+        'INDEX_DIR': Path(settings.BASE_DIR) / 'semantic_index',
+        'ENCODE_BATCH_SIZE': 64,
+        'CHUNK_WORDS': 200,
+        'CHUNK_OVERLAP_WORDS': 40,
+        'NPROBE': 16,
+        'TRAINING_SAMPLE': 100000,
+        'KMEANS_ITERATIONS': 10,
+        'SYNC_BATCH_SIZE': 500,
+    }
+    config.update(getattr(settings, 'SEMANTIC_SEARCH_CONFIG', {}))
+    return config
+
+
+def chunk_text(text: str, chunk_words: int, overlap_words: int) -> List[str]:
+    """Split text into overlapping word windows"""
+    words = text.split()
+    if not words:
+        return []
+    step = max(chunk_words - overlap_words, 1)
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(' '.join(words[start:start + chunk_words]))
+        if start + chunk_words >= len(words):
+            break
+    return chunks
+
+
+class Embedder:
+    """Sentence-transformers model, loaded once per process"""
+
+    def __init__(self, model_name: str, batch_size: int):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+                    self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    @property
+    def dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float16)
+        vectors = self.model.encode(
+            texts,
+            batch_size=self.batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+        return vectors.astype(np.float16)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def train_centroids(vectors: np.ndarray, n_lists: int, iterations: int, seed: int = 0) -> np.ndarray:
+    """Spherical k-means (cosine) over a float32 sample"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        counts = np.bincount(assignment, minlength=n_lists)
+        empty = counts == 0
+        # Re-seed empty lists from random points so every list stays useful
+        if empty.any():
+            sums[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()))]
+        centroids = _normalize(sums)
+    return centroids.astype(np.float32)
+
+
+@dataclass
+class SearchHit:
+    chunk_id: int
+    score: float
+
+
+class VectorIndex:
+    """
+    On-disk float16 vector index.
+
+    Layout of INDEX_DIR:
+      manifest.json              current generation, dimension, model
+      gen-<n>/vectors.npy        main segment, rows grouped by IVF list
+      gen-<n>/ids.npy            chunk id per main row
+      gen-<n>/centroids.npy      IVF centroids (float32)
+      gen-<n>/offsets.npy        list boundaries into the main segment
+      gen-<n>/delta.f16          appended vectors (flat, raw float16)
+      gen-<n>/delta.i64          chunk id per delta row
+    """
+
+    def __init__(self, index_dir: Path, nprobe: int = 16):
+        self.index_dir = Path(index_dir)
+        self.nprobe = nprobe
+        self._lock = threading.Lock()
+        self._loaded_main = None
+        self._loaded_delta = None
+        self.generation = 0
+        self.dimension = None
+        self.vectors = None
+        self.ids = None
+        self.centroids = None
+        self.offsets = None
+        self.delta_vectors = None
+        self.delta_ids = None
+        self._id_order = None
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.index_dir / 'manifest.json'
+
+    def _generation_dir(self, generation: int = None) -> Path:
+        return self.index_dir / f"gen-{self.generation if generation is None else generation}"
+
+    def _read_manifest(self) -> Optional[Dict]:
+        try:
+            with open(self.manifest_path) as manifest_file:
+                return json.load(manifest_file)
+        except FileNotFoundError:
+            return None
+
+    def _write_manifest(self, manifest: Dict) -> None:
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.manifest_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(tmp_path, self.manifest_path)
+
+    def refresh(self) -> bool:
+        """
+        (Re)load segments that changed on disk. Appends only grow the delta,
+        so the main segment and its sorted id order are reloaded only when a
+        rebuild writes a new generation.
+        """
+        manifest = self._read_manifest()
+        if manifest is None:
+            return False
+        gen_dir = self.index_dir / f"gen-{manifest['generation']}"
+        delta_path = gen_dir / 'delta.i64'
+        main_key = (manifest['generation'], self.manifest_path.stat().st_mtime)
+        # The delta is append-only within a generation: its size tells whether rows were added
+        delta_key = delta_path.stat().st_size if delta_path.exists() else 0
+        if (main_key, delta_key) == (self._loaded_main, self._loaded_delta):
+            return True
+
+        with self._lock:
+            if main_key != self._loaded_main:
+                self.generation = manifest['generation']
+                self.dimension = manifest['dimension']
+                self.vectors = np.load(gen_dir / 'vectors.npy', mmap_mode='r')
+                self.ids = np.load(gen_dir / 'ids.npy', mmap_mode='r')
+                self.centroids = np.load(gen_dir / 'centroids.npy')
+                self.offsets = np.load(gen_dir / 'offsets.npy')
+                order = np.argsort(self.ids, kind='stable')
+                self._id_order = (np.asarray(self.ids)[order], order)
+                self._loaded_main = main_key
+            self._load_delta(gen_dir)
+            self._loaded_delta = delta_key
+        return True
+
+    def _load_delta(self, gen_dir: Path) -> None:
+        ids_path, vectors_path = gen_dir / 'delta.i64', gen_dir / 'delta.f16'
+        if not ids_path.exists() or ids_path.stat().st_size == 0:
+            self.delta_ids = np.zeros(0, dtype=np.int64)
+            self.delta_vectors = np.zeros((0, self.dimension), dtype=np.float16)
+            return
+        self.delta_ids = np.fromfile(ids_path, dtype=np.int64)
+        # Ignore a torn trailing row from an interrupted append
+        rows = min(len(self.delta_ids), vectors_path.stat().st_size // (2 * self.dimension))
+        self.delta_ids = self.delta_ids[:rows]
+        self.delta_vectors = np.memmap(vectors_path, dtype=np.float16, mode='r', shape=(rows, self.dimension))
+
+    def build(self, ids: np.ndarray, vectors: np.ndarray, training_sample: int, iterations: int) -> None:
+        """Write a new generation containing exactly these vectors"""
+        manifest = self._read_manifest() or {'generation': 0}
+        generation = manifest['generation'] + 1
+        gen_dir = self.index_dir / f"gen-{generation}"
+        gen_dir.mkdir(parents=True, exist_ok=True)
+        dimension = vectors.shape[1]
+
+        n_lists = int(np.clip(4 * np.sqrt(max(len(vectors), 1)), 1, 65536))
+        n_lists = min(n_lists, max(min(len(vectors), training_sample), 1))
+        if len(vectors):
+            rng = np.random.default_rng(0)
+            sample_rows = rng.choice(len(vectors), size=min(training_sample, len(vectors)), replace=False)
+            centroids = train_centroids(vectors[np.sort(sample_rows)].astype(np.float32), n_lists, iterations)
+            assignment = np.concatenate([
+                np.argmax(vectors[start:start + 50000].astype(np.float32) @ centroids.T, axis=1)
+                for start in range(0, len(vectors), 50000)
+            ])
+        else:
+            centroids = np.zeros((0, dimension), dtype=np.float32)
+            assignment = np.zeros(0, dtype=np.int64)
+
+        # Store each IVF list contiguously so a probe is one sequential read
+        order = np.argsort(assignment, kind='stable')
+        counts = np.bincount(assignment, minlength=len(centroids))
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+        vectors_out = np.lib.format.open_memmap(
+            gen_dir / 'vectors.npy', mode='w+', dtype=np.float16, shape=(len(vectors), dimension)
+        )
+        for start in range(0, len(order), 50000):
+            rows = order[start:start + 50000]
+            vectors_out[start:start + len(rows)] = vectors[rows]
+        vectors_out.flush()
+        del vectors_out
+        np.save(gen_dir / 'ids.npy', np.asarray(ids, dtype=np.int64)[order])
+        np.save(gen_dir / 'centroids.npy', centroids)
+        np.save(gen_dir / 'offsets.npy', offsets)
+
+        previous = manifest['generation']
+        self._write_manifest({'generation': generation, 'dimension': dimension, 'built_at': time.time()})
+        if previous and (self.index_dir / f"gen-{previous}").exists():
+            shutil.rmtree(self.index_dir / f"gen-{previous}", ignore_errors=True)
+        self._loaded_main = None
+
+    def append(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        """Append vectors to the delta segment of the current generation"""
+        if not len(ids):
+            return
+        if self._read_manifest() is None:
+            # First batch ever: seed an empty main segment
+            self.build(np.zeros(0, dtype=np.int64), np.zeros((0, vectors.shape[1]), dtype=np.float16), 1, 1)
+        self.refresh()
+        gen_dir = self._generation_dir()
+        with open(gen_dir / 'delta.f16', 'ab') as vectors_file:
+            vectors_file.write(np.ascontiguousarray(vectors, dtype=np.float16).tobytes())
+        with open(gen_dir / 'delta.i64', 'ab') as ids_file:
+            ids_file.write(np.asarray(ids, dtype=np.int64).tobytes())
+        self._loaded_delta = None
+
+    def all_vectors(self, keep_ids: Optional[set] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Main + delta vectors, optionally restricted to live chunk ids"""
+        if not self.refresh():
+            return np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.float16)
+        ids = np.concatenate([np.asarray(self.ids), self.delta_ids])
+        vectors = np.concatenate([np.asarray(self.vectors), np.asarray(self.delta_vectors)])
+        if keep_ids is not None:
+            mask = np.isin(ids, np.fromiter(keep_ids, dtype=np.int64, count=len(keep_ids)))
+            ids, vectors = ids[mask], vectors[mask]
+        # Later rows win for re-embedded chunk ids
+        _, last = np.unique(ids[::-1], return_index=True)
+        keep = np.sort(len(ids) - 1 - last)
+        return ids[keep], vectors[keep]
+
+    @staticmethod
+    def _top_k(ids: np.ndarray, scores: np.ndarray, k: int) -> List[SearchHit]:
+        if not len(scores):
+            return []
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [SearchHit(int(ids[i]), float(scores[i])) for i in top]
+
+    def search(self, query: np.ndarray, k: int) -> List[SearchHit]:
+        """Approximate global search: probe the nprobe closest IVF lists plus the delta"""
+        if not self.refresh():
+            return []
+        query = query.astype(np.float32)
+        candidate_ids, candidate_scores = [], []
+
+        if len(self.centroids):
+            nprobe = min(self.nprobe, len(self.centroids))
+            probes = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+            for list_id in probes:
+                start, end = self.offsets[list_id], self.offsets[list_id + 1]
+                if start == end:
+                    continue
+                candidate_scores.append(np.asarray(self.vectors[start:end], dtype=np.float32) @ query)
+                candidate_ids.append(np.asarray(self.ids[start:end]))
+
+        if len(self.delta_ids):
+            candidate_scores.append(np.asarray(self.delta_vectors, dtype=np.float32) @ query)
+            candidate_ids.append(self.delta_ids)
+
+        if not candidate_ids:
+            return []
+        return self._top_k(np.concatenate(candidate_ids), np.concatenate(candidate_scores), k)
+
+    def search_subset(self, query: np.ndarray, chunk_ids: Iterable[int], k: int) -> List[SearchHit]:
+        """Exact search restricted to the given chunk ids (e.g. one patient)"""
+        if not self.refresh():
+            return []
+        wanted = np.fromiter(chunk_ids, dtype=np.int64)
+        if not len(wanted):
+            return []
+        query = query.astype(np.float32)
+
+        sorted_ids, order = self._id_order
+        positions = np.searchsorted(sorted_ids, wanted)
+        in_range = positions < len(sorted_ids)
+        positions, wanted_in_range = positions[in_range], wanted[in_range]
+        rows = np.sort(order[positions[sorted_ids[positions] == wanted_in_range]])
+        ids = [np.asarray(self.ids)[rows]]
+        scores = [np.asarray(self.vectors[rows], dtype=np.float32) @ query]
+
+        delta_mask = np.isin(self.delta_ids, wanted)
+        if delta_mask.any():
+            ids.append(self.delta_ids[delta_mask])
+            scores.append(np.asarray(self.delta_vectors[delta_mask], dtype=np.float32) @ query)
+        return self._top_k(np.concatenate(ids), np.concatenate(scores), k)
+
+
+class SemanticSearchService:
+    """Incremental indexing and querying of clinical text"""
+
+    def __init__(self):
+        config = _search_config()
+        self.config = config
+        self.embedder = Embedder(config['MODEL_NAME'], config['ENCODE_BATCH_SIZE'])
+        self.index = VectorIndex(config['INDEX_DIR'], nprobe=config['NPROBE'])
+
+    # --- Sources -----------------------------------------------------------
+
+    def _sources(self, since=None) -> Iterator[Tuple[str, int, int, str, object]]:
+        """Yield (source_type, source_id, patient_id, text, updated_at) for changed documents"""
+        from django.apps import apps
+        VisitNote = apps.get_model('visits', 'VisitNote')
+        UploadedFile = apps.get_model('file_management', 'UploadedFile')
+        from .models import AIInsight
+
+        batch = self.config['SYNC_BATCH_SIZE']
+        querysets = [
+            (SOURCE_VISIT_NOTE, VisitNote.objects.values_list('id', 'visit__patient_id', 'title', 'content', 'updated_at')),
+            (SOURCE_OCR_TEXT, UploadedFile.objects.exclude(ocr_text='').values_list(
+                'id', 'patient_id', 'original_filename', 'ocr_text', 'updated_at')),
+            (SOURCE_AI_INSIGHT, AIInsight.objects.values_list('id', 'patient_id', 'title', 'description', 'updated_at')),
+        ]
+        for source_type, queryset in querysets:
+            if since is not None:
+                queryset = queryset.filter(updated_at__gt=since)
+            for source_id, patient_id, title, body, updated_at in queryset.order_by().iterator(chunk_size=batch):
+                yield source_type, source_id, patient_id, f"{title}\n{body}".strip(), updated_at
+
+    def _content_hash(self, text: str) -> str:
+        return hashlib.sha1(f"{self.config['MODEL_NAME']}\n{text}".encode('utf-8')).hexdigest()
+
+    # --- Indexing ----------------------------------------------------------
+
+    def _watermark_path(self) -> Path:
+        return Path(self.config['INDEX_DIR']) / 'sync_watermark.json'
+
+    def sync(self, full: bool = False) -> Dict[str, int]:
+        """
+        Index new or changed documents since the last sync. Unchanged
+        documents (same content hash) are skipped without re-encoding.
+        """
+        watermark = None
+        if not full and self._watermark_path().exists():
+            with open(self._watermark_path()) as watermark_file:
+                watermark = datetime.fromisoformat(json.load(watermark_file)['since'])
+        # Taken before reading, so edits made during the sync are picked up next time
+        sync_started = timezone.now()
+
+        stats = {'documents': 0, 'skipped': 0, 'chunks': 0}
+        pending: List[Tuple[str, int, int, str]] = []
+        for source_type, source_id, patient_id, text, _ in self._sources(watermark):
+            stats['documents'] += 1
+            pending.append((source_type, source_id, patient_id, text))
+            if len(pending) >= self.config['SYNC_BATCH_SIZE']:
+                self._index_batch(pending, stats)
+                pending = []
+        if pending:
+            self._index_batch(pending, stats)
+
+        Path(self.config['INDEX_DIR']).mkdir(parents=True, exist_ok=True)
+        with open(self._watermark_path(), 'w') as watermark_file:
+            json.dump({'since': sync_started.isoformat()}, watermark_file)
+        logger.info(f"Semantic index sync: {stats}")
+        return stats
+
+    def _index_batch(self, documents: List[Tuple], stats: Dict[str, int]) -> None:
+        from .models import SemanticChunk
+
+        keys = {(source_type, source_id) for source_type, source_id, *_ in documents}
+        existing = {}
+        for source_type in {key[0] for key in keys}:
+            ids = [source_id for st, source_id in keys if st == source_type]
+            for row in SemanticChunk.objects.filter(source_type=source_type, source_id__in=ids).values(
+                    'source_type', 'source_id', 'content_hash'):
+                existing[(row['source_type'], row['source_id'])] = row['content_hash']
+
+        new_chunks = []
+        stale_keys = []
+        for source_type, source_id, patient_id, text in documents:
+            content_hash = self._content_hash(text)
+            if existing.get((source_type, source_id)) == content_hash:
+                stats['skipped'] += 1
+                continue
+            if (source_type, source_id) in existing:
+                stale_keys.append((source_type, source_id))
+            for chunk_index, chunk in enumerate(chunk_text(text, self.config['CHUNK_WORDS'],
+                                                           self.config['CHUNK_OVERLAP_WORDS'])):
+                new_chunks.append(SemanticChunk(
+                    source_type=source_type, source_id=source_id, patient_id=patient_id,
+                    chunk_index=chunk_index, text=chunk, content_hash=content_hash,
+                ))
+
+        if not stale_keys and not new_chunks:
+            return
+        # Encode first: a failure leaves the stored hashes untouched, so the next sync retries
+        vectors = self.embedder.encode([chunk.text for chunk in new_chunks])
+
+        with transaction.atomic():
+            # Old chunks disappear from the DB; their vectors are dropped at the next rebuild
+            for source_type, source_id in stale_keys:
+                SemanticChunk.objects.filter(source_type=source_type, source_id=source_id).delete()
+            if not new_chunks:
+                return
+
+            SemanticChunk.objects.bulk_create(new_chunks, batch_size=self.config['SYNC_BATCH_SIZE'])
+            if any(chunk.pk is None for chunk in new_chunks):
+                # Backends without RETURNING: read the ids back
+                lookup = {
+                    (row.source_type, row.source_id, row.chunk_index): row.pk
+                    for row in SemanticChunk.objects.filter(
+                        source_type__in={c.source_type for c in new_chunks},
+                        source_id__in={c.source_id for c in new_chunks})
+                }
+                for chunk in new_chunks:
+                    chunk.pk = lookup[(chunk.source_type, chunk.source_id, chunk.chunk_index)]
+
+            # Inside the transaction so a failed append rolls the rows back
+            self.index.append(np.array([chunk.pk for chunk in new_chunks], dtype=np.int64), vectors)
+        stats['chunks'] += len(new_chunks)
+
+    def prune_orphans(self) -> int:
+        """Delete chunks whose source document no longer exists"""
+        from django.apps import apps
+        from .models import SemanticChunk, AIInsight
+
+        source_models = {
+            SOURCE_VISIT_NOTE: apps.get_model('visits', 'VisitNote'),
+            SOURCE_OCR_TEXT: apps.get_model('file_management', 'UploadedFile'),
+            SOURCE_AI_INSIGHT: AIInsight,
+        }
+        deleted = 0
+        for source_type, model in source_models.items():
+            indexed = set(SemanticChunk.objects.filter(source_type=source_type)
+                          .values_list('source_id', flat=True).distinct())
+            live = set(model.objects.filter(id__in=indexed).values_list('id', flat=True)) if indexed else set()
+            orphans = list(indexed - live)
+            for start in range(0, len(orphans), 1000):
+                deleted += SemanticChunk.objects.filter(
+                    source_type=source_type, source_id__in=orphans[start:start + 1000]
+                ).delete()[0]
+        return deleted
+
+    def rebuild(self) -> int:
+        """Retrain the IVF lists over all live vectors and fold in the delta"""
+        from .models import SemanticChunk
+
+        self.prune_orphans()
+        live_ids = set(SemanticChunk.objects.values_list('id', flat=True).iterator(chunk_size=50000))
+        ids, vectors = self.index.all_vectors(keep_ids=live_ids)
+        if not len(ids) and not live_ids:
+            return 0
+        self.index.build(ids, vectors, self.config['TRAINING_SAMPLE'], self.config['KMEANS_ITERATIONS'])
+        logger.info(f"Semantic index rebuilt with {len(ids)} vectors")
+        return len(ids)
+
+    # --- Query -------------------------------------------------------------
+
+    def search(self, query: str, patient_id: int = None, source_types: List[str] = None,
+               top_k: int = 10, patients=None) -> List[Dict]:
+        """
+        Nearest chunks to the query. `patients` limits results to the
+        patients a user may see (None means no restriction).
+        """
+        from .models import SemanticChunk
+
+        query_vector = self.embedder.encode([query])[0]
+        # Over-fetch: deleted or filtered-out chunks are dropped after the DB lookup
+        fetch = top_k * 4
+        if patient_id is not None or patients is not None:
+            chunks = SemanticChunk.objects.all()
+            if patient_id is not None:
+                chunks = chunks.filter(patient_id=patient_id)
+            if patients is not None:
+                chunks = chunks.filter(patient__in=patients)
+            if source_types:
+                chunks = chunks.filter(source_type__in=source_types)
+            hits = self.index.search_subset(query_vector, chunks.values_list('id', flat=True), fetch)
+        else:
+            hits = self.index.search(query_vector, fetch)
+
+        rows = SemanticChunk.objects.in_bulk([hit.chunk_id for hit in hits])
+        results = []
+        for hit in hits:
+            chunk = rows.get(hit.chunk_id)
+            if chunk is None or (source_types and chunk.source_type not in source_types):
+                continue
+            results.append({
+                'score': round(hit.score, 4),
+                'source_type': chunk.source_type,
+                'source_id': chunk.source_id,
+                'patient_id': chunk.patient_id,
+                'chunk_index': chunk.chunk_index,
+                'snippet': chunk.text[:300],
+            })
+            if len(results) >= top_k:
+                break
+        return results
+
+
+semantic_search_service = SemanticSearchService()
@@ -1,9 +1,10 @@
 from rest_framework import serializers
 from .models import (
     AIInsight, PatientTrend, RiskPrediction, 
-    ClinicalDecisionSupport, AIProcessingLog,
+    ClinicalDecisionSupport, AIProcessingLog, AIUsageRollup,
     AIInsightType, RiskLevel
 )
+from .lifecycle import upsert_insight
 
 
 class AIInsightSerializer(serializers.ModelSerializer):
@@ -23,10 +24,10 @@ class AIInsightSerializer(serializers.ModelSerializer):
             'data_sources', 'evidence', 'is_actionable', 
             'recommended_actions', 'urgency_level', 'status', 
             'reviewed_by', 'reviewed_by_name', 'reviewed_at', 'review_notes', 
-            'created_at', 'updated_at', 'expires_at',
+            'created_at', 'updated_at', 'expires_at', 'is_active', 'archived_at',
             'is_critical', 'days_since_created'
         ]
-        read_only_fields = ['created_at', 'updated_at', 'is_critical', 'days_since_created']
+        read_only_fields = ['created_at', 'updated_at', 'is_active', 'archived_at', 'is_critical', 'days_since_created']
     
     def get_patient_name(self, obj):
         if obj.patient:
@@ -57,7 +58,8 @@ class AIInsightCreateSerializer(serializers.ModelSerializer):
     
     def create(self, validated_data):
         validated_data['created_by'] = self.context['request'].user
-        return super().create(validated_data)
+        insight, _ = upsert_insight(**validated_data)
+        return insight
 
 
 class PatientTrendSerializer(serializers.ModelSerializer):
@@ -158,6 +160,19 @@ class AIProcessingLogSerializer(serializers.ModelSerializer):
         return None
 
 
+class AIUsageRollupSerializer(serializers.ModelSerializer):
+    error_rate = serializers.ReadOnlyField()
+    
+    class Meta:
+        model = AIUsageRollup
+        fields = [
+            'id', 'period', 'bucket_start', 'model_used', 'process_type',
+            'request_count', 'error_count', 'error_rate', 'total_tokens', 'total_cost',
+            'total_latency_seconds', 'p50_latency_seconds', 'p90_latency_seconds',
+            'p99_latency_seconds', 'updated_at'
+        ]
+
+
 # Specialized serializers for API requests
 class GenerateInsightRequestSerializer(serializers.Serializer):
     patient_id = serializers.IntegerField()
@@ -195,6 +210,11 @@ class RiskAssessmentRequestSerializer(serializers.Serializer):
         required=False,
         help_text="Types of risks to assess. If not provided, all applicable risks will be assessed."
     )
+    recent_admissions = serializers.ListField(
+        child=serializers.DictField(),
+        required=False,
+        help_text="Hospital admissions in the readmission window, newest first"
+    )
     include_recommendations = serializers.BooleanField(default=True)
     prediction_horizon_days = serializers.IntegerField(default=30, min_value=1, max_value=365)
 
@@ -248,6 +268,25 @@ class AIInsightSummarySerializer(serializers.Serializer):
     recent_insights = AIInsightSerializer(many=True)
 
 
+class AIUsageAnalyticsRequestSerializer(serializers.Serializer):
+    period = serializers.ChoiceField(choices=[('hour', 'Hourly'), ('day', 'Daily')], default='day')
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+    model_used = serializers.CharField(max_length=100, required=False)
+    process_type = serializers.CharField(max_length=50, required=False)
+    include_rows = serializers.BooleanField(default=False)
+
+
+class SemanticSearchRequestSerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=1000)
+    patient_id = serializers.IntegerField(required=False)
+    source_types = serializers.MultipleChoiceField(
+        choices=[('visit_note', 'Visit Note'), ('ocr_text', 'OCR Text'), ('ai_insight', 'AI Insight')],
+        required=False
+    )
+    top_k = serializers.IntegerField(default=10, min_value=1, max_value=100)
+
+
 class TrendAnalysisResponseSerializer(serializers.Serializer):
     """Response format for trend analysis"""
     patient_id = serializers.IntegerField()
@@ -0,0 +1,113 @@
+"""
+Signal handlers for ai_insights
+- Keep AIInsight dashboard counters in step with saves and deletes
+- Feed vital signs from new and edited visits into PatientTrend running
+  statistics (an edit replaces the visit's earlier values)
+- Screen a patient's medication list for drug interactions when it is saved
+"""
+
+import logging
+
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+
+from .counters import TRACKED_FIELDS, record_change, snapshot
+from .drug_interactions import interaction_checks_enabled, check_patient
+from .models import AIInsight
+from .trend_engine import record_observations, vital_sign_values
+
+logger = logging.getLogger('ai_insights')
+
+
+def _stored_state(instance):
+    """Snapshot of an instance, reading the stored row once if counted fields were deferred"""
+    state = snapshot(instance)
+    if state is None and instance.pk is not None:
+        stored = AIInsight.objects.filter(pk=instance.pk).only(*TRACKED_FIELDS).first()
+        state = snapshot(stored) if stored else None
+    return state
+
+
+@receiver(post_init, sender=AIInsight)
+def remember_insight_state(sender, instance, **kwargs):
+    instance._counter_snapshot = snapshot(instance)
+
+
+@receiver(pre_save, sender=AIInsight)
+def load_insight_state(sender, instance, **kwargs):
+    if instance._counter_snapshot is None:
+        instance._counter_snapshot = _stored_state(instance)
+
+
+@receiver(post_save, sender=AIInsight)
+def update_insight_counters(sender, instance, created, **kwargs):
+    after = _stored_state(instance)
+    record_change(None if created else instance._counter_snapshot, after)
+    instance._counter_snapshot = after
+
+
+@receiver(post_delete, sender=AIInsight)
+def remove_insight_counters(sender, instance, **kwargs):
+    record_change(instance._counter_snapshot, None)
+
+
+VITAL_FIELDS = {'patient_id', 'scheduled_date', 'vital_signs'}
+
+
+def _vitals_state(visit):
+    """(patient_id, scheduled_date, metrics) of a visit, or None if those fields were deferred"""
+    if visit.get_deferred_fields() & VITAL_FIELDS:
+        return None
+    return visit.patient_id, visit.scheduled_date, vital_sign_values(visit.vital_signs)
+
+
+def vital_changes(visit_id, before, after):
+    """Observations to add and (patient_id, metric, visit_id) values to replace between two visit states"""
+    patient_id, scheduled_date, metrics = after
+    if before is None:
+        changed, replaced = set(metrics), []
+    elif before[:2] != after[:2]:
+        # Moved to another date or patient: every value moves with it
+        changed = set(metrics)
+        replaced = [(before[0], metric, visit_id) for metric in before[2]]
+    else:
+        changed = {metric for metric in set(metrics) | set(before[2]) if metrics.get(metric) != before[2].get(metric)}
+        replaced = [(patient_id, metric, visit_id) for metric in changed if metric in before[2]]
+    observations = [
+        (patient_id, metric, scheduled_date, metrics[metric], visit_id) for metric in changed if metric in metrics
+    ]
+    return observations, replaced
+
+
+@receiver(post_init, sender='visits.Visit')
+def remember_visit_vitals(sender, instance, **kwargs):
+    instance._vitals_snapshot = _vitals_state(instance)
+
+
+@receiver(post_save, sender='visits.Visit')
+def record_visit_vitals(sender, instance, created, **kwargs):
+    after = _vitals_state(instance)
+    before = None if created else instance._vitals_snapshot
+    instance._vitals_snapshot = after
+    if after is None or (before is None and not created):
+        # Saved with deferred fields: picked up by the next full trend recompute
+        return
+    observations, replaced = vital_changes(instance.pk, before, after)
+    if not observations and not replaced:
+        return
+    try:
+        record_observations(observations, replaced)
+    except Exception as e:
+        logger.error(f"Failed to update trends for visit {instance.pk}: {str(e)}")
+
+
+@receiver(post_save, sender='patients.Patient')
+def screen_patient_interactions(sender, instance, update_fields=None, **kwargs):
+    if not interaction_checks_enabled() or not instance.medications:
+        return
+    if update_fields is not None and 'medications' not in update_fields:
+        return
+    try:
+        check_patient(instance.pk, instance.medications)
+    except Exception as e:
+        logger.error(f"Drug interaction check failed for patient {instance.pk}: {str(e)}")
@@ -0,0 +1,236 @@
+"""
+Structured (JSON) outputs for AI prompt families
+Each prompt family that expects JSON declares an output schema:
+- The schema is appended to the system prompt and sent to the provider's
+  JSON / structured-output mode
+- Replies are validated locally against the schema
+- Common formatting slips (code fences, leading prose, trailing commas) are
+  repaired locally before anything is re-asked
+"""
+
+import json
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from .models import AIInsightType, RiskLevel
+
+FENCE_RE = re.compile(r'^\s*```[a-zA-Z0-9_-]*\s*\n?(.*?)\n?\s*```\s*$', re.DOTALL)
+TRAILING_COMMA_RE = re.compile(r',\s*([}\]])')
+URGENCY_LEVELS = ['immediate', 'within_24h', 'within_week', 'routine']
+
+
+@dataclass(frozen=True)
+class OutputSchema:
+    """JSON Schema (subset) describing one prompt family's reply"""
+    name: str
+    schema: Dict
+
+    def instruction(self) -> str:
+        return (
+            "Respond with a single JSON object only (no prose, no code fences) "
+            f"matching this JSON Schema: {json.dumps(self.schema, separators=(',', ':'))}"
+        )
+
+    def provider_format(self) -> Dict:
+        return {'name': self.name, 'schema': self.schema}
+
+
+@dataclass
+class ParsedOutput:
+    """Result of parsing one model reply"""
+    data: Optional[Any]
+    errors: List[str] = field(default_factory=list)
+    repaired: bool = False
+
+    @property
+    def valid(self) -> bool:
+        return self.data is not None and not self.errors
+
+
+def _string_list(description: str) -> Dict:
+    return {'type': 'array', 'items': {'type': 'string'}, 'description': description}
+
+
+RISK_ASSESSMENT_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'risk_score': {'type': 'number', 'minimum': 0, 'maximum': 1},
+        'risk_category': {'type': 'string', 'enum': RiskLevel.values},
+        'contributing_factors': _string_list("Factors increasing risk"),
+        'protective_factors': _string_list("Factors reducing risk"),
+        'recommendations': _string_list("Prevention strategies"),
+    },
+    'required': ['risk_score', 'risk_category', 'contributing_factors', 'recommendations'],
+}
+
+OUTPUT_SCHEMAS = {
+    'patient_summary': OutputSchema('patient_summary', {
+        'type': 'object',
+        'properties': {
+            'summary': {'type': 'string'},
+            'key_findings': _string_list("Important findings"),
+            'risk_factors': _string_list("Identified risk factors"),
+            'recommendations': _string_list("Actionable recommendations"),
+            'urgency_level': {'type': 'string', 'enum': URGENCY_LEVELS},
+            'insights': {
+                'type': 'array',
+                'items': {
+                    'type': 'object',
+                    'properties': {
+                        'insight_type': {'type': 'string', 'enum': AIInsightType.values},
+                        'title': {'type': 'string'},
+                        'description': {'type': 'string'},
+                        'risk_level': {'type': 'string', 'enum': RiskLevel.values},
+                        'priority_score': {'type': 'number', 'minimum': 0, 'maximum': 1},
+                        'confidence_score': {'type': 'number', 'minimum': 0, 'maximum': 1},
+                        'urgency_level': {'type': 'string', 'enum': URGENCY_LEVELS},
+                        'recommended_actions': _string_list("Actions for this insight"),
+                    },
+                    'required': ['insight_type', 'title', 'description', 'risk_level'],
+                },
+            },
+        },
+        'required': ['summary', 'key_findings', 'recommendations', 'urgency_level', 'insights'],
+    }),
+    'fall_risk': OutputSchema('fall_risk', RISK_ASSESSMENT_SCHEMA),
+    'readmission_risk': OutputSchema('readmission_risk', RISK_ASSESSMENT_SCHEMA),
+    'document_extraction': OutputSchema('document_extraction', {
+        'type': 'object',
+        'properties': {
+            'demographics': {'type': 'object'},
+            'diagnoses': _string_list("Diagnoses and conditions"),
+            'medications': {
+                'type': 'array',
+                'items': {
+                    'type': 'object',
+                    'properties': {
+                        'name': {'type': 'string'},
+                        'dose': {'type': 'string'},
+                        'frequency': {'type': 'string'},
+                    },
+                    'required': ['name'],
+                },
+            },
+            'vital_signs': {'type': 'object'},
+            'procedures': _string_list("Procedures and treatments"),
+            'assessment_findings': _string_list("Assessment findings"),
+            'plan_of_care': _string_list("Plan of care items"),
+        },
+        'required': ['diagnoses', 'medications', 'vital_signs'],
+    }),
+}
+
+
+def _coerce(value: Any, schema: Dict, path: str, errors: List[str]) -> Any:
+    """Validate value against a JSON Schema subset, coercing harmless mismatches"""
+    expected = schema.get('type')
+
+    if expected == 'object':
+        if not isinstance(value, dict):
+            errors.append(f"{path}: expected object")
+            return value
+        for name in schema.get('required', []):
+            if name not in value:
+                errors.append(f"{path}.{name}: required")
+        properties = schema.get('properties', {})
+        return {
+            key: _coerce(item, properties[key], f"{path}.{key}", errors) if key in properties else item
+            for key, item in value.items()
+        }
+
+    if expected == 'array':
+        if isinstance(value, str) and schema.get('items', {}).get('type') == 'string':
+            value = [value]
+        if not isinstance(value, list):
+            errors.append(f"{path}: expected array")
+            return value
+        items = schema.get('items', {})
+        return [_coerce(item, items, f"{path}[{index}]", errors) for index, item in enumerate(value)]
+
+    if expected in ('number', 'integer'):
+        if isinstance(value, str):
+            try:
+                value = float(value.strip().rstrip('%')) / (100 if value.strip().endswith('%') else 1)
+            except ValueError:
+                pass
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            errors.append(f"{path}: expected {expected}")
+            return value
+        if expected == 'integer':
+            value = int(value)
+        if 'minimum' in schema and value < schema['minimum']:
+            errors.append(f"{path}: below minimum {schema['minimum']}")
+        if 'maximum' in schema and value > schema['maximum']:
+            errors.append(f"{path}: above maximum {schema['maximum']}")
+        return value
+
+    if expected == 'string':
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = str(value)
+        if not isinstance(value, str):
+            errors.append(f"{path}: expected string")
+            return value
+        if 'enum' in schema:
+            normalized = value.strip().lower().replace(' ', '_')
+            if normalized not in schema['enum']:
+                errors.append(f"{path}: must be one of {', '.join(schema['enum'])}")
+                return value
+            return normalized
+        return value
+
+    if expected == 'boolean' and not isinstance(value, bool):
+        errors.append(f"{path}: expected boolean")
+    return value
+
+
+def validate(data: Any, schema: Dict) -> Tuple[Any, List[str]]:
+    """(coerced data, validation errors)"""
+    errors: List[str] = []
+    return _coerce(data, schema, '$', errors), errors
+
+
+def repair_json(text: str) -> Tuple[Optional[Any], bool]:
+    """Parse JSON, repairing fences, surrounding prose and trailing commas; (data, repaired)"""
+    try:
+        return json.loads(text), False
+    except (TypeError, json.JSONDecodeError):
+        pass
+    if not isinstance(text, str):
+        return None, False
+
+    candidate = text.strip()
+    fenced = FENCE_RE.match(candidate)
+    if fenced:
+        candidate = fenced.group(1).strip()
+
+    # Cut to the outermost object/array when the model wrapped it in prose
+    starts = [index for index in (candidate.find('{'), candidate.find('[')) if index >= 0]
+    if starts:
+        start = min(starts)
+        end = candidate.rfind('}' if candidate[start] == '{' else ']')
+        if end > start:
+            candidate = candidate[start:end + 1]
+
+    for attempt in (candidate, TRAILING_COMMA_RE.sub(r'\1', candidate)):
+        try:
+            return json.loads(attempt), True
+        except json.JSONDecodeError:
+            continue
+    return None, False
+
+
+def parse_output(text: str, output_schema: OutputSchema) -> ParsedOutput:
+    data, repaired = repair_json(text)
+    if data is None:
+        return ParsedOutput(None, ['$: reply is not valid JSON'])
+    data, errors = validate(data, output_schema.schema)
+    return ParsedOutput(data, errors, repaired)
+
+
+def reask_message(parsed: ParsedOutput) -> str:
+    problems = '; '.join(parsed.errors[:10])
+    return (
+        f"Your previous reply did not match the required JSON schema ({problems}). "
+        "Reply again with only the corrected JSON object."
+    )
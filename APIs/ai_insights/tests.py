@@ -1,3 +1,1067 @@
-from django.test import TestCase
+import datetime
+import importlib.util
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from authentication.models import User
+from oasis.models import OasisAssessment
+from patients.models import Patient
+from visits.models import Visit, VisitNote
+
+from .ai_services import risk_assessment_engine
+from .analytics import QuantileSketch, estimate_cost, run_rollups
+from .audit import AuditLogWriter, _encode, audit_log_writer
+from .clinical_ner import (
+    clinical_ner_service, entities_from_doc, extract_entities, measurement_entities, to_clinical_data
+)
+from .counters import read_counters, rebuild_counters
+from .drug_interactions import InteractionIndex, check_patient, screen_patients
+from .lifecycle import bulk_upsert_insights, hamming_distance, simhash, sweep_insights, upsert_insight
+from .medication_lexicon import AhoCorasick, MedicationLexicon, get_lexicon, scan_patient_medications
+from .models import (
+    AIInsight, AIProcessingLog, AIUsageRollup, ClinicalDecisionSupport, ClinicalEntity, PatientTrend,
+    RiskPrediction, SemanticChunk
+)
+from .patient_context import assemble_patient_context
+from .prompt_builder import PromptBuilder, compact_json, context_window_for, downsample_series
+from .providers import AIResponse, CircuitBreaker, LLMProvider, ProviderRouter
+from .risk_rules import mobility_status, triage_fall_risk, triage_readmission_risk
+from .semantic_search import SOURCE_VISIT_NOTE, VectorIndex, semantic_search_service
+from .structured_output import OUTPUT_SCHEMAS, parse_output, repair_json
+from .trend_engine import (
+    RunningTrendStats, analyze_series_batch, cap_points, record_observations, vital_sign_values
+)
+from .views import GenerateInsightsView
+
+
+def make_user(username='clinician', role='admin'):
+    return User.objects.create(username=username, role=role)
+
+
+def make_patient(user, mrn='M1', **fields):
+    values = dict(
+        mrn=mrn, first_name='Ada', last_name='Lovelace', date_of_birth=datetime.date(1950, 1, 1), gender='female',
+        address='1 Main St', emergency_contact_name='Kin', emergency_contact_phone='555', primary_diagnosis='CHF',
+        created_by=user,
+    )
+    values.update(fields)
+    return Patient.objects.create(**values)
+
+
+def insight_fields(patient, **fields):
+    values = dict(patient=patient, insight_type='risk_assessment', title='Fall risk',
+                  description='Patient reports two falls in the last month.', model_used='test-model')
+    values.update(fields)
+    return values
+
+
+class PromptBuilderTests(SimpleTestCase):
+    # Claude models use the character estimate, so counts do not depend on tiktoken
+    MODEL = 'claude-3'
+
+    def test_compact_json_drops_empty_values(self):
+        self.assertEqual(compact_json({'a': 1, 'b': None, 'c': '', 'd': [], 'e': {'f': {}}, 'g': 0.123456}),
+                         '{"a":1,"g":0.1235}')
+
+    def test_context_window_prefix_match(self):
+        self.assertEqual(context_window_for('gpt-4o-mini-2024-07-18'), 128000)
+        self.assertEqual(context_window_for('gpt-4-0613'), 8192)
+        self.assertEqual(context_window_for('unknown-model'), 8192)
+
+    def test_downsample_keeps_endpoints_and_extremes(self):
+        points = [{'timestamp': i, 'value': float(i % 7)} for i in range(100)]
+        points[50]['value'] = 99.0
+        reduced = downsample_series(points, 10)
+        self.assertLessEqual(len(reduced), 10)
+        self.assertEqual(reduced[0], points[0])
+        self.assertEqual(reduced[-1], points[-1])
+        self.assertEqual(max(point.get('max', point['value']) for point in reduced), 99.0)
+
+    def test_fits_budget_by_priority(self):
+        builder = PromptBuilder('system', self.MODEL, budget_tokens=120)
+        builder.add_section('Low', 'x' * 2000, priority=1)
+        builder.add_section('Required', {'id': 1}, required=True)
+        builder.add_section('High', list(range(200)), priority=10)
+        prompt = builder.build()
+        self.assertLessEqual(prompt.prompt_tokens, 120)
+        self.assertEqual(prompt.sections['Required']['state'], 'full')
+        self.assertEqual(prompt.sections['High']['state'], 'truncated')
+        self.assertEqual(prompt.sections['Low']['state'], 'dropped')
+        # Sections keep the order they were added in
+        user = prompt.messages[1]['content']
+        self.assertLess(user.index('Required'), user.index('High'))
+
+    def test_list_shrink_keeps_leading_items(self):
+        builder = PromptBuilder('system', self.MODEL, budget_tokens=60)
+        builder.add_section('Admissions', [{'n': i} for i in range(100)])
+        user = builder.build().messages[1]['content']
+        self.assertTrue(user.startswith('Admissions: [{"n":0},{"n":1}'))
+        self.assertNotIn('{"n":99}', user)
+
+
+class AuditLogWriterTests(TransactionTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.spill_path = Path(directory.name) / 'spill.jsonl'
+        self.writer = AuditLogWriter(spill_path=self.spill_path, asynchronous=False)
+
+    def _record(self, **fields):
+        record = dict(process_type='risk_assessment', model_used='gpt-4o-mini', input_data_size=10,
+                      processing_time_seconds=0.5, started_at=timezone.now())
+        record.update(fields)
+        return record
+
+    def test_completed_at_is_submit_time(self):
+        finished = timezone.now() - datetime.timedelta(hours=3)
+        self.writer._spill([self._record(completed_at=finished)])
+        self.writer.submit(**self._record())
+        self.assertEqual(AIProcessingLog.objects.count(), 2)
+        # The spilled record keeps its time instead of the replay time
+        self.assertEqual(AIProcessingLog.objects.order_by('completed_at').first().completed_at, finished)
+
+    def test_orphaned_replay_files_are_replayed(self):
+        orphan = self.spill_path.with_name(f"{self.spill_path.name}.999999.replay")
+        orphan.write_text(_encode(self._record()) + '\n')
+        old = time.time() - 3600
+        os.utime(orphan, (old, old))
+        fresh = self.spill_path.with_name(f"{self.spill_path.name}.999998.replay")
+        fresh.write_text(_encode(self._record()) + '\n')
+        self.assertEqual(self.writer.flush(), 1)
+        self.assertFalse(orphan.exists())
+        # Another process may still be replaying a recent file
+        self.assertTrue(fresh.exists())
+
+    def test_rejected_records_do_not_block_replay(self):
+        self.writer._spill([self._record(patient_id=987654), self._record(), self._record()])
+        self.assertEqual(self.writer.flush(), 2)
+        rejected = self.spill_path.with_name(f"{self.spill_path.name}.rejected")
+        self.assertEqual(len(rejected.read_text().splitlines()), 1)
+        self.assertFalse(self.spill_path.exists())
+        self.assertEqual(self.writer.flush(), 0)
+        self.assertEqual(AIProcessingLog.objects.count(), 2)
+
+
+class UsageRollupTests(TestCase):
+    def _log(self, started_at, latency, success=True, tokens=100, cost='0.0100', model='gpt-4o-mini'):
+        AIProcessingLog.objects.create(
+            process_type='insight_generation', model_used=model, input_data_size=10, success=success,
+            processing_time_seconds=latency, tokens_used=tokens, cost_estimate=Decimal(cost), started_at=started_at,
+        )
+
+    def test_sketch_quantiles_within_relative_error(self):
+        sketch = QuantileSketch(alpha=0.01)
+        for value in range(1, 1001):
+            sketch.add(float(value))
+        for q, exact in ((0.5, 500.5), (0.9, 900.1), (0.99, 990.01)):
+            self.assertAlmostEqual(sketch.quantile(q), exact, delta=exact * 0.011)
+
+    def test_sketches_merge_like_one(self):
+        left, right, whole = QuantileSketch(), QuantileSketch(), QuantileSketch()
+        for value in range(1, 501):
+            left.add(value / 10)
+            whole.add(value / 10)
+        for value in range(501, 1001):
+            right.add(value / 10)
+            whole.add(value / 10)
+        merged = QuantileSketch.from_dict(left.to_dict()).merge(right)
+        self.assertEqual(merged.quantile(0.9), whole.quantile(0.9))
+        self.assertEqual(merged.count, 1000)
+
+    def test_estimate_cost_uses_longest_prefix(self):
+        self.assertEqual(estimate_cost('gpt-4o-mini-2024-07-18', 1_000_000, 0), Decimal('0.1500'))
+        self.assertIsNone(estimate_cost('local-model', 10, 10))
+
+    def test_hourly_and_daily_rollups_are_idempotent(self):
+        day = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0) - datetime.timedelta(days=1)
+        self._log(day + datetime.timedelta(hours=1, minutes=5), 1.0)
+        self._log(day + datetime.timedelta(hours=1, minutes=50), 3.0, success=False, cost='0')
+        self._log(day + datetime.timedelta(hours=2, minutes=1), 2.0)
+        run_rollups()
+        run_rollups(since=day)
+
+        hourly = AIUsageRollup.objects.filter(period='hour').order_by('bucket_start')
+        self.assertEqual([(row.request_count, row.error_count) for row in hourly], [(2, 1), (1, 0)])
+        daily = AIUsageRollup.objects.get(period='day')
+        self.assertEqual((daily.request_count, daily.error_count, daily.total_tokens), (3, 1, 300))
+        self.assertEqual(daily.total_cost, Decimal('0.0200'))
+        self.assertAlmostEqual(daily.total_latency_seconds, 6.0)
+
+        # A late (spilled) record is picked up by the next run's lookback
+        self._log(day + datetime.timedelta(hours=2, minutes=30), 2.0)
+        run_rollups(since=day)
+        self.assertEqual(AIUsageRollup.objects.get(period='day').request_count, 4)
+
+
+class FakeProvider(LLMProvider):
+    def __init__(self, name, outcomes, delay=0.0):
+        super().__init__('key', f'{name}-model', timeout=5)
+        self.name = name
+        self.outcomes = list(outcomes)
+        self.delay = delay
+        self.calls = 0
+
+    def _create_client(self):
+        return object()
+
+    def complete(self, model, messages, max_tokens, temperature, top_p, response_schema=None):
+        self.calls += 1
+        time.sleep(self.delay)
+        if not self.outcomes.pop(0):
+            raise RuntimeError(f"{self.name} down")
+        return AIResponse(success=True, content=self.name, confidence=1.0, model_used=model, tokens_used=5)
+
+
+class ProviderRouterTests(SimpleTestCase):
+    MESSAGES = [{'role': 'user', 'content': 'hi'}]
+
+    def _warm(self, provider, latency):
+        for _ in range(20):
+            provider.breaker.record_success(latency)
+
+    def test_failover_to_backup(self):
+        primary, backup = FakeProvider('primary', [False]), FakeProvider('backup', [True])
+        response = ProviderRouter([primary, backup]).complete(self.MESSAGES)
+        self.assertEqual((response.success, response.content), (True, 'backup'))
+
+    def test_hedging_fails_over_when_primary_fails_without_history(self):
+        # No p95 yet: the hedge never starts, so the backup must still be tried
+        primary, backup = FakeProvider('primary', [False]), FakeProvider('backup', [True])
+        response = ProviderRouter([primary, backup], hedging=True).complete(self.MESSAGES)
+        self.assertEqual((response.content, backup.calls), ('backup', 1))
+
+    def test_hedging_fails_over_when_primary_fails_before_hedge_delay(self):
+        primary, backup = FakeProvider('primary', [False]), FakeProvider('backup', [True])
+        self._warm(primary, 5.0)
+        response = ProviderRouter([primary, backup], hedging=True).complete(self.MESSAGES)
+        self.assertEqual((response.content, backup.calls), ('backup', 1))
+
+    def test_slow_primary_is_hedged(self):
+        primary, backup = FakeProvider('primary', [True], delay=0.5), FakeProvider('backup', [True])
+        self._warm(primary, 0.01)
+        router = ProviderRouter([primary, backup], hedging=True, hedge_min_delay=0.05)
+        self.assertEqual(router.complete(self.MESSAGES).content, 'backup')
+
+    def test_both_failing_reports_every_error(self):
+        primary, backup = FakeProvider('primary', [False]), FakeProvider('backup', [False])
+        response = ProviderRouter([primary, backup], hedging=True).complete(self.MESSAGES)
+        self.assertFalse(response.success)
+        self.assertIn('primary down', response.error_message)
+        self.assertIn('backup down', response.error_message)
+
+    def test_circuit_opens_after_consecutive_failures(self):
+        primary, backup = FakeProvider('primary', [False] * 5), FakeProvider('backup', [True] * 6)
+        router = ProviderRouter([primary, backup])
+        for _ in range(6):
+            router.complete(self.MESSAGES)
+        self.assertEqual(primary.calls, 5)
+        self.assertEqual(primary.breaker.status()['state'], 'open')
+
+    def test_half_open_lets_one_trial_through(self):
+        breaker = CircuitBreaker(failure_threshold=1, cooldown_seconds=30)
+        breaker.record_failure()
+        self.assertFalse(breaker.available())
+        breaker.opened_at -= 30
+        self.assertTrue(breaker.available())
+        self.assertTrue(breaker.allow_request())
+        self.assertEqual(breaker.state, 'half_open')
+        self.assertFalse(breaker.available())
+        self.assertFalse(breaker.allow_request())
+        # A failed trial reopens the circuit; the next trial's success closes it
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        breaker.opened_at -= 30
+        self.assertTrue(breaker.allow_request())
+        breaker.record_success(0.1)
+        self.assertEqual(breaker.state, 'closed')
+        self.assertTrue(breaker.allow_request() and breaker.allow_request())
+
+    def test_half_open_primary_gets_a_single_trial_call(self):
+        primary, backup = FakeProvider('primary', [True] * 4, delay=0.3), FakeProvider('backup', [True] * 4)
+        primary.breaker = CircuitBreaker(failure_threshold=1, cooldown_seconds=30)
+        primary.breaker.record_failure()
+        primary.breaker.opened_at -= 30
+        router = ProviderRouter([primary, backup])
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            responses = list(pool.map(lambda _: router.complete(self.MESSAGES), range(4)))
+        self.assertEqual(primary.calls, 1)
+        self.assertEqual(sorted(response.content for response in responses), ['backup'] * 3 + ['primary'])
+        self.assertEqual(primary.breaker.state, 'closed')
+
+
+class FakeEmbedder:
+    """Bag-of-words vectors, so similar texts score close without a model"""
+    dimension = 16
+
+    def __init__(self):
+        self.fail = False
+
+    def encode(self, texts):
+        if self.fail:
+            raise RuntimeError('encoder unavailable')
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                vectors[row, sum(map(ord, word)) % self.dimension] += 1
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1)
+        return vectors.astype(np.float16)
+
+
+class VectorIndexTests(SimpleTestCase):
+    def setUp(self):
+        index_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(index_dir.cleanup)
+        self.index = VectorIndex(index_dir.name, nprobe=4)
+        self.vectors = np.eye(8, dtype=np.float16)
+
+    def test_append_reloads_only_the_delta(self):
+        self.index.build(np.arange(10, 16), self.vectors[:6], training_sample=100, iterations=2)
+        self.assertTrue(self.index.refresh())
+        id_order = self.index._id_order
+
+        self.index.append(np.array([3, 30]), self.vectors[6:8])
+        with mock.patch.object(np, 'load', wraps=np.load) as load:
+            hits = self.index.search_subset(self.vectors[6].astype(np.float32), [3, 12], k=5)
+        load.assert_not_called()
+        self.assertIs(self.index._id_order, id_order)
+        self.assertEqual([hit.chunk_id for hit in hits], [3, 12])
+
+        # A rebuild replaces the main segment and its id order
+        self.index.build(np.array([1, 2]), self.vectors[:2], training_sample=100, iterations=2)
+        hits = self.index.search_subset(self.vectors[1].astype(np.float32), [2, 3], k=5)
+        self.assertEqual([hit.chunk_id for hit in hits], [2])
+
+
+class SemanticSearchTests(TestCase):
+    def setUp(self):
+        index_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(index_dir.cleanup)
+        self.service = semantic_search_service
+        patcher = mock.patch.multiple(self.service, embedder=FakeEmbedder(), index=VectorIndex(index_dir.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.admin = make_user('admin')
+        self.physician = make_user('physician', role='physician')
+        self.own = make_patient(self.admin, 'M1', assigned_physician=self.physician)
+        self.other = make_patient(self.admin, 'M2')
+        self.index([(1, self.own.id, 'shortness of breath on exertion'),
+                    (2, self.other.id, 'shortness of breath at night')])
+
+    def index(self, notes):
+        self.service._index_batch([(SOURCE_VISIT_NOTE, note_id, patient_id, text)
+                                   for note_id, patient_id, text in notes], {'skipped': 0, 'chunks': 0})
+
+    def search(self, user, **params):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.get('/api/v1/ai/search/semantic/', {'q': 'shortness of breath', **params})
+
+    def test_global_search_is_scoped_to_assigned_patients(self):
+        response = self.search(self.physician)
+        self.assertEqual({hit['patient_id'] for hit in response.data['results']}, {self.own.id})
+        response = self.search(self.admin)
+        self.assertEqual({hit['patient_id'] for hit in response.data['results']}, {self.own.id, self.other.id})
+
+    def test_unassigned_patient_is_not_found_for_physician(self):
+        self.assertEqual(self.search(self.physician, patient_id=self.other.id).status_code, 404)
+        self.assertEqual(len(self.search(self.admin, patient_id=self.other.id).data['results']), 1)
+
+    def test_failed_encode_keeps_previous_chunks(self):
+        self.service.embedder.fail = True
+        with self.assertRaises(RuntimeError):
+            self.index([(1, self.own.id, 'new note text')])
+        chunk = SemanticChunk.objects.get(source_id=1)
+        self.assertEqual(chunk.text, 'shortness of breath on exertion')
+
+        # The old hash is still stored, so the next sync re-embeds the change
+        self.service.embedder.fail = False
+        self.index([(1, self.own.id, 'new note text')])
+        self.assertEqual(SemanticChunk.objects.get(source_id=1).text, 'new note text')
+
+    def test_failed_append_rolls_back_rows(self):
+        with mock.patch.object(self.service.index, 'append', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                self.index([(1, self.own.id, 'new note text'), (3, self.own.id, 'another note')])
+        self.assertEqual(SemanticChunk.objects.get(source_id=1).text, 'shortness of breath on exertion')
+        self.assertFalse(SemanticChunk.objects.filter(source_id=3).exists())
+
+
+class InsightLifecycleTests(TestCase):
+    def setUp(self):
+        self.patient = make_patient(make_user())
+
+    def test_exact_duplicate_refreshes_existing_row(self):
+        first, created = upsert_insight(**insight_fields(self.patient, confidence_score=0.4))
+        self.assertTrue(created)
+        self.assertIsNotNone(first.expires_at)
+        second, created = upsert_insight(**insight_fields(
+            self.patient, title='FALL RISK!', description='patient reports two falls in the last month',
+            confidence_score=0.9))
+        self.assertFalse(created)
+        self.assertEqual(second.pk, first.pk)
+        first.refresh_from_db()
+        self.assertEqual(first.confidence_score, 0.9)
+
+    def test_near_duplicate_is_merged_but_other_types_are_not(self):
+        upsert_insight(**insight_fields(self.patient, description=(
+            'Patient reports two falls in the last month while walking to the bathroom at night '
+            'and uses a cane indoors with poor lighting in the hallway')))
+        merged, created = upsert_insight(**insight_fields(self.patient, description=(
+            'Patient reports two falls in the last month while walking to the bathroom at night '
+            'and uses a cane indoors with dim lighting in the hallway')))
+        self.assertFalse(created)
+        # The newer wording replaces the old one
+        merged.refresh_from_db()
+        self.assertIn('dim lighting', merged.description)
+        _, created = upsert_insight(**insight_fields(self.patient, insight_type='care_gap'))
+        self.assertTrue(created)
+        self.assertEqual(AIInsight.objects.count(), 2)
+
+    def test_opposite_findings_are_not_merged(self):
+        low, _ = upsert_insight(**insight_fields(self.patient, description='Patient is at low risk of falls'))
+        high, created = upsert_insight(**insight_fields(
+            self.patient, description='Patient is at high risk of falls', risk_level='high'))
+        self.assertTrue(created)
+        # Same severity, but the wording is further apart than a rephrasing
+        _, created = upsert_insight(**insight_fields(self.patient, title='Blood pressure',
+                                                     description='Blood pressure steadily improving'))
+        self.assertTrue(created)
+        results = bulk_upsert_insights([
+            insight_fields(self.patient, title='Blood pressure', description='Blood pressure steadily worsening'),
+            insight_fields(self.patient, description='Patient is at low risk of falls', urgency_level='immediate'),
+        ])
+        self.assertEqual([created for _, created in results], [True, True])
+        self.assertEqual(AIInsight.objects.filter(is_active=True).count(), 5)
+        low.refresh_from_db()
+        high.refresh_from_db()
+        self.assertEqual((low.risk_level, low.description), ('low', 'Patient is at low risk of falls'))
+        self.assertEqual((high.risk_level, high.description), ('high', 'Patient is at high risk of falls'))
+
+    def test_simhash_distance(self):
+        text = 'blood pressure trending up over three visits'
+        self.assertEqual(hamming_distance(simhash(text), simhash(text.upper())), 0)
+        self.assertGreater(hamming_distance(simhash(text), simhash('new wound on left heel')), 8)
+
+    def test_bulk_upsert_dedupes_within_batch_and_against_live_rows(self):
+        existing, _ = upsert_insight(**insight_fields(self.patient))
+        results = bulk_upsert_insights([
+            insight_fields(self.patient, confidence_score=0.7),
+            insight_fields(self.patient, title='Medication gap', description='No statin on file.'),
+            insight_fields(self.patient, title='Medication gap', description='No statin on file.'),
+        ])
+        self.assertEqual([created for _, created in results], [False, True, False])
+        self.assertEqual(results[0][0].pk, existing.pk)
+        self.assertIs(results[2][0], results[1][0])
+        self.assertEqual(AIInsight.objects.count(), 2)
+        existing.refresh_from_db()
+        self.assertEqual(existing.confidence_score, 0.7)
+
+    def test_sweep_expires_and_archives(self):
+        now = timezone.now()
+        expired, _ = upsert_insight(**insight_fields(self.patient, expires_at=now - datetime.timedelta(hours=1)))
+        closed, _ = upsert_insight(**insight_fields(self.patient, title='Old', description='Resolved issue',
+                                                    status='resolved'))
+        live, _ = upsert_insight(**insight_fields(self.patient, title='Open', description='Needs follow up'))
+        AIInsight.objects.filter(pk=closed.pk).update(updated_at=now - datetime.timedelta(days=30))
+
+        self.assertEqual(sweep_insights(batch_size=1), {'expired': 1, 'archived': 1})
+        self.assertEqual(set(AIInsight.objects.filter(is_active=True).values_list('pk', flat=True)), {live.pk})
+        self.assertIsNotNone(AIInsight.objects.get(pk=expired.pk).archived_at)
+        # A deactivated fingerprint no longer blocks new insights with the same content
+        _, created = upsert_insight(**insight_fields(self.patient))
+        self.assertTrue(created)
+
+
+class InsightCounterTests(TestCase):
+    def setUp(self):
+        self.patient = make_patient(make_user())
+
+    def assert_counters_match_rebuild(self):
+        incremental = {None: read_counters(), self.patient.id: read_counters(self.patient.id)}
+        rebuild_counters()
+        for patient_id, values in incremental.items():
+            rebuilt = read_counters(patient_id) or {}
+            self.assertEqual({k: v for k, v in (values or {}).items() if v},
+                             {k: v for k, v in rebuilt.items() if v})
+
+    def test_counters_follow_saves_deletes_and_sweeps(self):
+        insight, _ = upsert_insight(**insight_fields(self.patient, risk_level='critical'))
+        upsert_insight(**insight_fields(self.patient, title='Gap', description='Missed lab', insight_type='care_gap'))
+        self.assertEqual(read_counters(self.patient.id)['total'], 2)
+        self.assertEqual(read_counters(self.patient.id)['critical'], 1)
+
+        insight.status = 'reviewed'
+        insight.save()
+        self.assertEqual(read_counters(self.patient.id)['status:reviewed'], 1)
+        self.assertEqual(read_counters(self.patient.id)['status:new'], 1)
+        self.assert_counters_match_rebuild()
+
+        bulk_upsert_insights([insight_fields(self.patient, title='New', description='Bulk row')])
+        AIInsight.objects.filter(title='Gap').update(expires_at=timezone.now() - datetime.timedelta(days=1))
+        sweep_insights()
+        insight.delete()
+        self.assertEqual(read_counters(self.patient.id)['total'], 1)
+        self.assert_counters_match_rebuild()
+
+
+class PatientDeletionCounterTests(TransactionTestCase):
+    def test_deleting_patient_with_insights_commits(self):
+        user = make_user()
+        patient, other = make_patient(user), make_patient(user, 'M2')
+        upsert_insight(**insight_fields(patient, risk_level='critical'))
+        upsert_insight(**insight_fields(other))
+
+        patient_id = patient.id
+        patient.delete()
+        self.assertEqual(read_counters()['total'], 1)
+        self.assertEqual(read_counters()['critical'], 0)
+        self.assertIsNone(read_counters(patient_id))
+
+
+DAYS = [datetime.datetime(2026, 1, 1) + datetime.timedelta(days=i) for i in range(12)]
+
+
+class TrendEngineTests(SimpleTestCase):
+    def test_direction_follows_metric_polarity(self):
+        results = analyze_series_batch({
+            (1, 'pain_level'): (DAYS, [8 - 0.5 * i + (0.1 if i % 2 else 0) for i in range(12)]),
+            (1, 'systolic_bp'): (DAYS, [120 + 2 * i for i in range(12)]),
+            (1, 'gait_speed'): (DAYS, [0.8 + 0.02 * i for i in range(12)]),
+        })
+        self.assertEqual(results[(1, 'pain_level')].direction, 'improving')
+        self.assertEqual(results[(1, 'systolic_bp')].direction, 'declining')
+        self.assertEqual(results[(1, 'gait_speed')].direction, 'improving')
+        self.assertGreater(results[(1, 'pain_level')].strength, 0.99)
+
+    def test_short_or_flat_series_stay_stable(self):
+        results = analyze_series_batch({
+            'pain_level': (DAYS[:2], [9, 2]),
+            'heart_rate': (DAYS, [72, 73] * 6),
+        })
+        self.assertEqual((results['pain_level'].direction, results['pain_level'].p_value), ('stable', 1.0))
+        self.assertEqual(results['heart_rate'].direction, 'stable')
+        self.assertFalse(results['heart_rate'].is_significant)
+
+    def test_change_point_and_anomalies(self):
+        results = analyze_series_batch({
+            'step': (DAYS, [70] * 6 + [90] * 6),
+            'spike': (DAYS, [70, 71] * 5 + [70, 120]),
+        })
+        self.assertEqual(results['step'].change_point, 6)
+        self.assertAlmostEqual(results['step'].change_point_shift, 20.0)
+        self.assertEqual(results['spike'].anomalies, [11])
+
+    def test_vital_sign_values(self):
+        self.assertEqual(
+            vital_sign_values({'Blood Pressure': '128/84', 'Heart Rate': '72 bpm', 'O2': True, 'notes': 'n/a'}),
+            {'systolic_bp': 128.0, 'diastolic_bp': 84.0, 'heart_rate': 72.0}
+        )
+
+    def test_cap_points_folds_overflow_into_archive(self):
+        config = {'RAW_POINTS': 10, 'ARCHIVE_CHUNK': 4, 'ARCHIVE_BUCKETS': 2}
+        points = [{'timestamp': i, 'value': float(i)} for i in range(22)]
+        raw, archive = cap_points(points, [], config)
+        self.assertEqual([point['value'] for point in raw], list(range(12, 22)))
+        # Three chunks of four overflowed; the archive was halved to stay within two buckets
+        self.assertEqual(len(archive), 2)
+        self.assertEqual(sum(bucket['n'] for bucket in archive), 12)
+        self.assertEqual((archive[0]['min'], archive[-1]['max']), (0, 11))
+
+
+class RunningTrendStatsTests(TestCase):
+    VALUES = [8 - 0.5 * i + (0.3 if i % 3 else -0.2) for i in range(12)]
+
+    def test_running_stats_match_batch(self):
+        batch = analyze_series_batch({'pain_level': (DAYS, self.VALUES)})['pain_level']
+        points = [{'timestamp': day.isoformat(), 'value': value} for day, value in zip(DAYS, self.VALUES)]
+        running = RunningTrendStats.from_points(points).result('pain_level')
+        for name in ('n', 'slope_per_day', 'r_squared', 'p_value', 'relative_change', 'ewma', 'mean'):
+            self.assertAlmostEqual(getattr(running, name), getattr(batch, name), places=6, msg=name)
+        self.assertEqual((running.direction, running.strength), (batch.direction, batch.strength))
+
+    def test_record_observations_updates_incrementally(self):
+        patient = make_patient(make_user())
+        record_observations([(patient.id, 'pain_level', day, value) for day, value in zip(DAYS[:6], self.VALUES)])
+        record_observations([(patient.id, 'pain_level', day, value) for day, value in zip(DAYS[6:], self.VALUES[6:])])
+        trend = PatientTrend.objects.get(patient=patient, metric_name='pain_level')
+        self.assertEqual((trend.running_stats['n'], len(trend.data_points)), (12, 12))
+        self.assertEqual(trend.trend_direction, 'improving')
+
+    def test_legacy_trend_without_running_stats_is_seeded(self):
+        patient = make_patient(make_user())
+        PatientTrend.objects.create(
+            patient=patient, metric_name='pain_level', metric_category='pain_levels', trend_direction='improving',
+            trend_strength=0.99, ai_interpretation='', clinical_significance='low',
+            data_points=[{'timestamp': day.isoformat(), 'value': value} for day, value in zip(DAYS[:11], self.VALUES)],
+        )
+        result = record_observations([(patient.id, 'pain_level', DAYS[11], self.VALUES[11])])[(patient.id, 'pain_level')]
+        self.assertEqual(result.n, 12)
+        trend = PatientTrend.objects.get(patient=patient, metric_name='pain_level')
+        self.assertEqual(trend.trend_direction, 'improving')
+        self.assertGreater(trend.trend_strength, 0.9)
+
+    def test_remove_undoes_add(self):
+        points = [{'timestamp': day.isoformat(), 'value': value} for day, value in zip(DAYS, self.VALUES)]
+        stats = RunningTrendStats.from_points(points)
+        stats.remove(points[4]['timestamp'], points[4]['value'])
+        expected = RunningTrendStats.from_points(points[:4] + points[5:])
+        for name in ('n', 'mean_t', 'mean_y', 'm2_t', 'm2_y', 'co_moment'):
+            self.assertAlmostEqual(getattr(stats, name), getattr(expected, name), places=6, msg=name)
+
+
+class VisitVitalsTrendTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.patient = make_patient(self.user)
+        self.visits = [
+            Visit.objects.create(patient=self.patient, clinician=self.user, visit_type='SN', scheduled_date=day,
+                                 vital_signs={'heart_rate': 80 + 2 * index, 'blood_pressure': '120/80'})
+            for index, day in enumerate(timezone.make_aware(day) for day in DAYS[:6])
+        ]
+
+    def trend(self, metric='heart_rate'):
+        return PatientTrend.objects.get(patient=self.patient, metric_name=metric)
+
+    def assert_matches_points(self, trend):
+        expected = RunningTrendStats.from_points(trend.data_points)
+        for name in ('n', 'mean_y', 'm2_y', 'co_moment', 'ewma'):
+            self.assertAlmostEqual(trend.running_stats[name], getattr(expected, name), places=6, msg=name)
+
+    def test_new_visits_are_recorded(self):
+        trend = self.trend()
+        self.assertEqual([point['value'] for point in trend.data_points], [80, 82, 84, 86, 88, 90])
+        self.assertEqual(trend.data_points[0]['visit_id'], self.visits[0].pk)
+        self.assertEqual(self.trend('systolic_bp').running_stats['n'], 6)
+
+    def test_edit_replaces_the_visit_value(self):
+        visit = Visit.objects.get(pk=self.visits[2].pk)
+        visit.vital_signs = {'heart_rate': 120, 'blood_pressure': '120/80'}
+        visit.save()
+        trend = self.trend()
+        self.assertEqual([point['value'] for point in trend.data_points], [80, 82, 120, 86, 88, 90])
+        self.assert_matches_points(trend)
+        # Unchanged metrics are not touched
+        self.assertEqual(self.trend('systolic_bp').running_stats['n'], 6)
+
+        # Saving again without changes records nothing
+        visit.save()
+        self.assertEqual(self.trend().running_stats['n'], 6)
+
+    def test_removed_and_moved_values(self):
+        visit = Visit.objects.get(pk=self.visits[1].pk)
+        visit.vital_signs = {'blood_pressure': '120/80'}
+        visit.save()
+        trend = self.trend()
+        self.assertEqual([point['value'] for point in trend.data_points], [80, 84, 86, 88, 90])
+        self.assert_matches_points(trend)
+
+        visit = Visit.objects.get(pk=self.visits[0].pk)
+        visit.scheduled_date = timezone.make_aware(DAYS[10])
+        visit.save()
+        trend = self.trend()
+        self.assertEqual([point['value'] for point in trend.data_points], [84, 86, 88, 90, 80])
+        self.assert_matches_points(trend)
+
+    @override_settings(HEALTHCARE_AI_CONFIG={'TREND_ANALYSIS': {'RAW_POINTS': 3, 'ARCHIVE_CHUNK': 2}})
+    def test_archived_value_is_left_for_the_full_recompute(self):
+        Visit.objects.create(patient=self.patient, clinician=self.user, visit_type='SN',
+                             scheduled_date=timezone.make_aware(DAYS[6]), vital_signs={'heart_rate': 92})
+        visit = Visit.objects.get(pk=self.visits[0].pk)
+        visit.vital_signs = {'heart_rate': 150}
+        visit.save()
+        trend = self.trend()
+        self.assertEqual(trend.running_stats['n'], 7)
+        self.assertNotIn(150, [point['value'] for point in trend.data_points])
+
+
+class RiskTriageTests(SimpleTestCase):
+    def test_oasis_labels_are_scored(self):
+        decision = triage_fall_risk({
+            'age': 70,
+            'functional_status': {'ambulation': 'Unable', 'transferring': 'Unable', 'grooming': 'Able'},
+            'cognitive_status': 'Unable to care',
+        })
+        self.assertEqual(set(decision.points), {'age', 'mobility', 'cognition'})
+        self.assertEqual(decision.path, 'llm')
+
+    def test_independent_patient_is_answered_by_rules(self):
+        decision = triage_fall_risk({
+            'age': 60, 'functional_status': {'ambulation': 'Able'}, 'cognitive_status': 'Alert/oriented',
+        })
+        self.assertEqual((decision.path, decision.protective_factors),
+                         ('rules_low', ['Age under 65', 'Independent mobility']))
+
+    def test_independent_phrasing_is_not_impairment(self):
+        for status in ('Ambulates independently, no assistive device, steady gait', 'Independent with transfers',
+                       'Ambulatory without walker or cane', {'ambulation': 'Able', 'transferring': 'Able'}):
+            with self.subTest(status=status):
+                self.assertEqual(mobility_status(status), 'independent')
+                decision = triage_fall_risk({'age': 60, 'functional_status': status, 'cognitive_status': 'Alert'})
+                self.assertNotIn('mobility', decision.points)
+                self.assertIn('Independent mobility', decision.protective_factors)
+                readmission = triage_readmission_risk({'age': 60, 'functional_status': status}, [])
+                self.assertNotIn('functional_status', readmission.points)
+        # Neutral wording is not evidence either way
+        self.assertIsNone(mobility_status('not limited'))
+        self.assertIsNone(mobility_status('gait and transfers assessed'))
+
+    def test_impaired_phrasing(self):
+        for status in ('Uses a walker, unsteady gait', 'Not able to transfer', 'Requires assistance with transfers',
+                       'Independent in room, wheelchair for distances', {'ambulation': 'Unable', 'grooming': 'Able'}):
+            with self.subTest(status=status):
+                self.assertEqual(mobility_status(status), 'impaired')
+
+    def test_unrecognized_status_escalates(self):
+        decision = triage_fall_risk({
+            'age': 60, 'functional_status': 'see attached PT note', 'cognitive_status': 'Pending evaluation',
+        })
+        self.assertEqual(decision.missing_inputs, ['functional_status', 'cognitive_status'])
+        self.assertEqual(decision.path, 'llm')
+
+    def test_high_risk_is_answered_by_rules(self):
+        decision = triage_fall_risk({
+            'age': 88, 'history': {'falls': ['2026-01-02', '2026-02-10']},
+            'functional_status': 'Uses a walker, unsteady gait', 'conditions': ['Dementia'],
+        })
+        self.assertEqual(decision.path, 'rules_high')
+        self.assertEqual(decision.to_dict()['risk_category'], 'critical')
+
+    def test_readmission_counts_admissions_and_diagnoses(self):
+        decision = triage_readmission_risk(
+            {'age': 82, 'primary_diagnosis': 'CHF exacerbation', 'functional_status': {'ambulation': 'Assistance'}},
+            recent_admissions=[{}, {}]
+        )
+        self.assertEqual(set(decision.points), {'prior_admissions', 'age', 'diagnoses', 'functional_status'})
+        self.assertEqual(decision.path, 'rules_high')
+        self.assertEqual(triage_readmission_risk({'age': 50}, []).missing_inputs, ['diagnoses'])
+
+
+class RiskAssessmentViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user()
+        self.patient = make_patient(self.user, date_of_birth=datetime.date(1940, 1, 1),
+                                    primary_diagnosis='CHF exacerbation', secondary_diagnoses='Dementia',
+                                    medications='Ativan, Ambien')
+        OasisAssessment.objects.create(
+            patient=self.patient, clinician=self.user, assessment_type='SOC', assessment_date=datetime.date.today(),
+            gender='F', primary_diagnosis='CHF', ambulation=3, transferring=3, cognitive_functioning=4,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        patcher = mock.patch.object(audit_log_writer, 'submit')
+        self.submit = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assess(self, **data):
+        return self.client.post('/api/v1/ai/risks/assess/', {'patient_id': self.patient.id, **data}, format='json')
+
+    def test_predictions_are_stored_in_one_insert(self):
+        with mock.patch.object(risk_assessment_engine, '_complete_structured') as complete, \
+                mock.patch.object(RiskPrediction.objects, 'bulk_create',
+                                  wraps=RiskPrediction.objects.bulk_create) as bulk_create:
+            response = self.assess(recent_admissions=[{'date': '2026-01-02'}, {'date': '2026-02-10'}])
+
+        self.assertEqual(response.status_code, 200)
+        # Both risks are clear-cut, so the rules answer without a model call
+        complete.assert_not_called()
+        self.assertEqual(self.submit.call_count, 2)
+        bulk_create.assert_called_once()
+        stored = RiskPrediction.objects.filter(patient=self.patient)
+        self.assertEqual(sorted(stored.values_list('risk_type', flat=True)), ['fall_risk', 'readmission_risk'])
+        self.assertEqual(sorted(p['risk_type'] for p in response.data['risk_predictions']),
+                         ['fall_risk', 'readmission_risk'])
+        self.assertEqual(response.data['overall_risk_score'], max(stored.values_list('risk_score', flat=True)))
+        self.assertEqual(sorted(response.data['critical_risks']), ['fall_risk', 'readmission_risk'])
+        self.assertTrue(response.data['recommended_interventions'])
+
+    def test_unsupported_risk_type_is_rejected(self):
+        response = self.assess(risk_types=['fall_risk', 'infection_risk'])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('infection_risk', response.data['risk_types'][0])
+        self.assertFalse(RiskPrediction.objects.exists())
+
+    def test_unassigned_patient_is_not_found_for_physician(self):
+        self.client.force_authenticate(make_user('physician', role='physician'))
+        self.assertEqual(self.assess().status_code, 404)
+
+
+class StructuredOutputTests(SimpleTestCase):
+    SCHEMA = OUTPUT_SCHEMAS['fall_risk']
+
+    def test_repairs_fences_prose_and_trailing_commas(self):
+        self.assertEqual(repair_json('{"a": 1}'), ({'a': 1}, False))
+        self.assertEqual(repair_json('```json\n{"a": [1, 2,],}\n```'), ({'a': [1, 2]}, True))
+        self.assertEqual(repair_json('Here is the result: {"a": 1} Hope this helps.'), ({'a': 1}, True))
+        self.assertEqual(repair_json('no json here'), (None, False))
+
+    def test_coerces_harmless_mismatches(self):
+        parsed = parse_output(
+            '{"risk_score": "45%", "risk_category": "High", "contributing_factors": "Recent fall",'
+            ' "recommendations": []}', self.SCHEMA)
+        self.assertTrue(parsed.valid)
+        self.assertEqual((parsed.data['risk_score'], parsed.data['risk_category']), (0.45, 'high'))
+        self.assertEqual(parsed.data['contributing_factors'], ['Recent fall'])
+
+    def test_reports_schema_errors(self):
+        parsed = parse_output('{"risk_score": 3, "risk_category": "severe"}', self.SCHEMA)
+        self.assertFalse(parsed.valid)
+        self.assertIn('$.risk_score: above maximum 1', parsed.errors)
+        self.assertIn('$.contributing_factors: required', parsed.errors)
+        self.assertTrue(any(error.startswith('$.risk_category: must be one of') for error in parsed.errors))
+        self.assertEqual(parse_output('nope', self.SCHEMA).errors, ['$: reply is not valid JSON'])
+
+
+class ProcessInsightsTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.patient = make_patient(self.user)
+
+    def process(self, parsed, insight_types=()):
+        response = AIResponse(True, 'raw reply', 0.8, 'test-model', parsed=parsed)
+        return GenerateInsightsView()._process_ai_insights(self.patient, response, self.user, list(insight_types))
+
+    def test_filter_keeps_matching_structured_insights(self):
+        insights = self.process({'summary': 'ok', 'insights': [
+            {'insight_type': 'care_gap', 'title': 'Missing A1c', 'description': 'No A1c this year',
+             'risk_level': 'moderate'},
+            {'insight_type': 'risk_assessment', 'title': 'Fall risk', 'description': 'Two falls',
+             'risk_level': 'high'},
+        ]}, insight_types=['care_gap'])
+        self.assertEqual([insight.title for insight in insights], ['Missing A1c'])
+
+    def test_filter_removing_every_insight_writes_nothing(self):
+        insights = self.process({'summary': 'ok', 'insights': [
+            {'insight_type': 'risk_assessment', 'title': 'Fall risk', 'description': 'Two falls',
+             'risk_level': 'high'},
+        ]}, insight_types=['care_gap'])
+        self.assertEqual(insights, [])
+        self.assertFalse(AIInsight.objects.exists())
+
+    def test_unstructured_reply_becomes_one_general_insight(self):
+        insights = self.process(None)
+        self.assertEqual([(insight.title, insight.description) for insight in insights],
+                         [('AI-Generated Patient Analysis', 'raw reply')])
+
+
+class MedicationLexiconTests(TestCase):
+    LEXICON = {
+        'classes': {
+            'insulin': {'high_alert': True, 'terms': ['insulin']},
+            'benzodiazepine': {'fall_risk': True, 'terms': ['benzo']},
+        },
+        'drugs': {
+            'insulin glargine': {'classes': ['insulin'], 'brands': ['lantus']},
+            'lorazepam': {'classes': ['benzodiazepine'], 'brands': ['ativan']},
+        },
+    }
+
+    def test_aho_corasick_finds_overlapping_keys(self):
+        automaton = AhoCorasick({'he': 1, 'she': 2, 'hers': 3, 'his': 4})
+        self.assertEqual(sorted(automaton.iter('ushers')), [(1, 4, 2), (2, 4, 1), (2, 6, 3)])
+
+    def test_longest_whole_word_match_wins(self):
+        lexicon = MedicationLexicon(self.LEXICON)
+        matches = lexicon.find('Insulin glargine 10u qHS, Ativan prn; benzos avoided')
+        self.assertEqual([(match.term, match.drug) for match in matches],
+                         [('insulin glargine', 'insulin glargine'), ('ativan', 'lorazepam')])
+        self.assertEqual(lexicon.classify('insulin and lantus'), {'insulin': ['insulin', 'insulin glargine']})
+        self.assertEqual(lexicon.drugs('insulin and lantus'), ['insulin glargine'])
+
+    def test_risk_flags(self):
+        lexicon = MedicationLexicon(self.LEXICON)
+        self.assertEqual([m.drug for m in lexicon.fall_risk_matches('lorazepam, lantus')], ['lorazepam'])
+        self.assertEqual([m.drug for m in lexicon.high_alert_matches('lorazepam, lantus')], ['insulin glargine'])
+
+    def test_unknown_class_is_rejected(self):
+        with self.assertRaises(ValueError):
+            MedicationLexicon({'classes': {}, 'drugs': {'x': {'classes': ['missing']}}})
+
+    def test_shipped_lexicon_and_cohort_scan(self):
+        self.assertEqual(get_lexicon().drugs('Coumadin 5mg, Percocet, metformin'), ['warfarin', 'oxycodone', 'metformin'])
+        user = make_user()
+        patient = make_patient(user, medications='Ambien 5mg at bedtime')
+        make_patient(user, 'M2', medications='vitamin D')
+        self.assertEqual(scan_patient_medications(), {patient.id: {'sedative_hypnotic': ['zolpidem']}})
+
+
+class DrugInteractionTests(TestCase):
+    TABLE = {'interactions': [
+        {'drugs': ['class:insulin', 'class:benzodiazepine'], 'severity': 'minor',
+         'effect': 'Masks hypoglycemia', 'management': 'Monitor glucose'},
+        {'drugs': ['insulin glargine', 'lorazepam'], 'severity': 'major',
+         'effect': 'Overlapping row', 'management': 'Review'},
+    ]}
+
+    def test_class_rows_expand_and_most_severe_row_wins(self):
+        index = InteractionIndex(self.TABLE, MedicationLexicon(MedicationLexiconTests.LEXICON))
+        self.assertEqual(len(index), 1)
+        hits = index.check(['Lantus 10 units', {'name': 'Ativan'}])
+        self.assertEqual([(hit.drug_a, hit.drug_b, hit.interaction.severity) for hit in hits],
+                         [('insulin glargine', 'lorazepam', 'major')])
+        self.assertEqual(index.check('lantus', 'minor'), [])
+
+    def test_severity_floor_and_unknown_references(self):
+        table = {'interactions': self.TABLE['interactions'][:1]}
+        index = InteractionIndex(table, MedicationLexicon(MedicationLexiconTests.LEXICON))
+        self.assertEqual(index.check('lantus, ativan', 'moderate'), [])
+        with self.assertRaises(ValueError):
+            InteractionIndex({'interactions': [dict(table['interactions'][0], drugs=['class:nsaid', 'lorazepam'])]},
+                             MedicationLexicon(MedicationLexiconTests.LEXICON))
+
+    def test_open_support_rows_are_not_duplicated(self):
+        user = make_user()
+        patient = make_patient(user, medications='Ativan 1mg, Percocet 5/325')
+        self.assertEqual(check_patient(patient.id, patient.medications)[0].interaction.severity, 'major')
+        check_patient(patient.id, patient.medications)
+        self.assertEqual(ClinicalDecisionSupport.objects.filter(patient=patient).count(), 1)
+
+        make_patient(user, 'M2', medications='Ambien, oxycodone')
+        make_patient(user, 'M3', medications='metformin')
+        stats = screen_patients()
+        self.assertEqual((stats['patients'], stats['patients_with_interactions'], stats['created']), (3, 2, 1))
+
+
+class ClinicalNERTests(SimpleTestCase):
+    NOTE = 'Pt with CHF. Metoprolol 25 mg BID\nBP 142/88, HR 104, temp 38.2, SpO2 91%, pain 6/10'
+
+    def test_measurements(self):
+        vitals = {entity['normalized']: (entity['value'], entity['unit'])
+                  for entity in measurement_entities(self.NOTE) if entity['label'] == 'vital'}
+        self.assertEqual(vitals, {
+            'blood_pressure 142/88': (142.0, 'mmHg'), 'heart_rate': (104.0, 'bpm'), 'temperature': (38.2, 'C'),
+            'oxygen_saturation': (91.0, '%'), 'pain': (6.0, '/10'),
+        })
+        doses = [entity['normalized'] for entity in measurement_entities(self.NOTE) if entity['label'] == 'dose']
+        self.assertEqual(doses, ['25 mg'])
+        self.assertEqual(measurement_entities('HR 400, BP 20/10'), [])
+
+    def test_doc_entities_shape_clinical_data(self):
+        def span(label, text, ent_id=''):
+            start = self.NOTE.index(text)
+            return SimpleNamespace(label_=label, text=text, ent_id_=ent_id, start_char=start, end_char=start + len(text))
+
+        doc = SimpleNamespace(text=self.NOTE, ents=[
+            span('PROBLEM', 'CHF', 'heart failure'), span('MEDICATION', 'Metoprolol', 'metoprolol'),
+            span('CHEMICAL', 'SpO2'), span('PERSON', 'Pt'),
+        ])
+        entities = entities_from_doc(doc, {'CHEMICAL': 'medication'})
+        self.assertNotIn('Pt', [entity['text'] for entity in entities])
+        data = to_clinical_data(self.NOTE, entities)
+        self.assertEqual(data['diagnoses'], ['heart failure'])
+        self.assertEqual(data['medications'][0], {'name': 'metoprolol', 'dose': '25 mg', 'frequency': 'bid'})
+        self.assertEqual(data['vital_signs']['blood_pressure'], '142/88')
+
+    @skipUnless(importlib.util.find_spec('spacy'), 'spaCy is not installed')
+    def test_pipeline_finds_lexicon_terms(self):
+        entities, = extract_entities(['Started warfarin for afib'])
+        self.assertEqual({(entity['label'], entity['normalized']) for entity in entities
+                          if entity['label'] in ('medication', 'problem')},
+                         {('medication', 'warfarin'), ('problem', 'atrial fibrillation')})
+
+
+class FakePool:
+    """In-process stand-in for the NER ProcessPoolExecutor"""
+    created = 0
+
+    def __init__(self, **kwargs):
+        FakePool.created += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def map(self, fn, *iterables):
+        nlp = SimpleNamespace(pipe=lambda texts, batch_size: (SimpleNamespace(text=text, ents=[]) for text in texts))
+        return [fn(*args, nlp=nlp) for args in zip(*iterables)]
+
+
+class ClinicalNERSyncTests(TestCase):
+    def setUp(self):
+        user = make_user()
+        visit = Visit.objects.create(patient=make_patient(user), clinician=user, visit_type='SN',
+                                     status='completed', scheduled_date=timezone.now())
+        for heart_rate in (80, 90, 100, 110):
+            VisitNote.objects.create(visit=visit, note_type='unstructured', title='Note',
+                                     content=f'HR {heart_rate}', created_by=user)
+        FakePool.created = 0
+
+    @override_settings(HEALTHCARE_AI_CONFIG={'MEDICAL_NER': {'N_PROCESS': 2, 'BATCH_SIZE': 1, 'SYNC_BATCH_SIZE': 2}})
+    def test_sync_reuses_one_worker_pool(self):
+        with mock.patch('ai_insights.clinical_ner.ProcessPoolExecutor', FakePool):
+            stats = clinical_ner_service.sync()
+        self.assertEqual(FakePool.created, 1)
+        self.assertEqual((stats['documents'], stats['entities']), (4, 4))
+        self.assertEqual(ClinicalEntity.objects.filter(label='vital').count(), 4)
+
+
+class PatientContextTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user()
+        self.patient = make_patient(self.user, date_of_birth=datetime.date(1956, 1, 1),
+                                    secondary_diagnoses='COPD; diabetes', medications='Ativan, Lantus')
+
+    def add_visit(self, days_ago=1, note='Ambulating with walker'):
+        visit = Visit.objects.create(
+            patient=self.patient, clinician=self.user, visit_type='SN', status='completed',
+            scheduled_date=timezone.now() - datetime.timedelta(days=days_ago), vital_signs={'heart_rate': 88},
+        )
+        VisitNote.objects.create(visit=visit, note_type='unstructured', title='Note', content=note,
+                                 created_by=self.user)
+        return visit
+
+    def test_context_contents(self):
+        self.add_visit()
+        OasisAssessment.objects.create(
+            patient=self.patient, clinician=self.user, assessment_type='SOC', assessment_date=datetime.date.today(),
+            gender='F', primary_diagnosis='CHF', ambulation=3, transferring=3, cognitive_functioning=4,
+        )
+        upsert_insight(**insight_fields(self.patient))
+
+        context = assemble_patient_context(self.patient.id)
+        self.assertEqual(context['conditions'], ['CHF', 'COPD', 'diabetes'])
+        self.assertEqual(context['medications'], ['Ativan', 'Lantus'])
+        self.assertEqual(context['functional_status'], {'transferring': 'Unable', 'ambulation': 'Unable'})
+        self.assertEqual(context['cognitive_status'], 'Unable to care')
+        self.assertEqual(context['recent_visits'][0]['notes'][0]['content'], 'Ambulating with walker')
+        self.assertEqual([insight['title'] for insight in context['open_insights']], ['Fall risk'])
+        # The OASIS labels reach the triage rules and are scored there
+        self.assertLessEqual({'mobility', 'cognition'}, set(triage_fall_risk(context).points))
+        self.assertIsNone(assemble_patient_context(0))
+
+    def test_cached_until_an_input_changes(self):
+        self.add_visit()
+        first = assemble_patient_context(self.patient.id)
+        with self.assertNumQueries(1):
+            self.assertEqual(assemble_patient_context(self.patient.id), first)
+        self.add_visit(note='Short of breath')
+        notes = [note['content'] for visit in assemble_patient_context(self.patient.id)['recent_visits']
+                 for note in visit['notes']]
+        self.assertIn('Short of breath', notes)
+
+    def test_query_count_does_not_grow_with_history(self):
+        self.add_visit()
+        with self.assertNumQueries(7):
+            assemble_patient_context(self.patient.id)
+        for days_ago in range(2, 6):
+            self.add_visit(days_ago)
+        cache.clear()
+        with self.assertNumQueries(7):
+            assemble_patient_context(self.patient.id)
@@ -0,0 +1,651 @@
+"""
+Vectorized trend analytics
+Batched NumPy statistics for many patient/metric series at once:
+- Least-squares slope with a t-test p-value (confidence = 1 - p)
+- EWMA level
+- Rolling z-score anomalies against the preceding window
+- Single mean-shift change point
+- Direction/strength classification, significance-gated so the LLM only
+  interprets trends that are statistically real
+- Vital-sign series collection for many patients in one query
+- Running sufficient statistics so new observations update a stored trend
+  in O(1), with raw points capped and older ones folded into an archive;
+  raw points carry their visit id, so an edited visit replaces its earlier
+  values instead of adding to them
+"""
+
+import math
+import re
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+
+SECONDS_PER_DAY = 86400.0
+NUMBER_RE = re.compile(r'-?\d+(?:\.\d+)?')
+BP_RE = re.compile(r'^(\d{2,3})\s*/\s*(\d{2,3})')
+
+# Metrics where a falling value is the clinically good direction
+LOWER_IS_BETTER = {
+    'pain_level', 'pain', 'blood_pressure', 'systolic_bp', 'diastolic_bp',
+    'heart_rate', 'respiratory_rate', 'temperature', 'blood_glucose',
+    'wound_size', 'edema',
+}
+
+# Metric name -> PatientTrend.metric_category
+METRIC_CATEGORIES = {
+    'pain_level': 'pain_levels',
+    'pain': 'pain_levels',
+    'wound_size': 'wound_healing',
+    'blood_glucose': 'lab_values',
+    'inr': 'lab_values',
+    'hemoglobin': 'lab_values',
+    'gait_speed': 'mobility',
+    'tug_seconds': 'mobility',
+    'adl_score': 'functional_status',
+    'mmse': 'cognitive_status',
+    'medication_adherence': 'medication_adherence',
+}
+
+
+def _trend_config() -> Dict:
+    config = {
+        'SIGNIFICANCE_LEVEL': 0.05,
+        'MIN_POINTS': 3,
+        'MIN_RELATIVE_CHANGE': 0.05,
+        'EWMA_ALPHA': 0.3,
+        'ZSCORE_WINDOW': 7,
+        'ZSCORE_THRESHOLD': 3.0,
+        'CHANGE_POINT_MIN_SEGMENT': 3,
+        'CHANGE_POINT_MIN_EXPLAINED': 0.5,
+        'RAW_POINTS': 200,
+        'ARCHIVE_CHUNK': 20,
+        'ARCHIVE_BUCKETS': 100,
+    }
+    config.update(getattr(settings, 'HEALTHCARE_AI_CONFIG', {}).get('TREND_ANALYSIS', {}))
+    return config
+
+
+def metric_category(metric_name: str) -> str:
+    return METRIC_CATEGORIES.get(metric_name, 'vital_signs')
+
+
+def to_days(timestamp) -> float:
+    """Timestamp (datetime, date, ISO string or epoch seconds) as fractional days"""
+    if isinstance(timestamp, str):
+        parsed = parse_datetime(timestamp)
+        if parsed is None:
+            parsed = datetime.fromisoformat(timestamp)
+        timestamp = parsed
+    if isinstance(timestamp, datetime):
+        return timestamp.timestamp() / SECONDS_PER_DAY
+    if isinstance(timestamp, date):
+        return datetime(timestamp.year, timestamp.month, timestamp.day).timestamp() / SECONDS_PER_DAY
+    return float(timestamp) / SECONDS_PER_DAY
+
+
+@dataclass
+class TrendResult:
+    """Statistics for one series"""
+    n: int
+    slope_per_day: float
+    r_squared: float
+    p_value: float
+    relative_change: float
+    ewma: Optional[float]
+    mean: float
+    anomalies: List[int] = field(default_factory=list)
+    change_point: Optional[int] = None
+    change_point_shift: float = 0.0
+    direction: str = 'stable'
+    strength: float = 0.0
+    is_significant: bool = False
+
+    @property
+    def confidence(self) -> float:
+        return 1.0 - self.p_value
+
+    def to_dict(self) -> Dict:
+        return {
+            'data_points_count': self.n,
+            'slope_per_day': round(self.slope_per_day, 6),
+            'r_squared': round(self.r_squared, 4),
+            'p_value': round(self.p_value, 6),
+            'confidence': round(self.confidence, 4),
+            'relative_change': round(self.relative_change, 4),
+            'ewma': None if self.ewma is None else round(self.ewma, 4),
+            'mean': round(self.mean, 4),
+            'anomalies': self.anomalies,
+            'change_point': self.change_point,
+            'change_point_shift': round(self.change_point_shift, 4),
+            'trend_direction': self.direction,
+            'trend_strength': round(self.strength, 4),
+            'is_significant': self.is_significant,
+        }
+
+
+def _betacf(a: np.ndarray, b: np.ndarray, x: np.ndarray, iterations: int = 200) -> np.ndarray:
+    """Continued fraction for the incomplete beta function (modified Lentz), vectorized"""
+    tiny = 1e-300
+    qab, qap, qam = a + b, a + 1.0, a - 1.0
+    c = np.ones_like(x)
+    d = 1.0 - qab * x / qap
+    d = np.where(np.abs(d) < tiny, tiny, d)
+    d = 1.0 / d
+    h = d.copy()
+    for m in range(1, iterations + 1):
+        m2 = 2 * m
+        aa = m * (b - m) * x / ((qam + m2) * (a + m2))
+        d = 1.0 + aa * d
+        d = np.where(np.abs(d) < tiny, tiny, d)
+        c = 1.0 + aa / c
+        c = np.where(np.abs(c) < tiny, tiny, c)
+        d = 1.0 / d
+        h *= d * c
+        aa = -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))
+        d = 1.0 + aa * d
+        d = np.where(np.abs(d) < tiny, tiny, d)
+        c = 1.0 + aa / c
+        c = np.where(np.abs(c) < tiny, tiny, c)
+        d = 1.0 / d
+        delta = d * c
+        h *= delta
+        if np.all(np.abs(delta - 1.0) < 1e-12):
+            break
+    return h
+
+
+def _regularized_beta(a: np.ndarray, b: np.ndarray, x: np.ndarray) -> np.ndarray:
+    lgamma = np.vectorize(math.lgamma, otypes=[float])
+    x = np.clip(x, 0.0, 1.0)
+    safe = np.clip(x, 1e-300, 1 - 1e-16)
+    log_front = lgamma(a + b) - lgamma(a) - lgamma(b) + a * np.log(safe) + b * np.log1p(-safe)
+    front = np.exp(log_front)
+    # Use the symmetry relation where the continued fraction converges faster
+    direct = x < (a + 1.0) / (a + b + 2.0)
+    result = np.where(
+        direct,
+        front * _betacf(a, b, safe) / a,
+        1.0 - front * _betacf(b, a, 1.0 - safe) / b,
+    )
+    return np.where(x <= 0.0, 0.0, np.where(x >= 1.0, 1.0, result))
+
+
+def t_test_p_values(t: np.ndarray, df: np.ndarray) -> np.ndarray:
+    """Two-sided Student-t p-values"""
+    t = np.asarray(t, dtype=np.float64)
+    df = np.asarray(df, dtype=np.float64)
+    p = np.ones_like(t)
+    valid = (df > 0) & np.isfinite(t)
+    if np.any(valid):
+        x = df[valid] / (df[valid] + t[valid] ** 2)
+        p[valid] = _regularized_beta(df[valid] / 2.0, np.full_like(x, 0.5), x)
+    p[np.isinf(t)] = 0.0
+    return np.clip(p, 0.0, 1.0)
+
+
+def _pack(series: Sequence[Tuple[Sequence[float], Sequence[float]]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Right-padded (S, L) day offsets, values and validity mask, each series sorted by time"""
+    length = max((len(values) for _, values in series), default=0)
+    days = np.zeros((len(series), length))
+    values = np.zeros((len(series), length))
+    mask = np.zeros((len(series), length), dtype=bool)
+    for row, (times, vals) in enumerate(series):
+        n = len(vals)
+        if not n:
+            continue
+        t = np.asarray(times, dtype=np.float64)
+        order = np.argsort(t, kind='stable')
+        days[row, :n] = t[order] - t[order[0]]
+        values[row, :n] = np.asarray(vals, dtype=np.float64)[order]
+        mask[row, :n] = True
+    return days, values, mask
+
+
+def _regression(days, values, mask, n):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_mean = np.where(n > 0, (days * mask).sum(axis=1) / n, 0.0)
+        y_mean = np.where(n > 0, (values * mask).sum(axis=1) / n, 0.0)
+        dx = np.where(mask, days - x_mean[:, None], 0.0)
+        dy = np.where(mask, values - y_mean[:, None], 0.0)
+        sxx = (dx * dx).sum(axis=1)
+        sxy = (dx * dy).sum(axis=1)
+        syy = (dy * dy).sum(axis=1)
+
+        slope = np.where(sxx > 0, sxy / sxx, 0.0)
+        r_squared = np.where((sxx > 0) & (syy > 0), sxy ** 2 / (sxx * syy), 0.0)
+        df = n - 2
+        sse = np.maximum(syy - slope * sxy, 0.0)
+        stderr = np.where((df > 0) & (sxx > 0), np.sqrt(sse / np.maximum(df, 1) / sxx), np.nan)
+        t = np.where(stderr > 0, slope / stderr, np.where(slope != 0, np.inf, 0.0))
+    p_value = t_test_p_values(np.where(df > 0, t, 0.0), df)
+    span = np.where(mask, days, 0.0).max(axis=1) if days.size else np.zeros(len(n))
+    return slope, r_squared, p_value, y_mean, syy, span
+
+
+def _ewma(values, mask, alpha):
+    level = np.full(values.shape[0], np.nan)
+    for column in range(values.shape[1]):
+        valid = mask[:, column]
+        current = values[:, column]
+        level = np.where(valid, np.where(np.isnan(level), current, alpha * current + (1 - alpha) * level), level)
+    return level
+
+
+def _rolling_anomalies(values, mask, window, threshold):
+    """|z| of each point against the `window` points before it (series are right-padded)"""
+    filled = np.where(mask, values, 0.0)
+    zeros = np.zeros((values.shape[0], 1))
+    csum = np.concatenate([zeros, np.cumsum(filled, axis=1)], axis=1)
+    csq = np.concatenate([zeros, np.cumsum(filled ** 2, axis=1)], axis=1)
+    index = np.arange(values.shape[1])
+    start = np.maximum(index - window, 0)
+    count = (index - start).astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        total = csum[:, index] - csum[:, start]
+        total_sq = csq[:, index] - csq[:, start]
+        mean = total / count
+        variance = (total_sq - count * mean ** 2) / (count - 1)
+        std = np.sqrt(np.maximum(variance, 0.0))
+        z = (values - mean) / std
+    # Require a reasonably full window and non-degenerate spread
+    eligible = mask & (count >= max(3, window // 2)) & (std > 0)
+    return eligible & (np.abs(z) > threshold)
+
+
+def _change_points(values, mask, n, syy, r_squared, min_segment, min_explained):
+    """
+    Best single mean shift per series: split index, shift size and whether it
+    is detected, i.e. explains enough variance and more than the linear fit does
+    """
+    rows, length = values.shape
+    if length < 2:
+        return np.full(rows, -1), np.zeros(rows), np.zeros(rows, dtype=bool)
+    filled = np.where(mask, values, 0.0)
+    left_sum = np.cumsum(filled, axis=1)[:, :-1]
+    total = filled.sum(axis=1)[:, None]
+    k = np.arange(1, length, dtype=np.float64)[None, :]
+    right_n = n[:, None] - k
+    with np.errstate(divide='ignore', invalid='ignore'):
+        left_mean = left_sum / k
+        right_mean = (total - left_sum) / right_n
+        between = k * right_n / n[:, None] * (left_mean - right_mean) ** 2
+    between = np.where((k >= min_segment) & (right_n >= min_segment), between, -np.inf)
+    best = np.argmax(between, axis=1)
+    best_between = between[np.arange(rows), best]
+    shift = right_mean[np.arange(rows), best] - left_mean[np.arange(rows), best]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        explained = np.where(syy > 0, best_between / syy, 0.0)
+    detected = np.isfinite(best_between) & (explained >= min_explained) & (explained > r_squared)
+    return np.where(detected, best + 1, -1), np.where(detected, shift, 0.0), detected
+
+
+def _metric_of(key: Hashable) -> str:
+    return key[-1] if isinstance(key, tuple) else key
+
+
+def classify_direction(metric: str, n: float, significant: bool, slope: float,
+                       fluctuating: bool, config: Dict) -> str:
+    """improving/declining for significant slopes (by metric polarity), else fluctuating/stable"""
+    if n < config['MIN_POINTS']:
+        return 'stable'
+    if significant:
+        polarity = -1.0 if metric in LOWER_IS_BETTER else 1.0
+        return 'improving' if slope * polarity > 0 else 'declining'
+    return 'fluctuating' if fluctuating else 'stable'
+
+
+def analyze_series_batch(series: Dict[Hashable, Tuple[Sequence, Sequence[float]]]) -> Dict[Hashable, TrendResult]:
+    """
+    Analyze many series in one vectorized pass.
+
+    `series` maps a key (e.g. (patient_id, metric_name)) to (timestamps, values);
+    keys whose last element is a metric name use its clinical polarity.
+    """
+    config = _trend_config()
+    keys = list(series)
+    if not keys:
+        return {}
+
+    packed = [([to_days(t) for t in times], values) for times, values in (series[key] for key in keys)]
+    days, values, mask = _pack(packed)
+    n = mask.sum(axis=1).astype(np.float64)
+
+    slope, r_squared, p_value, mean, syy, span = _regression(days, values, mask, n)
+    ewma = _ewma(values, mask, config['EWMA_ALPHA'])
+    anomalies = _rolling_anomalies(values, mask, config['ZSCORE_WINDOW'], config['ZSCORE_THRESHOLD'])
+    change_at, shift, has_change = _change_points(
+        values, mask, n, syy, r_squared, config['CHANGE_POINT_MIN_SEGMENT'], config['CHANGE_POINT_MIN_EXPLAINED']
+    )
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = np.where(np.abs(mean) > 1e-9, np.abs(mean), np.sqrt(syy / np.maximum(n - 1, 1)))
+        relative_change = np.where(scale > 0, slope * span / scale, 0.0)
+
+    significant = (
+        (n >= config['MIN_POINTS'])
+        & (p_value < config['SIGNIFICANCE_LEVEL'])
+        & (np.abs(relative_change) >= config['MIN_RELATIVE_CHANGE'])
+    )
+
+    results = {}
+    for row, key in enumerate(keys):
+        anomaly_index = np.flatnonzero(anomalies[row]).tolist()
+        direction = classify_direction(
+            _metric_of(key), n[row], bool(significant[row]), slope[row],
+            fluctuating=bool(has_change[row]) or len(anomaly_index) >= 2, config=config
+        )
+        results[key] = TrendResult(
+            n=int(n[row]),
+            slope_per_day=float(slope[row]),
+            r_squared=float(r_squared[row]),
+            p_value=float(p_value[row]),
+            relative_change=float(relative_change[row]),
+            ewma=None if np.isnan(ewma[row]) else float(ewma[row]),
+            mean=float(mean[row]),
+            anomalies=anomaly_index,
+            change_point=int(change_at[row]) if has_change[row] else None,
+            change_point_shift=float(shift[row]),
+            direction=direction,
+            strength=float(math.sqrt(r_squared[row])) if significant[row] else 0.0,
+            is_significant=bool(significant[row]),
+        )
+    return results
+
+
+def _numeric(value) -> Optional[float]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value) if math.isfinite(value) else None
+    if isinstance(value, str):
+        match = NUMBER_RE.search(value)
+        return float(match.group()) if match else None
+    return None
+
+
+def vital_sign_values(vital_signs: Dict) -> Dict[str, float]:
+    """Numeric metrics from a Visit.vital_signs dict ('120/80' blood pressure is split)"""
+    metrics = {}
+    for name, raw in (vital_signs or {}).items():
+        key = str(name).strip().lower().replace(' ', '_')
+        if isinstance(raw, str) and BP_RE.match(raw.strip()):
+            systolic, diastolic = BP_RE.match(raw.strip()).groups()
+            metrics['systolic_bp'] = float(systolic)
+            metrics['diastolic_bp'] = float(diastolic)
+            continue
+        value = _numeric(raw)
+        if value is not None:
+            metrics[key] = value
+    return metrics
+
+
+def collect_vital_series(patient_ids: Sequence[int], since: datetime,
+                         metrics: Sequence[str] = None) -> Dict[Tuple[int, str], List[Dict]]:
+    """
+    {(patient_id, metric): [{'timestamp', 'value', 'visit_id'}, ...]} from visit
+    vital signs, read for all patients in one query
+    """
+    from django.apps import apps
+    Visit = apps.get_model('visits', 'Visit')
+
+    wanted = set(metrics) if metrics else None
+    series: Dict[Tuple[int, str], List[Dict]] = {}
+    rows = (
+        Visit.objects
+        .filter(patient_id__in=patient_ids, scheduled_date__gte=since)
+        .exclude(vital_signs={})
+        .order_by('patient_id', 'scheduled_date')
+        .values_list('id', 'patient_id', 'scheduled_date', 'vital_signs')
+        .iterator()
+    )
+    for visit_id, patient_id, scheduled_date, vital_signs in rows:
+        for metric, value in vital_sign_values(vital_signs).items():
+            if wanted is None or metric in wanted:
+                series.setdefault((patient_id, metric), []).append({
+                    'timestamp': scheduled_date.isoformat(),
+                    'value': value,
+                    'visit_id': visit_id,
+                })
+    return series
+
+
+class RunningTrendStats:
+    """
+    Sufficient statistics for one series, updated in O(1) per observation.
+
+    Welford-style running means, second moments and the time/value co-moment
+    give the least-squares slope, r^2 and t-test without revisiting history.
+    Times are days relative to the first observation (`origin`, epoch days).
+    """
+
+    FIELDS = ('n', 'origin', 'mean_t', 'mean_y', 'm2_t', 'm2_y', 'co_moment', 't_min', 't_max', 'ewma', 'last_z')
+
+    def __init__(self, data: Dict = None):
+        data = data or {}
+        self.n = data.get('n', 0)
+        self.origin = data.get('origin')
+        self.mean_t = data.get('mean_t', 0.0)
+        self.mean_y = data.get('mean_y', 0.0)
+        self.m2_t = data.get('m2_t', 0.0)
+        self.m2_y = data.get('m2_y', 0.0)
+        self.co_moment = data.get('co_moment', 0.0)
+        self.t_min = data.get('t_min', 0.0)
+        self.t_max = data.get('t_max', 0.0)
+        self.ewma = data.get('ewma')
+        self.last_z = data.get('last_z', 0.0)
+
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    def add(self, timestamp, value: float, alpha: float) -> None:
+        days = to_days(timestamp)
+        if self.origin is None:
+            self.origin = days
+        t = days - self.origin
+
+        # z-score of the new point against everything before it
+        std = math.sqrt(self.m2_y / (self.n - 1)) if self.n > 1 else 0.0
+        self.last_z = (value - self.mean_y) / std if std > 0 else 0.0
+
+        self.n += 1
+        dt = t - self.mean_t
+        self.mean_t += dt / self.n
+        dy = value - self.mean_y
+        self.mean_y += dy / self.n
+        self.m2_t += dt * (t - self.mean_t)
+        self.m2_y += dy * (value - self.mean_y)
+        self.co_moment += dt * (value - self.mean_y)
+        self.t_min = min(self.t_min, t)
+        self.t_max = max(self.t_max, t)
+        self.ewma = value if self.ewma is None else alpha * value + (1 - alpha) * self.ewma
+
+    def remove(self, timestamp, value: float) -> None:
+        """
+        Undo add() for one observation, in any order. Exact for the moments;
+        the EWMA, last z-score and time range are left for the caller to refresh.
+        """
+        if self.n <= 1:
+            self.__init__()
+            return
+        t = to_days(timestamp) - self.origin
+        n = self.n - 1
+        mean_t = (self.mean_t * self.n - t) / n
+        mean_y = (self.mean_y * self.n - value) / n
+        self.m2_t = max(self.m2_t - (t - mean_t) * (t - self.mean_t), 0.0)
+        self.m2_y = max(self.m2_y - (value - mean_y) * (value - self.mean_y), 0.0)
+        self.co_moment -= (t - mean_t) * (value - self.mean_y)
+        self.n, self.mean_t, self.mean_y = n, mean_t, mean_y
+
+    def result(self, metric: str, config: Dict = None) -> TrendResult:
+        """Trend classification from the running statistics alone"""
+        config = config or _trend_config()
+        slope = self.co_moment / self.m2_t if self.m2_t > 0 else 0.0
+        r_squared = self.co_moment ** 2 / (self.m2_t * self.m2_y) if self.m2_t > 0 and self.m2_y > 0 else 0.0
+
+        df = self.n - 2
+        if df > 0 and self.m2_t > 0:
+            sse = max(self.m2_y - slope * self.co_moment, 0.0)
+            stderr = math.sqrt(sse / df / self.m2_t)
+            t_stat = slope / stderr if stderr > 0 else (math.inf if slope else 0.0)
+            p_value = float(t_test_p_values(np.array([t_stat]), np.array([df]))[0])
+        else:
+            p_value = 1.0
+
+        if abs(self.mean_y) > 1e-9:
+            scale = abs(self.mean_y)
+        else:
+            scale = math.sqrt(self.m2_y / max(self.n - 1, 1))
+        relative_change = slope * (self.t_max - self.t_min) / scale if scale > 0 else 0.0
+        significant = (
+            self.n >= config['MIN_POINTS']
+            and p_value < config['SIGNIFICANCE_LEVEL']
+            and abs(relative_change) >= config['MIN_RELATIVE_CHANGE']
+        )
+        anomalous = abs(self.last_z) > config['ZSCORE_THRESHOLD']
+
+        return TrendResult(
+            n=self.n,
+            slope_per_day=slope,
+            r_squared=r_squared,
+            p_value=p_value,
+            relative_change=relative_change,
+            ewma=self.ewma,
+            mean=self.mean_y,
+            anomalies=[self.n - 1] if anomalous else [],
+            direction=classify_direction(metric, self.n, significant, slope, anomalous, config),
+            strength=math.sqrt(r_squared) if significant else 0.0,
+            is_significant=significant,
+        )
+
+    @classmethod
+    def from_points(cls, data_points: Sequence[Dict], alpha: float = None) -> 'RunningTrendStats':
+        alpha = _trend_config()['EWMA_ALPHA'] if alpha is None else alpha
+        stats = cls()
+        for point in data_points:
+            stats.add(point['timestamp'], point['value'], alpha)
+        return stats
+
+
+def _merge_buckets(buckets: List[Dict]) -> Dict:
+    n = sum(bucket.get('n', 1) for bucket in buckets)
+    return {
+        'timestamp': buckets[0]['timestamp'],
+        'value': round(sum(bucket['value'] * bucket.get('n', 1) for bucket in buckets) / n, 4),
+        'min': min(bucket.get('min', bucket['value']) for bucket in buckets),
+        'max': max(bucket.get('max', bucket['value']) for bucket in buckets),
+        'n': n,
+    }
+
+
+def cap_points(raw_points: List[Dict], archive: List[Dict], config: Dict = None) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Keep at most RAW_POINTS recent observations. Overflow is folded, a chunk
+    at a time, into archive buckets (timestamp, mean, min, max, n); when the
+    archive is full its resolution is halved by merging neighbouring buckets.
+    Amortized O(1) per appended point.
+    """
+    config = config or _trend_config()
+    max_raw, chunk, max_buckets = config['RAW_POINTS'], config['ARCHIVE_CHUNK'], config['ARCHIVE_BUCKETS']
+    if len(raw_points) <= max_raw:
+        return raw_points, archive
+
+    archive = list(archive)
+    while len(raw_points) > max_raw:
+        archive.append(_merge_buckets(raw_points[:chunk]))
+        raw_points = raw_points[chunk:]
+    while len(archive) > max_buckets:
+        archive = [_merge_buckets(archive[i:i + 2]) for i in range(0, len(archive), 2)]
+    return raw_points, archive
+
+
+def record_observations(observations: Sequence[Tuple], replaced: Sequence[Tuple[int, str, int]] = ()
+                        ) -> Dict[Tuple[int, str], TrendResult]:
+    """
+    Append (patient_id, metric_name, timestamp, value[, visit_id]) observations
+    to their PatientTrend rows, updating running statistics, capped raw points
+    and the derived direction/strength without reading the stored history.
+
+    replaced lists (patient_id, metric_name, visit_id) values of edited visits
+    to take out first. A value already folded into the archive cannot be taken
+    out; the visit's new value is then skipped as well and left for the next
+    full recompute (TrendAnalyzer.analyze_patient_trends).
+    """
+    from django.db import transaction
+    from .models import PatientTrend
+
+    config = _trend_config()
+    grouped: Dict[Tuple[int, str], List[Tuple[object, float, Optional[int]]]] = {}
+    for patient_id, metric_name, timestamp, value, *visit_id in observations:
+        grouped.setdefault((patient_id, metric_name), []).append((timestamp, value, visit_id[0] if visit_id else None))
+    removals: Dict[Tuple[int, str], List[int]] = {}
+    for patient_id, metric_name, visit_id in replaced:
+        removals.setdefault((patient_id, metric_name), []).append(visit_id)
+        grouped.setdefault((patient_id, metric_name), [])
+    if not grouped:
+        return {}
+
+    results = {}
+    with transaction.atomic():
+        patient_ids = {patient_id for patient_id, _ in grouped}
+        existing = {
+            (trend.patient_id, trend.metric_name, trend.metric_category): trend
+            for trend in PatientTrend.objects.select_for_update().filter(
+                patient_id__in=patient_ids, metric_name__in={metric for _, metric in grouped}
+            )
+        }
+        for (patient_id, metric_name), points in grouped.items():
+            trend = existing.get((patient_id, metric_name, metric_category(metric_name)))
+            if trend is None and not points:
+                continue
+            if trend is None:
+                trend = PatientTrend(
+                    patient_id=patient_id, metric_name=metric_name, metric_category=metric_category(metric_name),
+                    trend_direction='stable', trend_strength=0.0, ai_interpretation='', clinical_significance='low'
+                )
+            if trend.running_stats or not trend.data_points:
+                stats = RunningTrendStats(trend.running_stats)
+            else:
+                # Rows saved before running statistics existed: seed them from the stored points
+                stats = RunningTrendStats.from_points(trend.data_points, config['EWMA_ALPHA'])
+            raw_points = list(trend.data_points)
+            reordered, archived_visits = False, set()
+            for visit_id in removals.get((patient_id, metric_name), []):
+                index = next((i for i, point in enumerate(raw_points) if point.get('visit_id') == visit_id), None)
+                if index is None:
+                    archived_visits.add(visit_id)
+                    continue
+                point = raw_points.pop(index)
+                stats.remove(point['timestamp'], point['value'])
+                reordered = True
+            for timestamp, value, visit_id in points:
+                if visit_id is not None and visit_id in archived_visits:
+                    continue
+                if raw_points and to_days(timestamp) < to_days(raw_points[-1]['timestamp']):
+                    reordered = True
+                stats.add(timestamp, value, config['EWMA_ALPHA'])
+                point = {
+                    'timestamp': timestamp.isoformat() if hasattr(timestamp, 'isoformat') else timestamp,
+                    'value': value,
+                }
+                if visit_id is not None:
+                    point['visit_id'] = visit_id
+                raw_points.append(point)
+            if reordered:
+                # The order-dependent statistics (EWMA, z-score of the latest point)
+                # are recomputed over the raw points once they are back in time order
+                raw_points.sort(key=lambda point: to_days(point['timestamp']))
+                recent = RunningTrendStats.from_points(raw_points, config['EWMA_ALPHA'])
+                stats.ewma, stats.last_z = recent.ewma, recent.last_z
+
+            result = stats.result(metric_name, config)
+            trend.running_stats = stats.to_dict()
+            trend.data_points, trend.archived_points = cap_points(raw_points, trend.archived_points, config)
+            trend.trend_direction = result.direction
+            trend.trend_strength = result.strength
+            trend.statistical_significance = result.p_value
+            trend.save()
+            results[(patient_id, metric_name)] = result
+    return results
@@ -14,10 +14,12 @@ urlpatterns = [
     # AI Processing Endpoints
     path('generate/', views.GenerateInsightsView.as_view(), name='generate_insights'),
     path('dashboard/', views.AIInsightDashboardView.as_view(), name='insights_dashboard'),
+    path('analytics/usage/', views.AIUsageAnalyticsView.as_view(), name='usage_analytics'),
+    path('search/semantic/', views.SemanticSearchView.as_view(), name='semantic_search'),
+    path('risks/assess/', views.RiskAssessmentView.as_view(), name='assess_risks'),
     
     # Specialized Analysis Endpoints (to be implemented)
     # path('trends/analyze/', views.TrendAnalysisView.as_view(), name='analyze_trends'),
-    # path('risks/assess/', views.RiskAssessmentView.as_view(), name='assess_risks'),
     # path('documents/analyze/', views.DocumentAnalysisView.as_view(), name='analyze_document'),
     # path('communication/generate/', views.ProviderCommunicationView.as_view(), name='generate_communication'),
 ]
@@ -10,7 +10,7 @@ import logging
 
 from .models import (
     AIInsight, PatientTrend, RiskPrediction, 
-    ClinicalDecisionSupport, AIProcessingLog
+    ClinicalDecisionSupport, AIProcessingLog, AIUsageRollup
 )
 from .serializers import (
     AIInsightSerializer, AIInsightCreateSerializer,
@@ -19,8 +19,15 @@ from .serializers import (
     GenerateInsightRequestSerializer, TrendAnalysisRequestSerializer,
     RiskAssessmentRequestSerializer, DocumentAnalysisRequestSerializer,
     ProviderCommunicationRequestSerializer, AIInsightSummarySerializer,
-    TrendAnalysisResponseSerializer, RiskAssessmentResponseSerializer
+    TrendAnalysisResponseSerializer, RiskAssessmentResponseSerializer,
+    AIUsageRollupSerializer, AIUsageAnalyticsRequestSerializer,
+    SemanticSearchRequestSerializer
 )
+from .analytics import summarize_rollups
+from .semantic_search import semantic_search_service
+from .lifecycle import bulk_upsert_insights
+from .patient_context import assemble_patient_context
+from .counters import aggregate_metrics, dashboard_summary, read_counters
 from .ai_services import (
     clinical_insight_generator, risk_assessment_engine,
     trend_analyzer, document_analyzer
@@ -34,6 +41,14 @@ Visit = apps.get_model('visits', 'Visit')
 logger = logging.getLogger('ai_insights')
 
 
+def restricted_patients(user):
+    """Patients a user may see, or None when the role sees every patient"""
+    if user.role == 'physician':
+        return Patient.objects.filter(assigned_physician=user)
+    # Admins, nurses and other staff see all patients
+    return None
+
+
 class AIInsightViewSet(viewsets.ModelViewSet):
     """ViewSet for managing AI insights"""
     queryset = AIInsight.objects.all()
@@ -47,6 +62,11 @@ class AIInsightViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         queryset = AIInsight.objects.all()
         
+        # Expired/archived insights only on request
+        include_inactive = self.request.query_params.get('include_inactive', None)
+        if not (include_inactive and include_inactive.lower() == 'true'):
+            queryset = queryset.filter(is_active=True)
+        
         # Filter by patient
         patient_id = self.request.query_params.get('patient_id', None)
         if patient_id:
@@ -74,7 +94,7 @@ class AIInsightViewSet(viewsets.ModelViewSet):
                 Q(risk_level='critical') | Q(urgency_level='immediate')
             )
         
-        return queryset.order_by('-priority_score', '-created_at')
+        return queryset.select_related('patient', 'created_by', 'reviewed_by').order_by('-priority_score', '-created_at')
     
     @action(detail=True, methods=['post'])
     def mark_reviewed(self, request, pk=None):
@@ -148,62 +168,60 @@ class GenerateInsightsView(APIView):
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
     def _collect_patient_data(self, patient, include_historical, days):
-        """Collect comprehensive patient data for analysis"""
-        data = {
-            'patient_id': patient.id,
-            'demographics': {
-                'age': patient.age if hasattr(patient, 'age') else None,
-                'gender': patient.gender if hasattr(patient, 'gender') else None,
-            },
-            'conditions': [],
-            'medications': [],
-            'recent_visits': [],
-            'vital_signs': [],
-            'assessments': []
-        }
-        
-        if include_historical:
-            # Get recent visits
-            recent_visits = patient.visits.filter(
-                visit_date__gte=timezone.now() - timedelta(days=days)
-            ).order_by('-visit_date')[:10]
-            
-            for visit in recent_visits:
-                visit_data = {
-                    'date': visit.visit_date.isoformat(),
-                    'type': visit.visit_type if hasattr(visit, 'visit_type') else 'unknown',
-                    'notes': visit.notes if hasattr(visit, 'notes') else '',
-                }
-                data['recent_visits'].append(visit_data)
-        
-        return data
+        """Collect comprehensive patient data for analysis (cached versioned snapshot)"""
+        return assemble_patient_context(patient.id, days=days, include_historical=include_historical)
     
     def _process_ai_insights(self, patient, ai_response, user, insight_types):
         """Process AI response and create insight objects"""
         insights = []
         
         try:
-            # Parse AI response - assuming it returns structured insights
-            ai_content = ai_response.content
+            parsed = ai_response.parsed or {}
+            common = {
+                'patient': patient,
+                'created_by': user,
+                'model_used': ai_response.model_used,
+                'data_sources': ['patient_data', 'visit_history'],
+                'is_actionable': True,
+            }
             
-            # Create a general insight from the AI response
-            insight = AIInsight.objects.create(
-                patient=patient,
-                created_by=user,
-                insight_type='risk_assessment',  # Default type
-                title='AI-Generated Patient Analysis',
-                description=ai_content,
-                risk_level='low',  # Default, should be determined by AI
-                priority_score=0.5,  # Default
-                confidence_score=ai_response.confidence,
-                model_used=ai_response.model_used,
-                data_sources=['patient_data', 'visit_history'],
-                evidence={'ai_analysis': ai_content},
-                is_actionable=True,
-                recommended_actions=['Review AI analysis', 'Consider clinical correlation'],
-                urgency_level='routine'
-            )
-            insights.append(insight)
+            rows = []
+            for item in parsed.get('insights', []):
+                if insight_types and item['insight_type'] not in insight_types:
+                    continue
+                rows.append(dict(
+                    common,
+                    insight_type=item['insight_type'],
+                    title=item['title'][:200],
+                    description=item['description'],
+                    risk_level=item['risk_level'],
+                    priority_score=item.get('priority_score', 0.5),
+                    confidence_score=item.get('confidence_score', ai_response.confidence),
+                    evidence={'summary': parsed.get('summary', '')},
+                    recommended_actions=item.get('recommended_actions') or parsed.get('recommendations', []),
+                    urgency_level=item.get('urgency_level', parsed.get('urgency_level', 'routine')),
+                ))
+            
+            if not parsed.get('insights'):
+                # Unstructured reply: keep it as one general insight
+                ai_content = ai_response.content
+                rows.append(dict(
+                    common,
+                    insight_type='risk_assessment',  # Default type
+                    title='AI-Generated Patient Analysis',
+                    description=parsed.get('summary') or ai_content,
+                    risk_level='low',  # Default, should be determined by AI
+                    priority_score=0.5,  # Default
+                    confidence_score=ai_response.confidence,
+                    evidence={'ai_analysis': ai_content},
+                    recommended_actions=parsed.get('recommendations') or [
+                        'Review AI analysis', 'Consider clinical correlation'
+                    ],
+                    urgency_level=parsed.get('urgency_level', 'routine'),
+                ))
+            
+            # One batched write, deduped against live insights
+            insights = [insight for insight, _ in bulk_upsert_insights(rows)]
             
         except Exception as e:
             logger.error(f"Error processing AI insights: {str(e)}")
@@ -211,6 +229,48 @@ class GenerateInsightsView(APIView):
         return insights
 
 
+class RiskAssessmentView(APIView):
+    """Assess a patient's risks and store the predictions"""
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def post(self, request):
+        serializer = RiskAssessmentRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        data = serializer.validated_data
+        patients = restricted_patients(request.user)
+        patient = get_object_or_404(Patient if patients is None else patients, id=data['patient_id'])
+        risk_types = list(dict.fromkeys(data.get('risk_types') or risk_assessment_engine.RISK_TYPES))
+        unsupported = [risk_type for risk_type in risk_types if risk_type not in risk_assessment_engine.RISK_TYPES]
+        if unsupported:
+            return Response({
+                'risk_types': [f"Risk assessment is not available for: {', '.join(unsupported)}"]
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        patient_data = assemble_patient_context(patient.id)
+        predictions = risk_assessment_engine.create_risk_predictions(
+            patient.id, risk_types, patient_data, data.get('recent_admissions', [])
+        )
+        
+        highest = max(predictions, key=lambda prediction: prediction.risk_score, default=None)
+        interventions = []
+        if data['include_recommendations']:
+            for prediction in predictions:
+                interventions.extend(
+                    strategy for strategy in prediction.prevention_strategies if strategy not in interventions
+                )
+        
+        return Response(RiskAssessmentResponseSerializer({
+            'patient_id': patient.id,
+            'overall_risk_score': highest.risk_score if highest else 0.0,
+            'highest_risk_category': highest.risk_category if highest else 'low',
+            'critical_risks': [prediction.risk_type for prediction in predictions if prediction.is_high_risk],
+            'recommended_interventions': interventions,
+            'risk_predictions': predictions,
+        }).data)
+
+
 class AIInsightDashboardView(APIView):
     """Dashboard view for AI insights summary"""
     permission_classes = [permissions.IsAuthenticated]
@@ -219,37 +279,94 @@ class AIInsightDashboardView(APIView):
         patient_id = request.query_params.get('patient_id')
         
         # Base queryset
-        insights_qs = AIInsight.objects.all()
+        insights_qs = AIInsight.objects.filter(is_active=True)
         if patient_id:
             insights_qs = insights_qs.filter(patient_id=patient_id)
         
-        # Calculate summary statistics
-        total_insights = insights_qs.count()
-        critical_insights = insights_qs.filter(
-            Q(risk_level='critical') | Q(urgency_level='immediate')
-        ).count()
-        new_insights = insights_qs.filter(status='new').count()
+        # Summary statistics from the incrementally maintained counters; scopes
+        # that were never counted fall back to one conditional-aggregation query
+        metrics = read_counters(patient_id=patient_id or None)
+        if metrics is None:
+            metrics = aggregate_metrics(insights_qs)
         
-        # Insights by type
-        insights_by_type = dict(
-            insights_qs.values_list('insight_type').annotate(count=Count('id'))
+        # Recent insights, with the related rows the serializer reads
+        recent_insights = (
+            insights_qs
+            .select_related('patient', 'created_by', 'reviewed_by')
+            .order_by('-created_at')[:10]
         )
         
-        # Insights by risk level
-        insights_by_risk_level = dict(
-            insights_qs.values_list('risk_level').annotate(count=Count('id'))
-        )
+        summary_data = dashboard_summary(metrics)
+        summary_data['recent_insights'] = AIInsightSerializer(recent_insights, many=True).data
+        
+        return Response(summary_data)
+
+
+class AIUsageAnalyticsView(APIView):
+    """Latency, error rate, token and cost analytics from precomputed rollups"""
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get(self, request):
+        serializer = AIUsageAnalyticsRequestSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
-        # Recent insights
-        recent_insights = insights_qs.order_by('-created_at')[:10]
+        params = serializer.validated_data
+        since = params.get('since') or timezone.now() - timedelta(days=7)
+        rollups = AIUsageRollup.objects.filter(period=params['period'], bucket_start__gte=since)
+        if params.get('until'):
+            rollups = rollups.filter(bucket_start__lt=params['until'])
+        if params.get('model_used'):
+            rollups = rollups.filter(model_used=params['model_used'])
+        if params.get('process_type'):
+            rollups = rollups.filter(process_type=params['process_type'])
+        rollups = list(rollups.order_by('bucket_start'))
         
-        summary_data = {
-            'total_insights': total_insights,
-            'critical_insights': critical_insights,
-            'new_insights': new_insights,
-            'insights_by_type': insights_by_type,
-            'insights_by_risk_level': insights_by_risk_level,
-            'recent_insights': AIInsightSerializer(recent_insights, many=True).data
+        analytics = {
+            'period': params['period'],
+            'since': since,
+            'overall': summarize_rollups(rollups),
+            'by_model': summarize_rollups(rollups, group_by='model_used'),
+            'by_process_type': summarize_rollups(rollups, group_by='process_type'),
         }
+        if params['include_rows']:
+            analytics['rollups'] = AIUsageRollupSerializer(rollups, many=True).data
         
-        return Response(summary_data)
+        return Response(analytics)
+
+
+class SemanticSearchView(APIView):
+    """Semantic search over visit notes, OCR text and AI insights"""
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get(self, request):
+        serializer = SemanticSearchRequestSerializer(data={
+            **request.query_params.dict(),
+            'source_types': request.query_params.getlist('source_types'),
+        })
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        params = serializer.validated_data
+        patients = restricted_patients(request.user)
+        if params.get('patient_id') is not None and patients is not None:
+            get_object_or_404(patients, id=params['patient_id'])
+        try:
+            results = semantic_search_service.search(
+                params['q'],
+                patient_id=params.get('patient_id'),
+                source_types=list(params.get('source_types') or []),
+                top_k=params['top_k'],
+                patients=patients
+            )
+        except ImportError:
+            logger.error("Semantic search unavailable: sentence-transformers is not installed")
+            return Response({
+                'error': 'Semantic search is not available'
+            }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        
+        return Response({
+            'query': params['q'],
+            'patient_id': params.get('patient_id'),
+            'results': results
+        })
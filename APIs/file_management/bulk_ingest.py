@@ -0,0 +1,386 @@
+"""
+Bulk ingestion of ZIP archives
+Migrates document archives (tens of thousands of scans) into UploadedFiles:
+- Entries are read as decompressed streams straight from the ZIP, hashed
+  while they are written to a staging file that then becomes the stored
+  blob (content_store), so the archive is never extracted and every entry
+  is written to disk once; identical content is stored once
+- An optional CSV manifest maps entries to a patient MRN, category and
+  description; unmapped entries go to the ingest's default patient
+- UploadedFile rows are created with bulk_create in batches and their OCR
+  jobs queued together in the bulk lane, behind interactive work
+- Progress counters and per-entry errors are saved on the BulkIngest after
+  every batch; an interrupted ingest resumes after its last saved batch, and
+  content a patient already has is skipped as a duplicate
+- A live run refreshes updated_at at least every HEARTBEAT_SECONDS, also
+  within slow batches and large entries, so it is never taken over as stale
+- API uploads are queued and processed by ingest_archive --queued
+"""
+
+import csv
+import hashlib
+import logging
+import mimetypes
+import os
+import posixpath
+import time
+import uuid
+import zipfile
+import zlib
+from datetime import timedelta
+from typing import Callable, Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.core.files.move import file_move_safe
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from patients.models import Patient
+
+from .chunked_upload import SNIFF_BYTES, StagedUpload, sniff_type
+from .content_store import store_upload
+from .models import BulkIngest, FileCategory, OCRLane, UploadedFile
+from .ocr_queue import enqueue_bulk, is_ocr_candidate
+
+logger = logging.getLogger('file_management')
+
+MANIFEST_ENTRY_COLUMNS = ('filename', 'entry', 'path')
+
+
+def _ingest_config() -> Dict:
+    config = {
+        'BATCH_SIZE': 200,
+        # Entries are copied out of the archive in pieces of this size
+        'READ_SIZE': 256 * 1024,
+        'MAX_ENTRY_SIZE': 1024 * 1024 * 1024,
+        'MAX_ERRORS': 1000,
+        # A running ingest not updated for this long is taken over (its process died)
+        'STALE_SECONDS': 600,
+        # A live run marks itself alive this often (capped at half of STALE_SECONDS)
+        'HEARTBEAT_SECONDS': 60,
+        'POLL_INTERVAL': 5.0,
+        'STAGING_DIR': os.path.join(str(getattr(settings, 'MEDIA_ROOT', '')), 'bulk_ingest'),
+    }
+    config.update(getattr(settings, 'BULK_INGEST_CONFIG', {}))
+    return config
+
+
+def poll_interval() -> float:
+    return _ingest_config()['POLL_INTERVAL']
+
+
+class IngestError(Exception):
+    """The archive or manifest cannot be ingested at all"""
+
+
+class EntryError(Exception):
+    """One archive entry cannot be ingested; it is recorded on the ingest and skipped"""
+
+
+def entry_key(name: str) -> str:
+    """Archive entry path as matched against the manifest"""
+    name = name.replace('\\', '/').lstrip('/')
+    return posixpath.normpath(name) if name else name
+
+
+def read_manifest(path: str) -> Dict[str, Dict[str, str]]:
+    """Manifest rows by entry path: {'mrn', 'category', 'description'} (missing columns are blank)"""
+    with open(path, newline='', encoding='utf-8-sig') as handle:
+        reader = csv.DictReader(handle)
+        columns = {name.strip().lower(): name for name in reader.fieldnames or []}
+        entry_column = next((columns[name] for name in MANIFEST_ENTRY_COLUMNS if name in columns), None)
+        if entry_column is None:
+            raise IngestError(f"Manifest needs a {' or '.join(MANIFEST_ENTRY_COLUMNS)} column")
+        manifest = {}
+        for row in reader:
+            entry = entry_key((row.get(entry_column) or '').strip())
+            if entry:
+                manifest[entry] = {
+                    field: (row.get(columns[field]) or '').strip() if field in columns else ''
+                    for field in ('mrn', 'category', 'description')
+                }
+    return manifest
+
+
+def _check_archive(path: str) -> int:
+    try:
+        with zipfile.ZipFile(path) as archive:
+            return sum(1 for info in archive.infolist() if _is_document(info))
+    except (zipfile.BadZipFile, OSError) as e:
+        raise IngestError(f"Not a readable ZIP archive: {str(e)}")
+
+
+def _is_document(info: zipfile.ZipInfo) -> bool:
+    name = entry_key(info.filename)
+    # Folders and the resource forks and dotfiles archivers add
+    return not info.is_dir() and not name.startswith('__MACOSX/') and not os.path.basename(name).startswith('.')
+
+
+def create_ingest(archive_path: str, user, manifest_path: str = '', patient: Optional[Patient] = None,
+                  category: str = '', description: str = '', filename: str = '',
+                  remove_archive: bool = False, status: str = 'queued') -> BulkIngest:
+    """Validate the archive and manifest and record the ingest"""
+    total = _check_archive(archive_path)
+    if manifest_path:
+        read_manifest(manifest_path)
+    return BulkIngest.objects.create(
+        uploaded_by=user,
+        patient=patient,
+        category=category or FileCategory.OTHER,
+        description=description,
+        filename=filename or os.path.basename(archive_path),
+        archive_path=archive_path,
+        manifest_path=manifest_path,
+        remove_archive=remove_archive,
+        total_entries=total,
+        status=status,
+    )
+
+
+def _save_upload(uploaded, path: str) -> None:
+    temporary_path = getattr(uploaded, 'temporary_file_path', None)
+    if temporary_path is not None:
+        # Large uploads are already a temporary file on disk; move it instead of copying
+        uploaded.close()
+        file_move_safe(temporary_path(), path)
+        return
+    with open(path, 'wb') as handle:
+        for chunk in uploaded.chunks():
+            handle.write(chunk)
+
+
+def submit_archive(archive, user, manifest=None, patient: Optional[Patient] = None, category: str = '',
+                   description: str = '') -> BulkIngest:
+    """Keep an uploaded archive (and manifest) for ingest_archive --queued and record the ingest"""
+    staging_dir = _ingest_config()['STAGING_DIR']
+    os.makedirs(staging_dir, exist_ok=True)
+    name = uuid.uuid4().hex
+    archive_path = os.path.join(staging_dir, f"{name}.zip")
+    manifest_path = os.path.join(staging_dir, f"{name}.csv") if manifest is not None else ''
+    _save_upload(archive, archive_path)
+    try:
+        if manifest is not None:
+            _save_upload(manifest, manifest_path)
+        return create_ingest(archive_path, user, manifest_path, patient, category, description,
+                             filename=os.path.basename(archive.name), remove_archive=True)
+    except Exception:
+        for path in (archive_path, manifest_path):
+            if path and os.path.exists(path):
+                os.remove(path)
+        raise
+
+
+def claim_ingest(stale_seconds: Optional[int] = None) -> Optional[BulkIngest]:
+    """Atomically take the oldest queued (or abandoned running) ingest"""
+    stale_seconds = _ingest_config()['STALE_SECONDS'] if stale_seconds is None else stale_seconds
+    cutoff = timezone.now() - timedelta(seconds=stale_seconds)
+    candidates = BulkIngest.objects.filter(
+        Q(status='queued') | Q(status='running', updated_at__lt=cutoff)
+    ).order_by('created_at').values_list('pk', 'status', 'updated_at')
+    for pk, status, updated_at in candidates[:10]:
+        # Conditional on the state just read, so two processes never take the same ingest
+        if BulkIngest.objects.filter(pk=pk, status=status, updated_at=updated_at).update(
+                status='running', updated_at=timezone.now()):
+            return BulkIngest.objects.get(pk=pk)
+    return None
+
+
+class _Ingestion:
+    """State of one run over an archive: resolved patients and the pending batch"""
+
+    def __init__(self, ingest: BulkIngest, manifest: Dict[str, Dict[str, str]], config: Dict):
+        self.ingest = ingest
+        self.manifest = manifest
+        self.config = config
+        self.batch: List[UploadedFile] = []
+        self.batch_errors: List[Dict[str, str]] = []
+        self.patients = self._resolve_patients()
+        self.heartbeat_seconds = min(config['HEARTBEAT_SECONDS'], config['STALE_SECONDS'] / 2)
+        self.last_beat = time.monotonic()
+
+    def _resolve_patients(self) -> Dict[str, int]:
+        mrns = sorted({row['mrn'] for row in self.manifest.values() if row['mrn']})
+        patients = {}
+        for start in range(0, len(mrns), 500):
+            patients.update(Patient.objects.filter(mrn__in=mrns[start:start + 500]).values_list('mrn', 'id'))
+        return patients
+
+    def target(self, name: str) -> Dict:
+        """Patient id, category and description for an entry"""
+        row = self.manifest.get(entry_key(name))
+        if row is None and self.manifest and self.ingest.patient_id is None:
+            raise EntryError("Entry is not in the manifest")
+        row = row or {'mrn': '', 'category': '', 'description': ''}
+        if row['mrn']:
+            if row['mrn'] not in self.patients:
+                raise EntryError(f"No patient with MRN {row['mrn']}")
+            patient_id = self.patients[row['mrn']]
+        elif self.ingest.patient_id is not None:
+            patient_id = self.ingest.patient_id
+        else:
+            raise EntryError("No patient for entry: add it to the manifest or set a default patient")
+        category = row['category'] or self.ingest.category
+        if category not in FileCategory.values:
+            raise EntryError(f"Unknown category {category}")
+        return {'patient_id': patient_id, 'category': category,
+                'description': row['description'] or self.ingest.description}
+
+    def stage(self, archive: zipfile.ZipFile, info: zipfile.ZipInfo, index: int) -> UploadedFile:
+        """Copy one entry into storage; returns the unsaved UploadedFile"""
+        target = self.target(info.filename)
+        if info.flag_bits & 0x1:
+            raise EntryError("Entry is encrypted")
+        if info.file_size > self.config['MAX_ENTRY_SIZE']:
+            raise EntryError(f"Entry exceeds the {self.config['MAX_ENTRY_SIZE']} byte limit")
+
+        path = os.path.join(self.config['STAGING_DIR'], f"{self.ingest.pk}-{index}.part")
+        hasher = hashlib.sha256()
+        head = b''
+        size = 0
+        try:
+            with archive.open(info) as stream, open(path, 'wb') as staging:
+                for piece in iter(lambda: stream.read(self.config['READ_SIZE']), b''):
+                    size += len(piece)
+                    # Do not trust the declared size (zip bombs)
+                    if size > self.config['MAX_ENTRY_SIZE']:
+                        raise EntryError(f"Entry exceeds the {self.config['MAX_ENTRY_SIZE']} byte limit")
+                    staging.write(piece)
+                    hasher.update(piece)
+                    if len(head) < SNIFF_BYTES:
+                        head += piece[:SNIFF_BYTES - len(head)]
+                    self.heartbeat()
+
+            filename = os.path.basename(entry_key(info.filename))[:255]
+            content_type = sniff_type(head) or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            staged = StagedUpload(path, filename, hasher.hexdigest(), content_type)
+            try:
+                blob = store_upload(staged)
+            finally:
+                staged.close()
+        except (zipfile.BadZipFile, zlib.error, NotImplementedError, EOFError, OSError) as e:
+            # Corrupt data (CRC mismatch), unsupported compression, truncated archive
+            raise EntryError(f"{type(e).__name__}: {str(e)}")
+        finally:
+            if os.path.exists(path):
+                # Content already stored, or the entry failed
+                os.remove(path)
+
+        return UploadedFile(
+            uploaded_by_id=self.ingest.uploaded_by_id,
+            file=blob.name,
+            original_filename=filename,
+            file_size=blob.size,
+            file_type=content_type,
+            content_hash=blob.sha256,
+            tags=[f"bulk_ingest:{self.ingest.pk}"],
+            **target,
+        )
+
+    def heartbeat(self) -> None:
+        """Refresh updated_at if it is due, so claim_ingest does not take over a live run"""
+        if time.monotonic() - self.last_beat < self.heartbeat_seconds:
+            return
+        BulkIngest.objects.filter(pk=self.ingest.pk, status='running').update(updated_at=timezone.now())
+        self.last_beat = time.monotonic()
+
+    def add(self, uploaded: UploadedFile) -> None:
+        self.batch.append(uploaded)
+
+    def fail(self, name: str, error: str) -> None:
+        self.batch_errors.append({'entry': name, 'error': error})
+
+    def flush(self, processed: int) -> None:
+        """Create the batch's files, queue their OCR and save progress (one transaction)"""
+        files, duplicates = self._new_files(self.batch)
+        with transaction.atomic():
+            created = UploadedFile.objects.bulk_create(files)
+            queued = enqueue_bulk(uploaded.pk for uploaded in created if is_ocr_candidate(uploaded))
+            ingest = self.ingest
+            ingest.processed_entries = processed
+            ingest.created_files += len(created)
+            ingest.duplicate_entries += duplicates
+            ingest.failed_entries += len(self.batch_errors)
+            ingest.ocr_queued += queued
+            room = max(self.config['MAX_ERRORS'] - len(ingest.errors), 0)
+            ingest.errors = ingest.errors + self.batch_errors[:room]
+            ingest.save(update_fields=[
+                'processed_entries', 'created_files', 'duplicate_entries', 'failed_entries', 'ocr_queued',
+                'errors', 'updated_at',
+            ])
+        self.batch, self.batch_errors = [], []
+        self.last_beat = time.monotonic()
+
+    def _new_files(self, files: List[UploadedFile]):
+        """Drop content the patient already has (including earlier in this batch)"""
+        existing = set(UploadedFile.objects.filter(
+            content_hash__in={uploaded.content_hash for uploaded in files},
+            patient_id__in={uploaded.patient_id for uploaded in files},
+        ).values_list('patient_id', 'content_hash'))
+        new = []
+        for uploaded in files:
+            key = (uploaded.patient_id, uploaded.content_hash)
+            if key not in existing:
+                existing.add(key)
+                new.append(uploaded)
+        return new, len(files) - len(new)
+
+
+def run_ingest(ingest: BulkIngest, progress: Optional[Callable[[BulkIngest], None]] = None) -> BulkIngest:
+    """Ingest a claimed (running) BulkIngest, resuming after its last saved batch"""
+    config = _ingest_config()
+    os.makedirs(config['STAGING_DIR'], exist_ok=True)
+    now = timezone.now()
+    BulkIngest.objects.filter(pk=ingest.pk).update(status='running', started_at=ingest.started_at or now,
+                                                   updated_at=now)
+    ingest.status = 'running'
+    try:
+        manifest = read_manifest(ingest.manifest_path) if ingest.manifest_path else {}
+        with zipfile.ZipFile(ingest.archive_path) as archive:
+            entries = [info for info in archive.infolist() if _is_document(info)]
+            if ingest.processed_entries:
+                logger.info(f"Resuming bulk ingest {ingest.pk} at entry {ingest.processed_entries}")
+            run = _Ingestion(ingest, manifest, config)
+            for index in range(ingest.processed_entries, len(entries)):
+                info = entries[index]
+                try:
+                    run.add(run.stage(archive, info, index))
+                except EntryError as e:
+                    run.fail(info.filename, str(e))
+                run.heartbeat()
+                if len(run.batch) + len(run.batch_errors) >= config['BATCH_SIZE']:
+                    run.flush(index + 1)
+                    if progress:
+                        progress(ingest)
+            run.flush(len(entries))
+            if manifest:
+                found = {entry_key(info.filename) for info in entries}
+                missing = [{'entry': entry, 'error': "Listed in the manifest but not in the archive"}
+                           for entry in manifest if entry not in found]
+                room = max(config['MAX_ERRORS'] - len(ingest.errors), 0)
+                ingest.errors = ingest.errors + missing[:room]
+    except (IngestError, zipfile.BadZipFile, OSError) as e:
+        ingest.status, ingest.error_message = 'failed', str(e)
+        logger.error(f"Bulk ingest {ingest.pk} failed: {str(e)}")
+    except Exception as e:
+        # Anything else must not leave the ingest 'running' until it is taken over
+        ingest.status, ingest.error_message = 'failed', f"{type(e).__name__}: {str(e)}"
+        logger.exception(f"Bulk ingest {ingest.pk} failed unexpectedly")
+    else:
+        ingest.status = 'completed'
+    ingest.finished_at = timezone.now()
+    ingest.save(update_fields=['status', 'error_message', 'errors', 'finished_at', 'updated_at'])
+    if progress:
+        progress(ingest)
+    if ingest.status == 'completed' and ingest.remove_archive:
+        for path in (ingest.archive_path, ingest.manifest_path):
+            if path and os.path.exists(path):
+                os.remove(path)
+    return ingest
+
+
+def create_files(files: Iterable[UploadedFile], lane: int = OCRLane.INTERACTIVE) -> List[UploadedFile]:
+    """bulk_create unsaved UploadedFiles and queue OCR for them in one go"""
+    with transaction.atomic():
+        created = UploadedFile.objects.bulk_create(list(files))
+        enqueue_bulk((uploaded.pk for uploaded in created if is_ocr_candidate(uploaded)), lane=lane)
+    return created
@@ -0,0 +1,321 @@
+"""
+Resumable chunked uploads
+Large scans and faxes are uploaded as a session instead of one multipart request:
+- init creates an UploadSession and an empty staging file; each chunk is
+  PUT with its byte offset and streamed from the request body straight to
+  the staging file in small pieces, so the web worker never holds a whole
+  file (or a whole chunk) in memory
+- A chunk is acknowledged by advancing received_bytes with a conditional
+  update; a chunk at the wrong offset is rejected with the current offset,
+  so an interrupted client resumes from the last acknowledged byte
+- The SHA-256 of the file is computed as chunks arrive (the running hash is
+  kept per process; finalize rehashes the staging file only when chunks
+  were served by different processes) and the MIME type is sniffed from the
+  first bytes
+- finalize moves the staging file into content-addressed storage
+  (content_store) and creates the UploadedFile, exactly like a regular upload
+"""
+
+import hashlib
+import logging
+import mimetypes
+import os
+from collections import OrderedDict
+from datetime import timedelta
+from typing import BinaryIO, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+
+from .content_store import store_upload
+from .models import UploadedFile, UploadSession
+
+logger = logging.getLogger('file_management')
+
+# Bytes needed to sniff every known signature (DICOM's magic sits at offset 128)
+SNIFF_BYTES = 132
+SIGNATURES = [
+    (0, b'%PDF-', 'application/pdf'),
+    (0, b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (0, b'\xff\xd8\xff', 'image/jpeg'),
+    (0, b'II*\x00', 'image/tiff'),
+    (0, b'MM\x00*', 'image/tiff'),
+    (0, b'GIF87a', 'image/gif'),
+    (0, b'GIF89a', 'image/gif'),
+    (0, b'BM', 'image/bmp'),
+    (0, b'PK\x03\x04', 'application/zip'),
+    (128, b'DICM', 'application/dicom'),
+]
+
+
+def _upload_config() -> Dict:
+    config = {
+        'CHUNK_SIZE': 5 * 1024 * 1024,
+        'MAX_CHUNK_SIZE': 16 * 1024 * 1024,
+        'MAX_FILE_SIZE': 1024 * 1024 * 1024,
+        # Request body is copied to disk in pieces of this size
+        'READ_SIZE': 256 * 1024,
+        'SESSION_TTL_HOURS': 24,
+        'STAGING_DIR': os.path.join(str(getattr(settings, 'MEDIA_ROOT', '')), 'upload_sessions'),
+    }
+    config.update(getattr(settings, 'CHUNKED_UPLOAD_CONFIG', {}))
+    return config
+
+
+def chunk_size() -> int:
+    """Chunk size suggested to clients when a session starts"""
+    return _upload_config()['CHUNK_SIZE']
+
+
+class UploadError(Exception):
+    """Rejected upload request; carries the HTTP status and the offset the client should resume from"""
+
+    def __init__(self, message: str, status: int = 400, offset: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+    def to_dict(self) -> Dict:
+        data = {'error': str(self)}
+        if self.offset is not None:
+            data['offset'] = self.offset
+        return data
+
+
+class StagedUpload(File):
+    """Finished staging file; FileSystemStorage moves it into place instead of copying it"""
+
+    def __init__(self, path: str, name: str, sha256: str, content_type: str):
+        super().__init__(open(path, 'rb'), name)
+        self.path = path
+        self.sha256 = sha256
+        self.content_type = content_type
+
+    def temporary_file_path(self) -> str:
+        return self.path
+
+
+# Running SHA-256 per session, valid only while its offset matches received_bytes.
+# Bounded: a session whose hasher was evicted (or whose chunks went to another
+# process) is rehashed from the staging file at finalize.
+_hashers: 'OrderedDict[str, Tuple[int, object]]' = OrderedDict()
+MAX_HASHERS = 256
+
+
+def _remember_hasher(session_id, offset: int, hasher) -> None:
+    _hashers[str(session_id)] = (offset, hasher)
+    _hashers.move_to_end(str(session_id))
+    while len(_hashers) > MAX_HASHERS:
+        _hashers.popitem(last=False)
+
+
+def _hasher_at(session_id, offset: int):
+    entry = _hashers.get(str(session_id))
+    if offset == 0:
+        return hashlib.sha256()
+    if entry is None or entry[0] != offset:
+        return None
+    return entry[1].copy()
+
+
+def sniff_type(head: bytes) -> str:
+    for offset, magic, mime_type in SIGNATURES:
+        if head[offset:offset + len(magic)] == magic:
+            return mime_type
+    return ''
+
+
+def staging_path(session: UploadSession) -> str:
+    return os.path.join(_upload_config()['STAGING_DIR'], f"{session.pk}.part")
+
+
+def start_session(patient, user, filename: str, total_size: int, category: str = '', description: str = '',
+                  declared_type: str = '', expected_sha256: str = '') -> UploadSession:
+    config = _upload_config()
+    if total_size > config['MAX_FILE_SIZE']:
+        raise UploadError(f"File exceeds the {config['MAX_FILE_SIZE']} byte upload limit", status=413)
+    session_fields = {}
+    if category:
+        session_fields['category'] = category
+    session = UploadSession.objects.create(
+        patient=patient,
+        uploaded_by=user,
+        filename=os.path.basename(filename),
+        description=description,
+        declared_type=declared_type,
+        expected_sha256=expected_sha256.lower(),
+        total_size=total_size,
+        expires_at=timezone.now() + timedelta(hours=config['SESSION_TTL_HOURS']),
+        **session_fields,
+    )
+    path = staging_path(session)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+    return session
+
+
+def _check_open(session: UploadSession) -> None:
+    if session.status != 'uploading':
+        raise UploadError(f"Upload session is {session.status}", status=409)
+    if session.expires_at <= timezone.now():
+        raise UploadError("Upload session has expired", status=410)
+
+
+def receive_chunk(session: UploadSession, offset: int, stream: BinaryIO, length: int,
+                  chunk_sha256: str = '') -> int:
+    """
+    Append one chunk read from stream (length bytes, starting at offset) and
+    acknowledge it; returns the new offset
+    """
+    config = _upload_config()
+    _check_open(session)
+    if offset != session.received_bytes:
+        raise UploadError("Chunk offset does not match the received bytes", status=409,
+                          offset=session.received_bytes)
+    if length <= 0:
+        raise UploadError("Empty chunk", offset=offset)
+    if length > config['MAX_CHUNK_SIZE']:
+        raise UploadError(f"Chunk exceeds the {config['MAX_CHUNK_SIZE']} byte limit", status=413, offset=offset)
+    if offset + length > session.total_size:
+        raise UploadError("Chunk runs past the declared file size", offset=offset)
+
+    file_hasher = _hasher_at(session.pk, offset)
+    chunk_hasher = hashlib.sha256() if chunk_sha256 else None
+    head = b''
+    received = 0
+    with open(staging_path(session), 'r+b') as staging:
+        staging.seek(offset)
+        while received < length:
+            piece = stream.read(min(config['READ_SIZE'], length - received))
+            if not piece:
+                break
+            staging.write(piece)
+            received += len(piece)
+            if file_hasher is not None:
+                file_hasher.update(piece)
+            if chunk_hasher is not None:
+                chunk_hasher.update(piece)
+            if offset == 0 and len(head) < SNIFF_BYTES:
+                head += piece[:SNIFF_BYTES - len(head)]
+
+    # Nothing is acknowledged until the whole chunk arrived intact; the next
+    # attempt simply overwrites the same byte range
+    if received < length:
+        raise UploadError(f"Chunk ended after {received} of {length} bytes", offset=offset)
+    if chunk_hasher is not None and chunk_hasher.hexdigest() != chunk_sha256.lower():
+        raise UploadError("Chunk checksum mismatch", offset=offset)
+
+    new_offset = offset + length
+    updates = {'received_bytes': new_offset, 'updated_at': timezone.now()}
+    if offset == 0:
+        updates['detected_type'] = sniff_type(head)
+    acknowledged = UploadSession.objects.filter(
+        pk=session.pk, status='uploading', received_bytes=offset
+    ).update(**updates)
+    if not acknowledged:
+        # A concurrent request acknowledged this offset first
+        session.refresh_from_db(fields=['received_bytes', 'status'])
+        raise UploadError("Chunk offset does not match the received bytes", status=409,
+                          offset=session.received_bytes)
+    for field, value in updates.items():
+        setattr(session, field, value)
+    if file_hasher is not None:
+        _remember_hasher(session.pk, new_offset, file_hasher)
+    return new_offset
+
+
+def _file_sha256(session: UploadSession, path: str) -> str:
+    entry = _hashers.pop(str(session.pk), None)
+    if entry is not None and entry[0] == session.total_size:
+        return entry[1].hexdigest()
+    logger.debug(f"Rehashing staged upload {session.pk}: chunks were received by another process")
+    hasher = hashlib.sha256()
+    read_size = _upload_config()['READ_SIZE']
+    with open(path, 'rb') as handle:
+        for piece in iter(lambda: handle.read(read_size), b''):
+            hasher.update(piece)
+    return hasher.hexdigest()
+
+
+def _content_type(session: UploadSession) -> str:
+    return (
+        session.detected_type
+        or session.declared_type
+        or mimetypes.guess_type(session.filename)[0]
+        or 'application/octet-stream'
+    )
+
+
+def finalize_session(session: UploadSession) -> UploadedFile:
+    """Move the completed staging file into storage and create its UploadedFile"""
+    _check_open(session)
+    if session.received_bytes != session.total_size:
+        raise UploadError(
+            f"Upload incomplete: {session.received_bytes} of {session.total_size} bytes received",
+            offset=session.received_bytes,
+        )
+    path = staging_path(session)
+    # Drop bytes of any unacknowledged retry written past the end
+    os.truncate(path, session.total_size)
+    sha256 = _file_sha256(session, path)
+    if session.expected_sha256 and sha256 != session.expected_sha256:
+        raise UploadError("File checksum mismatch; abort the session and upload again", status=422)
+
+    content_type = _content_type(session)
+    staged = StagedUpload(path, session.filename, sha256, content_type)
+    try:
+        blob = store_upload(staged)
+    finally:
+        staged.close()
+    if os.path.exists(path):
+        # The content was already stored, or the storage copied rather than moved it
+        os.remove(path)
+
+    with transaction.atomic():
+        uploaded = UploadedFile.objects.create(
+            patient=session.patient,
+            uploaded_by=session.uploaded_by,
+            file=blob.name,
+            original_filename=session.filename,
+            file_size=blob.size,
+            file_type=content_type,
+            content_hash=blob.sha256,
+            category=session.category,
+            description=session.description,
+        )
+        UploadSession.objects.filter(pk=session.pk).update(
+            status='completed', uploaded_file=uploaded, updated_at=timezone.now()
+        )
+    session.status = 'completed'
+    session.uploaded_file = uploaded
+    return uploaded
+
+
+def discard_staging(session: UploadSession) -> None:
+    _hashers.pop(str(session.pk), None)
+    path = staging_path(session)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def abort_session(session: UploadSession) -> None:
+    if session.status == 'completed':
+        raise UploadError("Upload session is already completed", status=409)
+    UploadSession.objects.filter(pk=session.pk).update(status='aborted', updated_at=timezone.now())
+    session.status = 'aborted'
+    discard_staging(session)
+
+
+def purge_expired_sessions(include_aborted: bool = True) -> int:
+    """Delete expired unfinished sessions and their staging files"""
+    expired = UploadSession.objects.filter(status='uploading', expires_at__lte=timezone.now())
+    if include_aborted:
+        expired = expired | UploadSession.objects.filter(status='aborted')
+    purged = 0
+    for session in expired.iterator():
+        discard_staging(session)
+        session.delete()
+        purged += 1
+    return purged
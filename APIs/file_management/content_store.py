@@ -0,0 +1,141 @@
+"""
+Content-addressed file storage and OCR result reuse
+- Uploads are stored once per SHA-256 under blobs/<aa>/<hash><ext>; the
+  hash is computed while the upload streams in (upload_handlers), so the
+  same fax uploaded three times is one stored blob
+- OCR output is cached per (content hash, OCR version) in OCRResult and
+  reused for duplicate uploads and re-OCR requests without running OCR
+- The OCR version is a digest of everything that changes OCR output: the
+  engine backend, tesseract version and language, the preprocessing
+  pipeline and the document rasterization settings
+"""
+
+import hashlib
+import json
+import logging
+import os
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from django.core.files.storage import default_storage
+from django.db.models import F
+
+from .document_ocr import document_signature
+from .models import OCRResult, UploadedFile
+from .ocr_engine import engine_signature
+from .ocr_utils import ocr_result
+from .preprocessing import pipeline_signature
+
+logger = logging.getLogger('file_management')
+
+BLOB_DIR = 'blobs'
+# Bump when the stored OCR result layout changes
+OCR_RESULT_VERSION = 1
+# structured_data keys that describe how the text was produced (cached with the text)
+METADATA_KEYS = ('pages', 'preprocessing')
+
+
+@dataclass(frozen=True)
+class StoredBlob:
+    name: str
+    sha256: str
+    size: int
+    content_type: str
+    created: bool
+
+
+def hash_file(file) -> str:
+    hasher = hashlib.sha256()
+    for chunk in file.chunks():
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def ensure_content_hash(file_instance: UploadedFile) -> str:
+    """Content hash of a file, hashing (and saving) it now if it was uploaded before hashing existed"""
+    if not file_instance.content_hash:
+        with file_instance.file.open('rb') as handle:
+            file_instance.content_hash = hash_file(handle)
+        UploadedFile.objects.filter(pk=file_instance.pk).update(content_hash=file_instance.content_hash)
+    return file_instance.content_hash
+
+
+def blob_name(sha256: str, filename: str) -> str:
+    # The extension is kept: OCR picks the PDF/TIFF page pipeline by extension
+    extension = os.path.splitext(filename)[1].lower()[:10]
+    return f"{BLOB_DIR}/{sha256[:2]}/{sha256}{extension}"
+
+
+def store_upload(uploaded) -> StoredBlob:
+    """Store an upload under its content hash, reusing the blob if that content is already stored"""
+    sha256 = getattr(uploaded, 'sha256', None) or hash_file(uploaded)
+    name = blob_name(sha256, uploaded.name)
+    content_type = getattr(uploaded, 'content_type', None) or 'application/octet-stream'
+    if default_storage.exists(name):
+        return StoredBlob(name, sha256, uploaded.size, content_type, created=False)
+
+    uploaded.seek(0)
+    saved = default_storage.save(name, uploaded)
+    if saved != name:
+        # A concurrent upload of the same content won the race; keep the first copy
+        default_storage.delete(saved)
+        return StoredBlob(name, sha256, uploaded.size, content_type, created=False)
+    return StoredBlob(name, sha256, uploaded.size, content_type, created=True)
+
+
+def ocr_version() -> str:
+    signature = {
+        'result': OCR_RESULT_VERSION,
+        'engine': engine_signature(),
+        'preprocessing': pipeline_signature(),
+        'documents': document_signature(),
+    }
+    return hashlib.sha256(json.dumps(signature, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+def cached_ocr_result(content_hash: str, data_type: str, version: str) -> Optional[Dict]:
+    """Job result rebuilt from the cached OCR text, or None on a miss"""
+    if not content_hash:
+        return None
+    cached = OCRResult.objects.filter(content_hash=content_hash, ocr_version=version).values(
+        'pk', 'ocr_text', 'metadata'
+    ).first()
+    if cached is None:
+        return None
+    OCRResult.objects.filter(pk=cached['pk']).update(reuse_count=F('reuse_count') + 1)
+    return ocr_result(cached['ocr_text'], data_type, **cached['metadata'])
+
+
+def save_ocr_result(content_hash: str, version: str, result: Dict) -> None:
+    if not content_hash:
+        return
+    structured_data = result['structured_data']
+    OCRResult.objects.update_or_create(
+        content_hash=content_hash,
+        ocr_version=version,
+        defaults={
+            'ocr_text': result['ocr_text'],
+            'metadata': {key: structured_data[key] for key in METADATA_KEYS if key in structured_data},
+        },
+    )
+
+
+def hash_missing_files(batch_size: int = 200) -> int:
+    """Fill content_hash for files uploaded before hashing existed"""
+    hashed = 0
+    pending = UploadedFile.objects.filter(content_hash='').only('pk', 'file').order_by('pk')
+    batch = []
+    for uploaded in pending.iterator(chunk_size=batch_size):
+        try:
+            with uploaded.file.open('rb') as handle:
+                uploaded.content_hash = hash_file(handle)
+        except (FileNotFoundError, ValueError) as e:
+            logger.warning(f"Cannot hash file {uploaded.pk}: {str(e)}")
+            continue
+        batch.append(uploaded)
+        if len(batch) >= batch_size:
+            hashed += UploadedFile.objects.bulk_update(batch, ['content_hash'])
+            batch = []
+    if batch:
+        hashed += UploadedFile.objects.bulk_update(batch, ['content_hash'])
+    return hashed
@@ -0,0 +1,136 @@
+"""
+Thumbnails and first-page previews
+Lets file lists show documents without downloading the originals:
+- Derivatives of images and PDFs (first page) are rendered on first request,
+  or ahead of time by the OCR worker for new uploads (DERIVATIVE_CONFIG EAGER)
+- JPEGs are decoded at reduced scale and PDF pages are rasterized straight
+  at the target size, so a 12MP photo or a long PDF is never fully decoded
+- Rendered files are cached on disk keyed by content hash, kind and size;
+  the content never changes for a key, so responses are served with
+  long-lived immutable cache headers
+- The cache is bounded (MAX_CACHE_BYTES); the least recently used files are
+  pruned as new ones are written (and by prune_derivatives)
+"""
+
+import io
+import logging
+import os
+from typing import Dict, Optional
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+from .disk_cache import prune_lru, touch, write_atomically
+from .document_ocr import document_kind
+
+logger = logging.getLogger('file_management')
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tif', '.tiff', '.webp'}
+KINDS = ('thumbnail', 'preview')
+CONTENT_TYPE = 'image/jpeg'
+
+
+def _derivative_config() -> Dict:
+    config = {
+        # Allowed long-side sizes in pixels per kind; the first is the default
+        'SIZES': {'thumbnail': [256, 128, 512], 'preview': [1200, 2000]},
+        'QUALITY': 80,
+        'MAX_CACHE_BYTES': 512 * 1024 * 1024,
+        # Prune the cache after this many new files written by a process
+        'PRUNE_EVERY': 50,
+        'EAGER': True,
+        'CACHE_DIR': os.path.join(str(getattr(settings, 'MEDIA_ROOT', '')), 'derivatives'),
+    }
+    config.update(getattr(settings, 'DERIVATIVE_CONFIG', {}))
+    return config
+
+
+def eager_derivatives() -> bool:
+    return bool(_derivative_config()['EAGER'])
+
+
+def supports_derivatives(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS | {'.pdf'}
+
+
+def derivative_size(kind: str, requested: Optional[str] = None) -> Optional[int]:
+    """The requested size if it is allowed for the kind, the default size if none was requested"""
+    sizes = _derivative_config()['SIZES'][kind]
+    if requested in (None, ''):
+        return sizes[0]
+    try:
+        size = int(requested)
+    except ValueError:
+        return None
+    return size if size in sizes else None
+
+
+def cache_path(content_hash: str, kind: str, size: int) -> str:
+    return os.path.join(_derivative_config()['CACHE_DIR'], content_hash[:2], f"{content_hash}-{kind}-{size}.jpg")
+
+
+def _render(path: str, size: int) -> Image.Image:
+    """First page of the file, at most size pixels on its long side"""
+    if document_kind(path) == 'pdf':
+        import pymupdf
+
+        with pymupdf.open(path) as document:
+            page = document[0]
+            zoom = size / max(page.rect.width, page.rect.height)
+            pixmap = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False)
+            return Image.open(io.BytesIO(pixmap.tobytes('png')))
+
+    with Image.open(path) as image:
+        # JPEG: let the decoder downscale by up to 8x instead of decoding every pixel
+        image.draft('RGB', (size, size))
+        image = ImageOps.exif_transpose(image)
+    # Before scaling: bilevel faxes and palette images only resize with nearest-neighbour
+    if image.mode == '1':
+        image = image.convert('L')
+    elif image.mode not in ('RGB', 'L'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    image.thumbnail((size, size))
+    return image
+
+
+_written = 0
+
+
+def generate_derivative(path: str, content_hash: str, kind: str, size: Optional[int] = None) -> str:
+    """Path of the cached derivative, rendering it on a miss"""
+    global _written
+    config = _derivative_config()
+    size = size or config['SIZES'][kind][0]
+    target = cache_path(content_hash, kind, size)
+    # mtime is the recency used for pruning (atime is often disabled)
+    if touch(target):
+        return target
+
+    image = _render(path, size)
+    # Unique temporary name, renamed into place: concurrent renders never serve a partial file
+    write_atomically(target, lambda temp_path: image.save(temp_path, 'JPEG', quality=config['QUALITY'], optimize=True))
+
+    _written += 1
+    if (_written - 1) % config['PRUNE_EVERY'] == 0:
+        prune_cache()
+    return target
+
+
+def generate_derivatives(path: str, content_hash: str) -> int:
+    """Render the default thumbnail and preview of a file (OCR worker pool task); returns the number rendered"""
+    rendered = 0
+    for kind in KINDS:
+        if not os.path.exists(cache_path(content_hash, kind, _derivative_config()['SIZES'][kind][0])):
+            generate_derivative(path, content_hash, kind)
+            rendered += 1
+    return rendered
+
+
+def prune_cache(max_bytes: Optional[int] = None) -> int:
+    """Delete least recently used derivatives until the cache fits; returns the number deleted"""
+    config = _derivative_config()
+    max_bytes = config['MAX_CACHE_BYTES'] if max_bytes is None else max_bytes
+    return prune_lru(config['CACHE_DIR'], max_bytes)
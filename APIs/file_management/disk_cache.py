@@ -0,0 +1,72 @@
+"""
+Bounded on-disk caches
+Shared by the OCR preprocessing and derivative (thumbnail/preview) caches:
+- Files are written under a unique temporary name and renamed into place,
+  so concurrent writers (threads or processes) never see a partial file
+- Recency is the file's mtime, refreshed on every hit (atime is often
+  disabled); pruning deletes the least recently used files until the
+  directory fits its byte budget
+"""
+
+import logging
+import os
+import tempfile
+from typing import Callable
+
+logger = logging.getLogger('file_management')
+
+TEMP_SUFFIX = '.tmp'
+
+
+def write_atomically(target: str, write: Callable[[str], None]) -> None:
+    """Call write(temp_path) and move the result to target"""
+    directory = os.path.dirname(target)
+    os.makedirs(directory, exist_ok=True)
+    handle, temp_path = tempfile.mkstemp(dir=directory, suffix=TEMP_SUFFIX)
+    os.close(handle)
+    try:
+        write(temp_path)
+        os.replace(temp_path, target)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def touch(path: str) -> bool:
+    """Mark a cached file as recently used; False if it is gone (pruned meanwhile)"""
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def prune_lru(directory: str, max_bytes: int) -> int:
+    """Delete least recently used files until the directory fits; returns the number deleted"""
+    entries, total = [], 0
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if name.endswith(TEMP_SUFFIX):
+                # Still being written
+                continue
+            entry_path = os.path.join(root, name)
+            try:
+                stat = os.stat(entry_path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+            total += stat.st_size
+    deleted = 0
+    for _, file_size, entry_path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(entry_path)
+        except FileNotFoundError:
+            pass
+        total -= file_size
+        deleted += 1
+    if deleted:
+        logger.info(f"Pruned {deleted} cached files from {directory}")
+    return deleted
@@ -0,0 +1,156 @@
+"""
+Multi-page document OCR
+Text extraction for PDFs and multi-frame TIFF faxes:
+- PDF pages with an embedded text layer are read directly (no OCR)
+- Only pages without usable text are rasterized (grayscale, at OCR_CONFIG
+  DOCUMENTS DPI), run through the preprocessing stages and OCRed
+- Pages are independent tasks, so a process pool OCRs them in parallel;
+  results stream back page by page as they finish
+- The OCR worker fans document pages out over its own pool (see
+  ocr_queue.OCRWorker); extract_document_text() is the standalone entry point
+"""
+
+import io
+import os
+from concurrent.futures import as_completed
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from PIL import Image
+
+from .ocr_engine import get_engine
+from .ocr_utils import OCRJobError
+from .preprocessing import preprocess_image, preprocessing_enabled
+
+PDF_EXTENSIONS = {'.pdf'}
+TIFF_EXTENSIONS = {'.tif', '.tiff'}
+DOCUMENT_MIME_TYPES = {'application/pdf', 'image/tiff'}
+
+
+def _document_config() -> Dict:
+    ocr_config = getattr(settings, 'OCR_CONFIG', {})
+    config = {
+        'DPI': 300,
+        # Pages whose text layer is shorter than this are treated as scans
+        'MIN_TEXT_CHARS': 25,
+        'MAX_PAGES': 500,
+    }
+    config.update(ocr_config.get('DOCUMENTS', {}))
+    return config
+
+
+@dataclass(frozen=True)
+class PageResult:
+    """Text of one document page and where it came from"""
+    page: int
+    text: str
+    source: str  # 'text_layer' or 'ocr'
+
+    def to_dict(self) -> Dict:
+        return {'page': self.page + 1, 'source': self.source, 'chars': len(self.text)}
+
+
+def document_signature() -> Dict:
+    """Settings that change document OCR output (part of the OCR cache key)"""
+    config = _document_config()
+    return {'dpi': config['DPI'], 'min_text_chars': config['MIN_TEXT_CHARS']}
+
+
+def document_kind(path: str) -> Optional[str]:
+    """'pdf' or 'tiff' for multi-page capable files, None for plain images"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in PDF_EXTENSIONS:
+        return 'pdf'
+    if extension in TIFF_EXTENSIONS:
+        return 'tiff'
+    return None
+
+
+def plan_pages(path: str) -> Tuple[List[PageResult], List[int]]:
+    """
+    Pages answered by the embedded text layer, and the indexes of the pages
+    that still need OCR.
+    """
+    config = _document_config()
+    kind = document_kind(path)
+    if kind == 'tiff':
+        with Image.open(path) as image:
+            page_count = getattr(image, 'n_frames', 1)
+        if page_count > config['MAX_PAGES']:
+            raise OCRJobError(f"Document has {page_count} pages (limit {config['MAX_PAGES']})")
+        return [], list(range(page_count))
+
+    import pymupdf
+
+    text_pages, ocr_pages = [], []
+    with pymupdf.open(path) as document:
+        if document.page_count > config['MAX_PAGES']:
+            raise OCRJobError(f"Document has {document.page_count} pages (limit {config['MAX_PAGES']})")
+        for index, page in enumerate(document):
+            text = page.get_text('text').strip()
+            if len(text) >= config['MIN_TEXT_CHARS']:
+                text_pages.append(PageResult(index, text, 'text_layer'))
+            else:
+                ocr_pages.append(index)
+    return text_pages, ocr_pages
+
+
+def _render_page(path: str, index: int, dpi: int) -> Image.Image:
+    if document_kind(path) == 'tiff':
+        with Image.open(path) as image:
+            image.seek(index)
+            return image.convert('L')
+
+    import pymupdf
+
+    with pymupdf.open(path) as document:
+        pixmap = document[index].get_pixmap(dpi=dpi, colorspace=pymupdf.csGRAY, alpha=False)
+        return Image.open(io.BytesIO(pixmap.tobytes('png')))
+
+
+def ocr_page(path: str, index: int, dpi: Optional[int] = None) -> PageResult:
+    """Rasterize and OCR one page; runs in a worker process"""
+    try:
+        image = _render_page(path, index, dpi or _document_config()['DPI'])
+        if preprocessing_enabled():
+            image = preprocess_image(image).image
+        text = get_engine().image_to_text(image)
+    except Exception as e:
+        raise OCRJobError(f"Page {index + 1}: {type(e).__name__}: {str(e)}") from None
+    return PageResult(index, text, 'ocr')
+
+
+def iter_document_pages(path: str, executor=None) -> Iterator[PageResult]:
+    """
+    Yield every page as soon as its text is available: text-layer pages
+    first, then OCRed pages in completion order. Pages are OCRed in
+    parallel when an executor is given.
+    """
+    dpi = _document_config()['DPI']
+    text_pages, ocr_pages = plan_pages(path)
+    yield from text_pages
+    if executor is None:
+        for index in ocr_pages:
+            yield ocr_page(path, index, dpi)
+        return
+    futures = [executor.submit(ocr_page, path, index, dpi) for index in ocr_pages]
+    try:
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def assemble_pages(pages: List[PageResult]) -> Dict:
+    """Join page texts in page order (form feed between pages, as tesseract does)"""
+    pages = sorted(pages, key=lambda page: page.page)
+    return {
+        'text': '\f'.join(page.text for page in pages),
+        'pages': [page.to_dict() for page in pages],
+    }
+
+
+def extract_document_text(path: str, executor=None) -> Dict:
+    return assemble_pages(list(iter_document_pages(path, executor)))
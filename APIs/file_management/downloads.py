@@ -0,0 +1,213 @@
+"""
+File downloads
+Permission-checked downloads whose cost in the web worker does not grow
+with the file size:
+- DOWNLOAD_CONFIG BACKEND 'nginx' (X-Accel-Redirect) or 'sendfile'
+  (X-Sendfile for Apache/lighttpd) hands the file to the front-end server,
+  which then also answers Range requests itself
+- 'django' (default) streams through FileResponse; gunicorn's
+  wsgi.file_wrapper sends it with os.sendfile, so the bytes never pass
+  through Python. A single Range is served the same way from an offset
+- Multi-range requests are answered as multipart/byteranges, read in
+  fixed-size blocks
+- ETag is the content hash (stored content never changes), so If-None-Match
+  and If-Range need no file access
+"""
+
+import io
+import os
+import uuid
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import content_disposition_header, parse_etags
+
+from .content_store import ensure_content_hash
+
+BLOCK_SIZE = 64 * 1024
+
+
+def _download_config() -> Dict:
+    config = {
+        'BACKEND': 'django',
+        # Internal nginx location that aliases MEDIA_ROOT (X-Accel-Redirect)
+        'ACCEL_REDIRECT_PREFIX': '/protected-media/',
+        # More ranges than this (after merging overlaps) get the whole file
+        'MAX_RANGES': 16,
+    }
+    config.update(getattr(settings, 'DOWNLOAD_CONFIG', {}))
+    return config
+
+
+def etag_matches(request, etag: str) -> bool:
+    """If-None-Match lists this ETag (or *)"""
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    etags = parse_etags(header)
+    # Weak comparison, as RFC 9110 requires for If-None-Match
+    return '*' in etags or etag in [value[2:] if value.startswith('W/') else value for value in etags]
+
+
+def parse_ranges(header: Optional[str], size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Inclusive (start, end) byte ranges of a Range header, sorted and merged;
+    None when the header is absent or malformed (serve the whole file),
+    [] when no range is satisfiable
+    """
+    if not header or not header.startswith('bytes='):
+        return None
+    ranges = []
+    for spec in header[len('bytes='):].split(','):
+        first, dash, last = spec.strip().partition('-')
+        if not dash:
+            return None
+        try:
+            if first:
+                start = int(first)
+                end = int(last) if last else size - 1
+                if start > end and last:
+                    return None
+            else:
+                # Suffix range: the last N bytes
+                length = int(last)
+                start, end = max(size - length, 0), size - 1
+                if length == 0:
+                    continue
+        except ValueError:
+            return None
+        if start < size:
+            ranges.append((start, min(end, size - 1)))
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class FileRange(io.RawIOBase):
+    """
+    Read-only view of a byte range of an open file. It keeps fileno(), so
+    gunicorn's file wrapper still uses os.sendfile: it starts at the current
+    offset and sends Content-Length bytes.
+    """
+
+    def __init__(self, file, start: int, length: int):
+        super().__init__()
+        self.file = file
+        self.remaining = length
+        self.file.seek(start)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def fileno(self) -> int:
+        return self.file.fileno()
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self) -> None:
+        self.file.close()
+        super().close()
+
+
+def _byteranges(path: str, ranges: List[Tuple[int, int]], size: int, content_type: str,
+                boundary: str) -> Tuple[Iterator[bytes], int]:
+    """multipart/byteranges body and its exact length"""
+    headers = [
+        f"--{boundary}\r\nContent-Type: {content_type}\r\nContent-Range: bytes {start}-{end}/{size}\r\n\r\n".encode()
+        for start, end in ranges
+    ]
+    closing = f"\r\n--{boundary}--\r\n".encode()
+    length = sum(len(header) + end - start + 1 for header, (start, end) in zip(headers, ranges))
+    length += 2 * (len(ranges) - 1) + len(closing)
+
+    def body():
+        with open(path, 'rb') as handle:
+            for index, (header, (start, end)) in enumerate(zip(headers, ranges)):
+                yield (b'\r\n' if index else b'') + header
+                handle.seek(start)
+                remaining = end - start + 1
+                while remaining:
+                    block = handle.read(min(BLOCK_SIZE, remaining))
+                    if not block:
+                        return
+                    remaining -= len(block)
+                    yield block
+        yield closing
+    return body(), length
+
+
+def _offloaded(config: Dict, file_instance) -> HttpResponse:
+    response = HttpResponse(content_type=file_instance.file_type or 'application/octet-stream')
+    if config['BACKEND'] == 'nginx':
+        response['X-Accel-Redirect'] = config['ACCEL_REDIRECT_PREFIX'] + quote(file_instance.file.name)
+    else:
+        response['X-Sendfile'] = file_instance.file.path
+    # The front-end server replaces the empty body and answers Range itself
+    return response
+
+
+def download_response(request, file_instance, as_attachment: bool = True) -> HttpResponse:
+    """Response for GET/HEAD of an uploaded file; permissions must already be checked"""
+    config = _download_config()
+    etag = f'"{ensure_content_hash(file_instance)}"'
+    if etag_matches(request, etag):
+        response = HttpResponseNotModified()
+    else:
+        if config['BACKEND'] in ('nginx', 'sendfile'):
+            response = _offloaded(config, file_instance)
+        else:
+            response = _django_response(request, file_instance, config, etag)
+        response['Accept-Ranges'] = 'bytes'
+        # Blobs are stored under their hash; downloads get the uploaded name
+        response['Content-Disposition'] = content_disposition_header(as_attachment, file_instance.original_filename)
+    response['ETag'] = etag
+    # Patient documents must not be stored by shared caches
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _django_response(request, file_instance, config: Dict, etag: str) -> HttpResponse:
+    content_type = file_instance.file_type or 'application/octet-stream'
+    path = file_instance.file.path
+    size = os.path.getsize(path)
+    ranges = parse_ranges(request.META.get('HTTP_RANGE'), size)
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if ranges is not None and if_range and if_range != etag:
+        # The client's partial copy is of other content
+        ranges = None
+    if ranges is not None and len(ranges) > config['MAX_RANGES']:
+        ranges = None
+
+    if ranges is None:
+        return FileResponse(open(path, 'rb'), content_type=content_type)
+    if not ranges:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f"bytes */{size}"
+        return response
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        response = FileResponse(FileRange(open(path, 'rb'), start, end - start + 1),
+                                content_type=content_type, status=206)
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = f"bytes {start}-{end}/{size}"
+        return response
+
+    boundary = uuid.uuid4().hex
+    body, length = _byteranges(path, ranges, size, content_type, boundary)
+    response = StreamingHttpResponse(body, status=206, content_type=f"multipart/byteranges; boundary={boundary}")
+    response['Content-Length'] = length
+    return response
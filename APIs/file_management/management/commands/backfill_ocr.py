@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from file_management.document_ocr import DOCUMENT_MIME_TYPES
+from file_management.models import UploadedFile
+from file_management.ocr_queue import enqueue_bulk
+
+
+class Command(BaseCommand):
+    help = "Queue OCR for unprocessed image and PDF files in the bulk lane (served after interactive jobs)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patient', type=int, action='append', dest='patients',
+                            help="Limit to a patient id (repeatable)")
+        parser.add_argument('--include-failed', action='store_true', help="Also retry files whose OCR failed")
+        parser.add_argument('--all', action='store_true', help="Re-OCR every file, processed or not")
+
+    def handle(self, *args, **options):
+        queryset = UploadedFile.objects.filter(Q(file_type__startswith='image/') | Q(file_type__in=DOCUMENT_MIME_TYPES))
+        if options['patients']:
+            queryset = queryset.filter(patient_id__in=options['patients'])
+        if not options['all']:
+            statuses = ['pending', 'failed'] if options['include_failed'] else ['pending']
+            queryset = queryset.filter(is_processed=False, processing_status__in=statuses)
+
+        queued = enqueue_bulk(queryset.values_list('id', flat=True))
+        self.stdout.write(self.style.SUCCESS(f"Queued {queued} files for OCR in the bulk lane"))
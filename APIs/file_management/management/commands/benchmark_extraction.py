@@ -0,0 +1,90 @@
+import gc
+import os
+import re
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from file_management.extraction import RULE_SETS, compile_rule_set, extract
+
+NAMED_GROUP_RE = re.compile(r'\(\?P<\w+>')
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'testdata', 'ocr_corpus')
+
+
+def _previous(text, data_type):
+    """The previous OCRProcessor approach: one search per field, lowercasing the text again each time"""
+    found = {}
+    for rule in RULE_SETS[data_type].rules:
+        if RULE_SETS[data_type].repeated:
+            # Medications were matched case-insensitively against the original text
+            found[rule.field] = [match.groupdict() for match in re.finditer(rule.pattern, text, re.IGNORECASE)]
+            continue
+        match = re.search(rule.pattern, text.lower())
+        if match:
+            found[rule.field] = match.groupdict()
+    return found
+
+
+def _single_pass(data_type):
+    """Every rule merged into one alternation, scanned once (zero-width so fields cannot hide each other)"""
+    rule_set = RULE_SETS[data_type]
+    alternatives = '|'.join(f"({NAMED_GROUP_RE.sub('(?:', rule.pattern)})" for rule in rule_set.rules)
+    combined = re.compile(alternatives if rule_set.repeated else f"(?=(?:{alternatives}))")
+
+    def run(text, _data_type):
+        found = {}
+        for match in combined.finditer(text.lower()):
+            found.setdefault(match.lastindex, match.group(match.lastindex))
+            if not rule_set.repeated and len(found) == len(rule_set.rules):
+                break
+        return found
+    return run
+
+
+def _load_corpus(directory):
+    texts = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.txt'):
+            with open(os.path.join(directory, name), encoding='utf-8') as handle:
+                texts.append(handle.read())
+    return texts
+
+
+class Command(BaseCommand):
+    help = "Micro-benchmark structured data extraction: previous per-field code, compiled rules and a single-pass alternation"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corpus', default=CORPUS_DIR, help="Directory of OCR text samples (*.txt)")
+        parser.add_argument('--iterations', type=int, default=2000)
+        parser.add_argument('--scale', type=int, default=1,
+                            help="Repeat each sample this many times to simulate multi-page documents")
+
+    def handle(self, *args, **options):
+        texts = _load_corpus(options['corpus'])
+        if not texts:
+            raise CommandError(f"No .txt samples in {options['corpus']}")
+        texts = ['\n'.join([text] * options['scale']) for text in texts]
+        iterations = options['iterations']
+        characters = sum(len(text) for text in texts)
+        self.stdout.write(f"{len(texts)} samples, {characters} characters, {iterations} iterations")
+
+        for data_type in RULE_SETS:
+            compile_rule_set(data_type)
+            variants = (('previous', _previous), ('compiled', extract), ('single-pass', _single_pass(data_type)))
+            timings = {}
+            for label, function in variants:
+                # As timeit does: collections over the loaded project's heap would dominate the timings
+                gc.collect()
+                gc.disable()
+                try:
+                    started = time.perf_counter()
+                    for _ in range(iterations):
+                        for text in texts:
+                            function(text, data_type)
+                    elapsed = time.perf_counter() - started
+                finally:
+                    gc.enable()
+                timings[label] = elapsed / (iterations * len(texts)) * 1e6
+            self.stdout.write(f"{data_type:16s} " + '  '.join(
+                f"{label} {microseconds:8.1f}us/doc" for label, microseconds in timings.items()
+            ) + f"  speedup {timings['previous'] / timings['compiled']:5.2f}x")
@@ -0,0 +1,101 @@
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image, ImageDraw
+
+from file_management.ocr_engine import create_engine, get_engine, init_engine
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp')
+SAMPLE_LINES = [
+    "Patient: DOE, JANE  DOB: 03/14/1948  MRN: 00123456",
+    "Glucose: 142 mg/dL  Hemoglobin: 11.8 g/dL  Creatinine: 1.3",
+    "BP: 148/92  HR: 88  Temp: 99.1  RR: 18  O2: 94%",
+    "Metoprolol 25 mg bid  Lisinopril 10 mg daily  Furosemide 40 mg",
+    "Assessment: CHF exacerbation, fall risk high, home safety review",
+]
+
+
+def _ocr_paths(paths):
+    """Worker task: OCR a batch of files with this process's engine"""
+    engine = get_engine()
+    chars = 0
+    for path in paths:
+        with Image.open(path) as image:
+            chars += len(engine.image_to_text(image))
+    return chars
+
+
+def _write_samples(directory, count):
+    """Synthetic corpus: small label/card snippets and full pages, alternating"""
+    paths = []
+    for index in range(count):
+        small = index % 2 == 0
+        size = (640, 160) if small else (1275, 1650)
+        image = Image.new('L', size, 255)
+        draw = ImageDraw.Draw(image)
+        lines = SAMPLE_LINES[:2] if small else SAMPLE_LINES * 12
+        for row, line in enumerate(lines):
+            draw.text((20, 20 + row * 24), line, fill=0)
+        path = os.path.join(directory, f"sample_{index:03d}.png")
+        image.save(path)
+        paths.append(path)
+    return paths
+
+
+class Command(BaseCommand):
+    help = "Compare OCR throughput of the per-image pytesseract path with persistent engine workers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corpus', help="Directory of sample images (default: generated samples)")
+        parser.add_argument('--samples', type=int, default=40, help="Number of generated samples")
+        parser.add_argument('--engines', default='pytesseract,tesserocr', help="Comma-separated engines to compare")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Pool processes")
+        parser.add_argument('--batch-size', type=int, default=8, help="Images per pool task")
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            if options['corpus']:
+                paths = sorted(
+                    os.path.join(options['corpus'], name) for name in os.listdir(options['corpus'])
+                    if name.lower().endswith(IMAGE_EXTENSIONS)
+                )
+            else:
+                paths = _write_samples(directory, options['samples'])
+            if not paths:
+                raise CommandError("No sample images found")
+
+            tesseract_cmd = getattr(settings, 'OCR_CONFIG', {}).get('TESSERACT_CMD')
+            baseline = None
+            self.stdout.write(f"{len(paths)} images, {options['workers']} workers, batch size {options['batch_size']}")
+            for name in [engine.strip() for engine in options['engines'].split(',') if engine.strip()]:
+                try:
+                    create_engine(name, tesseract_cmd=tesseract_cmd).close()
+                except Exception as e:
+                    self.stdout.write(self.style.WARNING(f"{name}: unavailable ({type(e).__name__}: {str(e)})"))
+                    continue
+                for mode, seconds in self._run(name, paths, tesseract_cmd, options):
+                    rate = len(paths) / seconds
+                    baseline = baseline or rate
+                    self.stdout.write(
+                        f"{name:12s} {mode:10s} {seconds:8.2f}s {rate:8.1f} images/s {rate / baseline:6.2f}x"
+                    )
+
+    def _run(self, name, paths, tesseract_cmd, options):
+        # Sequential: one engine in this process
+        init_engine(tesseract_cmd, backend=name)
+        started = time.perf_counter()
+        _ocr_paths(paths)
+        yield 'sequential', time.perf_counter() - started
+
+        # Pool: one engine per worker process, images sent in batches
+        batches = [paths[start:start + options['batch_size']] for start in range(0, len(paths), options['batch_size'])]
+        with ProcessPoolExecutor(options['workers'], initializer=init_engine, initargs=(tesseract_cmd, name)) as pool:
+            # Warm the workers so engine start-up is not timed
+            list(pool.map(_ocr_paths, [[]] * options['workers']))
+            started = time.perf_counter()
+            list(pool.map(_ocr_paths, batches))
+            yield 'pool', time.perf_counter() - started
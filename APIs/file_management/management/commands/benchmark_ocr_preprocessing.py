@@ -0,0 +1,109 @@
+import difflib
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image, ImageDraw, ImageFont
+
+from file_management.ocr_engine import get_engine
+from file_management.preprocessing import DEFAULT_STAGES, preprocess_image
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp')
+DEFAULT_VARIANTS = ['none', 'grayscale,downsample', ','.join(DEFAULT_STAGES)]
+SAMPLE_LINES = [
+    "HOME HEALTH VISIT NOTE",
+    "Patient: Jane Doe   DOB: 03/14/1948",
+    "BP 148/92   HR 88   Temp 99.1   O2 94%",
+    "Glucose 142 mg/dL   Hemoglobin 11.8 g/dL",
+    "Metoprolol 25 mg twice daily",
+    "Lisinopril 10 mg daily",
+    "Furosemide 40 mg every morning",
+    "Assessment: CHF with mild edema",
+    "Plan: daily weights, call MD if gain over 3 lb",
+]
+
+
+def _normalize(text):
+    return ' '.join(text.split()).lower()
+
+
+def _write_samples(directory, count, seed=7):
+    """Synthetic phone photos of a printed page (12MP, skewed, unevenly lit) with ground truth"""
+    rng = random.Random(seed)
+    font = ImageFont.load_default(size=64)
+    samples = []
+    for index in range(count):
+        lines = rng.sample(SAMPLE_LINES, 6)
+        page = Image.new('L', (2550, 3300), 255)
+        draw = ImageDraw.Draw(page)
+        for row, line in enumerate(lines):
+            draw.text((200, 300 + row * 120), line, fill=0, font=font)
+        photo = Image.new('L', (4032, 3024), 70)
+        page = page.rotate(rng.uniform(-5, 5), expand=True, fillcolor=70).resize((2700, 3400))
+        photo = photo.resize((3024, 4032))
+        photo.paste(page, (160, 300))
+        # Uneven lighting and sensor noise
+        array = np.asarray(photo, dtype=np.float32)
+        array *= np.linspace(0.75, 1.0, array.shape[1], dtype=np.float32)[None, :]
+        array += np.random.default_rng(seed + index).normal(0, 8, array.shape).astype(np.float32)
+        photo = Image.fromarray(np.clip(array, 0, 255).astype(np.uint8))
+        path = os.path.join(directory, f"photo_{index:03d}.jpg")
+        photo.save(path, quality=90)
+        samples.append((path, '\n'.join(lines)))
+    return samples
+
+
+def _load_corpus(directory):
+    """Images with a same-named .txt ground truth next to them"""
+    samples = []
+    for name in sorted(os.listdir(directory)):
+        stem, extension = os.path.splitext(name)
+        truth_path = os.path.join(directory, f"{stem}.txt")
+        if extension.lower() in IMAGE_EXTENSIONS and os.path.exists(truth_path):
+            with open(truth_path, encoding='utf-8') as handle:
+                samples.append((os.path.join(directory, name), handle.read()))
+    return samples
+
+
+class Command(BaseCommand):
+    help = "Measure OCR time per preprocessing stage and accuracy against ground truth for stage variants"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corpus', help="Directory of images with <name>.txt ground truth (default: generated photos)")
+        parser.add_argument('--samples', type=int, default=6, help="Number of generated samples")
+        parser.add_argument('--variant', action='append', dest='variants',
+                            help="Comma-separated stage list to compare, or 'none' (repeatable)")
+
+    def handle(self, *args, **options):
+        engine = get_engine()
+        with tempfile.TemporaryDirectory() as directory:
+            samples = _load_corpus(options['corpus']) if options['corpus'] else _write_samples(directory, options['samples'])
+            if not samples:
+                raise CommandError("No images with ground truth found")
+            self.stdout.write(f"{len(samples)} images, engine {engine.name}")
+
+            for variant in options['variants'] or DEFAULT_VARIANTS:
+                stages = [] if variant == 'none' else [stage.strip() for stage in variant.split(',') if stage.strip()]
+                totals, accuracy = {}, 0.0
+                for path, truth in samples:
+                    with Image.open(path) as image:
+                        prepared = preprocess_image(image, stages=stages)
+                    started = time.perf_counter()
+                    try:
+                        text = engine.image_to_text(prepared.image)
+                    except Exception as e:
+                        raise CommandError(f"OCR failed: {type(e).__name__}: {str(e)}")
+                    timings = dict(prepared.timings_ms, ocr=(time.perf_counter() - started) * 1000)
+                    for stage, ms in timings.items():
+                        totals[stage] = totals.get(stage, 0.0) + ms
+                    accuracy += difflib.SequenceMatcher(None, _normalize(truth), _normalize(text)).ratio()
+
+                count = len(samples)
+                stage_summary = '  '.join(f"{stage} {ms / count:.0f}ms" for stage, ms in totals.items())
+                self.stdout.write(
+                    f"{variant:55s} total {sum(totals.values()) / count:7.0f}ms/image  "
+                    f"accuracy {accuracy / count:6.1%}  [{stage_summary}]"
+                )
@@ -0,0 +1,74 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from file_management.bulk_ingest import IngestError, claim_ingest, create_ingest, poll_interval, run_ingest
+from file_management.models import FileCategory
+from patients.models import Patient
+
+
+class Command(BaseCommand):
+    help = (
+        "Ingest a ZIP archive of documents as uploaded files (OCR queued in the bulk lane), "
+        "or process archives queued through the API with --queued"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('archive', nargs='?', help="ZIP archive to ingest")
+        parser.add_argument('--manifest', default='', help="CSV with filename, mrn, category, description columns")
+        parser.add_argument('--user', help="Username recorded as the uploader")
+        parser.add_argument('--mrn', help="Patient for entries the manifest does not map")
+        parser.add_argument('--category', choices=FileCategory.values, default=FileCategory.OTHER)
+        parser.add_argument('--description', default='')
+        parser.add_argument('--queued', action='store_true', help="Process ingests queued through the API")
+        parser.add_argument('--loop', action='store_true', help="With --queued, keep polling for new ingests")
+
+    def handle(self, *args, **options):
+        if options['queued']:
+            self._run_queued(options['loop'])
+            return
+        if not options['archive'] or not options['user']:
+            raise CommandError("An archive and --user are required (or use --queued)")
+
+        try:
+            user = get_user_model().objects.get(username=options['user'])
+            patient = Patient.objects.get(mrn=options['mrn']) if options['mrn'] else None
+        except (get_user_model().DoesNotExist, Patient.DoesNotExist) as e:
+            raise CommandError(str(e))
+        try:
+            ingest = create_ingest(options['archive'], user, options['manifest'], patient, options['category'],
+                                   options['description'], status='running')
+        except IngestError as e:
+            raise CommandError(str(e))
+        self.stdout.write(f"Bulk ingest {ingest.pk}: {ingest.total_entries} entries")
+        self._report(run_ingest(ingest, progress=self._progress))
+
+    def _run_queued(self, loop: bool):
+        while True:
+            ingest = claim_ingest()
+            if ingest is None:
+                if not loop:
+                    break
+                time.sleep(poll_interval())
+                continue
+            self.stdout.write(f"Bulk ingest {ingest.pk} ({ingest.filename}): {ingest.total_entries} entries")
+            self._report(run_ingest(ingest, progress=self._progress))
+
+    def _progress(self, ingest):
+        self.stdout.write(
+            f"  {ingest.processed_entries}/{ingest.total_entries} entries: {ingest.created_files} created, "
+            f"{ingest.duplicate_entries} duplicates, {ingest.failed_entries} failed"
+        )
+
+    def _report(self, ingest):
+        for error in ingest.errors:
+            self.stdout.write(self.style.WARNING(f"  {error['entry']}: {error['error']}"))
+        if ingest.status == 'failed':
+            self.stdout.write(self.style.ERROR(f"Bulk ingest {ingest.pk} failed: {ingest.error_message}"))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Bulk ingest {ingest.pk} completed: {ingest.created_files} files created, "
+            f"{ingest.duplicate_entries} duplicates skipped, {ingest.failed_entries} failed, "
+            f"{ingest.ocr_queued} queued for OCR"
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from file_management.derivatives import prune_cache
+
+
+class Command(BaseCommand):
+    help = "Delete least recently used thumbnails and previews until the derivative cache fits its size limit"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-bytes', type=int, help="Target cache size (default: DERIVATIVE_CONFIG MAX_CACHE_BYTES)")
+
+    def handle(self, *args, **options):
+        deleted = prune_cache(options['max_bytes'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} cached derivatives"))
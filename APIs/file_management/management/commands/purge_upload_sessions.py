@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from file_management.chunked_upload import purge_expired_sessions
+
+
+class Command(BaseCommand):
+    help = "Delete expired and aborted chunked upload sessions along with their staging files"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-aborted', action='store_true', help="Only purge expired sessions")
+
+    def handle(self, *args, **options):
+        purged = purge_expired_sessions(include_aborted=not options['keep_aborted'])
+        self.stdout.write(self.style.SUCCESS(f"Purged {purged} upload sessions"))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from file_management.content_store import hash_missing_files, ocr_version
+from file_management.models import UploadedFile
+from file_management.ocr_queue import enqueue_bulk
+
+
+class Command(BaseCommand):
+    help = "Re-queue OCR (bulk lane) only for files produced by a different OCR engine/config version"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Report what would be queued")
+
+    def handle(self, *args, **options):
+        hashed = hash_missing_files()
+        if hashed:
+            self.stdout.write(f"Hashed {hashed} files uploaded before content hashing")
+
+        version = ocr_version()
+        stale = UploadedFile.objects.filter(is_processed=True).exclude(ocr_version=version)
+        # Files sharing content are OCRed once; the worker completes the rest from the OCR cache
+        stale_ids = list(stale.values_list('id', flat=True))
+        distinct_contents = stale.exclude(content_hash='').values('content_hash').distinct().count()
+        if options['dry_run']:
+            self.stdout.write(
+                f"OCR version {version}: {len(stale_ids)} files ({distinct_contents} distinct contents) would be queued"
+            )
+            return
+
+        queued = enqueue_bulk(stale_ids)
+        self.stdout.write(self.style.SUCCESS(f"OCR version {version}: queued {queued} files for reprocessing"))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from file_management.ocr_queue import OCRWorker
+
+
+class Command(BaseCommand):
+    help = "Run the OCR worker: claim queued OCR jobs (interactive lane first) and process them in a process pool"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help="Worker processes (default: OCR_CONFIG QUEUE WORKERS or CPU count)")
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is drained")
+
+    def handle(self, *args, **options):
+        worker = OCRWorker(workers=options['workers'])
+        self.stdout.write(f"OCR worker {worker.name} starting with {worker.workers} processes")
+        stats = worker.run(once=options['once'])
+        self.stdout.write(self.style.SUCCESS(
+            f"OCR worker stopped: {stats['completed']} completed, {stats['failed']} failed, "
+            f"{stats['retried']} retried"
+        ))
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_management', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OCRJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lane', models.IntegerField(choices=[(0, 'Interactive'), (1, 'Bulk Backfill')], default=0)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='queued', max_length=20)),
+                ('data_type', models.CharField(blank=True, help_text='Structured-data extractor; derived from the category if blank', max_length=30)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('error_message', models.TextField(blank=True)),
+                ('worker', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('heartbeat_at', models.DateTimeField(blank=True, help_text='Refreshed by the worker while the job runs', null=True)),
+                ('file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ocr_jobs', to='file_management.uploadedfile')),
+            ],
+            options={
+                'ordering': ['lane', 'created_at'],
+                'indexes': [models.Index(fields=['status', 'lane', 'created_at'], name='file_manage_status_d8ea88_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='ocrjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['queued', 'running'])), fields=('file',), name='ocr_job_one_active_per_file'),
+        ),
+    ]
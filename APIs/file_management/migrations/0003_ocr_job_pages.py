@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_management', '0002_ocr_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ocrjob',
+            name='pages_done',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='ocrjob',
+            name='pages_total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
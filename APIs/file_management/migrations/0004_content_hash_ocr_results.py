@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_management', '0003_ocr_job_pages'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OCRResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64)),
+                ('ocr_version', models.CharField(max_length=32)),
+                ('ocr_text', models.TextField(blank=True)),
+                ('metadata', models.JSONField(blank=True, default=dict)),
+                ('reuse_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='uploadedfile',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='uploadedfile',
+            name='ocr_version',
+            field=models.CharField(blank=True, help_text='OCR engine/config version that produced ocr_text', max_length=32),
+        ),
+        migrations.AddConstraint(
+            model_name='ocrresult',
+            constraint=models.UniqueConstraint(fields=('content_hash', 'ocr_version'), name='ocr_result_unique_version'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:55
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('file_management', '0004_content_hash_ocr_results'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=255)),
+                ('category', models.CharField(choices=[('lab_results', 'Lab Results'), ('imaging', 'Imaging'), ('forms', 'Forms'), ('prescriptions', 'Prescriptions'), ('insurance', 'Insurance Documents'), ('other', 'Other')], default='other', max_length=20)),
+                ('description', models.TextField(blank=True)),
+                ('declared_type', models.CharField(blank=True, max_length=100)),
+                ('detected_type', models.CharField(blank=True, help_text='MIME type sniffed from the first chunk', max_length=100)),
+                ('expected_sha256', models.CharField(blank=True, max_length=64)),
+                ('total_size', models.BigIntegerField()),
+                ('received_bytes', models.BigIntegerField(default=0)),
+                ('status', models.CharField(choices=[('uploading', 'Uploading'), ('completed', 'Completed'), ('aborted', 'Aborted')], default='uploading', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('expires_at', models.DateTimeField()),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to='patients.patient')),
+                ('uploaded_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('uploaded_file', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='file_management.uploadedfile')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'expires_at'], name='file_manage_status_34e06c_idx')],
+            },
+        ),
+    ]
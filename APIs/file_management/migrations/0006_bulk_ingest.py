@@ -0,0 +1,49 @@
+# Generated by Django 4.2.30 on 2026-10-19 07:17
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('patients', '0001_initial'),
+        ('file_management', '0005_upload_sessions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BulkIngest',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('category', models.CharField(choices=[('lab_results', 'Lab Results'), ('imaging', 'Imaging'), ('forms', 'Forms'), ('prescriptions', 'Prescriptions'), ('insurance', 'Insurance Documents'), ('other', 'Other')], default='other', max_length=20)),
+                ('description', models.TextField(blank=True)),
+                ('filename', models.CharField(max_length=255)),
+                ('archive_path', models.CharField(max_length=500)),
+                ('manifest_path', models.CharField(blank=True, max_length=500)),
+                ('remove_archive', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='queued', max_length=20)),
+                ('total_entries', models.PositiveIntegerField(default=0)),
+                ('processed_entries', models.PositiveIntegerField(default=0)),
+                ('created_files', models.PositiveIntegerField(default=0)),
+                ('duplicate_entries', models.PositiveIntegerField(default=0)),
+                ('failed_entries', models.PositiveIntegerField(default=0)),
+                ('ocr_queued', models.PositiveIntegerField(default=0)),
+                ('errors', models.JSONField(blank=True, default=list)),
+                ('error_message', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('patient', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='patients.patient')),
+                ('uploaded_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'updated_at'], name='file_manage_status_8dbede_idx')],
+            },
+        ),
+    ]
@@ -30,6 +30,8 @@ class UploadedFile(models.Model):
     file_size = models.PositiveIntegerField()  # in bytes
     file_type = models.CharField(max_length=50)  # MIME type
     category = models.CharField(max_length=20, choices=FileCategory.choices, default=FileCategory.OTHER)
+    # SHA-256 of the content; identical uploads share one stored blob
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
     
     # OCR and AI processing
     ocr_text = models.TextField(blank=True)
@@ -41,6 +43,7 @@ class UploadedFile(models.Model):
         ('completed', 'Completed'),
         ('failed', 'Failed'),
     ], default='pending')
+    ocr_version = models.CharField(max_length=32, blank=True, help_text="OCR engine/config version that produced ocr_text")
     
     # Metadata
     description = models.TextField(blank=True)
@@ -64,3 +67,155 @@ class UploadedFile(models.Model):
             self.file_size = self.file.size
             self.file_type = getattr(self.file.file, 'content_type', 'application/octet-stream')
         super().save(*args, **kwargs)
+
+
+class OCRLane(models.IntegerChoices):
+    # Lower value = served first
+    INTERACTIVE = 0, 'Interactive'
+    BULK = 1, 'Bulk Backfill'
+
+
+class OCRJob(models.Model):
+    """Queued OCR work for an uploaded file, picked up by the OCR worker (run_ocr_worker)"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    file = models.ForeignKey(UploadedFile, on_delete=models.CASCADE, related_name='ocr_jobs')
+    lane = models.IntegerField(choices=OCRLane.choices, default=OCRLane.INTERACTIVE)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    data_type = models.CharField(max_length=30, blank=True, help_text="Structured-data extractor; derived from the category if blank")
+    attempts = models.PositiveIntegerField(default=0)
+    pages_total = models.PositiveIntegerField(default=0)
+    pages_done = models.PositiveIntegerField(default=0)
+    error_message = models.TextField(blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True, help_text="Refreshed by the worker while the job runs")
+
+    class Meta:
+        ordering = ['lane', 'created_at']
+        indexes = [
+            models.Index(fields=['status', 'lane', 'created_at']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['file'], condition=models.Q(status__in=['queued', 'running']),
+                                    name='ocr_job_one_active_per_file'),
+        ]
+
+    def __str__(self):
+        return f"OCR job #{self.pk} for file #{self.file_id} ({self.get_lane_display()}, {self.status})"
+
+
+class OCRResult(models.Model):
+    """OCR output cached per (content hash, OCR version); reused for duplicate uploads and re-OCR"""
+    content_hash = models.CharField(max_length=64)
+    ocr_version = models.CharField(max_length=32)
+    ocr_text = models.TextField(blank=True)
+    # Page and preprocessing details recorded alongside the structured data
+    metadata = models.JSONField(default=dict, blank=True)
+    reuse_count = models.PositiveIntegerField(default=0)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['content_hash', 'ocr_version'], name='ocr_result_unique_version'),
+        ]
+
+    def __str__(self):
+        return f"OCR result {self.content_hash[:12]} ({self.ocr_version})"
+
+
+class UploadSession(models.Model):
+    """Resumable chunked upload: chunks are appended to a staging file until finalized into an UploadedFile"""
+    STATUS_CHOICES = [
+        ('uploading', 'Uploading'),
+        ('completed', 'Completed'),
+        ('aborted', 'Aborted'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='upload_sessions')
+    uploaded_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    
+    filename = models.CharField(max_length=255)
+    category = models.CharField(max_length=20, choices=FileCategory.choices, default=FileCategory.OTHER)
+    description = models.TextField(blank=True)
+    declared_type = models.CharField(max_length=100, blank=True)
+    detected_type = models.CharField(max_length=100, blank=True, help_text="MIME type sniffed from the first chunk")
+    expected_sha256 = models.CharField(max_length=64, blank=True)
+    
+    total_size = models.BigIntegerField()
+    # Bytes acknowledged so far; the next chunk must start here
+    received_bytes = models.BigIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='uploading')
+    uploaded_file = models.ForeignKey(UploadedFile, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'expires_at']),
+        ]
+
+    def __str__(self):
+        return f"Upload {self.id} ({self.filename}, {self.received_bytes}/{self.total_size} bytes)"
+
+
+class BulkIngest(models.Model):
+    """ZIP archive of documents being ingested as UploadedFiles (bulk_ingest), with progress and per-entry errors"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    uploaded_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    # Used for entries the manifest does not map to a patient
+    patient = models.ForeignKey(Patient, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    category = models.CharField(max_length=20, choices=FileCategory.choices, default=FileCategory.OTHER)
+    description = models.TextField(blank=True)
+    
+    filename = models.CharField(max_length=255)
+    archive_path = models.CharField(max_length=500)
+    manifest_path = models.CharField(max_length=500, blank=True)
+    # Archives uploaded through the API are deleted once ingested
+    remove_archive = models.BooleanField(default=False)
+    
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    total_entries = models.PositiveIntegerField(default=0)
+    # Entries before this index are done; an interrupted ingest resumes here
+    processed_entries = models.PositiveIntegerField(default=0)
+    created_files = models.PositiveIntegerField(default=0)
+    duplicate_entries = models.PositiveIntegerField(default=0)
+    failed_entries = models.PositiveIntegerField(default=0)
+    ocr_queued = models.PositiveIntegerField(default=0)
+    # [{'entry': name, 'error': message}, ...], capped at BULK_INGEST_CONFIG MAX_ERRORS
+    errors = models.JSONField(default=list, blank=True)
+    error_message = models.TextField(blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'updated_at']),
+        ]
+
+    def __str__(self):
+        return f"Bulk ingest {self.id} ({self.filename}, {self.processed_entries}/{self.total_entries} entries)"
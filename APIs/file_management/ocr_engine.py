@@ -0,0 +1,156 @@
+"""
+OCR engines
+One interface over the ways of running tesseract:
+- tesserocr: binds libtesseract directly; the API and traineddata are loaded
+  once per process and images are handed over in memory (no temp files, no
+  process spawn per image)
+- pytesseract: spawns the tesseract CLI per image (the fallback when
+  tesserocr is not installed)
+- OCR_CONFIG ENGINE BACKEND selects 'tesserocr', 'pytesseract' or 'auto'
+  (tesserocr when it loads); get_engine() keeps one engine per process,
+  so OCR worker processes load it once at start-up and reuse it for every job
+"""
+
+import logging
+import shutil
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+import pytesseract
+from django.conf import settings
+
+logger = logging.getLogger('file_management')
+
+
+def _engine_config() -> Dict:
+    ocr_config = getattr(settings, 'OCR_CONFIG', {})
+    config = {
+        'BACKEND': 'auto',
+        'LANG': 'eng',
+        'TESSDATA_PATH': None,
+    }
+    config.update(ocr_config.get('ENGINE', {}))
+    return config
+
+
+def _use_tesseract_cmd(tesseract_cmd: Optional[str]) -> None:
+    # Ignore a configured binary that is not present on this host
+    if tesseract_cmd and shutil.which(tesseract_cmd):
+        pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+
+
+class OCREngine:
+    """Image-to-text backend"""
+    name = 'base'
+
+    def image_to_text(self, image) -> str:
+        raise NotImplementedError
+
+    def images_to_text(self, images) -> List[str]:
+        return [self.image_to_text(image) for image in images]
+
+    def version(self) -> str:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class PytesseractEngine(OCREngine):
+    """tesseract CLI via pytesseract: one process spawn and traineddata load per image"""
+    name = 'pytesseract'
+
+    def __init__(self, lang: str = 'eng', tesseract_cmd: Optional[str] = None):
+        self.lang = lang
+        _use_tesseract_cmd(tesseract_cmd)
+
+    def image_to_text(self, image) -> str:
+        return pytesseract.image_to_string(image, lang=self.lang).strip()
+
+    def version(self) -> str:
+        return str(pytesseract.get_tesseract_version())
+
+
+class TesserocrEngine(OCREngine):
+    """Long-lived libtesseract API; images are passed in memory"""
+    name = 'tesserocr'
+
+    def __init__(self, lang: str = 'eng', tessdata_path: Optional[str] = None):
+        import tesserocr
+
+        kwargs = {'lang': lang}
+        if tessdata_path:
+            kwargs['path'] = tessdata_path
+        self._api = tesserocr.PyTessBaseAPI(**kwargs)
+
+    def image_to_text(self, image) -> str:
+        self._api.SetImage(image)
+        return self._api.GetUTF8Text().strip()
+
+    def version(self) -> str:
+        import tesserocr
+
+        return tesserocr.tesseract_version().splitlines()[0]
+
+    def close(self) -> None:
+        self._api.End()
+
+
+def create_engine(name: Optional[str] = None, tesseract_cmd: Optional[str] = None) -> OCREngine:
+    config = _engine_config()
+    name = name or config['BACKEND']
+    if name in ('auto', 'tesserocr'):
+        try:
+            return TesserocrEngine(config['LANG'], config['TESSDATA_PATH'])
+        except ImportError:
+            if name == 'tesserocr':
+                raise
+        except RuntimeError as e:
+            # tesserocr is installed but could not load traineddata
+            if name == 'tesserocr':
+                raise
+            logger.warning(f"tesserocr unavailable ({str(e)}); falling back to pytesseract")
+    elif name != 'pytesseract':
+        raise ValueError(f"Unknown OCR engine: {name}")
+    return PytesseractEngine(config['LANG'], tesseract_cmd)
+
+
+_engine: Optional[OCREngine] = None
+
+
+def get_engine() -> OCREngine:
+    """The engine of this process, created on first use"""
+    global _engine
+    if _engine is None:
+        _engine = create_engine(tesseract_cmd=getattr(settings, 'OCR_CONFIG', {}).get('TESSERACT_CMD'))
+    return _engine
+
+
+def init_engine(tesseract_cmd: Optional[str] = None, backend: Optional[str] = None) -> OCREngine:
+    """Load the engine now (process-pool initializer), replacing any existing one"""
+    global _engine
+    if _engine is not None:
+        _engine.close()
+    _engine = create_engine(backend, tesseract_cmd=tesseract_cmd)
+    return _engine
+
+
+@lru_cache(maxsize=1)
+def engine_signature() -> Dict:
+    """Backend, tesseract version and language the OCR workers will use (part of the OCR cache key)"""
+    config = _engine_config()
+    try:
+        # The engine create_engine() really yields on this host, after any 'auto' fallback
+        engine = _engine or create_engine(tesseract_cmd=getattr(settings, 'OCR_CONFIG', {}).get('TESSERACT_CMD'))
+    except Exception as e:
+        logger.warning(f"OCR engine unavailable: {str(e)}")
+        return {'backend': config['BACKEND'], 'tesseract': 'unavailable', 'lang': config['LANG']}
+    try:
+        version = engine.version()
+    except (Exception, SystemExit):
+        # pytesseract exits on an unparseable version string
+        version = 'unavailable'
+    finally:
+        if engine is not _engine:
+            engine.close()
+    return {'backend': engine.name, 'tesseract': version, 'lang': config['LANG']}
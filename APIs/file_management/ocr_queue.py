@@ -0,0 +1,463 @@
+"""
+OCR job queue
+Takes OCR off the request path:
+- Uploads and re-OCR requests enqueue an OCRJob and return immediately
+- Two priority lanes: interactive (uploads, manual re-OCR) is always served
+  before bulk (backfills), and bulk work never takes the slots reserved
+  for interactive jobs
+- The worker (run_ocr_worker) claims jobs in batches and runs tesseract in
+  a process pool sized to the CPU cores; each pool process keeps one OCR
+  engine loaded, and small images are sent several to a task
+- PDFs and TIFF faxes fan out page by page over the same pool; pages with
+  an embedded text layer skip OCR, and page progress is recorded as each
+  page finishes
+- Content already OCRed with the current OCR version is completed from the
+  OCR cache (content_store) without running OCR
+- New uploads also get their thumbnail and preview rendered on the pool
+  (derivatives), so file lists never wait for them
+- Every status change on UploadedFile.processing_status is a single
+  update() call; failed jobs are retried up to MAX_ATTEMPTS
+- A worker refreshes heartbeat_at on its jobs every HEARTBEAT_SECONDS and
+  requeues other workers' jobs whose heartbeat is older than JOB_TIMEOUT
+  (their worker died); a job that has already used MAX_ATTEMPTS is failed
+  instead, so a file that crashes its worker is not retried forever
+"""
+
+import logging
+import os
+import socket
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .content_store import cached_ocr_result, ocr_version, save_ocr_result
+from .models import OCRJob, OCRLane, UploadedFile
+from .derivatives import eager_derivatives, generate_derivatives, supports_derivatives
+from .document_ocr import DOCUMENT_MIME_TYPES, assemble_pages, document_kind, ocr_page, plan_pages
+from .ocr_utils import OCRJobError, init_ocr_worker, ocr_result, run_ocr_batch
+
+logger = logging.getLogger('file_management')
+
+ACTIVE_STATUSES = ('queued', 'running')
+CATEGORY_DATA_TYPES = {
+    'lab_results': 'lab_values',
+    'forms': 'vital_signs',
+    'prescriptions': 'medication_list',
+    'insurance': 'insurance_info',
+}
+
+
+def _queue_config() -> Dict:
+    ocr_config = getattr(settings, 'OCR_CONFIG', {})
+    config = {
+        'WORKERS': os.cpu_count() or 1,
+        'INTERACTIVE_RESERVED': 1,
+        'POLL_INTERVAL': 1.0,
+        'MAX_ATTEMPTS': 3,
+        # A running job whose heartbeat is older than this is requeued (its worker died)
+        'JOB_TIMEOUT': 600,
+        # Workers mark their jobs alive this often (capped at half of JOB_TIMEOUT)
+        'HEARTBEAT_SECONDS': 60,
+        # Images at or below this size are OCRed several to a worker task
+        'SMALL_IMAGE_BYTES': 512 * 1024,
+        'BATCH_SIZE': 8,
+    }
+    config.update(ocr_config.get('QUEUE', {}))
+    return config
+
+
+def is_ocr_candidate(file_instance: UploadedFile) -> bool:
+    return file_instance.file_type.startswith('image/') or file_instance.file_type in DOCUMENT_MIME_TYPES
+
+
+def data_type_for(file_instance: UploadedFile) -> str:
+    return CATEGORY_DATA_TYPES.get(file_instance.category, 'general')
+
+
+def enqueue_ocr(file_instance: UploadedFile, lane: int = OCRLane.INTERACTIVE, data_type: str = '') -> OCRJob:
+    """
+    Queue OCR for a file. A file has at most one active job; re-enqueueing
+    returns it, promoting it to the more urgent lane if needed. Content that
+    was already OCRed with the current OCR version is completed at once from
+    the cache.
+    """
+    active = OCRJob.objects.filter(file=file_instance, status__in=ACTIVE_STATUSES).first()
+    if active is None:
+        version = ocr_version()
+        cached = cached_ocr_result(file_instance.content_hash, data_type or data_type_for(file_instance), version)
+        if cached is not None:
+            return _complete_from_cache(file_instance, lane, data_type, cached, version)
+        try:
+            with transaction.atomic():
+                active = OCRJob.objects.create(file=file_instance, lane=lane, data_type=data_type)
+                UploadedFile.objects.filter(pk=file_instance.pk).update(
+                    processing_status='pending', updated_at=timezone.now()
+                )
+            file_instance.processing_status = 'pending'
+            return active
+        except IntegrityError:
+            # Another request queued it first
+            active = OCRJob.objects.get(file=file_instance, status__in=ACTIVE_STATUSES)
+    if lane < active.lane:
+        OCRJob.objects.filter(pk=active.pk, status='queued').update(lane=lane)
+        active.lane = lane
+    return active
+
+
+def _complete_from_cache(file_instance: UploadedFile, lane: int, data_type: str, result: Dict,
+                         version: str) -> OCRJob:
+    now = timezone.now()
+    with transaction.atomic():
+        job = OCRJob.objects.create(file=file_instance, lane=lane, data_type=data_type, status='running',
+                                    worker='cache', started_at=now)
+        complete_job({'job_id': job.pk, 'file_id': file_instance.pk}, result, version, from_cache=True)
+    job.status, job.finished_at = 'completed', now
+    file_instance.ocr_text = result['ocr_text']
+    file_instance.structured_data = result['structured_data']
+    file_instance.is_processed = True
+    file_instance.processing_status = 'completed'
+    file_instance.ocr_version = version
+    return job
+
+
+def enqueue_bulk(file_ids: Iterable[int], lane: int = OCRLane.BULK) -> int:
+    """Queue many files in the bulk lane (files that already have an active job are skipped)"""
+    file_ids = list(file_ids)
+    busy = set(OCRJob.objects.filter(file_id__in=file_ids, status__in=ACTIVE_STATUSES)
+               .values_list('file_id', flat=True))
+    jobs = [OCRJob(file_id=file_id, lane=lane) for file_id in file_ids if file_id not in busy]
+    with transaction.atomic():
+        OCRJob.objects.bulk_create(jobs, batch_size=1000, ignore_conflicts=True)
+        UploadedFile.objects.filter(pk__in=[job.file_id for job in jobs]).update(
+            processing_status='pending', updated_at=timezone.now()
+        )
+    return len(jobs)
+
+
+def queue_position(job: OCRJob) -> Optional[int]:
+    """Jobs that will be served before this one (None once it has left the queue)"""
+    if job.status != 'queued':
+        return None
+    return OCRJob.objects.filter(status='queued').filter(
+        lane__lt=job.lane
+    ).count() + OCRJob.objects.filter(status='queued', lane=job.lane, created_at__lt=job.created_at).count()
+
+
+def job_status(file_instance: UploadedFile) -> Dict:
+    job = file_instance.ocr_jobs.order_by('-created_at').first()
+    status = {
+        'file_id': file_instance.pk,
+        'processing_status': file_instance.processing_status,
+        'is_processed': file_instance.is_processed,
+        'job': None,
+    }
+    if job is not None:
+        status['job'] = {
+            'id': job.pk,
+            'lane': job.get_lane_display(),
+            'status': job.status,
+            'attempts': job.attempts,
+            'pages_total': job.pages_total,
+            'pages_done': job.pages_done,
+            'queue_position': queue_position(job),
+            'error_message': job.error_message,
+            'created_at': job.created_at,
+            'started_at': job.started_at,
+            'finished_at': job.finished_at,
+        }
+    return status
+
+
+def claim_jobs(lane: int, limit: int, worker: str, max_file_size: Optional[int] = None) -> List[Dict]:
+    """Atomically move up to `limit` queued jobs of a lane to running"""
+    if limit <= 0:
+        return []
+    with transaction.atomic():
+        queued = OCRJob.objects.filter(status='queued', lane=lane).order_by('created_at')
+        if max_file_size is not None:
+            queued = queued.filter(file__file_size__lte=max_file_size)
+        if connection.features.has_select_for_update_skip_locked:
+            queued = queued.select_for_update(skip_locked=True)
+        jobs = list(queued.select_related('file')[:limit])
+        if not jobs:
+            return []
+        now = timezone.now()
+        OCRJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+            status='running', started_at=now, heartbeat_at=now, attempts=F('attempts') + 1, worker=worker,
+            pages_total=0, pages_done=0,
+        )
+        UploadedFile.objects.filter(pk__in=[job.file_id for job in jobs]).update(
+            processing_status='processing', updated_at=now
+        )
+    return [
+        {
+            'job_id': job.pk,
+            'file_id': job.file_id,
+            'lane': job.lane,
+            'attempts': job.attempts + 1,
+            'path': job.file.file.path,
+            'content_hash': job.file.content_hash,
+            'file_size': job.file.file_size,
+            'data_type': job.data_type or data_type_for(job.file),
+        }
+        for job in jobs
+    ]
+
+
+def complete_job(claim: Dict, result: Dict, version: str, from_cache: bool = False) -> None:
+    now = timezone.now()
+    with transaction.atomic():
+        UploadedFile.objects.filter(pk=claim['file_id']).update(
+            ocr_text=result['ocr_text'],
+            structured_data=result['structured_data'],
+            is_processed=True,
+            processing_status='completed',
+            ocr_version=version,
+            updated_at=now,
+        )
+        OCRJob.objects.filter(pk=claim['job_id']).update(status='completed', finished_at=now, error_message='')
+        if not from_cache:
+            save_ocr_result(claim['content_hash'], version, result)
+
+
+def fail_job(claim: Dict, error: str, max_attempts: int) -> None:
+    now = timezone.now()
+    with transaction.atomic():
+        if claim['attempts'] < max_attempts:
+            OCRJob.objects.filter(pk=claim['job_id']).update(status='queued', error_message=error)
+            UploadedFile.objects.filter(pk=claim['file_id']).update(processing_status='pending', updated_at=now)
+            return
+        OCRJob.objects.filter(pk=claim['job_id']).update(status='failed', finished_at=now, error_message=error)
+        UploadedFile.objects.filter(pk=claim['file_id']).update(
+            processing_status='failed', structured_data={'error': error}, updated_at=now
+        )
+
+
+def heartbeat_jobs(job_ids: Iterable[int], worker: str) -> int:
+    """Mark a worker's running jobs alive"""
+    return OCRJob.objects.filter(pk__in=list(job_ids), status='running', worker=worker).update(
+        heartbeat_at=timezone.now()
+    )
+
+
+def requeue_stale_jobs(timeout_seconds: int, max_attempts: Optional[int] = None) -> Dict[str, int]:
+    """
+    Return running jobs whose heartbeat stopped (worker died) to the queue;
+    jobs that already used max_attempts are failed instead
+    """
+    max_attempts = _queue_config()['MAX_ATTEMPTS'] if max_attempts is None else max_attempts
+    now = timezone.now()
+    counts = {'requeued': 0, 'failed': 0}
+    with transaction.atomic():
+        stale = OCRJob.objects.filter(status='running', heartbeat_at__lt=now - timedelta(seconds=timeout_seconds))
+        if connection.features.has_select_for_update_skip_locked:
+            stale = stale.select_for_update(skip_locked=True)
+        jobs = list(stale.values_list('pk', 'file_id', 'attempts'))
+        retry = [(pk, file_id) for pk, file_id, attempts in jobs if attempts < max_attempts]
+        give_up = [(pk, file_id) for pk, file_id, attempts in jobs if attempts >= max_attempts]
+        if retry:
+            counts['requeued'] = OCRJob.objects.filter(pk__in=[pk for pk, _ in retry]).update(status='queued')
+            UploadedFile.objects.filter(pk__in=[file_id for _, file_id in retry]).update(
+                processing_status='pending', updated_at=now
+            )
+        if give_up:
+            error = f"OCR worker stopped responding ({max_attempts} attempts)"
+            counts['failed'] = OCRJob.objects.filter(pk__in=[pk for pk, _ in give_up]).update(
+                status='failed', finished_at=now, error_message=error
+            )
+            UploadedFile.objects.filter(pk__in=[file_id for _, file_id in give_up]).update(
+                processing_status='failed', structured_data={'error': error}, updated_at=now
+            )
+    return counts
+
+
+class OCRWorker:
+    """Claims queued OCR jobs and runs them in a process pool"""
+
+    def __init__(self, workers: int = None):
+        self.config = _queue_config()
+        self.small_image_bytes = self.config['SMALL_IMAGE_BYTES']
+        self.batch_size = max(self.config['BATCH_SIZE'], 1)
+        self.workers = workers or self.config['WORKERS']
+        # Bulk jobs may use every slot except the ones reserved for interactive work
+        self.bulk_slots = max(self.workers - self.config['INTERACTIVE_RESERVED'], 1)
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self.ocr_version = ocr_version()
+        self.eager_derivatives = eager_derivatives()
+        self.stats = {'completed': 0, 'failed': 0, 'retried': 0, 'reused': 0}
+        self.heartbeat_seconds = min(self.config['HEARTBEAT_SECONDS'], self.config['JOB_TIMEOUT'] / 2)
+        self.last_beat = None
+        # Multi-page documents in flight: job id -> collected pages and pending page futures
+        self._documents: Dict[int, Dict] = {}
+
+    def run(self, once: bool = False) -> Dict[str, int]:
+        """Process jobs until interrupted (or until the queue is empty with once=True)"""
+        self._maintain({})
+
+        # Forked workers must not share the parent's database connections
+        connections.close_all()
+        tesseract_cmd = getattr(settings, 'OCR_CONFIG', {}).get('TESSERACT_CMD')
+        in_flight = {}
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=init_ocr_worker,
+                                 initargs=(tesseract_cmd,)) as pool:
+            try:
+                while True:
+                    self._maintain(in_flight)
+                    claimed = self._fill(pool, in_flight)
+                    if not in_flight:
+                        if claimed:
+                            # Everything claimed was answered from the cache; claim again
+                            continue
+                        if once:
+                            break
+                        time.sleep(self.config['POLL_INTERVAL'])
+                        continue
+                    done, _ = wait(in_flight, timeout=self.config['POLL_INTERVAL'], return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._finish(*in_flight.pop(future), future)
+            except KeyboardInterrupt:
+                logger.info("OCR worker stopping; in-flight jobs will finish first")
+                for future in list(in_flight):
+                    self._finish(*in_flight.pop(future), future)
+        return self.stats
+
+    def _maintain(self, in_flight: Dict) -> None:
+        """Heartbeat this worker's jobs and requeue those of dead workers, when due"""
+        if self.last_beat is not None and time.monotonic() - self.last_beat < self.heartbeat_seconds:
+            return
+        job_ids = {claim['job_id'] for claims, _ in in_flight.values() for claim in claims}
+        if job_ids:
+            heartbeat_jobs(job_ids, self.name)
+        stale = requeue_stale_jobs(self.config['JOB_TIMEOUT'], self.config['MAX_ATTEMPTS'])
+        if stale['requeued']:
+            logger.warning(f"Requeued {stale['requeued']} stale OCR jobs")
+        if stale['failed']:
+            logger.error(f"Failed {stale['failed']} stale OCR jobs that reached {self.config['MAX_ATTEMPTS']} attempts")
+        self.last_beat = time.monotonic()
+
+    def _fill(self, pool, in_flight: Dict) -> int:
+        free = self.workers - len(in_flight)
+        claims = claim_jobs(OCRLane.INTERACTIVE, free, self.name)
+        bulk_running = sum(1 for claims_, _ in in_flight.values() if claims_[0]['lane'] == OCRLane.BULK)
+        claims += claim_jobs(OCRLane.BULK, min(free - len(claims), self.bulk_slots - bulk_running), self.name)
+        for claim in claims:
+            self._submit_derivatives(pool, claim)
+            if self._complete_cached(claim):
+                continue
+            if document_kind(claim['path']):
+                self._submit_document(pool, in_flight, claim)
+            elif claim['file_size'] <= self.small_image_bytes:
+                # Fill the task with more small images from the same lane
+                extras = claim_jobs(claim['lane'], self.batch_size - 1, self.name, max_file_size=self.small_image_bytes)
+                for extra in extras:
+                    self._submit_derivatives(pool, extra)
+                batch = [claim] + [extra for extra in extras if not self._complete_cached(extra)]
+                self._submit_files(pool, in_flight, batch)
+            else:
+                self._submit_files(pool, in_flight, [claim])
+        return len(claims)
+
+    def _complete_cached(self, claim: Dict) -> bool:
+        """Finish the job from the OCR cache if this content was OCRed with the current version"""
+        cached = cached_ocr_result(claim['content_hash'], claim['data_type'], self.ocr_version)
+        if cached is None:
+            return False
+        complete_job(claim, cached, self.ocr_version, from_cache=True)
+        self.stats['completed'] += 1
+        self.stats['reused'] += 1
+        return True
+
+    def _submit_derivatives(self, pool, claim: Dict) -> None:
+        """Render thumbnail and preview of a new upload; untracked, failures only logged"""
+        # Bulk backfills are left to lazy generation on first request
+        if claim['lane'] != OCRLane.INTERACTIVE or not self.eager_derivatives:
+            return
+        if not claim['content_hash'] or not supports_derivatives(claim['path']):
+            return
+        file_id = claim['file_id']
+
+        def log_failure(future):
+            if not future.cancelled() and future.exception() is not None:
+                logger.warning(f"Derivatives failed for file {file_id}: {future.exception()}")
+
+        pool.submit(generate_derivatives, claim['path'], claim['content_hash']).add_done_callback(log_failure)
+
+    def _submit_files(self, pool, in_flight: Dict, claims: List[Dict]) -> None:
+        items = [(claim['path'], claim['data_type']) for claim in claims]
+        in_flight[pool.submit(run_ocr_batch, items)] = (claims, None)
+
+    def _submit_document(self, pool, in_flight: Dict, claim: Dict) -> None:
+        """Read the text layer here and queue one pool task per page that needs OCR"""
+        try:
+            text_pages, ocr_pages = plan_pages(claim['path'])
+        except Exception as e:
+            self._record_failure(claim, str(e) if isinstance(e, OCRJobError) else f"{type(e).__name__}: {str(e)}")
+            return
+        OCRJob.objects.filter(pk=claim['job_id']).update(
+            pages_total=len(text_pages) + len(ocr_pages), pages_done=len(text_pages)
+        )
+        document = {'pages': text_pages, 'remaining': set(ocr_pages), 'futures': []}
+        if not ocr_pages:
+            self._complete_document(claim, document)
+            return
+        self._documents[claim['job_id']] = document
+        for index in ocr_pages:
+            future = pool.submit(ocr_page, claim['path'], index)
+            document['futures'].append(future)
+            in_flight[future] = ([claim], index)
+
+    def _finish(self, claims: List[Dict], page: Optional[int], future) -> None:
+        if page is not None:
+            self._finish_page(claims[0], page, future)
+            return
+        try:
+            outcomes = future.result()
+        except Exception as e:
+            outcomes = [(False, f"{type(e).__name__}: {str(e)}")] * len(claims)
+        for claim, (succeeded, result) in zip(claims, outcomes):
+            if succeeded:
+                complete_job(claim, result, self.ocr_version)
+                self.stats['completed'] += 1
+            else:
+                self._record_failure(claim, result)
+
+    def _finish_page(self, claim: Dict, page: int, future) -> None:
+        document = self._documents.get(claim['job_id'])
+        if document is None:
+            # Another page of this document already failed
+            return
+        try:
+            result = future.result()
+        except Exception as e:
+            # Give up on the whole document; pages not yet started are cancelled
+            del self._documents[claim['job_id']]
+            for other in document['futures']:
+                other.cancel()
+            self._record_failure(claim, str(e) if isinstance(e, OCRJobError) else f"{type(e).__name__}: {str(e)}")
+            return
+        document['pages'].append(result)
+        document['remaining'].discard(page)
+        OCRJob.objects.filter(pk=claim['job_id']).update(pages_done=F('pages_done') + 1)
+        if not document['remaining']:
+            del self._documents[claim['job_id']]
+            self._complete_document(claim, document)
+
+    def _complete_document(self, claim: Dict, document: Dict) -> None:
+        assembled = assemble_pages(document['pages'])
+        result = ocr_result(assembled['text'], claim['data_type'], pages=assembled['pages'])
+        complete_job(claim, result, self.ocr_version)
+        self.stats['completed'] += 1
+
+    def _record_failure(self, claim: Dict, error: str) -> None:
+        fail_job(claim, error, self.config['MAX_ATTEMPTS'])
+        if claim['attempts'] < self.config['MAX_ATTEMPTS']:
+            self.stats['retried'] += 1
+        else:
+            self.stats['failed'] += 1
+            logger.error(f"OCR failed for file {claim['file_id']}: {error}")
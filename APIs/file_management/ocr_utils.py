@@ -1,8 +1,10 @@
-import pytesseract
 from PIL import Image
 import json
 import re
-from typing import Dict, Any
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from .extraction import extract
 
 
 class OCRProcessor:
@@ -12,12 +14,31 @@ class OCRProcessor:
     def extract_text_from_image(image_path: str) -> str:
         """Extract text from image using OCR"""
         try:
-            image = Image.open(image_path)
-            text = pytesseract.image_to_string(image)
-            return text.strip()
+            return OCRProcessor.image_to_text(image_path)
         except Exception as e:
             return f"OCR Error: {str(e)}"
     
+    @staticmethod
+    def image_to_text(image_path: str) -> str:
+        """Extract text from image using OCR, raising on failure"""
+        return OCRProcessor.image_to_text_with_stats(image_path)[0]
+    
+    @staticmethod
+    def image_to_text_with_stats(image_path: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """OCR text plus preprocessing stage timings (None when preprocessing is off)"""
+        from .ocr_engine import get_engine
+        from .preprocessing import preprocess_file, preprocessing_enabled
+
+        if not preprocessing_enabled():
+            with Image.open(image_path) as image:
+                return get_engine().image_to_text(image), None
+        prepared = preprocess_file(image_path)
+        started = time.perf_counter()
+        text = get_engine().image_to_text(prepared.image)
+        stats = prepared.to_dict()
+        stats['timings_ms']['ocr'] = round((time.perf_counter() - started) * 1000, 2)
+        return text, stats
+    
     @staticmethod
     def extract_structured_data(text: str, data_type: str) -> Dict[str, Any]:
         """Extract structured data based on document type"""
@@ -33,84 +54,39 @@ class OCRProcessor:
         else:
             return OCRProcessor._extract_general_info(text)
     
+    @staticmethod
+    def _extract_fields(text: str, data_type: str) -> Dict[str, Any]:
+        """First match per field as matched in the (lowercased) text"""
+        return {extraction.field: extraction.text for extraction in extract(text, data_type)}
+    
     @staticmethod
     def _extract_lab_values(text: str) -> Dict[str, Any]:
         """Extract lab values from text"""
-        lab_data = {}
-        
-        # Common lab value patterns
-        patterns = {
-            'glucose': r'glucose[:\s]*(\d+\.?\d*)',
-            'hemoglobin': r'h[bg|emoglobin][:\s]*(\d+\.?\d*)',
-            'cholesterol': r'cholesterol[:\s]*(\d+\.?\d*)',
-            'blood_pressure': r'bp[:\s]*(\d+/\d+)',
-            'heart_rate': r'hr[:\s]*(\d+)',
-        }
-        
-        for key, pattern in patterns.items():
-            match = re.search(pattern, text.lower())
-            if match:
-                lab_data[key] = match.group(1)
-        
-        return lab_data
+        return OCRProcessor._extract_fields(text, 'lab_values')
     
     @staticmethod
     def _extract_vital_signs(text: str) -> Dict[str, Any]:
         """Extract vital signs from text"""
-        vitals = {}
-        
-        patterns = {
-            'blood_pressure': r'bp[:\s]*(\d+/\d+)',
-            'heart_rate': r'hr[:\s]*(\d+)',
-            'temperature': r'temp[:\s]*(\d+\.?\d*)',
-            'respiratory_rate': r'rr[:\s]*(\d+)',
-            'oxygen_saturation': r'o2[:\s]*(\d+)%?',
-        }
-        
-        for key, pattern in patterns.items():
-            match = re.search(pattern, text.lower())
-            if match:
-                vitals[key] = match.group(1)
-        
-        return vitals
+        return OCRProcessor._extract_fields(text, 'vital_signs')
     
     @staticmethod
     def _extract_medications(text: str) -> Dict[str, Any]:
         """Extract medication information from text"""
         medications = []
-        
-        # Simple medication pattern (this would be more sophisticated in production)
-        med_pattern = r'([A-Za-z]+)\s+(\d+(?:\.\d+)?)\s*(mg|mcg|g)\s*(?:(daily|bid|tid|qid))?'
-        matches = re.finditer(med_pattern, text, re.IGNORECASE)
-        
-        for match in matches:
-            medication = {
-                'name': match.group(1),
-                'dose': match.group(2),
-                'unit': match.group(3),
-                'frequency': match.group(4) if match.group(4) else 'as directed'
-            }
-            medications.append(medication)
-        
+        for extraction in extract(text, 'medication_list'):
+            groups = extraction.groups
+            medications.append({
+                'name': groups['name'],
+                'dose': groups['dose'],
+                'unit': groups['unit'],
+                'frequency': groups['frequency'] or 'as directed'
+            })
         return {'medications': medications}
     
     @staticmethod
     def _extract_insurance_info(text: str) -> Dict[str, Any]:
         """Extract insurance information from text"""
-        insurance_data = {}
-        
-        patterns = {
-            'policy_number': r'policy[:\s#]*(\w+)',
-            'group_number': r'group[:\s#]*(\w+)',
-            'member_id': r'member[:\s#]*(\w+)',
-        }
-        
-        for key, pattern in patterns.items():
-            match = re.search(pattern, text.lower())
-            if match:
-                insurance_data[key] = match.group(1)
-        
-        return insurance_data
+        return OCRProcessor._extract_fields(text, 'insurance_info')
     
     @staticmethod
     def _extract_general_info(text: str) -> Dict[str, Any]:
@@ -121,3 +97,52 @@ class OCRProcessor:
             'contains_dates': bool(re.search(r'\d{1,2}[/-]\d{1,2}[/-]\d{2,4}', text)),
             'summary': text[:200] + '...' if len(text) > 200 else text
         }
+
+
+def init_ocr_worker(tesseract_cmd: str = None) -> None:
+    """Process-pool initializer: load the OCR engine once per worker process"""
+    from .ocr_engine import init_engine
+
+    init_engine(tesseract_cmd)
+
+
+class OCRJobError(Exception):
+    """OCR failure raised from a worker process (pytesseract's own errors do not survive pickling)"""
+
+
+def ocr_result(text: str, data_type: str, **metadata) -> Dict[str, Any]:
+    """Job result: OCR text and structured data, with page/preprocessing metadata alongside"""
+    structured_data = OCRProcessor.extract_structured_data(text, data_type)
+    structured_data.update({key: value for key, value in metadata.items() if value is not None})
+    return {'ocr_text': text, 'structured_data': structured_data}
+
+
+def run_ocr_job(file_path: str, data_type: str) -> Dict[str, Any]:
+    """OCR one file in a worker process; no database access happens here"""
+    from .document_ocr import document_kind, extract_document_text
+
+    try:
+        if document_kind(file_path):
+            # Pages run sequentially here; OCRWorker fans them out over its pool instead
+            document = extract_document_text(file_path)
+            return ocr_result(document['text'], data_type, pages=document['pages'])
+        text, preprocessing = OCRProcessor.image_to_text_with_stats(file_path)
+    except OCRJobError:
+        raise
+    except Exception as e:
+        raise OCRJobError(f"{type(e).__name__}: {str(e)}") from None
+    return ocr_result(text, data_type, preprocessing=preprocessing)
+
+
+def run_ocr_batch(items: List[Tuple[str, str]]) -> List[Tuple[bool, Any]]:
+    """
+    run_ocr_job() over several (file_path, data_type) items in one worker task;
+    returns (True, result) or (False, error message) per item
+    """
+    outcomes = []
+    for file_path, data_type in items:
+        try:
+            outcomes.append((True, run_ocr_job(file_path, data_type)))
+        except OCRJobError as e:
+            outcomes.append((False, str(e)))
+    return outcomes
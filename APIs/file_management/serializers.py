@@ -1,5 +1,10 @@
 from rest_framework import serializers
-from .models import UploadedFile
+from django.urls import reverse
+from patients.models import Patient
+from .bulk_ingest import create_files
+from .content_store import store_upload
+from .derivatives import supports_derivatives
+from .models import BulkIngest, FileCategory, UploadedFile, UploadSession
 
 
 class FileUploadSerializer(serializers.ModelSerializer):
@@ -7,27 +12,80 @@ class FileUploadSerializer(serializers.ModelSerializer):
     patient_name = serializers.CharField(source='patient.full_name', read_only=True)
     uploaded_by_name = serializers.CharField(source='uploaded_by.get_full_name', read_only=True)
     file_size_mb = serializers.ReadOnlyField()
+    thumbnail_url = serializers.SerializerMethodField()
+    preview_url = serializers.SerializerMethodField()
+    download_url = serializers.SerializerMethodField()
 
     class Meta:
         model = UploadedFile
         fields = [
             'id', 'patient', 'patient_name', 'file', 'original_filename',
-            'file_size', 'file_size_mb', 'file_type', 'category', 'description',
+            'file_size', 'file_size_mb', 'file_type', 'content_hash', 'download_url', 'thumbnail_url',
+            'preview_url', 'category', 'description',
             'tags', 'ocr_text', 'structured_data', 'is_processed', 'processing_status',
             'uploaded_by', 'uploaded_by_name', 'created_at', 'updated_at'
         ]
         read_only_fields = [
-            'id', 'file_size', 'file_type', 'ocr_text', 'structured_data',
+            'id', 'file_size', 'file_type', 'content_hash', 'ocr_text', 'structured_data',
             'is_processed', 'processing_status', 'uploaded_by', 'created_at', 'updated_at'
         ]
 
+    def _derivative_url(self, obj, kind):
+        if not obj.content_hash or not supports_derivatives(obj.file.name):
+            return None
+        # Versioned by content, so clients and browsers can cache it indefinitely
+        url = f"{reverse(f'files-{kind}', args=[obj.pk])}?v={obj.content_hash}"
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+    def get_download_url(self, obj):
+        url = reverse('files-download', args=[obj.pk])
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+    def get_thumbnail_url(self, obj):
+        return self._derivative_url(obj, 'thumbnail')
+
+    def get_preview_url(self, obj):
+        return self._derivative_url(obj, 'preview')
+
     def create(self, validated_data):
         file = validated_data['file']
         validated_data['original_filename'] = file.name
         validated_data['uploaded_by'] = self.context['request'].user
+        # Identical content is stored once and shared between uploads
+        blob = store_upload(file)
+        validated_data.update(
+            file=blob.name, file_size=blob.size, file_type=blob.content_type, content_hash=blob.sha256
+        )
         return super().create(validated_data)
 
 
+class MultipleFileUploadSerializer(serializers.Serializer):
+    files = serializers.ListField(child=serializers.FileField(), allow_empty=False)
+    patient = serializers.PrimaryKeyRelatedField(queryset=Patient.objects.all())
+    category = serializers.ChoiceField(choices=FileCategory.choices, default=FileCategory.OTHER)
+    description = serializers.CharField(required=False, allow_blank=True, default='')
+
+    def create(self, validated_data):
+        """Store every file and create them (and queue their OCR) in one batch"""
+        files = []
+        for file in validated_data['files']:
+            blob = store_upload(file)
+            files.append(UploadedFile(
+                patient=validated_data['patient'],
+                uploaded_by=self.context['request'].user,
+                file=blob.name,
+                original_filename=file.name,
+                file_size=blob.size,
+                file_type=blob.content_type,
+                content_hash=blob.sha256,
+                category=validated_data['category'],
+                description=validated_data['description'],
+            ))
+        return create_files(files)
+
+
 class OCRRequestSerializer(serializers.Serializer):
     extract_structured_data = serializers.BooleanField(default=True)
     data_type = serializers.ChoiceField(
@@ -40,3 +98,44 @@ class OCRRequestSerializer(serializers.Serializer):
         ],
         default='general'
     )
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = [
+            'id', 'patient', 'filename', 'category', 'description', 'declared_type', 'detected_type',
+            'expected_sha256', 'total_size', 'received_bytes', 'status', 'uploaded_file',
+            'created_at', 'updated_at', 'expires_at'
+        ]
+        read_only_fields = [
+            'id', 'detected_type', 'received_bytes', 'status', 'uploaded_file',
+            'created_at', 'updated_at', 'expires_at'
+        ]
+        extra_kwargs = {
+            'declared_type': {'required': False},
+            'expected_sha256': {'required': False, 'min_length': 64},
+        }
+
+    def validate_total_size(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("total_size must be positive")
+        return value
+
+
+class BulkIngestSerializer(serializers.ModelSerializer):
+    archive = serializers.FileField(write_only=True)
+    manifest = serializers.FileField(write_only=True, required=False)
+
+    class Meta:
+        model = BulkIngest
+        fields = [
+            'id', 'archive', 'manifest', 'patient', 'category', 'description', 'filename', 'status',
+            'total_entries', 'processed_entries', 'created_files', 'duplicate_entries', 'failed_entries',
+            'ocr_queued', 'errors', 'error_message', 'created_at', 'updated_at', 'started_at', 'finished_at'
+        ]
+        read_only_fields = [
+            'id', 'filename', 'status', 'total_entries', 'processed_entries', 'created_files',
+            'duplicate_entries', 'failed_entries', 'ocr_queued', 'errors', 'error_message',
+            'created_at', 'updated_at', 'started_at', 'finished_at'
+        ]
@@ -0,0 +1,1038 @@
+import datetime
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from PIL import Image, ImageDraw
+from rest_framework.test import APIClient
+
+from authentication.models import User
+from patients.models import Patient
+
+from . import bulk_ingest, chunked_upload, content_store, derivatives, ocr_engine, preprocessing
+from .bulk_ingest import IngestError, claim_ingest, create_ingest, entry_key, read_manifest, run_ingest
+from .document_ocr import (
+    PageResult, assemble_pages, document_kind, extract_document_text, ocr_page, plan_pages
+)
+from .downloads import parse_ranges
+from .extraction import RULE_SETS, extract
+from .models import BulkIngest, OCRJob, OCRLane, OCRResult, UploadedFile, UploadSession
+from .ocr_queue import (
+    OCRWorker, claim_jobs, complete_job, enqueue_bulk, enqueue_ocr, fail_job, queue_position, requeue_stale_jobs
+)
+from .ocr_utils import OCRJobError, OCRProcessor, ocr_result, run_ocr_batch
+from .views import IMMUTABLE_CACHE_CONTROL
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), 'testdata', 'ocr_corpus')
+
+
+def make_patient():
+    user = User.objects.create(username='clinician', role='admin')
+    return Patient.objects.create(
+        mrn='M1', first_name='Ada', last_name='Lovelace', date_of_birth=datetime.date(1950, 1, 1), gender='female',
+        address='1 Main St', emergency_contact_name='Kin', emergency_contact_phone='555', primary_diagnosis='CHF',
+        created_by=user,
+    )
+
+
+def make_file(patient, name='scan.png', content_hash='', file_size=1000, file_type='image/png', **fields):
+    return UploadedFile.objects.create(
+        patient=patient, uploaded_by=patient.created_by, file=f'patient_files/{patient.pk}/{name}',
+        original_filename=name, file_size=file_size, file_type=file_type, content_hash=content_hash, **fields
+    )
+
+
+def _corpus():
+    with open(os.path.join(CORPUS_DIR, 'golden.json'), encoding='utf-8') as handle:
+        golden = json.load(handle)
+    for name, expected in golden.items():
+        with open(os.path.join(CORPUS_DIR, name), encoding='utf-8') as handle:
+            yield name, handle.read(), expected
+
+
+class ExtractionGoldenTests(SimpleTestCase):
+    """Extraction over OCR output samples must match the recorded golden results"""
+
+    def test_golden_corpus(self):
+        for name, text, expected in _corpus():
+            for data_type in RULE_SETS:
+                with self.subTest(sample=name, data_type=data_type):
+                    actual = [extraction.to_dict() for extraction in extract(text, data_type)]
+                    self.assertEqual(actual, expected[data_type])
+
+    def test_spans_point_at_values(self):
+        for name, text, expected in _corpus():
+            for data_type in ('lab_values', 'vital_signs', 'insurance_info'):
+                for extraction in expected[data_type]:
+                    start, end = extraction['span']
+                    self.assertEqual(text.lower()[start:end], extraction['text'])
+
+    def test_structured_data_keeps_string_values(self):
+        for name, text, expected in _corpus():
+            with self.subTest(sample=name):
+                self.assertEqual(
+                    OCRProcessor.extract_structured_data(text, 'lab_values'),
+                    {extraction['field']: extraction['text'] for extraction in expected['lab_values']},
+                )
+
+    def test_hemoglobin_spellings(self):
+        for text, value in [('Hb 12.1', 12.1), ('HGB: 9.8', 9.8), ('Hemoglobin 14', 14.0)]:
+            with self.subTest(text=text):
+                self.assertEqual([(e.field, e.value) for e in extract(text, 'lab_values')], [('hemoglobin', value)])
+        # The old h[bg|emoglobin] character class read "ho" + "1" here as a hemoglobin of 1
+        self.assertNotIn('hemoglobin', OCRProcessor.extract_structured_data('cho1esterol 180', 'lab_values'))
+
+    def test_fields_do_not_hide_each_other(self):
+        # The policy value swallows the "group" label; the group field must still be found
+        result = OCRProcessor.extract_structured_data('Policy group 123', 'insurance_info')
+        self.assertEqual(result, {'policy_number': 'group', 'group_number': '123'})
+
+    def test_medication_names_keep_case(self):
+        medications = OCRProcessor.extract_structured_data('Metoprolol 25 mg bid', 'medication_list')['medications']
+        self.assertEqual(medications, [{'name': 'Metoprolol', 'dose': '25', 'unit': 'mg', 'frequency': 'bid'}])
+
+
+class RangeParsingTests(SimpleTestCase):
+    def test_ranges(self):
+        cases = [
+            ('bytes=0-99', [(0, 99)]),
+            ('bytes=100-', [(100, 999)]),
+            ('bytes=-100', [(900, 999)]),
+            ('bytes=-5000', [(0, 999)]),
+            ('bytes=990-2000', [(990, 999)]),
+            # Sorted, and overlapping or adjacent ranges merged
+            ('bytes=500-599, 0-9, 10-19, 550-700', [(0, 19), (500, 700)]),
+        ]
+        for header, expected in cases:
+            with self.subTest(header=header):
+                self.assertEqual(parse_ranges(header, 1000), expected)
+
+    def test_unsatisfiable_and_malformed(self):
+        self.assertEqual(parse_ranges('bytes=1000-', 1000), [])
+        self.assertEqual(parse_ranges('bytes=-0', 1000), [])
+        for header in (None, '', 'items=0-9', 'bytes=abc', 'bytes=9-0', 'bytes=5'):
+            with self.subTest(header=header):
+                self.assertIsNone(parse_ranges(header, 1000))
+
+
+class ManifestTests(SimpleTestCase):
+    def _manifest(self, content):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8') as handle:
+            handle.write(content)
+        self.addCleanup(os.remove, handle.name)
+        return handle.name
+
+    def test_rows_by_entry_path(self):
+        path = self._manifest('\ufeffPath, MRN ,Category\n./scans\\a.pdf,M1,forms\nb.pdf,M2,\n,M3,\n')
+        self.assertEqual(read_manifest(path), {
+            'scans/a.pdf': {'mrn': 'M1', 'category': 'forms', 'description': ''},
+            'b.pdf': {'mrn': 'M2', 'category': '', 'description': ''},
+        })
+
+    def test_entry_column_required(self):
+        with self.assertRaises(IngestError):
+            read_manifest(self._manifest('mrn,category\nM1,forms\n'))
+
+    def test_entry_key(self):
+        self.assertEqual(entry_key('/scans//2019/./a.pdf'), 'scans/2019/a.pdf')
+
+
+class OCRQueueTests(TestCase):
+    def setUp(self):
+        self.patient = make_patient()
+
+    def test_enqueue_is_idempotent_and_promotes_lane(self):
+        uploaded = make_file(self.patient)
+        job = enqueue_ocr(uploaded, lane=OCRLane.BULK)
+        again = enqueue_ocr(uploaded, lane=OCRLane.INTERACTIVE)
+        self.assertEqual(again.pk, job.pk)
+        self.assertEqual(OCRJob.objects.get(pk=job.pk).lane, OCRLane.INTERACTIVE)
+        self.assertEqual(enqueue_bulk([uploaded.pk, make_file(self.patient, 'b.png').pk]), 1)
+        self.assertEqual(OCRJob.objects.count(), 2)
+
+    def test_interactive_lane_is_served_first(self):
+        bulk = enqueue_ocr(make_file(self.patient, 'bulk.png'), lane=OCRLane.BULK)
+        first = enqueue_ocr(make_file(self.patient, 'a.png'))
+        second = enqueue_ocr(make_file(self.patient, 'b.png'))
+        self.assertEqual([queue_position(job) for job in (first, second, bulk)], [0, 1, 2])
+
+        claims = claim_jobs(OCRLane.INTERACTIVE, 5, 'worker-1')
+        self.assertEqual([claim['job_id'] for claim in claims], [first.pk, second.pk])
+        self.assertEqual(claims[0]['attempts'], 1)
+        self.assertEqual(set(OCRJob.objects.filter(status='running').values_list('worker', flat=True)), {'worker-1'})
+        self.assertEqual(UploadedFile.objects.get(pk=first.file_id).processing_status, 'processing')
+        self.assertEqual(claim_jobs(OCRLane.INTERACTIVE, 5, 'worker-1'), [])
+        self.assertEqual(claim_jobs(OCRLane.BULK, 0, 'worker-1'), [])
+
+    def test_claim_can_be_limited_to_small_files(self):
+        enqueue_ocr(make_file(self.patient, 'big.png', file_size=10 ** 7))
+        small = enqueue_ocr(make_file(self.patient, 'small.png', file_size=100))
+        claims = claim_jobs(OCRLane.INTERACTIVE, 5, 'worker-1', max_file_size=1000)
+        self.assertEqual([claim['job_id'] for claim in claims], [small.pk])
+
+    def test_complete_and_fail(self):
+        done = enqueue_ocr(make_file(self.patient, 'a.png', content_hash='a' * 64))
+        failing = enqueue_ocr(make_file(self.patient, 'b.png'))
+        claims = {claim['job_id']: claim for claim in claim_jobs(OCRLane.INTERACTIVE, 5, 'worker-1')}
+
+        complete_job(claims[done.pk], ocr_result('Hb 12.1', 'general'), 'v1')
+        uploaded = UploadedFile.objects.get(pk=done.file_id)
+        self.assertEqual((uploaded.processing_status, uploaded.ocr_text, uploaded.ocr_version),
+                         ('completed', 'Hb 12.1', 'v1'))
+
+        fail_job(claims[failing.pk], 'unreadable', max_attempts=2)
+        self.assertEqual(OCRJob.objects.get(pk=failing.pk).status, 'queued')
+        retry, = claim_jobs(OCRLane.INTERACTIVE, 5, 'worker-1')
+        self.assertEqual(retry['attempts'], 2)
+        fail_job(retry, 'unreadable', max_attempts=2)
+        self.assertEqual(OCRJob.objects.get(pk=failing.pk).status, 'failed')
+        self.assertEqual(UploadedFile.objects.get(pk=failing.file_id).structured_data, {'error': 'unreadable'})
+
+    def test_stale_running_jobs_are_requeued(self):
+        job = enqueue_ocr(make_file(self.patient))
+        claim_jobs(OCRLane.INTERACTIVE, 1, 'dead-worker')
+        self.assertEqual(requeue_stale_jobs(600), {'requeued': 0, 'failed': 0})
+        OCRJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - datetime.timedelta(hours=1))
+        self.assertEqual(requeue_stale_jobs(600), {'requeued': 1, 'failed': 0})
+        self.assertEqual(OCRJob.objects.get(pk=job.pk).status, 'queued')
+        self.assertEqual(UploadedFile.objects.get(pk=job.file_id).processing_status, 'pending')
+
+    def test_stale_job_at_max_attempts_fails(self):
+        job = enqueue_ocr(make_file(self.patient))
+        for attempt in range(2):
+            claim_jobs(OCRLane.INTERACTIVE, 1, 'crashing-worker')
+            OCRJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - datetime.timedelta(hours=1))
+            self.assertEqual(requeue_stale_jobs(600, max_attempts=2), {'requeued': 1 - attempt, 'failed': attempt})
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+        self.assertIn('stopped responding', job.error_message)
+        self.assertEqual(UploadedFile.objects.get(pk=job.file_id).processing_status, 'failed')
+
+    def test_worker_heartbeat_keeps_long_jobs(self):
+        job = enqueue_ocr(make_file(self.patient))
+        worker = OCRWorker(workers=1)
+        claim, = claim_jobs(OCRLane.INTERACTIVE, 1, worker.name)
+        long_ago = timezone.now() - datetime.timedelta(hours=1)
+        OCRJob.objects.filter(pk=job.pk).update(started_at=long_ago, heartbeat_at=long_ago)
+
+        worker._maintain({'future': ([claim], None)})
+        self.assertEqual(OCRJob.objects.get(pk=job.pk).status, 'running')
+        self.assertGreater(OCRJob.objects.get(pk=job.pk).heartbeat_at, long_ago)
+
+        # Rate limited: the next pass within HEARTBEAT_SECONDS writes nothing
+        with self.assertNumQueries(0):
+            worker._maintain({'future': ([claim], None)})
+
+
+class OCRQueueViewTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.patient = make_patient()
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient.created_by)
+
+    def upload(self, name, content, content_type):
+        with mock.patch('file_management.ocr_utils.OCRProcessor') as processor:
+            response = self.client.post('/api/v1/file-management/', {
+                'file': SimpleUploadedFile(name, content, content_type), 'original_filename': name,
+                'patient': self.patient.pk,
+            }, format='multipart')
+        # OCR runs in the worker, never in the request
+        processor.assert_not_called()
+        return response
+
+    def test_upload_returns_before_ocr_and_queues_it(self):
+        response = self.upload('scan.png', b'\x89PNG\r\n\x1a\nscan', 'image/png')
+        self.assertEqual((response.status_code, response.data['processing_status']), (201, 'pending'))
+        job = OCRJob.objects.get(file_id=response.data['id'])
+        self.assertEqual((job.status, job.lane), ('queued', OCRLane.INTERACTIVE))
+
+        notes = self.upload('notes.txt', b'plain text', 'text/plain')
+        self.assertEqual(notes.status_code, 201)
+        self.assertFalse(OCRJob.objects.filter(file_id=notes.data['id']).exists())
+
+    def test_ocr_status(self):
+        earlier = enqueue_ocr(make_file(self.patient, 'earlier.png'))
+        file_id = self.upload('scan.png', b'\x89PNG\r\n\x1a\nscan', 'image/png').data['id']
+        url = f'/api/v1/file-management/{file_id}/ocr_status/'
+
+        status = self.client.get(url).data
+        self.assertEqual((status['file_id'], status['processing_status']), (file_id, 'pending'))
+        self.assertEqual((status['job']['status'], status['job']['lane'], status['job']['queue_position']),
+                         ('queued', 'Interactive', 1))
+
+        claims = claim_jobs(OCRLane.INTERACTIVE, 2, 'worker-1')
+        self.assertEqual(claims[0]['job_id'], earlier.pk)
+        complete_job(claims[1], ocr_result('Hb 12.1', 'general'), 'v1')
+        status = self.client.get(url).data
+        self.assertEqual((status['processing_status'], status['is_processed']), ('completed', True))
+        self.assertEqual((status['job']['status'], status['job']['queue_position'], status['job']['attempts']),
+                         ('completed', None, 1))
+
+
+class FakeEngine:
+    def image_to_text(self, image):
+        return f"ocr {image.size[0]}x{image.size[1]}"
+
+
+@mock.patch('file_management.document_ocr.preprocessing_enabled', return_value=False)
+@mock.patch('file_management.document_ocr.get_engine', return_value=FakeEngine())
+class DocumentPageTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def make_pdf(self, page_texts):
+        import pymupdf
+
+        path = os.path.join(self.directory, 'doc.pdf')
+        document = pymupdf.open()
+        for text in page_texts:
+            page = document.new_page(width=200, height=200)
+            if text:
+                page.insert_text((10, 20), text, fontsize=8)
+        document.save(path)
+        document.close()
+        return path
+
+    def make_tiff(self, frames):
+        path = os.path.join(self.directory, 'fax.tif')
+        images = [Image.new('L', (40 + 10 * index, 30), 255) for index in range(frames)]
+        images[0].save(path, save_all=True, append_images=images[1:])
+        return path
+
+    def test_document_kind(self, *mocks):
+        self.assertEqual([document_kind(name) for name in ('a.PDF', 'b.tiff', 'c.tif', 'd.png')],
+                         ['pdf', 'tiff', 'tiff', None])
+
+    def test_text_layer_pages_skip_ocr(self, *mocks):
+        path = self.make_pdf(['Discharge summary for the patient, page one', '', 'short'])
+        text_pages, ocr_pages = plan_pages(path)
+        self.assertEqual([(page.page, page.source) for page in text_pages], [(0, 'text_layer')])
+        self.assertEqual(ocr_pages, [1, 2])
+
+    def test_tiff_frames_are_pages(self, *mocks):
+        path = self.make_tiff(3)
+        self.assertEqual(plan_pages(path), ([], [0, 1, 2]))
+        self.assertEqual(ocr_page(path, 2), PageResult(2, 'ocr 60x30', 'ocr'))
+        with self.assertRaises(OCRJobError):
+            ocr_page(path, 5)
+
+    @override_settings(OCR_CONFIG={'DOCUMENTS': {'MAX_PAGES': 2}})
+    def test_page_limit(self, *mocks):
+        with self.assertRaises(OCRJobError):
+            plan_pages(self.make_tiff(3))
+
+    def test_assembly_orders_pages(self, *mocks):
+        assembled = assemble_pages([PageResult(1, 'two', 'ocr'), PageResult(0, 'one', 'text_layer')])
+        self.assertEqual(assembled['text'], 'one\ftwo')
+        self.assertEqual(assembled['pages'], [{'page': 1, 'source': 'text_layer', 'chars': 3},
+                                              {'page': 2, 'source': 'ocr', 'chars': 3}])
+
+        path = self.make_pdf(['Medication reconciliation completed at visit', ''])
+        text = extract_document_text(path)['text']
+        self.assertTrue(text.startswith('Medication reconciliation completed at visit\focr '))
+
+
+class OCREngineTests(SimpleTestCase):
+    def test_backend_selection(self):
+        self.assertIsInstance(ocr_engine.create_engine('pytesseract'), ocr_engine.PytesseractEngine)
+        with self.assertRaises(ValueError):
+            ocr_engine.create_engine('easyocr')
+        for error in (ImportError('no tesserocr'), RuntimeError('no traineddata')):
+            with self.subTest(error=error), mock.patch.object(ocr_engine, 'TesserocrEngine', side_effect=error):
+                self.assertIsInstance(ocr_engine.create_engine('auto'), ocr_engine.PytesseractEngine)
+                with self.assertRaises(type(error)):
+                    ocr_engine.create_engine('tesserocr')
+
+    def test_one_engine_per_process(self):
+        first, second = mock.Mock(), mock.Mock()
+        with mock.patch.object(ocr_engine, '_engine', None), \
+                mock.patch.object(ocr_engine, 'create_engine', side_effect=[first, second]):
+            self.assertIs(ocr_engine.get_engine(), first)
+            self.assertIs(ocr_engine.get_engine(), first)
+            # A pool initializer replaces (and closes) the engine it finds
+            self.assertIs(ocr_engine.init_engine(), second)
+            first.close.assert_called_once_with()
+
+    def test_signature_names_the_engine_created(self):
+        ocr_engine.engine_signature.cache_clear()
+        self.addCleanup(ocr_engine.engine_signature.cache_clear)
+        tesserocr = mock.Mock(spec=ocr_engine.TesserocrEngine, version=mock.Mock(return_value='5.3.0'))
+        tesserocr.name = 'tesserocr'
+        with mock.patch.object(ocr_engine, '_engine', None):
+            # tesserocr importable but unable to start: auto mode runs pytesseract
+            with mock.patch.object(ocr_engine, 'TesserocrEngine', side_effect=RuntimeError('no traineddata')), \
+                    mock.patch.object(ocr_engine.PytesseractEngine, 'version', return_value='5.3.0'):
+                self.assertEqual(ocr_engine.engine_signature(),
+                                 {'backend': 'pytesseract', 'tesseract': '5.3.0', 'lang': 'eng'})
+            ocr_engine.engine_signature.cache_clear()
+            with mock.patch.object(ocr_engine, 'TesserocrEngine', return_value=tesserocr):
+                self.assertEqual(ocr_engine.engine_signature()['backend'], 'tesserocr')
+            # The probe engine is not kept open
+            tesserocr.close.assert_called_once_with()
+
+    @mock.patch('file_management.preprocessing.preprocessing_enabled', return_value=False)
+    def test_batch_isolates_failures(self, _):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'a.png')
+        Image.new('L', (20, 10), 255).save(path)
+
+        with mock.patch.object(ocr_engine, 'get_engine', return_value=FakeEngine()):
+            outcomes = run_ocr_batch([(path, 'general'), (os.path.join(directory.name, 'missing.png'), 'general')])
+        self.assertEqual(outcomes[0], (True, ocr_result('ocr 20x10', 'general')))
+        self.assertFalse(outcomes[1][0])
+        self.assertIn('FileNotFoundError', outcomes[1][1])
+
+
+class PreprocessingTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def make_page(self, size=(3400, 4400)):
+        image = Image.new('RGB', size, 'white')
+        draw = ImageDraw.Draw(image)
+        for row in range(10):
+            top = 200 + row * 300
+            draw.rectangle((200, top, size[0] - 200, top + 60), fill='black')
+        return image
+
+    def test_signature_tracks_settings(self):
+        with override_settings(OCR_CONFIG={'PREPROCESSING': {'ENABLED': False}}):
+            self.assertFalse(preprocessing.preprocessing_enabled())
+            self.assertIsNone(preprocessing.pipeline_signature())
+        default = preprocessing.pipeline_signature()
+        with override_settings(OCR_CONFIG={'PREPROCESSING': {'TARGET_DPI': 200}}):
+            self.assertNotEqual(preprocessing.pipeline_signature(), default)
+        # Cache location does not change the image
+        with override_settings(OCR_CONFIG={'PREPROCESSING': {'CACHE_DIR': self.directory}}):
+            self.assertEqual(preprocessing.pipeline_signature(), default)
+
+    def test_stages_are_timed(self):
+        result = preprocessing.preprocess_image(self.make_page((850, 1100)))
+        self.assertEqual(list(result.timings_ms), preprocessing.DEFAULT_STAGES)
+        self.assertEqual(result.image.mode, 'L')
+        self.assertFalse(result.cached)
+        self.assertEqual(result.to_dict()['stages'], preprocessing.DEFAULT_STAGES)
+        with self.assertRaises(ValueError):
+            preprocessing.preprocess_image(self.make_page((100, 100)), stages=['sharpen'])
+
+    def test_downsample_to_target_dpi(self):
+        # No DPI recorded: the long side is taken as an 11 inch page
+        result = preprocessing.preprocess_image(self.make_page(), stages=['downsample'])
+        self.assertEqual(result.image.size, (2550, 3300))
+        self.assertEqual(result.details['scale'], 0.75)
+
+        image = self.make_page((1200, 1500))
+        image.info['dpi'] = (600, 600)
+        result = preprocessing.preprocess_image(image, stages=['downsample'])
+        self.assertEqual(result.image.size, (600, 750))
+        self.assertEqual(result.details['source_dpi'], 600.0)
+
+        # Phone photos carry 72 dpi: not a page resolution, so the page size estimate is used
+        path = os.path.join(self.directory, 'photo.jpg')
+        self.make_page((4032, 3024)).save(path, format='JPEG', dpi=(72, 72))
+        with Image.open(path) as photo:
+            result = preprocessing.preprocess_image(photo, stages=['downsample'])
+        self.assertEqual(result.image.size, (3300, 2475))
+
+        # Never upscaled
+        result = preprocessing.preprocess_image(self.make_page((850, 1100)), stages=['downsample'])
+        self.assertEqual(result.image.size, (850, 1100))
+        self.assertNotIn('scale', result.details)
+
+    def test_file_cache(self):
+        path = os.path.join(self.directory, 'page.png')
+        self.make_page((850, 1100)).save(path)
+        cache_dir = os.path.join(self.directory, 'cache')
+        with override_settings(OCR_CONFIG={'PREPROCESSING': {'CACHE_DIR': cache_dir}}):
+            first = preprocessing.preprocess_file(path)
+            second = preprocessing.preprocess_file(path)
+            self.assertFalse(first.cached)
+            self.assertTrue(second.cached)
+            self.assertEqual(list(second.timings_ms), ['cache_read'])
+            self.assertEqual(second.image.tobytes(), first.image.tobytes())
+
+            # Keyed by content: a copy of the file under another name hits
+            copy = os.path.join(self.directory, 'copy.png')
+            shutil.copyfile(path, copy)
+            self.assertTrue(preprocessing.preprocess_file(copy).cached)
+
+            # Changing the pipeline settings misses the cache
+            with override_settings(OCR_CONFIG={'PREPROCESSING': {'CACHE_DIR': cache_dir, 'THRESHOLD_C': 5}}):
+                self.assertFalse(preprocessing.preprocess_file(path).cached)
+
+        with override_settings(OCR_CONFIG={'PREPROCESSING': {'CACHE_DIR': cache_dir, 'CACHE': False}}):
+            self.assertFalse(preprocessing.preprocess_file(path).cached)
+
+    def test_file_cache_is_bounded(self):
+        cache_dir = os.path.join(self.directory, 'cache')
+        paths = []
+        for index in range(3):
+            paths.append(os.path.join(self.directory, f'page-{index}.png'))
+            self.make_page((500 + index, 400)).save(paths[-1])
+        config = {'CACHE_DIR': cache_dir, 'STAGES': ['grayscale'], 'PRUNE_EVERY': 1}
+        with override_settings(OCR_CONFIG={'PREPROCESSING': config}):
+            preprocessing.preprocess_file(paths[0])
+        first, = [os.path.join(root, name) for root, _, names in os.walk(cache_dir) for name in names]
+        # Room for one cached page: every write prunes the least recently used ones
+        config['MAX_CACHE_BYTES'] = os.path.getsize(first) * 3 // 2
+        with override_settings(OCR_CONFIG={'PREPROCESSING': config}):
+            for path in paths[1:]:
+                preprocessing.preprocess_file(path)
+            cached = [name for _, _, names in os.walk(cache_dir) for name in names]
+            self.assertEqual(len(cached), 1)
+            self.assertTrue(preprocessing.preprocess_file(paths[-1]).cached)
+            self.assertFalse(preprocessing.preprocess_file(paths[0]).cached)
+
+
+class ContentStoreTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.patient = make_patient()
+
+    def test_same_content_is_stored_once(self):
+        sha256 = hashlib.sha256(b'fax page').hexdigest()
+        first = content_store.store_upload(SimpleUploadedFile('Fax.PDF', b'fax page', 'application/pdf'))
+        self.assertEqual(first.name, f"blobs/{sha256[:2]}/{sha256}.pdf")
+        self.assertEqual((first.sha256, first.size, first.created), (sha256, 8, True))
+
+        second = content_store.store_upload(SimpleUploadedFile('copy.pdf', b'fax page', 'application/pdf'))
+        self.assertEqual((second.name, second.created), (first.name, False))
+        self.assertEqual(os.listdir(os.path.join(settings.MEDIA_ROOT, 'blobs', sha256[:2])), [f"{sha256}.pdf"])
+
+    def test_ocr_result_reuse(self):
+        result = ocr_result('Hb 12.1', 'lab_values', pages=[{'page': 1, 'source': 'ocr', 'chars': 7}])
+        content_store.save_ocr_result('a' * 64, 'v1', result)
+        self.assertIsNone(content_store.cached_ocr_result('a' * 64, 'lab_values', 'v2'))
+        self.assertIsNone(content_store.cached_ocr_result('', 'lab_values', 'v1'))
+
+        cached = content_store.cached_ocr_result('a' * 64, 'lab_values', 'v1')
+        self.assertEqual(cached, result)
+        self.assertEqual(OCRResult.objects.get().reuse_count, 1)
+
+    def test_duplicate_upload_completes_from_cache(self):
+        version = content_store.ocr_version()
+        content_store.save_ocr_result('b' * 64, version, ocr_result('Hb 9.8', 'general'))
+        uploaded = make_file(self.patient, content_hash='b' * 64)
+
+        job = enqueue_ocr(uploaded)
+        job.refresh_from_db()
+        uploaded.refresh_from_db()
+        self.assertEqual((job.status, job.worker), ('completed', 'cache'))
+        self.assertEqual((uploaded.processing_status, uploaded.ocr_text, uploaded.ocr_version),
+                         ('completed', 'Hb 9.8', version))
+        self.assertEqual(OCRResult.objects.get().reuse_count, 1)
+
+        # Different content still goes through the queue
+        self.assertEqual(enqueue_ocr(make_file(self.patient, 'other.png', content_hash='c' * 64)).status, 'queued')
+
+    def test_hash_missing_files(self):
+        stored = make_file(self.patient, 'stored.png')
+        stored.file.save('stored.png', ContentFile(b'scan'), save=True)
+        missing = make_file(self.patient, 'missing.png')
+        hashed = make_file(self.patient, 'hashed.png', content_hash='d' * 64)
+
+        with self.assertLogs('file_management', 'WARNING'):
+            self.assertEqual(content_store.hash_missing_files(), 1)
+        self.assertEqual(UploadedFile.objects.get(pk=stored.pk).content_hash, hashlib.sha256(b'scan').hexdigest())
+        self.assertEqual(UploadedFile.objects.get(pk=missing.pk).content_hash, '')
+        self.assertEqual(UploadedFile.objects.get(pk=hashed.pk).content_hash, 'd' * 64)
+
+
+class ChunkedUploadTests(TestCase):
+    CONTENT = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 40
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.patient = make_patient()
+
+    def start(self, **fields):
+        return chunked_upload.start_session(self.patient, self.patient.created_by, 'scan.png', len(self.CONTENT),
+                                            **fields)
+
+    def send(self, session, offset, length, **kwargs):
+        stream = io.BytesIO(self.CONTENT[offset:offset + length])
+        return chunked_upload.receive_chunk(session, offset, stream, length, **kwargs)
+
+    def test_chunks_resume_and_finalize(self):
+        session = self.start(expected_sha256=hashlib.sha256(self.CONTENT).hexdigest().upper())
+        self.assertEqual(self.send(session, 0, 4000), 4000)
+        self.assertEqual(session.detected_type, 'image/png')
+
+        # A retried chunk is rejected with the offset to resume from
+        with self.assertRaises(chunked_upload.UploadError) as raised:
+            self.send(session, 0, 4000)
+        self.assertEqual((raised.exception.status, raised.exception.to_dict()['offset']), (409, 4000))
+
+        # A truncated chunk is not acknowledged
+        with self.assertRaises(chunked_upload.UploadError) as raised:
+            chunked_upload.receive_chunk(session, 4000, io.BytesIO(self.CONTENT[4000:5000]), 2000)
+        self.assertEqual(raised.exception.offset, 4000)
+        self.assertEqual(UploadSession.objects.get(pk=session.pk).received_bytes, 4000)
+
+        with self.assertRaises(chunked_upload.UploadError) as raised:
+            chunked_upload.finalize_session(session)
+        self.assertEqual(raised.exception.offset, 4000)
+
+        self.assertEqual(self.send(session, 4000, len(self.CONTENT) - 4000), len(self.CONTENT))
+        uploaded = chunked_upload.finalize_session(session)
+        self.assertEqual((uploaded.content_hash, uploaded.file_type, uploaded.file_size),
+                         (hashlib.sha256(self.CONTENT).hexdigest(), 'image/png', len(self.CONTENT)))
+        with uploaded.file.open('rb') as handle:
+            self.assertEqual(handle.read(), self.CONTENT)
+        self.assertFalse(os.path.exists(chunked_upload.staging_path(session)))
+        self.assertEqual(UploadSession.objects.get(pk=session.pk).status, 'completed')
+
+    def test_chunk_checksum(self):
+        session = self.start()
+        with self.assertRaises(chunked_upload.UploadError) as raised:
+            self.send(session, 0, 1000, chunk_sha256='0' * 64)
+        self.assertEqual(raised.exception.offset, 0)
+        self.assertEqual(UploadSession.objects.get(pk=session.pk).received_bytes, 0)
+        chunk_sha256 = hashlib.sha256(self.CONTENT[:1000]).hexdigest()
+        self.assertEqual(self.send(session, 0, 1000, chunk_sha256=chunk_sha256), 1000)
+
+    def test_chunks_from_other_processes_are_rehashed(self):
+        session = self.start()
+        self.send(session, 0, 3000)
+        # The next chunk lands on a process without the running hash
+        with mock.patch.dict(chunked_upload._hashers, clear=True):
+            self.send(session, 3000, len(self.CONTENT) - 3000)
+            uploaded = chunked_upload.finalize_session(session)
+        self.assertEqual(uploaded.content_hash, hashlib.sha256(self.CONTENT).hexdigest())
+
+    def test_file_checksum_mismatch(self):
+        session = self.start(expected_sha256='f' * 64)
+        self.send(session, 0, len(self.CONTENT))
+        with self.assertRaises(chunked_upload.UploadError) as raised:
+            chunked_upload.finalize_session(session)
+        self.assertEqual(raised.exception.status, 422)
+        self.assertFalse(UploadedFile.objects.exists())
+
+    def test_limits_and_closed_sessions(self):
+        with override_settings(CHUNKED_UPLOAD_CONFIG={'MAX_FILE_SIZE': 100}):
+            with self.assertRaises(chunked_upload.UploadError) as raised:
+                self.start()
+            self.assertEqual(raised.exception.status, 413)
+
+        session = self.start()
+        with self.assertRaises(chunked_upload.UploadError):
+            self.send(session, 0, len(self.CONTENT) + 1)
+        chunked_upload.abort_session(session)
+        self.assertFalse(os.path.exists(chunked_upload.staging_path(session)))
+        with self.assertRaises(chunked_upload.UploadError) as raised:
+            self.send(session, 0, 1000)
+        self.assertEqual(raised.exception.status, 409)
+        self.assertEqual(chunked_upload.purge_expired_sessions(), 1)
+
+
+class DerivativeTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.directory = directory.name
+        self.patient = make_patient()
+
+    def make_image(self, name='photo.png', size=(1600, 1200), mode='RGB'):
+        path = os.path.join(self.directory, name)
+        Image.new(mode, size, 'white').save(path)
+        return path
+
+    def test_size_validation(self):
+        self.assertEqual(derivatives.derivative_size('thumbnail'), 256)
+        self.assertEqual(derivatives.derivative_size('thumbnail', ''), 256)
+        self.assertEqual(derivatives.derivative_size('preview', '2000'), 2000)
+        for requested in ('300', 'large', '2000'):
+            with self.subTest(requested=requested):
+                self.assertIsNone(derivatives.derivative_size('thumbnail', requested))
+        self.assertTrue(derivatives.supports_derivatives('fax.TIF'))
+        self.assertTrue(derivatives.supports_derivatives('report.pdf'))
+        self.assertFalse(derivatives.supports_derivatives('notes.txt'))
+
+    def test_render_and_cache(self):
+        path = self.make_image()
+        target = derivatives.generate_derivative(path, 'a' * 64, 'thumbnail', 128)
+        self.assertEqual(target, derivatives.cache_path('a' * 64, 'thumbnail', 128))
+        with Image.open(target) as image:
+            self.assertEqual((image.format, image.size), ('JPEG', (128, 96)))
+        with mock.patch.object(derivatives, '_render') as render:
+            self.assertEqual(derivatives.generate_derivative(path, 'a' * 64, 'thumbnail', 128), target)
+            render.assert_not_called()
+
+        # Bilevel faxes are rendered in grayscale
+        fax = derivatives.generate_derivative(self.make_image('fax.tif', mode='1'), 'b' * 64, 'thumbnail')
+        with Image.open(fax) as image:
+            self.assertEqual((image.mode, image.size), ('L', (256, 192)))
+
+        self.assertEqual(derivatives.generate_derivatives(path, 'c' * 64), 2)
+        self.assertEqual(derivatives.generate_derivatives(path, 'c' * 64), 0)
+
+    def test_pdf_first_page(self):
+        import pymupdf
+        path = os.path.join(self.directory, 'report.pdf')
+        document = pymupdf.open()
+        document.new_page(width=400, height=800)
+        document.new_page(width=800, height=400)
+        document.save(path)
+        document.close()
+        with Image.open(derivatives.generate_derivative(path, 'd' * 64, 'thumbnail')) as image:
+            self.assertEqual(image.size, (128, 256))
+
+    def test_prune_least_recently_used(self):
+        path = self.make_image()
+        old = derivatives.generate_derivative(path, 'e' * 64, 'thumbnail')
+        new = derivatives.generate_derivative(path, 'f' * 64, 'thumbnail')
+        os.utime(old, (1, 1))
+        self.assertEqual(derivatives.prune_cache(max_bytes=os.path.getsize(new)), 1)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+
+    def test_cache_is_pruned_as_files_are_written(self):
+        path = self.make_image()
+        first = derivatives.generate_derivative(path, 'e' * 64, 'thumbnail')
+        os.utime(first, (1, 1))
+        budget = os.path.getsize(first) * 3 // 2
+        with self.settings(DERIVATIVE_CONFIG={'PRUNE_EVERY': 1, 'MAX_CACHE_BYTES': budget}):
+            second = derivatives.generate_derivative(path, 'f' * 64, 'thumbnail')
+        self.assertFalse(os.path.exists(first))
+        self.assertTrue(os.path.exists(second))
+
+    def test_concurrent_renders_do_not_collide(self):
+        path = self.make_image()
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            targets = set(pool.map(lambda _: derivatives.generate_derivative(path, 'a' * 64, 'preview'), range(8)))
+        target, = targets
+        with Image.open(target) as image:
+            self.assertEqual(image.size, (1200, 900))
+        self.assertEqual(os.listdir(os.path.dirname(target)), [os.path.basename(target)])
+
+    def test_thumbnail_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(self.patient.created_by)
+        uploaded = make_file(self.patient, 'photo.png')
+        with open(self.make_image(), 'rb') as handle:
+            uploaded.file.save('photo.png', ContentFile(handle.read()), save=True)
+        url = f'/api/v1/file-management/{uploaded.pk}/thumbnail/'
+
+        self.assertEqual(client.get(url, {'size': '300'}).status_code, 400)
+        response = client.get(url)
+        self.assertEqual((response.status_code, response['Content-Type']), (200, 'image/jpeg'))
+        uploaded.refresh_from_db()
+        self.assertEqual(response['ETag'], f'"{uploaded.content_hash}-thumbnail-256"')
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+        versioned = client.get(url, {'v': uploaded.content_hash}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(versioned.status_code, 304)
+        self.assertEqual(versioned['Cache-Control'], IMMUTABLE_CACHE_CONTROL)
+
+        notes = make_file(self.patient, 'notes.txt', file_type='text/plain')
+        self.assertEqual(client.get(f'/api/v1/file-management/{notes.pk}/thumbnail/').status_code, 404)
+
+    def test_thumbnail_pruned_before_it_is_opened_is_rendered_again(self):
+        client = APIClient()
+        client.force_authenticate(self.patient.created_by)
+        uploaded = make_file(self.patient, 'photo.png')
+        with open(self.make_image(), 'rb') as handle:
+            uploaded.file.save('photo.png', ContentFile(handle.read()), save=True)
+        generate = derivatives.generate_derivative
+
+        def pruned_after_render(*args):
+            target = generate(*args)
+            if render.call_count == 1:
+                os.remove(target)
+            return target
+
+        with mock.patch('file_management.views.generate_derivative', side_effect=pruned_after_render) as render:
+            response = client.get(f'/api/v1/file-management/{uploaded.pk}/thumbnail/')
+        self.addCleanup(response.close)
+        self.assertEqual((response.status_code, render.call_count), (200, 2))
+        with Image.open(io.BytesIO(b''.join(response.streaming_content))) as image:
+            self.assertEqual(image.size, (256, 192))
+
+
+class DownloadTests(TestCase):
+    CONTENT = bytes(range(100))
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.uploaded = make_file(make_patient(), 'Scan 1.png', file_size=len(self.CONTENT))
+        self.uploaded.file.save('scan.png', ContentFile(self.CONTENT), save=True)
+        self.etag = f'"{hashlib.sha256(self.CONTENT).hexdigest()}"'
+        self.client = APIClient()
+        self.client.force_authenticate(self.uploaded.uploaded_by)
+
+    def download(self, **headers):
+        response = self.client.get(f'/api/v1/file-management/{self.uploaded.pk}/download/', **headers)
+        self.addCleanup(response.close)
+        return response
+
+    def body(self, response):
+        return b''.join(response.streaming_content) if response.streaming else response.content
+
+    def test_whole_file(self):
+        response = self.download()
+        self.assertEqual((response.status_code, self.body(response)), (200, self.CONTENT))
+        self.assertEqual((response['ETag'], response['Accept-Ranges']), (self.etag, 'bytes'))
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="Scan 1.png"')
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+    def test_single_range(self):
+        response = self.download(HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual((response['Content-Range'], response['Content-Length']), ('bytes 10-19/100', '10'))
+        self.assertEqual(self.body(response), self.CONTENT[10:20])
+
+        suffix = self.download(HTTP_RANGE='bytes=-5')
+        self.assertEqual((suffix['Content-Range'], self.body(suffix)), ('bytes 95-99/100', self.CONTENT[95:]))
+
+    def test_multiple_ranges(self):
+        response = self.download(HTTP_RANGE='bytes=0-1, 50-52')
+        self.assertEqual(response.status_code, 206)
+        content_type, _, boundary = response['Content-Type'].partition('; boundary=')
+        self.assertEqual(content_type, 'multipart/byteranges')
+        body = self.body(response)
+        self.assertEqual(int(response['Content-Length']), len(body))
+        parts = body.split(f"--{boundary}".encode())
+        self.assertEqual(parts[-1], b'--\r\n')
+        self.assertEqual(
+            [part.split(b'\r\n\r\n', 1)[1].rstrip(b'\r\n') for part in parts[1:-1]],
+            [self.CONTENT[0:2], self.CONTENT[50:53]]
+        )
+        self.assertIn(b'Content-Range: bytes 50-52/100', parts[2])
+
+    def test_unsatisfiable_range(self):
+        response = self.download(HTTP_RANGE='bytes=200-300')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */100'))
+
+    def test_if_range_mismatch_sends_whole_file(self):
+        response = self.download(HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"stale"')
+        self.assertEqual((response.status_code, self.body(response)), (200, self.CONTENT))
+        matching = self.download(HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE=self.etag)
+        self.assertEqual(matching.status_code, 206)
+
+    def test_not_modified(self):
+        response = self.download(HTTP_IF_NONE_MATCH=f'W/{self.etag}')
+        self.assertEqual((response.status_code, response['ETag']), (304, self.etag))
+        self.assertEqual(self.download(HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_offloaded_to_front_end_server(self):
+        with self.settings(DOWNLOAD_CONFIG={'BACKEND': 'nginx'}):
+            response = self.download(HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.uploaded.file.name}')
+        self.assertEqual(response.content, b'')
+
+        with self.settings(DOWNLOAD_CONFIG={'BACKEND': 'sendfile'}):
+            response = self.download()
+        self.assertEqual(response['X-Sendfile'], self.uploaded.file.path)
+
+
+class BulkIngestHeartbeatTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.patient = make_patient()
+        archive_path = os.path.join(directory.name, 'scans.zip')
+        with zipfile.ZipFile(archive_path, 'w') as archive:
+            for index in range(3):
+                archive.writestr(f'scan-{index}.txt', f'page {index}')
+        self.ingest = create_ingest(archive_path, self.patient.created_by, patient=self.patient)
+
+    def test_live_ingest_is_not_taken_over(self):
+        self.assertEqual(claim_ingest().pk, self.ingest.pk)
+        long_ago = timezone.now() - datetime.timedelta(hours=1)
+        stage = bulk_ingest._Ingestion.stage
+
+        def slow_stage(run, *args):
+            # The previous entry's heartbeat kept the ingest fresh
+            self.assertIsNone(claim_ingest())
+            staged = stage(run, *args)
+            BulkIngest.objects.filter(pk=self.ingest.pk).update(updated_at=long_ago)
+            return staged
+
+        with override_settings(BULK_INGEST_CONFIG={'HEARTBEAT_SECONDS': 0}), \
+                mock.patch.object(bulk_ingest._Ingestion, 'stage', slow_stage):
+            ingest = run_ingest(self.ingest)
+        self.assertEqual((ingest.status, ingest.created_files), ('completed', 3))
+
+    def test_heartbeat_is_rate_limited(self):
+        claim_ingest()
+        long_ago = timezone.now() - datetime.timedelta(hours=1)
+        BulkIngest.objects.filter(pk=self.ingest.pk).update(updated_at=long_ago)
+        run = bulk_ingest._Ingestion(self.ingest, {}, bulk_ingest._ingest_config())
+        run.heartbeat()
+        self.assertEqual(BulkIngest.objects.get(pk=self.ingest.pk).updated_at, long_ago)
+        self.assertEqual(claim_ingest().pk, self.ingest.pk)
+
+
+class BulkIngestRunTests(TestCase):
+    PNG = b'\x89PNG\r\n\x1a\n' + bytes(range(64))
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.directory = directory.name
+        self.patient = make_patient()
+        self.other = Patient.objects.create(
+            mrn='M2', first_name='Grace', last_name='Hopper', date_of_birth=datetime.date(1940, 1, 1),
+            gender='female', address='2 Main St', emergency_contact_name='Kin', emergency_contact_phone='555',
+            primary_diagnosis='COPD', created_by=self.patient.created_by,
+        )
+
+    def make_ingest(self, entries, manifest_rows, **fields):
+        archive_path = os.path.join(self.directory, 'scans.zip')
+        with zipfile.ZipFile(archive_path, 'w') as archive:
+            for name, content in entries:
+                archive.writestr(name, content)
+        manifest_path = os.path.join(self.directory, 'manifest.csv')
+        with open(manifest_path, 'w', encoding='utf-8') as handle:
+            handle.write('Filename,MRN,Category,Description\n')
+            handle.writelines(f"{','.join(row)}\n" for row in manifest_rows)
+        return create_ingest(archive_path, self.patient.created_by, manifest_path, status='running', **fields)
+
+    def test_manifest_mapping_errors_and_duplicates(self):
+        ingest = self.make_ingest(
+            [('labs/a.png', self.PNG), ('notes.txt', b'plain text'), ('c.png', b'\x89PNG\r\n\x1a\nother'),
+             ('d.png', b'\x89PNG\r\n\x1a\nthird'), ('copy/a.png', self.PNG), ('unlisted.png', b'unlisted'),
+             ('__MACOSX/._a.png', b'fork')],
+            [('labs/a.png', 'M1', 'lab_results', 'CBC'), ('notes.txt', 'M2', '', ''), ('c.png', 'M9', '', ''),
+             ('d.png', 'M1', 'bogus', ''), ('copy/a.png', 'M1', '', ''), ('gone.png', 'M1', '', '')],
+        )
+        self.assertEqual(ingest.total_entries, 6)
+        ingest = run_ingest(ingest)
+
+        self.assertEqual(ingest.status, 'completed')
+        self.assertEqual(
+            (ingest.processed_entries, ingest.created_files, ingest.duplicate_entries, ingest.failed_entries,
+             ingest.ocr_queued),
+            (6, 2, 1, 3, 1)
+        )
+        self.assertEqual(
+            {(uploaded.original_filename, uploaded.patient_id, uploaded.category, uploaded.description)
+             for uploaded in UploadedFile.objects.all()},
+            {('a.png', self.patient.pk, 'lab_results', 'CBC'), ('notes.txt', self.other.pk, 'other', '')}
+        )
+        self.assertEqual(OCRJob.objects.get().file.original_filename, 'a.png')
+        self.assertEqual(
+            [(error['entry'], error['error']) for error in ingest.errors],
+            [('c.png', 'No patient with MRN M9'), ('d.png', 'Unknown category bogus'),
+             ('unlisted.png', 'Entry is not in the manifest'),
+             ('gone.png', 'Listed in the manifest but not in the archive')]
+        )
+
+    def scans(self, count):
+        return self.make_ingest(
+            [(f'scan-{index}.png', self.PNG + bytes([index])) for index in range(count)],
+            [(f'scan-{index}.png', 'M1', '', '') for index in range(count)],
+        )
+
+    def interrupt_flush(self, on_call, error):
+        flush, calls = bulk_ingest._Ingestion.flush, []
+
+        def interrupted(run, processed):
+            calls.append(processed)
+            if len(calls) == on_call:
+                raise error
+            flush(run, processed)
+        return mock.patch.object(bulk_ingest._Ingestion, 'flush', interrupted)
+
+    def test_unexpected_error_fails_the_ingest(self):
+        ingest = self.scans(2)
+        with self.interrupt_flush(1, RuntimeError('database went away')), self.assertLogs('file_management', 'ERROR'):
+            ingest = run_ingest(ingest)
+        self.assertEqual((ingest.status, ingest.error_message), ('failed', 'RuntimeError: database went away'))
+        ingest.refresh_from_db()
+        self.assertEqual(ingest.status, 'failed')
+        self.assertIsNotNone(ingest.finished_at)
+
+    @override_settings(BULK_INGEST_CONFIG={'BATCH_SIZE': 2})
+    def test_resumes_after_saved_progress(self):
+        ingest = self.scans(5)
+        # The process dies during the second batch
+        with self.interrupt_flush(2, KeyboardInterrupt()), self.assertRaises(KeyboardInterrupt):
+            run_ingest(ingest)
+        ingest.refresh_from_db()
+        self.assertEqual((ingest.status, ingest.processed_entries, ingest.created_files), ('running', 2, 2))
+
+        # Taken over once stale; the entries of the saved batch are not read again
+        claimed = claim_ingest(stale_seconds=0)
+        with mock.patch.object(bulk_ingest._Ingestion, 'stage', autospec=True,
+                               side_effect=bulk_ingest._Ingestion.stage) as stage:
+            ingest = run_ingest(claimed)
+        self.assertEqual([call.args[3] for call in stage.call_args_list], [2, 3, 4])
+        self.assertEqual((ingest.status, ingest.processed_entries, ingest.created_files, ingest.ocr_queued),
+                         ('completed', 5, 5, 5))
+        self.assertEqual(UploadedFile.objects.count(), 5)
+
+
+class MultipleFileUploadViewTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.patient = make_patient()
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient.created_by)
+
+    def test_files_are_created_and_queued_together(self):
+        files = [SimpleUploadedFile('a.png', b'\x89PNG\r\n\x1a\nfirst', 'image/png'),
+                 SimpleUploadedFile('b.txt', b'plain text', 'text/plain')]
+        with mock.patch('file_management.bulk_ingest.enqueue_bulk', wraps=bulk_ingest.enqueue_bulk) as enqueue:
+            response = self.client.post('/api/v1/files/upload/multiple/', {
+                'files': files, 'patient': self.patient.pk, 'category': 'lab_results',
+            }, format='multipart')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([item['original_filename'] for item in response.data], ['a.png', 'b.txt'])
+        enqueue.assert_called_once()
+        self.assertEqual(set(UploadedFile.objects.values_list('category', flat=True)), {'lab_results'})
+        self.assertEqual(OCRJob.objects.get().file.original_filename, 'a.png')
+
+    def test_invalid_upload_creates_nothing(self):
+        response = self.client.post('/api/v1/files/upload/multiple/', {'patient': self.patient.pk},
+                                    format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(UploadedFile.objects.exists())
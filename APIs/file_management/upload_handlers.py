@@ -0,0 +1,35 @@
+"""
+Upload handlers that SHA-256 hash files while they stream in
+Drop-in replacements for Django's memory/temporary-file handlers
+(FILE_UPLOAD_HANDLERS); the finished upload carries a `sha256` attribute,
+so content-addressed storage needs no second pass over the file.
+"""
+
+import hashlib
+
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+
+class HashingUploadMixin:
+    def new_file(self, *args, **kwargs):
+        # Before super(): the memory handler raises StopFutureHandlers once it takes the file
+        self.hasher = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded = super().file_complete(file_size)
+        if uploaded is not None:
+            uploaded.sha256 = self.hasher.hexdigest()
+        return uploaded
+
+
+class HashingMemoryFileUploadHandler(HashingUploadMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadMixin, TemporaryFileUploadHandler):
+    pass
@@ -1,8 +1,11 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import FileUploadViewSet
+from .views import BulkIngestViewSet, FileUploadViewSet, UploadSessionViewSet
 
 router = DefaultRouter()
+# Before the file routes, which would otherwise match uploads/ and bulk-ingests/ as a file id
+router.register(r'uploads', UploadSessionViewSet, basename='upload-sessions')
+router.register(r'bulk-ingests', BulkIngestViewSet, basename='bulk-ingests')
 router.register(r'', FileUploadViewSet, basename='files')
 
 urlpatterns = [
@@ -1,12 +1,97 @@
-from rest_framework import viewsets, status, permissions
+from rest_framework import mixins, viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.core.files.storage import default_storage
 from django.conf import settings
+from django.http import FileResponse, HttpResponseNotModified
+import logging
 import os
-from .models import UploadedFile
-from .serializers import FileUploadSerializer, OCRRequestSerializer
-from .ocr_utils import OCRProcessor
+from .bulk_ingest import IngestError, submit_archive
+from .chunked_upload import (
+    UploadError, abort_session, chunk_size, finalize_session, receive_chunk, start_session,
+)
+from .models import BulkIngest, OCRLane, UploadedFile, UploadSession
+from .serializers import (
+    BulkIngestSerializer, FileUploadSerializer, MultipleFileUploadSerializer, OCRRequestSerializer,
+    UploadSessionSerializer,
+)
+from .ocr_queue import enqueue_ocr, is_ocr_candidate, job_status
+from .content_store import ensure_content_hash
+from .derivatives import CONTENT_TYPE, derivative_size, generate_derivative, supports_derivatives
+from .downloads import download_response, etag_matches
+
+logger = logging.getLogger('file_management')
+
+# Derivative URLs carry ?v=<content hash>, so a response for that URL never changes
+IMMUTABLE_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+
+
+def visible_files(user):
+    """Filter files based on user permissions"""
+    if user.role == 'admin':
+        return UploadedFile.objects.all()
+    elif user.role == 'physician':
+        return UploadedFile.objects.filter(patient__assigned_physician=user)
+    else:
+        # Nurses and other staff can see files for all patients
+        return UploadedFile.objects.all()
+
+
+def derivative_response(request, file_instance, kind):
+    """Cached thumbnail/preview image of a file, rendered on first request"""
+    size = derivative_size(kind, request.GET.get('size'))
+    if size is None:
+        return Response({'error': f'Unsupported {kind} size'}, status=status.HTTP_400_BAD_REQUEST)
+    if not supports_derivatives(file_instance.file.name):
+        return Response({'error': f'No {kind} is available for this file type'}, status=status.HTTP_404_NOT_FOUND)
+    content_hash = ensure_content_hash(file_instance)
+
+    etag = f'"{content_hash}-{kind}-{size}"'
+    # Unversioned URLs must revalidate: the file behind an id can be replaced
+    cache_control = IMMUTABLE_CACHE_CONTROL if request.GET.get('v') == content_hash else 'private, no-cache'
+    if etag_matches(request, etag):
+        response = HttpResponseNotModified()
+    else:
+        try:
+            try:
+                handle = open(generate_derivative(file_instance.file.path, content_hash, kind, size), 'rb')
+            except FileNotFoundError:
+                # Pruned by another process between rendering and opening; render it again
+                handle = open(generate_derivative(file_instance.file.path, content_hash, kind, size), 'rb')
+        except Exception as e:
+            logger.warning(f"Cannot render {kind} of file {file_instance.pk}: {type(e).__name__}: {str(e)}")
+            return Response({'error': f'Could not render a {kind} of this file'},
+                            status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        response = FileResponse(handle, content_type=CONTENT_TYPE)
+    response['ETag'] = etag
+    response['Cache-Control'] = cache_control
+    return response
+
+
+def bulk_ingest_response(request):
+    """Queue a ZIP archive (and optional CSV manifest) for bulk ingestion; 202 with the ingest to poll"""
+    serializer = BulkIngestSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    data = serializer.validated_data
+    try:
+        ingest = submit_archive(
+            data['archive'], request.user, manifest=data.get('manifest'), patient=data.get('patient'),
+            category=data.get('category', ''), description=data.get('description', ''),
+        )
+    except IngestError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(BulkIngestSerializer(ingest).data, status=status.HTTP_202_ACCEPTED)
+
+
+def multiple_upload_response(request):
+    """Upload several files for one patient; OCR is queued for all of them together"""
+    serializer = MultipleFileUploadSerializer(data=request.data, context={'request': request})
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    files = serializer.save()
+    return Response(FileUploadSerializer(files, many=True, context={'request': request}).data,
+                    status=status.HTTP_201_CREATED)
 
 
 class FileUploadViewSet(viewsets.ModelViewSet):
@@ -15,14 +100,7 @@ class FileUploadViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         """Filter files based on user permissions"""
-        user = self.request.user
-        if user.role == 'admin':
-            return UploadedFile.objects.all()
-        elif user.role == 'physician':
-            return UploadedFile.objects.filter(patient__assigned_physician=user)
-        else:
-            # Nurses and other staff can see files for all patients
-            return UploadedFile.objects.all()
+        return visible_files(self.request.user)
 
     def create(self, request, *args, **kwargs):
         """Upload a new file"""
@@ -30,57 +108,21 @@ class FileUploadViewSet(viewsets.ModelViewSet):
         if serializer.is_valid():
             file_instance = serializer.save()
             
-            # Check if file is an image and trigger OCR processing
-            if file_instance.file_type.startswith('image/'):
-                file_instance.processing_status = 'pending'
-                file_instance.save()
-                
-                # In a production environment, this would be handled by a background task
-                # For now, we'll process it synchronously
-                self._process_file_ocr(file_instance)
+            # Queue OCR; the OCR worker (run_ocr_worker) picks it up off the request path
+            if is_ocr_candidate(file_instance):
+                enqueue_ocr(file_instance, OCRLane.INTERACTIVE)
             
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-    def _process_file_ocr(self, file_instance):
-        """Process file for OCR (would be async in production)"""
-        try:
-            file_instance.processing_status = 'processing'
-            file_instance.save()
-            
-            # Extract text using OCR
-            file_path = file_instance.file.path
-            ocr_text = OCRProcessor.extract_text_from_image(file_path)
-            
-            # Extract structured data based on category
-            data_type = 'general'
-            if file_instance.category == 'lab_results':
-                data_type = 'lab_values'
-            elif file_instance.category == 'forms':
-                data_type = 'vital_signs'
-            
-            structured_data = OCRProcessor.extract_structured_data(ocr_text, data_type)
-            
-            # Update file instance
-            file_instance.ocr_text = ocr_text
-            file_instance.structured_data = structured_data
-            file_instance.is_processed = True
-            file_instance.processing_status = 'completed'
-            file_instance.save()
-            
-        except Exception as e:
-            file_instance.processing_status = 'failed'
-            file_instance.structured_data = {'error': str(e)}
-            file_instance.save()
-
     @action(detail=True, methods=['post'])
     def process_ocr(self, request, pk=None):
         """Manually trigger OCR processing for a file"""
         file_instance = self.get_object()
         
-        if not file_instance.file_type.startswith('image/'):
+        if not is_ocr_candidate(file_instance):
             return Response(
-                {'error': 'OCR is only available for image files'}, 
+                {'error': 'OCR is only available for image and PDF files'}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
         
@@ -88,12 +130,30 @@ class FileUploadViewSet(viewsets.ModelViewSet):
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
-        # Process OCR
-        self._process_file_ocr(file_instance)
-        
-        # Return updated file data
-        response_serializer = self.get_serializer(file_instance)
-        return Response(response_serializer.data)
+        # Queue in the interactive lane, ahead of any bulk backfill
+        enqueue_ocr(file_instance, OCRLane.INTERACTIVE, serializer.validated_data['data_type'])
+        return Response(job_status(file_instance), status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=['get'])
+    def ocr_status(self, request, pk=None):
+        """OCR processing status and the latest queued job for a file"""
+        file_instance = self.get_object()
+        return Response(job_status(file_instance))
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """The original file (?inline=1 to display it); supports Range and If-None-Match"""
+        return download_response(request, self.get_object(), as_attachment=not request.GET.get('inline'))
+
+    @action(detail=True, methods=['get'])
+    def thumbnail(self, request, pk=None):
+        """Small JPEG of the image or first PDF page (?size= one of the configured sizes)"""
+        return derivative_response(request, self.get_object(), 'thumbnail')
+
+    @action(detail=True, methods=['get'])
+    def preview(self, request, pk=None):
+        """Larger JPEG of the image or first PDF page"""
+        return derivative_response(request, self.get_object(), 'preview')
 
     @action(detail=False, methods=['get'])
     def by_patient(self, request):
@@ -131,3 +191,99 @@ class FileUploadViewSet(viewsets.ModelViewSet):
         
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
+
+
+class UploadSessionViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """
+    Resumable chunked uploads: POST to start a session, PUT each chunk's raw
+    bytes with its offset, then POST finalize. GET returns the offset to
+    resume from after an interruption.
+    """
+    serializer_class = UploadSessionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(uploaded_by=self.request.user)
+
+    def _error(self, error):
+        return Response(error.to_dict(), status=error.status)
+
+    def create(self, request, *args, **kwargs):
+        """Start an upload session"""
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+        try:
+            session = start_session(
+                data['patient'], request.user, data['filename'], data['total_size'],
+                category=data.get('category', ''), description=data.get('description', ''),
+                declared_type=data.get('declared_type', ''), expected_sha256=data.get('expected_sha256', ''),
+            )
+        except UploadError as e:
+            return self._error(e)
+        response = self.get_serializer(session).data
+        response['chunk_size'] = chunk_size()
+        return Response(response, status=status.HTTP_201_CREATED)
+
+    def update(self, request, *args, **kwargs):
+        """
+        Upload one chunk: the raw request body, written at ?offset= (or the
+        Upload-Offset header). The body is streamed to disk, never parsed.
+        """
+        session = self.get_object()
+        raw_offset = request.query_params.get('offset', request.META.get('HTTP_UPLOAD_OFFSET'))
+        try:
+            offset = int(raw_offset)
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'An integer offset and Content-Length are required', 'offset': session.received_bytes},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            new_offset = receive_chunk(
+                session, offset, request.stream, length, request.META.get('HTTP_X_CHUNK_SHA256', '')
+            )
+        except UploadError as e:
+            return self._error(e)
+        return Response({'id': str(session.pk), 'offset': new_offset, 'total_size': session.total_size})
+
+    @action(detail=True, methods=['post'])
+    def finalize(self, request, pk=None):
+        """Assemble the uploaded chunks into an UploadedFile and queue OCR"""
+        session = self.get_object()
+        try:
+            file_instance = finalize_session(session)
+        except UploadError as e:
+            return self._error(e)
+        if is_ocr_candidate(file_instance):
+            enqueue_ocr(file_instance, OCRLane.INTERACTIVE)
+        serializer = FileUploadSerializer(file_instance, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def destroy(self, request, *args, **kwargs):
+        """Abort an unfinished upload and discard its chunks"""
+        session = self.get_object()
+        try:
+            abort_session(session)
+        except UploadError as e:
+            return self._error(e)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class BulkIngestViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """
+    Bulk ingestion of ZIP archives: POST the archive (optionally with a CSV
+    manifest of filename, mrn, category, description); GET reports progress
+    and per-entry errors while ingest_archive --queued works through it.
+    """
+    serializer_class = BulkIngestSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return BulkIngest.objects.filter(uploaded_by=self.request.user)
+
+    def create(self, request, *args, **kwargs):
+        """Queue an archive for ingestion"""
+        return bulk_ingest_response(request)
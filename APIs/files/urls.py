@@ -9,6 +9,7 @@ urlpatterns = [
     # File upload endpoints
     path('upload/', views.FileUploadView.as_view(), name='file_upload'),
     path('upload/multiple/', views.MultipleFileUploadView.as_view(), name='multiple_file_upload'),
+    path('upload/bulk/', views.BulkFileUploadView.as_view(), name='bulk_file_upload'),
     path('upload/patient/<int:patient_id>/', views.PatientFileUploadView.as_view(), name='patient_file_upload'),
     path('upload/visit/<int:visit_id>/', views.VisitFileUploadView.as_view(), name='visit_file_upload'),
     
@@ -2,6 +2,11 @@ from rest_framework import generics, status, permissions, viewsets
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from file_management.downloads import download_response
+from file_management.views import (
+    bulk_ingest_response, derivative_response, multiple_upload_response, visible_files,
+)
 
 
 class DocumentViewSet(viewsets.ModelViewSet):
@@ -36,15 +41,13 @@ class FileUploadView(APIView):
 
 class FileDownloadView(APIView):
     """
-    Handle file downloads.
+    Handle file downloads (uploaded files, with Range and conditional request support).
     """
     permission_classes = [permissions.IsAuthenticated]
     
     def get(self, request, file_id):
-        return Response({
-            'message': f'File download endpoint for file {file_id} - implement download logic',
-            'status': 'placeholder'
-        }, status=status.HTTP_200_OK)
+        file_instance = get_object_or_404(visible_files(request.user), pk=file_id)
+        return download_response(request, file_instance)
 
 
 class FileDeleteView(APIView):
@@ -75,15 +78,12 @@ class FileShareView(APIView):
 
 class BulkFileUploadView(APIView):
     """
-    Handle bulk file uploads.
+    Handle bulk file uploads (ZIP archive plus optional CSV manifest, ingested in the background).
     """
     permission_classes = [permissions.IsAuthenticated]
     
     def post(self, request):
-        return Response({
-            'message': 'Bulk file upload endpoint - implement bulk upload logic',
-            'status': 'placeholder'
-        }, status=status.HTTP_200_OK)
+        return bulk_ingest_response(request)
 
 
 class FileMetadataView(APIView):
@@ -107,15 +107,12 @@ class FileMetadataView(APIView):
 
 class MultipleFileUploadView(APIView):
     """
-    Handle multiple file uploads.
+    Handle multiple file uploads (several files for one patient).
     """
     permission_classes = [permissions.IsAuthenticated]
     
     def post(self, request):
-        return Response({
-            'message': 'Multiple file upload endpoint - implement multiple file handling logic',
-            'status': 'placeholder'
-        }, status=status.HTTP_200_OK)
+        return multiple_upload_response(request)
 
 
 class PatientFileUploadView(APIView):
@@ -276,41 +273,35 @@ class DocumentDetailView(APIView):
 
 class DocumentDownloadView(APIView):
     """
-    Handle document downloads.
+    Handle document downloads (uploaded files, with Range and conditional request support).
     """
     permission_classes = [permissions.IsAuthenticated]
     
     def get(self, request, document_id):
-        return Response({
-            'message': f'Document download endpoint for document {document_id} - implement document download',
-            'status': 'placeholder'
-        }, status=status.HTTP_200_OK)
+        document = get_object_or_404(visible_files(request.user), pk=document_id)
+        return download_response(request, document)
 
 
 class DocumentPreviewView(APIView):
     """
-    Handle document previews.
+    Handle document previews (first page of uploaded files, rendered and cached on first request).
     """
     permission_classes = [permissions.IsAuthenticated]
     
     def get(self, request, document_id):
-        return Response({
-            'message': f'Document preview endpoint for document {document_id} - implement document preview',
-            'status': 'placeholder'
-        }, status=status.HTTP_200_OK)
+        document = get_object_or_404(visible_files(request.user), pk=document_id)
+        return derivative_response(request, document, 'preview')
 
 
 class DocumentThumbnailView(APIView):
     """
-    Handle document thumbnails.
+    Handle document thumbnails (uploaded files, rendered and cached on first request).
     """
     permission_classes = [permissions.IsAuthenticated]
     
     def get(self, request, document_id):
-        return Response({
-            'message': f'Document thumbnail endpoint for document {document_id} - implement document thumbnail',
-            'status': 'placeholder'
-        }, status=status.HTTP_200_OK)
+        document = get_object_or_404(visible_files(request.user), pk=document_id)
+        return derivative_response(request, document, 'thumbnail')
 
 
 class FileCategoryListView(APIView):
@@ -170,6 +170,11 @@ MEDIA_ROOT = BASE_DIR / 'media'
 # File upload settings
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
+# Hash uploads while they stream in (content-addressed file storage)
+FILE_UPLOAD_HANDLERS = [
+    'file_management.upload_handlers.HashingMemoryFileUploadHandler',
+    'file_management.upload_handlers.HashingTemporaryFileUploadHandler',
+]
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
@@ -192,5 +197,7 @@ AI_CONFIG = {
     'DEFAULT_MODEL': 'gpt-4',
     'MAX_TOKENS': 4000,
     'TEMPERATURE': 0.7,
-    'BACKUP_MODEL': 'claude-3-sonnet-20240229'
+    'BACKUP_MODEL': 'claude-3-sonnet-20240229',
+    'REQUEST_TIMEOUT_SECONDS': 60,
+    'ENABLE_HEDGING': False,
 }
@@ -153,6 +153,11 @@ MEDIA_ROOT = BASE_DIR / 'media'
 # File upload settings
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
+# Hash uploads while they stream in (content-addressed file storage)
+FILE_UPLOAD_HANDLERS = [
+    'file_management.upload_handlers.HashingMemoryFileUploadHandler',
+    'file_management.upload_handlers.HashingTemporaryFileUploadHandler',
+]
 
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -185,6 +190,26 @@ AI_CONFIG = {
     'MAX_TOKENS': 4000,
     'TEMPERATURE': 0.3,
     'TOP_P': 0.9,
+    'BACKUP_MODEL': config('AI_BACKUP_MODEL', default='claude-3-5-sonnet-20241022'),
+    'REQUEST_TIMEOUT_SECONDS': 60,
+    'ENABLE_HEDGING': config('AI_ENABLE_HEDGING', default=True, cast=bool),
+    'HEDGE_MIN_DELAY_SECONDS': 1.0,
+}
+
+# Buffered AIProcessingLog writer (see ai_insights/audit.py)
+AI_AUDIT_CONFIG = {
+    'ASYNC': True,
+    'BATCH_SIZE': 100,
+    'FLUSH_INTERVAL_SECONDS': 2.0,
+    'SPILL_PATH': BASE_DIR / 'logs' / 'ai_audit_spill.jsonl',
+}
+
+# Local semantic search over notes / OCR text / insights (see ai_insights/semantic_search.py)
+SEMANTIC_SEARCH_CONFIG = {
+    'MODEL_NAME': 'sentence-transformers/all-MiniLM-L6-v2',
+    'INDEX_DIR': BASE_DIR / 'semantic_index',
+    'ENCODE_BATCH_SIZE': 64,
+    'NPROBE': 16,
 }
 
 # Celery Configuration for Background AI Tasks
@@ -200,6 +225,44 @@ OCR_CONFIG = {
     'TESSERACT_CMD': config('TESSERACT_CMD', default=r'C:\Program Files\Tesseract-OCR\tesseract.exe'),
     'SUPPORTED_FORMATS': ['pdf', 'png', 'jpg', 'jpeg', 'tiff', 'bmp'],
     'MAX_FILE_SIZE': 50 * 1024 * 1024,  # 50MB
+    # 'tesserocr' keeps tesseract loaded in each OCR worker; 'auto' falls back to pytesseract
+    'ENGINE': {
+        'BACKEND': config('OCR_ENGINE', default='auto'),
+    },
+    # Grayscale, downsample, crop, deskew and threshold images before OCR
+    'PREPROCESSING': {
+        'ENABLED': config('OCR_PREPROCESSING', default=True, cast=bool),
+    },
+}
+
+# Resumable chunked uploads (/api/v1/file-management/uploads/)
+CHUNKED_UPLOAD_CONFIG = {
+    'CHUNK_SIZE': 5 * 1024 * 1024,  # 5MB suggested to clients
+    'MAX_CHUNK_SIZE': 16 * 1024 * 1024,  # 16MB
+    'MAX_FILE_SIZE': 1024 * 1024 * 1024,  # 1GB
+    'SESSION_TTL_HOURS': 24,
+}
+
+# Thumbnails and previews of uploaded files (rendered lazily, cached on disk)
+DERIVATIVE_CONFIG = {
+    'MAX_CACHE_BYTES': config('DERIVATIVE_CACHE_BYTES', default=512 * 1024 * 1024, cast=int),
+    # Render for new uploads in the OCR worker instead of on first request
+    'EAGER': config('DERIVATIVE_EAGER', default=True, cast=bool),
+}
+
+# File downloads: 'django' streams via FileResponse (sendfile under gunicorn);
+# 'nginx' needs an internal location, e.g.
+#   location /protected-media/ { internal; alias <MEDIA_ROOT>/; }
+# 'sendfile' is X-Sendfile for Apache mod_xsendfile / lighttpd
+DOWNLOAD_CONFIG = {
+    'BACKEND': config('DOWNLOAD_BACKEND', default='django'),
+    'ACCEL_REDIRECT_PREFIX': config('DOWNLOAD_ACCEL_REDIRECT_PREFIX', default='/protected-media/'),
+}
+
+# ZIP archive ingestion (run `manage.py ingest_archive --queued --loop` for API uploads)
+BULK_INGEST_CONFIG = {
+    'BATCH_SIZE': config('BULK_INGEST_BATCH_SIZE', default=200, cast=int),
+    'MAX_ENTRY_SIZE': 1024 * 1024 * 1024,  # 1GB
 }
 
 # Healthcare AI Settings
@@ -79,6 +79,7 @@ urlpatterns = [
     path('api/v1/visits/', include('visits.urls')),
     path('api/v1/oasis/', include('oasis.urls')),
     path('api/v1/files/', include('files.urls')),
+    path('api/v1/file-management/', include('file_management.urls')),
     path('api/v1/communication/', include('communication.urls')),
     path('api/v1/ai/', include('ai_insights.urls')),
     
@@ -97,7 +98,7 @@ urlpatterns = [
     })),
 ]
 
-# Serve media files in development
+# Serve static files in development; uploaded media is only reachable
+# through the permission-checked file endpoints
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)